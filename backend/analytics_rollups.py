@@ -0,0 +1,248 @@
+"""
+Дневные агрегаты админской аналитики (коллекция analytics_rollups)
+
+/api/admin/analytics/overview раньше загружал в память все challenge_progress, quiz_attempts,
+time_activity и video_watch_time, чтобы сложить баллы. Теперь обработчики, которые меняют
+баллы или прогресс урока, обновляют агрегаты через $inc/$addToSet (record_rollup), а обзор
+читает документ итогов и документы за последние ACTIVITY_WINDOW_DAYS дней.
+
+Документ дня (_id — дата UTC):
+    {
+        "_id": "2025-10-09", "date": datetime,
+        "points": {"challenges": 10, "quizzes": 0, "time": 25, "videos": 3, "files": 5},
+        "lessons_completed": 2,
+        "active_students": [user_id, ...],               # чей прогресс урока менялся в этот день
+        "active_lessons": ["user_id:lesson_id", ...],    # какие записи lesson_progress менялись
+        "updated_at": datetime
+    }
+
+Документ итогов (_id "totals") — те же points и lessons_completed за всё время, плюс
+"backfilled": true после пересчёта по исходным коллекциям.
+
+Баллы по источникам считаются как раньше в обзоре: "time" — все total_points из
+time_activity (включая просмотры файлов, тесты и проверку упражнений), "files" — только
+activity_type "file_view".
+
+Пересчёт по исходным коллекциям (также выполняется автоматически, если итоги ещё не
+построены или сброшены удалением урока):
+    python analytics_rollups.py
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import DeleteMany, ReplaceOne, UpdateOne
+
+TOTALS_ID = 'totals'
+POINT_SOURCES = ('challenges', 'quizzes', 'time', 'videos', 'files')
+ACTIVITY_WINDOW_DAYS = 7
+
+# (источник, коллекция, поле баллов, поля даты по приоритету, фильтр). Накопленные баллы
+# документа при пересчёте относятся к дню его последнего обновления.
+POINT_PIPELINE_SOURCES = [
+    ('challenges', 'challenge_progress', 'points_earned', ('last_updated', 'started_at'), None),
+    ('quizzes', 'quiz_attempts', 'points_earned', ('attempted_at',), None),
+    ('time', 'time_activity', 'total_points', ('last_activity_at', 'last_updated', 'created_at'), None),
+    ('videos', 'video_watch_time', 'total_points', ('last_updated', 'created_at'), None),
+    ('files', 'time_activity', 'total_points', ('created_at',), {'activity_type': 'file_view'}),
+]
+
+
+def day_key(when: datetime) -> str:
+    return when.strftime('%Y-%m-%d')
+
+
+def window_day_keys(now: datetime, days: int = ACTIVITY_WINDOW_DAYS) -> List[str]:
+    """
+    Дни, покрывающие последние `days` суток (включая сегодняшний)
+    """
+    start = (now - timedelta(days=days)).date()
+    return [day_key(start + timedelta(days=offset)) for offset in range((now.date() - start).days + 1)]
+
+
+def _day_start(key: str) -> datetime:
+    return datetime.strptime(key, '%Y-%m-%d')
+
+
+def _empty_points() -> Dict[str, int]:
+    return {source: 0 for source in POINT_SOURCES}
+
+
+async def record_rollup(collection, user_id: str, points: Optional[Dict[str, int]] = None,
+                        active_lesson: Optional[str] = None, lessons_completed: int = 0,
+                        at: Optional[datetime] = None):
+    """
+    Учитывает событие в документе дня и в итогах: изменение баллов по источникам,
+    активность по уроку (запись lesson_progress) и завершённые уроки
+    """
+    at = at or datetime.utcnow()
+    key = day_key(at)
+    increments = {f'points.{source}': value for source, value in (points or {}).items() if value}
+    if lessons_completed:
+        increments['lessons_completed'] = lessons_completed
+    if not increments and not active_lesson:
+        return
+
+    day_update: Dict[str, Any] = {'$set': {'date': _day_start(key), 'updated_at': at}}
+    if increments:
+        day_update['$inc'] = increments
+    if active_lesson:
+        day_update['$addToSet'] = {'active_students': user_id, 'active_lessons': f'{user_id}:{active_lesson}'}
+    operations = [UpdateOne({'_id': key}, day_update, upsert=True)]
+    if increments:
+        operations.append(UpdateOne({'_id': TOTALS_ID}, {'$inc': increments, '$set': {'updated_at': at}}, upsert=True))
+    await collection.bulk_write(operations, ordered=False)
+
+
+async def invalidate_rollups(collection):
+    """
+    Помечает итоги устаревшими (например, после удаления прогресса урока):
+    следующий обзор пересчитает агрегаты
+    """
+    await collection.update_one({'_id': TOTALS_ID}, {'$set': {'backfilled': False}})
+
+
+def _day_expression(date_fields) -> Dict[str, Any]:
+    date: Any = f'${date_fields[-1]}'
+    for field in reversed(date_fields[:-1]):
+        date = {'$ifNull': [f'${field}', date]}
+    # $dateToString падает на строках, поэтому не-даты превращаются в null
+    return {'$cond': [{'$eq': [{'$type': date}, 'date']},
+                      {'$dateToString': {'format': '%Y-%m-%d', 'date': date}}, None]}
+
+
+def points_by_day_pipeline(points_field: str, date_fields, match: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    pipeline = [{'$match': match}] if match else []
+    pipeline.append({'$group': {'_id': _day_expression(date_fields), 'points': {'$sum': f'${points_field}'}}})
+    return pipeline
+
+
+def activity_by_day_pipeline() -> List[Dict[str, Any]]:
+    return [
+        {'$match': {'user_id': {'$type': 'string'}, 'lesson_id': {'$type': 'string'}}},
+        {'$group': {
+            '_id': _day_expression(('last_activity_at',)),
+            'active_students': {'$addToSet': '$user_id'},
+            'active_lessons': {'$addToSet': {'$concat': ['$user_id', ':', '$lesson_id']}},
+        }},
+    ]
+
+
+def completions_by_day_pipeline() -> List[Dict[str, Any]]:
+    return [
+        {'$match': {'is_completed': True}},
+        {'$group': {'_id': _day_expression(('completed_at',)), 'count': {'$sum': 1}}},
+    ]
+
+
+async def build_rollups(db) -> Dict[str, Dict[str, Any]]:
+    """
+    Документы дней и итогов, рассчитанные агрегациями по исходным коллекциям
+    """
+    totals: Dict[str, Any] = {'_id': TOTALS_ID, 'points': _empty_points(), 'lessons_completed': 0}
+    days: Dict[str, Dict[str, Any]] = {}
+
+    def day_doc(key: str) -> Dict[str, Any]:
+        if key not in days:
+            days[key] = {'_id': key, 'date': _day_start(key), 'points': _empty_points(),
+                         'lessons_completed': 0, 'active_students': [], 'active_lessons': []}
+        return days[key]
+
+    point_results, activity, completions = await asyncio.gather(
+        asyncio.gather(*[
+            db[collection].aggregate(points_by_day_pipeline(field, date_fields, match)).to_list(length=None)
+            for _, collection, field, date_fields, match in POINT_PIPELINE_SOURCES
+        ]),
+        db.lesson_progress.aggregate(activity_by_day_pipeline()).to_list(length=None),
+        db.lesson_progress.aggregate(completions_by_day_pipeline()).to_list(length=None),
+    )
+
+    for (source, *_), rows in zip(POINT_PIPELINE_SOURCES, point_results):
+        for row in rows:
+            points = row.get('points') or 0
+            totals['points'][source] += points
+            # Документы без даты учитываются только в итогах
+            if row['_id'] and points:
+                day_doc(row['_id'])['points'][source] += points
+    for row in activity:
+        if row['_id']:
+            doc = day_doc(row['_id'])
+            doc['active_students'] = sorted(row['active_students'])
+            doc['active_lessons'] = sorted(lesson for lesson in row['active_lessons'] if lesson)
+    for row in completions:
+        totals['lessons_completed'] += row['count']
+        if row['_id']:
+            day_doc(row['_id'])['lessons_completed'] += row['count']
+
+    now = datetime.utcnow()
+    for doc in days.values():
+        doc['updated_at'] = now
+    totals.update({'backfilled': True, 'rebuilt_at': now, 'updated_at': now})
+    days[TOTALS_ID] = totals
+    return days
+
+
+async def rebuild_rollups(db) -> Dict[str, Any]:
+    """
+    Пересчитывает все агрегаты и заменяет ими коллекцию. Запускать при низкой нагрузке:
+    события, записанные во время пересчёта, могут не попасть в агрегаты до следующего.
+    """
+    docs = await build_rollups(db)
+    operations = [ReplaceOne({'_id': key}, doc, upsert=True) for key, doc in docs.items()]
+    operations.append(DeleteMany({'_id': {'$nin': list(docs)}}))
+    await db.analytics_rollups.bulk_write(operations, ordered=False)
+    return docs[TOTALS_ID]
+
+
+async def load_overview(collection, now: Optional[datetime] = None,
+                        days: int = ACTIVITY_WINDOW_DAYS) -> Optional[Dict[str, Any]]:
+    """
+    Итоги и активность за последние `days` суток — не больше days + 2 документов.
+    None, если итоги ещё не построены пересчётом.
+    """
+    now = now or datetime.utcnow()
+    keys = window_day_keys(now, days)
+    docs = await collection.find({'_id': {'$in': [TOTALS_ID] + keys}}).to_list(length=len(keys) + 1)
+    by_id = {doc['_id']: doc for doc in docs}
+    totals = by_id.get(TOTALS_ID)
+    if not totals or not totals.get('backfilled'):
+        return None
+
+    points = _empty_points()
+    points.update(totals.get('points') or {})
+    active_students, active_lessons = set(), set()
+    lessons_completed_recent = 0
+    for key in keys:
+        doc = by_id.get(key) or {}
+        active_students.update(doc.get('active_students') or [])
+        active_lessons.update(doc.get('active_lessons') or [])
+        lessons_completed_recent += doc.get('lessons_completed', 0)
+    return {
+        'points': points,
+        'lessons_completed': totals.get('lessons_completed', 0),
+        'lessons_completed_recent': lessons_completed_recent,
+        'active_students': len(active_students),
+        'recent_activity': len(active_lessons),
+        'rebuilt_at': totals.get('rebuilt_at'),
+    }
+
+
+async def _main(argv) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('MONGODB_DATABASE')]
+    try:
+        totals = await rebuild_rollups(db)
+        print(f"✅ Агрегаты аналитики пересчитаны: {totals['points']}, завершено уроков: {totals['lessons_completed']}")
+    finally:
+        client.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(_main(sys.argv)))
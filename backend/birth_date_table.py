@@ -0,0 +1,112 @@
+"""
+Предрасчитанная таблица чисел по дате рождения (1900–2100)
+
+Личные числа, сила планет и квадрат Пифагора зависят только от даты рождения, поэтому
+для всех ~73 тыс. дат диапазона они считаются заранее скриптом build_birth_date_table.py
+и хранятся в data/birth_date_table.bin. Файл отображается в память (mmap), запись
+находится по порядковому номеру дня за O(1) без форматирования строк и разбора цифр.
+
+Формат файла (little-endian):
+    заголовок  HEADER_FORMAT: сигнатура, версия, размер записи, ordinal первого дня, число записей
+    записи     RECORD_FORMAT на каждый день подряд начиная с FIRST_DATE
+"""
+import mmap
+import os
+import struct
+import threading
+from datetime import date
+from typing import NamedTuple, Optional, Tuple
+
+MAGIC = b'NBDT'
+# Увеличить при изменении формулы любого из чисел — старый файл перестанет читаться
+VERSION = 1
+HEADER_FORMAT = '<4sHHII'
+# soul, mind, destiny, helping_mind, wisdom, ruling | calculation_number | weekday |
+# A1..A4 | количество цифр 1..9 в квадрате | сила 7 планет | количество цифр calculation_number
+RECORD_FORMAT = '<6BIB4B9B7BB'
+
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+FIRST_DATE = date(1900, 1, 1)
+LAST_DATE = date(2100, 12, 31)
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'birth_date_table.bin')
+
+
+class BirthDateRecord(NamedTuple):
+    numbers: Tuple[int, ...]          # soul, mind, destiny, helping_mind, wisdom, ruling
+    calculation_number: int           # DDMM * YYYY
+    weekday: int                      # 0=понедельник ... 6=воскресенье
+    additional_numbers: Tuple[int, ...]
+    digit_counts: Tuple[int, ...]     # количество цифр 1..9 в квадрате Пифагора
+    strength: Tuple[int, ...]         # Солнце, Луна, Марс, Меркурий, Юпитер, Венера, Сатурн
+    strength_digits: int              # сколько планет получили цифру
+
+
+def pack_record(record: BirthDateRecord) -> bytes:
+    return struct.pack(
+        RECORD_FORMAT, *record.numbers, record.calculation_number, record.weekday,
+        *record.additional_numbers, *record.digit_counts, *record.strength, record.strength_digits
+    )
+
+
+class BirthDateTable:
+    """
+    Таблица поверх отображённого в память файла
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.first_ordinal, self.count = struct.unpack_from(HEADER_FORMAT, self._mm, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+            raise ValueError(f"Неподдерживаемая версия таблицы дат рождения: {path}")
+        if len(self._mm) < HEADER_SIZE + self.count * RECORD_SIZE:
+            raise ValueError(f"Таблица дат рождения повреждена: {path}")
+
+    def lookup(self, day: int, month: int, year: int) -> Optional[BirthDateRecord]:
+        """
+        Запись для даты или None, если дата некорректна или вне диапазона таблицы
+        """
+        try:
+            index = date(year, month, day).toordinal() - self.first_ordinal
+        except (ValueError, TypeError):
+            return None
+        if index < 0 or index >= self.count:
+            return None
+        values = struct.unpack_from(RECORD_FORMAT, self._mm, HEADER_SIZE + index * RECORD_SIZE)
+        return BirthDateRecord(values[0:6], values[6], values[7], values[8:12], values[12:21], values[21:28], values[28])
+
+    def close(self):
+        self._mm.close()
+
+
+_table = None
+_table_lock = threading.Lock()
+_table_failed = False
+
+
+def get_birth_date_table() -> Optional[BirthDateTable]:
+    """
+    Общий экземпляр таблицы (открывается один раз на процесс).
+    Возвращает None, если файл не собран — тогда числа считаются как обычно.
+    """
+    global _table, _table_failed
+    if _table is not None or _table_failed:
+        return _table
+    with _table_lock:
+        if _table is None and not _table_failed:
+            try:
+                _table = BirthDateTable(os.environ.get('BIRTH_DATE_TABLE_PATH', DEFAULT_PATH))
+            except (OSError, ValueError, struct.error):
+                _table_failed = True
+    return _table
+
+
+def lookup_birth_date(day: int, month: int, year: int) -> Optional[BirthDateRecord]:
+    table = get_birth_date_table()
+    if table is None:
+        return None
+    return table.lookup(day, month, year)
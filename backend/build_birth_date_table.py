@@ -0,0 +1,71 @@
+"""
+Сборка таблицы чисел по дате рождения data/birth_date_table.bin
+
+Запуск (выполняется при сборке Docker-образа):
+    python build_birth_date_table.py [output.bin]
+
+Каждая запись считается обычными функциями numerology.py, поэтому таблица всегда
+совпадает с расчётом без неё. Формат файла описан в birth_date_table.py.
+"""
+import os
+import struct
+import sys
+from datetime import timedelta
+
+from birth_date_table import (
+    DEFAULT_PATH, FIRST_DATE, HEADER_FORMAT, LAST_DATE, MAGIC, RECORD_SIZE, VERSION,
+    BirthDateRecord, pack_record,
+)
+from numerology import (
+    PLANET_NAMES, _compute_planetary_strength, _compute_pythagorean_square,
+    calculate_destiny_number, calculate_helping_mind_number, calculate_mind_number,
+    calculate_ruling_number, calculate_soul_number, calculate_wisdom_number,
+)
+
+
+def build_record(day: int, month: int, year: int) -> BirthDateRecord:
+    planetary = _compute_planetary_strength(day, month, year)
+    square = _compute_pythagorean_square(day, month, year)
+    return BirthDateRecord(
+        numbers=(
+            calculate_soul_number(day),
+            calculate_mind_number(month),
+            calculate_destiny_number(day, month, year),
+            calculate_helping_mind_number(day, month),
+            calculate_wisdom_number(day, month, year),
+            calculate_ruling_number(day, month, year),
+        ),
+        calculation_number=planetary['calculation_number'],
+        weekday=(planetary['start_planet_index'] - 1) % 7,
+        additional_numbers=tuple(square['additional_numbers']),
+        digit_counts=tuple(len(square['square'][r][c]) for r, c in (
+            (0, 0), (1, 0), (2, 0), (0, 1), (1, 1), (2, 1), (0, 2), (1, 2), (2, 2))),
+        strength=tuple(planetary['strength'][planet] for planet in PLANET_NAMES),
+        strength_digits=len(planetary['weekday_map']),
+    )
+
+
+def build() -> bytes:
+    records = bytearray()
+    count = 0
+    day = FIRST_DATE
+    while day <= LAST_DATE:
+        records += pack_record(build_record(day.day, day.month, day.year))
+        count += 1
+        day += timedelta(days=1)
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, RECORD_SIZE, FIRST_DATE.toordinal(), count)
+    return header + bytes(records)
+
+
+def main(argv) -> int:
+    output = argv[1] if len(argv) > 1 else DEFAULT_PATH
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    data = build()
+    with open(output, 'wb') as f:
+        f.write(data)
+    print(f"✅ {output}: {(LAST_DATE - FIRST_DATE).days + 1} дат, {len(data) / 1024 / 1024:.1f} МБ")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,138 @@
+"""
+Сборка офлайн-справочника городов data/city_gazetteer.bin
+
+Источник — выгрузка GeoNames (https://www.geonames.org, лицензия CC-BY 4.0):
+    cities15000.txt  — TSV-дамп с download.geonames.org/export/dump/cities15000.zip
+    cities15000.json — тот же набор городов из пакета geonamescache
+
+Запуск:
+    python build_city_gazetteer.py path/to/cities15000.txt [output.bin]
+
+В индекс попадают основное название и альтернативные написания латиницей и кириллицей
+(транслитерации в нижнем регистре и аббревиатуры отбрасываются, чтобы файл оставался
+компактным). Формат файла описан в city_gazetteer.py.
+"""
+import json
+import re
+import struct
+import sys
+from typing import Dict, List, Any
+
+from city_gazetteer import (
+    CITY_FORMAT, COORD_SCALE, DEFAULT_PATH, HEADER_FORMAT, HEADER_SIZE, MAGIC, VERSION,
+    normalize_city_name,
+)
+
+# Латиница (включая расширенную), кириллица, цифры и обычная пунктуация названий
+_INDEXED_SPELLING = re.compile(r"^[A-Za-zÀ-ɏЀ-ӿ0-9 .'’\-()]+$")
+
+
+def load_geonames_tsv(path: str) -> List[Dict[str, Any]]:
+    cities = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            row = line.rstrip('\n').split('\t')
+            if len(row) < 18:
+                continue
+            cities.append({
+                "name": row[1],
+                "alternatenames": [n for n in row[3].split(',') if n],
+                "latitude": float(row[4]),
+                "longitude": float(row[5]),
+                "countrycode": row[8],
+                "population": int(row[14] or 0),
+                "timezone": row[17],
+            })
+    return cities
+
+
+def load_geonames_json(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding='utf-8') as f:
+        return list(json.load(f).values())
+
+
+def city_spellings(city: Dict[str, Any]) -> set:
+    """
+    Нормализованные написания города, попадающие в индекс имён
+    """
+    spellings = {normalize_city_name(city["name"])}
+    for alt in city.get("alternatenames", []):
+        if _INDEXED_SPELLING.match(alt) and not alt.isupper() and not alt.islower():
+            spellings.add(normalize_city_name(alt))
+    spellings.discard('')
+    return spellings
+
+
+def build(cities: List[Dict[str, Any]]) -> bytes:
+    cities = [c for c in cities if c.get("timezone")]
+    # Более населённые города первыми: при равных именах побеждает крупнейший
+    cities.sort(key=lambda c: (-int(c.get("population") or 0), c["name"]))
+
+    timezones = sorted({c["timezone"] for c in cities})
+    tz_index = {tz: i for i, tz in enumerate(timezones)}
+
+    city_records = bytearray()
+    display_offsets = [0]
+    display_blob = bytearray()
+    entries = []
+    for city_id, city in enumerate(cities):
+        city_records += struct.pack(
+            CITY_FORMAT,
+            round(city["latitude"] * COORD_SCALE),
+            round(city["longitude"] * COORD_SCALE),
+            tz_index[city["timezone"]],
+            min(int(city.get("population") or 0), 0xFFFFFFFF),
+            (city.get("countrycode") or "--").encode('ascii')[:2].ljust(2, b'-'),
+        )
+        display_blob += city["name"].encode('utf-8')
+        display_offsets.append(len(display_blob))
+        for spelling in city_spellings(city):
+            entries.append((spelling.encode('utf-8'), city_id))
+
+    # Побайтный порядок совпадает со сравнением bytes при бинарном поиске;
+    # city_id уже упорядочен по убыванию населения
+    entries.sort()
+
+    name_offsets = [0]
+    name_blob = bytearray()
+    name_ids = bytearray()
+    for key, city_id in entries:
+        name_blob += key
+        name_offsets.append(len(name_blob))
+        name_ids += struct.pack('<I', city_id)
+
+    sections = [
+        bytes(city_records),
+        struct.pack(f'<{len(display_offsets)}I', *display_offsets),
+        bytes(display_blob),
+        struct.pack(f'<{len(name_offsets)}I', *name_offsets),
+        bytes(name_ids),
+        bytes(name_blob),
+        '\n'.join(timezones).encode('utf-8'),
+    ]
+    offsets = []
+    position = HEADER_SIZE
+    for section in sections:
+        offsets.append(position)
+        position += len(section)
+
+    header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, len(cities), len(entries), len(timezones), *offsets)
+    return header + b''.join(sections)
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+    source = argv[1]
+    output = argv[2] if len(argv) > 2 else DEFAULT_PATH
+    cities = load_geonames_json(source) if source.endswith('.json') else load_geonames_tsv(source)
+    data = build(cities)
+    with open(output, 'wb') as f:
+        f.write(data)
+    print(f"✅ {output}: {len(cities)} городов, {len(data) / 1024 / 1024:.1f} МБ")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,199 @@
+"""
+Офлайн-справочник городов (gazetteer) для определения координат и часового пояса
+
+Данные лежат в компактном бинарном файле data/city_gazetteer.bin, который собирается
+скриптом build_city_gazetteer.py из выгрузки GeoNames (cities15000, лицензия CC-BY 4.0).
+Файл отображается в память (mmap), поэтому каждый воркер читает одни и те же страницы
+без разбора и без сетевых запросов.
+
+Формат файла (little-endian):
+    заголовок     HEADER_FORMAT: сигнатура, версия, количества и смещения секций
+    города        city_count записей CITY_FORMAT: lat*1e5, lon*1e5, индекс tz, население, страна
+    отображаемые  (city_count + 1) смещений uint32 + UTF-8 блоб с названиями городов
+    имена         (name_count + 1) смещений uint32 + uint32 номер города на имя
+                  + UTF-8 блоб нормализованных имён, отсортированных побайтно
+                  (при равных именах — по убыванию населения)
+    часовые пояса IANA-имена через '\\n'
+"""
+import mmap
+import os
+import re
+import struct
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Tuple, Any
+
+MAGIC = b'NCGZ'
+VERSION = 1
+# magic, version, city_count, name_count, tz_count, 7 смещений секций
+HEADER_FORMAT = '<4sHxxIII7I'
+CITY_FORMAT = '<iiHI2s'
+COORD_SCALE = 100000
+
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+CITY_SIZE = struct.calcsize(CITY_FORMAT)
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'city_gazetteer.bin')
+
+_NON_WORD = re.compile(r'[\W_]+', re.UNICODE)
+# Префиксы, которые пользователи часто пишут перед названием
+_CITY_PREFIXES = ('г ', 'город ', 'gorod ', 'city of ')
+
+
+def normalize_city_name(name: str) -> str:
+    """
+    Нормализует название города для поиска: регистр, диакритика (ё -> е, ș -> s),
+    пунктуация и дефисы заменяются пробелами
+    """
+    if not name:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', name.casefold())
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _NON_WORD.sub(' ', stripped).strip()
+
+
+def _query_variants(name: str) -> List[str]:
+    """
+    Варианты запроса: как есть, без префикса "г.", только часть до запятой
+    """
+    if not name:
+        return []
+    variants = []
+    key = normalize_city_name(name)
+    if key:
+        variants.append(key)
+    if ',' in name:
+        head = normalize_city_name(name.split(',', 1)[0])
+        if head and head not in variants:
+            variants.append(head)
+    for variant in list(variants):
+        for prefix in _CITY_PREFIXES:
+            if variant.startswith(prefix):
+                bare = variant[len(prefix):].strip()
+                if bare and bare not in variants:
+                    variants.append(bare)
+    return variants
+
+
+class CityGazetteer:
+    """
+    Справочник городов поверх отображённого в память бинарного файла
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.city_count, self.name_count, tz_count,
+         self._cities_off, self._display_idx_off, self._display_off,
+         self._name_idx_off, self._name_ids_off, self._names_off, tz_off) = \
+            struct.unpack_from(HEADER_FORMAT, self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Неподдерживаемый формат справочника городов: {path}")
+
+        self.timezones = self._mm[tz_off:].decode('utf-8').split('\n')[:tz_count]
+
+    def __len__(self) -> int:
+        return self.city_count
+
+    def _name_at(self, index: int) -> bytes:
+        start, end = struct.unpack_from('<II', self._mm, self._name_idx_off + 4 * index)
+        return self._mm[self._names_off + start:self._names_off + end]
+
+    def _city_id_at(self, index: int) -> int:
+        return struct.unpack_from('<I', self._mm, self._name_ids_off + 4 * index)[0]
+
+    def _lower_bound(self, key: bytes) -> int:
+        lo, hi = 0, self.name_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def city(self, city_id: int) -> Dict[str, Any]:
+        """
+        Запись города по внутреннему номеру
+        """
+        lat, lon, tz_index, population, country = struct.unpack_from(
+            CITY_FORMAT, self._mm, self._cities_off + CITY_SIZE * city_id)
+        start, end = struct.unpack_from('<II', self._mm, self._display_idx_off + 4 * city_id)
+        return {
+            "name": self._mm[self._display_off + start:self._display_off + end].decode('utf-8'),
+            "country": country.decode('ascii'),
+            "latitude": lat / COORD_SCALE,
+            "longitude": lon / COORD_SCALE,
+            "timezone": self.timezones[tz_index],
+            "population": population,
+        }
+
+    def lookup(self, name: str) -> Optional[Tuple[float, float, str]]:
+        """
+        Точный поиск по нормализованному названию (кириллица или латиница).
+        При совпадении нескольких городов возвращается самый населённый.
+        """
+        for variant in _query_variants(name):
+            key = variant.encode('utf-8')
+            index = self._lower_bound(key)
+            if index < self.name_count and self._name_at(index) == key:
+                city = self.city(self._city_id_at(index))
+                return city["latitude"], city["longitude"], city["timezone"]
+        return None
+
+    def search_prefix(self, prefix: str, limit: int = 10, max_scan: int = 5000) -> List[Dict[str, Any]]:
+        """
+        Поиск городов по началу названия (для автодополнения), по убыванию населения.
+        Для очень коротких префиксов просматривается не больше max_scan имён.
+        """
+        key = normalize_city_name(prefix).encode('utf-8')
+        if not key or limit <= 0:
+            return []
+
+        found = {}
+        index = self._lower_bound(key)
+        end = min(self.name_count, index + max_scan)
+        while index < end:
+            name = self._name_at(index)
+            if not name.startswith(key):
+                break
+            city_id = self._city_id_at(index)
+            if city_id not in found:
+                found[city_id] = name.decode('utf-8')
+            index += 1
+
+        cities = []
+        for city_id, matched in found.items():
+            city = self.city(city_id)
+            city["matched_name"] = matched
+            cities.append(city)
+        cities.sort(key=lambda c: -c["population"])
+        return cities[:limit]
+
+    def close(self):
+        self._mm.close()
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+_gazetteer_failed = False
+
+
+def get_city_gazetteer() -> Optional[CityGazetteer]:
+    """
+    Общий экземпляр справочника (открывается один раз на процесс).
+    Возвращает None, если файл данных отсутствует или повреждён.
+    """
+    global _gazetteer, _gazetteer_failed
+    if _gazetteer is not None or _gazetteer_failed:
+        return _gazetteer
+    with _gazetteer_lock:
+        if _gazetteer is None and not _gazetteer_failed:
+            try:
+                _gazetteer = CityGazetteer(os.environ.get('CITY_GAZETTEER_PATH', DEFAULT_PATH))
+            except (OSError, ValueError, struct.error) as e:
+                print(f"Справочник городов недоступен: {e}")
+                _gazetteer_failed = True
+    return _gazetteer
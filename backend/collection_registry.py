@@ -0,0 +1,115 @@
+"""
+Реестр коллекций MongoDB
+
+Обработчики раньше проверяли наличие коллекции через db.list_collection_names() — это
+запрос к каталогу на каждый вызов, иногда несколько раз за запрос. Теперь при старте
+реестр один раз читает список коллекций, создаёт недостающие из EXPECTED_COLLECTIONS
+вместе с их индексами и дальше отвечает на проверки из памяти.
+
+Новая коллекция с индексами добавляется сюда, а не в on_startup.
+"""
+import logging
+from typing import Dict, List, Set
+
+from pymongo import IndexModel
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Коллекции, которые приложение ожидает, и индексы для их путей запросов.
+# init-mongo.js создаёт индексы только в базе learning_v2, поэтому для базы MONGODB_DATABASE
+# они объявляются здесь; проверка планов запросов — index_check.py.
+EXPECTED_COLLECTIONS: Dict[str, List[IndexModel]] = {
+    # get_current_user / профиль / списание баллов — по id, вход и регистрация — по email
+    'users': [IndexModel([('id', 1)]), IndexModel([('email', 1)])],
+    'credit_transactions': [
+        # Одна транзакция на ключ идемпотентности списания
+        IndexModel([('user_id', 1), ('idempotency_key', 1)], unique=True,
+                   partialFilterExpression={'idempotency_key': {'$type': 'string'}}),
+        # Постраничная выдача истории баллов
+        IndexModel([('user_id', 1), ('created_at', -1), ('id', -1)]),
+    ],
+    'credit_aggregates': [],
+    'analytics_rollups': [],
+    'numerology_calculations': [
+        # Последние расчёты по типам и история расчётов пользователя
+        IndexModel([('user_id', 1), ('calculation_type', 1), ('created_at', -1)]),
+        IndexModel([('user_id', 1), ('created_at', -1)]),
+    ],
+    'lessons_v2': [IndexModel([('id', 1)]), IndexModel([('is_active', 1)])],
+    'files': [IndexModel([('id', 1)]), IndexModel([('lesson_id', 1)])],
+    'push_subscriptions': [
+        IndexModel([('user_id', 1), ('endpoint', 1)]),
+        IndexModel([('user_id', 1), ('enabled', 1)]),
+    ],
+    # Агрегаты дашборда и аналитики студента: выборка по пользователю и окну дат
+    'lesson_progress': [IndexModel([('user_id', 1), ('lesson_id', 1)])],
+    'exercise_responses': [IndexModel([('user_id', 1), ('submitted_at', -1)])],
+    'quiz_attempts': [IndexModel([('user_id', 1), ('attempted_at', -1)])],
+    'quiz_results': [],
+    'challenge_progress': [IndexModel([('user_id', 1)])],
+    'time_activity': [
+        IndexModel([('user_id', 1), ('activity_type', 1)]),
+        # Поиск записи активности урока за сегодня при просмотре урока/теории/упражнения
+        IndexModel([('user_id', 1), ('lesson_id', 1), ('activity_type', 1), ('created_at', -1)]),
+        IndexModel([('lesson_id', 1)]),
+    ],
+    'video_watch_time': [
+        IndexModel([('user_id', 1)]),
+        # Учёт просмотра видео: один документ на (файл, пользователь)
+        IndexModel([('file_id', 1), ('user_id', 1)]),
+    ],
+    'file_analytics': [IndexModel([('user_id', 1), ('action', 1), ('created_at', -1)])],
+    'personal_consultations': [],
+    'consultation_purchases': [],
+}
+
+
+class CollectionRegistry:
+    """
+    Кеш имён коллекций базы, заполняется при старте (ensure)
+    """
+
+    def __init__(self, expected: Dict[str, List[IndexModel]] = None):
+        self.expected = EXPECTED_COLLECTIONS if expected is None else expected
+        self._names: Set[str] = set()
+        # 'коллекция.индекс' -> ошибка создания (например, конфликт с уже существующим индексом)
+        self.index_errors: Dict[str, str] = {}
+
+    async def ensure(self, db):
+        """
+        Создаёт недостающие ожидаемые коллекции и их индексы, кеширует список коллекций
+        """
+        self._names = set(await db.list_collection_names())
+        for name, indexes in self.expected.items():
+            if name not in self._names:
+                try:
+                    await db.create_collection(name)
+                    logger.info(f"Создана коллекция {name}")
+                except CollectionInvalid:
+                    pass  # создана другим воркером
+                self._names.add(name)
+            # По одному индексу: create_indexes не создаёт ни одного, если хотя бы один конфликтует
+            for index in indexes:
+                key = f"{name}.{index.document['name']}"
+                try:
+                    await db[name].create_indexes([index])
+                    self.index_errors.pop(key, None)
+                except OperationFailure as e:
+                    # Не мешаем старту: план запроса покажет index_check.py
+                    self.index_errors[key] = str(e)
+                    logger.error(f"Не удалось создать индекс {key}: {e}")
+
+    def exists(self, name: str) -> bool:
+        # Ожидаемые коллекции создаются при старте; даже до этого запрос к ним просто пуст
+        return name in self.expected or name in self._names
+
+    @property
+    def names(self) -> Set[str]:
+        """
+        Известные коллекции: ожидаемые и найденные в базе при старте
+        """
+        return self._names | set(self.expected)
+
+
+collection_registry = CollectionRegistry()
@@ -0,0 +1,258 @@
+"""
+Материализованные счётчики баллов пользователя (коллекция credit_aggregates)
+
+/user/points-breakdown раньше перебирал всю историю credit_transactions пользователя.
+Теперь на каждую записанную транзакцию счётчики обновляются через $inc, а разбивка
+читается одним документом по _id, независимо от длины истории.
+
+Документ credit_aggregates:
+    {
+        "_id": user_id,
+        "transaction_count": 42,
+        "total_earned": 310, "total_spent": 57,          # сумма положительных / отрицательных amount
+        "breakdown": {"earned_points": .., "purchased_points": .., "admin_points": ..,
+                      "exercise_review_points": ..},     # как в /user/points-breakdown
+        "by_category": {"numerology": {"earned": 0, "spent": 12, "count": 12}, ...},
+        "by_day": {"2025-10-09": {"earned": 10, "spent": 3}, ...},   # по created_at (UTC)
+        "backfilled": true,                              # счётчики включают историю до их появления
+        "updated_at": datetime
+    }
+
+Если $inc пакета не прошёл, у его пользователей ставится backfilled: false — следующее
+чтение пересчитает счётчики по истории (rebuild_user_aggregate).
+
+Заполнение по существующей истории:
+    python credit_aggregates.py            # все пользователи
+    python credit_aggregates.py <user_id>  # один пользователь
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+# Категории разбивки баллов (см. /user/points-breakdown)
+EARNED_CATEGORIES = ('learning', 'exercise', 'quiz', 'challenge', 'lesson')
+PURCHASED_CATEGORIES = ('purchase', 'subscription')
+
+BREAKDOWN_FIELDS = ('earned_points', 'purchased_points', 'admin_points', 'exercise_review_points')
+
+# $inc транзакции приходит сразу после её записи; пересчёт, увидевший транзакции моложе
+# этого окна, не сохраняется — их $inc ещё может прийти и задвоить счётчики
+REBUILD_GRACE_SECONDS = 60
+REBUILD_ATTEMPTS = 3
+
+
+def breakdown_bucket(transaction: Dict[str, Any]) -> Optional[str]:
+    """
+    В какую группу разбивки попадает транзакция (None — не учитывается)
+    """
+    if transaction.get('transaction_type') != 'credit':
+        return None
+    category = transaction.get('category', '')
+    details = transaction.get('details') or {}
+
+    if category in EARNED_CATEGORIES:
+        # Проверка упражнения администратором считается отдельно
+        if category == 'exercise' and (details.get('reviewed_by') or details.get('admin_review')):
+            return 'exercise_review_points'
+        return 'earned_points'
+    if category in PURCHASED_CATEGORIES:
+        return 'purchased_points'
+    if category == 'admin' or details.get('added_by_admin'):
+        return 'admin_points'
+    if category == 'exercise_review' or details.get('exercise_review'):
+        return 'exercise_review_points'
+    return None
+
+
+def _field_key(value: Any) -> str:
+    # Имена полей Mongo не могут содержать '.' и начинаться с '$'
+    key = str(value or 'other').replace('.', '_')
+    return key.lstrip('$') or 'other'
+
+
+def transaction_increments(transaction: Dict[str, Any]) -> Dict[str, int]:
+    """
+    Поля и значения $inc для одной транзакции
+    """
+    amount = transaction.get('amount') or 0
+    category = _field_key(transaction.get('category'))
+    increments = {'transaction_count': 1, f'by_category.{category}.count': 1}
+
+    if amount > 0:
+        increments['total_earned'] = amount
+        increments[f'by_category.{category}.earned'] = amount
+    elif amount < 0:
+        increments['total_spent'] = -amount
+        increments[f'by_category.{category}.spent'] = -amount
+
+    created_at = transaction.get('created_at')
+    if isinstance(created_at, datetime) and amount:
+        side = 'earned' if amount > 0 else 'spent'
+        increments[f"by_day.{created_at.strftime('%Y-%m-%d')}.{side}"] = abs(amount)
+
+    bucket = breakdown_bucket(transaction)
+    if bucket and amount:
+        increments[f'breakdown.{bucket}'] = amount
+    return increments
+
+
+def _merge_by_user(transactions: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, int]]:
+    merged: Dict[str, Dict[str, int]] = {}
+    for transaction in transactions:
+        user_id = transaction.get('user_id')
+        if not user_id:
+            continue
+        user_increments = merged.setdefault(user_id, {})
+        for field, value in transaction_increments(transaction).items():
+            user_increments[field] = user_increments.get(field, 0) + value
+    return merged
+
+
+async def apply_credit_aggregates(collection, transactions: Iterable[Dict[str, Any]]):
+    """
+    Обновляет счётчики для записанных транзакций: один $inc на пользователя за пакет
+    """
+    merged = _merge_by_user(transactions)
+    if not merged:
+        return
+    now = datetime.utcnow()
+    try:
+        await collection.bulk_write([
+            UpdateOne({'_id': user_id}, {'$inc': increments, '$set': {'updated_at': now}}, upsert=True)
+            for user_id, increments in merged.items()
+        ], ordered=False)
+    except Exception:
+        # Часть $inc могла пройти: счётчики этих пользователей пересчитаются при следующем чтении
+        await invalidate_credit_aggregates(collection, list(merged))
+        raise
+
+
+async def invalidate_credit_aggregates(collection, user_ids: List[str]):
+    """
+    Помечает счётчики пользователей непостроенными (backfilled: false)
+    """
+    try:
+        await collection.update_many({'_id': {'$in': user_ids}}, {'$set': {'backfilled': False}})
+    except Exception as e:
+        print(f"credit_aggregates: не удалось сбросить счётчики {len(user_ids)} пользователей: {e}")
+
+
+def build_aggregate(user_id: str, transactions: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Документ счётчиков, рассчитанный по полной истории пользователя
+    """
+    doc: Dict[str, Any] = {
+        '_id': user_id,
+        'transaction_count': 0,
+        'total_earned': 0,
+        'total_spent': 0,
+        'breakdown': {field: 0 for field in BREAKDOWN_FIELDS},
+        'by_category': {},
+        'by_day': {},
+    }
+    for field, value in _merge_by_user(transactions).get(user_id, {}).items():
+        # 'by_category.numerology.spent' -> doc['by_category']['numerology']['spent']
+        target = doc
+        *path, leaf = field.split('.')
+        for part in path:
+            target = target.setdefault(part, {})
+        target[leaf] = target.get(leaf, 0) + value
+    doc['backfilled'] = True
+    doc['updated_at'] = datetime.utcnow()
+    return doc
+
+
+_BACKFILL_PROJECTION = {'_id': 0, 'user_id': 1, 'amount': 1, 'category': 1, 'details': 1,
+                        'transaction_type': 1, 'created_at': 1, 'written_at': 1}
+
+
+def _has_recent(transactions: Iterable[Dict[str, Any]]) -> bool:
+    cutoff = datetime.utcnow() - timedelta(seconds=REBUILD_GRACE_SECONDS)
+    for transaction in transactions:
+        # written_at — время записи очередью credit_ledger (у отложенных записей позже created_at)
+        for field in ('written_at', 'created_at'):
+            value = transaction.get(field)
+            if isinstance(value, datetime) and value >= cutoff:
+                return True
+    return False
+
+
+async def rebuild_user_aggregate(db, user_id: str) -> Dict[str, Any]:
+    """
+    Пересчитывает счётчики пользователя по credit_transactions и сохраняет их.
+
+    Одновременно очередь баллов может делать $inc того же документа, поэтому замена условная:
+    только если счётчики ещё не построены и transaction_count не изменился с чтения перед
+    пересчётом (иначе пересчёт повторяется). Если в истории есть транзакции моложе
+    REBUILD_GRACE_SECONDS, пересчёт возвращается без сохранения — его повторит следующее чтение.
+    """
+    doc = None
+    for _ in range(REBUILD_ATTEMPTS):
+        current = await db.credit_aggregates.find_one({'_id': user_id}, {'by_day': 0})
+        if current and current.get('backfilled'):
+            return current
+        transactions = await db.credit_transactions.find({'user_id': user_id}, _BACKFILL_PROJECTION).to_list(length=None)
+        doc = build_aggregate(user_id, transactions)
+        if _has_recent(transactions):
+            return doc
+        try:
+            # Несовпадение фильтра при upsert — вставка с тем же _id, т.е. DuplicateKeyError
+            await db.credit_aggregates.replace_one(
+                {'_id': user_id, 'backfilled': {'$ne': True},
+                 'transaction_count': current.get('transaction_count') if current else None},
+                doc, upsert=True)
+        except DuplicateKeyError:
+            continue
+        return doc
+    return doc
+
+
+async def backfill_credit_aggregates(db, batch_size: int = 1000) -> int:
+    """
+    Строит счётчики всех пользователей по существующей истории (за один проход по индексу
+    user_id). Запускать при низкой нагрузке: транзакции, записанные во время прохода по
+    пользователю, могут не попасть в его счётчики до следующего пересчёта.
+    """
+    users = 0
+    current_user, current = None, []
+    cursor = db.credit_transactions.find({}, _BACKFILL_PROJECTION).sort('user_id', 1).batch_size(batch_size)
+    async for transaction in cursor:
+        user_id = transaction.get('user_id')
+        if user_id != current_user:
+            if current_user:
+                await db.credit_aggregates.replace_one({'_id': current_user}, build_aggregate(current_user, current), upsert=True)
+                users += 1
+            current_user, current = user_id, []
+        current.append(transaction)
+    if current_user:
+        await db.credit_aggregates.replace_one({'_id': current_user}, build_aggregate(current_user, current), upsert=True)
+        users += 1
+    return users
+
+
+async def _main(argv) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('MONGODB_DATABASE')]
+    try:
+        if len(argv) > 1:
+            doc = await rebuild_user_aggregate(db, argv[1])
+            print(f"✅ {argv[1]}: {doc['transaction_count']} транзакций")
+        else:
+            users = await backfill_credit_aggregates(db)
+            print(f"✅ Счётчики баллов построены для {users} пользователей")
+    finally:
+        client.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(_main(sys.argv)))
@@ -0,0 +1,279 @@
+"""
+Отложенная пакетная запись истории баллов (credit_transactions)
+
+Начисления за обучение (просмотр видео, файлов, уроков) и списания записывают по одной
+транзакции на запрос. Вместо insert_one на пути запроса транзакции складываются в
+ограниченную очередь процесса и пишутся insert_many — когда набирается FLUSH_BATCH_SIZE
+записей или раз в FLUSH_INTERVAL секунд. Баланс пользователя (users.credits_remaining)
+по-прежнему меняется сразу; в очередь попадает только запись истории.
+
+При остановке (on_shutdown) очередь выгружается полностью. Если Mongo недоступна,
+пакет возвращается в начало очереди и будет записан при следующей выгрузке, а то, что не
+удалось записать при остановке, сохраняется в SPILL_DIR и дописывается при следующем старте.
+Туда же уходит переполненная очередь, которую не удалось выгрузить: баланс к этому моменту
+уже изменён, поэтому put() не бросает исключений, а запись истории не теряется.
+
+Транзакции, отклонённые insert_many не из-за дубликата ключа, повторно не записываются (Mongo
+отклонит их снова): они сохраняются в SPILL_DIR/rejected-*.jsonl, которые при старте не
+загружаются и разбираются вручную.
+"""
+import asyncio
+import glob
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from bson import json_util
+from pymongo.errors import BulkWriteError
+
+FLUSH_BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+# Предел очереди: при переполнении запрос ждёт выгрузку, а если она не удалась — очередь
+# сохраняется в SPILL_DIR
+MAX_QUEUE_SIZE = 20000
+
+DUPLICATE_KEY_ERROR = 11000
+
+SPILL_DIR = os.environ.get('CREDIT_LEDGER_SPILL_DIR', os.path.join('uploads', 'tmp', 'credit_ledger'))
+
+
+class CreditLedgerQueue:
+    """
+    Очередь транзакций баллов с выгрузкой insert_many по размеру или по времени
+    """
+
+    def __init__(self, batch_size: int = FLUSH_BATCH_SIZE, interval: float = FLUSH_INTERVAL,
+                 max_size: int = MAX_QUEUE_SIZE):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_size = max_size
+        self.collection = None
+        self.on_written = None
+        self._queue = deque()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._timer_task: Optional[asyncio.Task] = None
+        self.enqueued = 0
+        self.written = 0
+        self.duplicates = 0
+        self.flushes = 0
+        self.errors = 0
+        self.callback_errors = 0
+        self.spilled = 0
+        self.rejected = 0
+        self.max_depth = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def configure(self, collection, on_written=None):
+        """
+        Подключает коллекцию и запускает периодическую выгрузку (вызывается при старте).
+        Транзакции, сохранённые на диск при прошлой остановке, возвращаются в очередь.
+        on_written(transactions) — корутина, вызываемая для каждого записанного пакета.
+        """
+        self.collection = collection
+        self.on_written = on_written
+        self._load_spilled()
+        if self._timer_task is None:
+            self._timer_task = asyncio.get_running_loop().create_task(self._run_timer())
+
+    async def _run_timer(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._queue:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    print(f"credit_ledger: ошибка фоновой выгрузки: {e}")
+
+    @property
+    def configured(self) -> bool:
+        return self.collection is not None
+
+    async def put(self, transaction: Dict[str, Any]):
+        """
+        Ставит транзакцию в очередь (коллекция должна быть подключена через configure).
+        Не бросает исключений: баланс пользователя к этому моменту уже изменён.
+        """
+        self._queue.append(transaction)
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, len(self._queue))
+        if len(self._queue) > self.max_size:
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"credit_ledger: очередь переполнена, выгрузка не удалась: {e}")
+            if len(self._queue) > self.max_size:
+                try:
+                    self._spill()
+                except OSError as e:
+                    # Диск тоже недоступен: транзакции остаются в очереди сверх предела
+                    print(f"credit_ledger: не удалось сохранить очередь на диск: {e}")
+            return
+        if len(self._queue) >= self.batch_size and self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_in_background())
+
+    async def _flush_in_background(self):
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"credit_ledger: ошибка выгрузки: {e}")
+        finally:
+            self._flush_task = None
+
+    async def flush(self):
+        """
+        Записывает всё, что накопилось к моменту вызова, пакетами по batch_size
+        """
+        async with self._flush_lock:
+            remaining = len(self._queue)
+            while remaining > 0 and self._queue:
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                remaining -= len(batch)
+                await self._write(batch)
+
+    async def _write(self, batch: List[Dict[str, Any]]):
+        started = time.perf_counter()
+        written = batch
+        # Время записи (а не created_at) — по нему пересчёт счётчиков узнаёт, что $inc ещё в пути
+        now = datetime.utcnow()
+        for transaction in batch:
+            transaction['written_at'] = now
+        try:
+            await self.collection.insert_many(batch, ordered=False)
+            self.written += len(batch)
+        except BulkWriteError as e:
+            write_errors = e.details.get('writeErrors', [])
+            duplicates = sum(1 for err in write_errors if err.get('code') == DUPLICATE_KEY_ERROR)
+            # Повтор с тем же ключом идемпотентности уже записан — это не ошибка
+            self.duplicates += duplicates
+            self.written += e.details.get('nInserted', 0)
+            rejected = {err['index'] for err in write_errors}
+            written = [doc for index, doc in enumerate(batch) if index not in rejected]
+            failed = {err['index'] for err in write_errors if err.get('code') != DUPLICATE_KEY_ERROR}
+            if failed:
+                # Повтор отклонялся бы снова: сохраняем на диск для ручного разбора
+                self.errors += 1
+                errmsg = next(err.get('errmsg') for err in write_errors if err.get('code') != DUPLICATE_KEY_ERROR)
+                print(f"credit_ledger: не записано {len(failed)} транзакций: {errmsg}")
+                rejected_docs = [doc for index, doc in enumerate(batch) if index in failed]
+                try:
+                    self._spill(rejected_docs, prefix='rejected')
+                    self.rejected += len(rejected_docs)
+                except OSError as spill_error:
+                    print(f"credit_ledger: не удалось сохранить на диск, транзакции остаются в очереди: {spill_error}")
+                    self._queue.extend(rejected_docs)
+        except Exception as e:
+            # Mongo недоступна: возвращаем пакет в начало очереди
+            self.errors += 1
+            self._queue.extendleft(reversed(batch))
+            raise RuntimeError(f"не удалось записать {len(batch)} транзакций: {e}") from e
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.flushes += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+        if self.on_written is not None and written:
+            try:
+                await self.on_written(written)
+            except Exception as e:
+                # Пакет уже записан — повторять нельзя, иначе история задвоится; счётчики
+                # затронутых пользователей сброшены и пересчитаются при чтении
+                self.callback_errors += 1
+                print(f"credit_ledger: ошибка обработки записанного пакета: {e}")
+
+    def has_pending(self, user_id: str, idempotency_key: Optional[str] = None) -> bool:
+        """
+        Есть ли в очереди транзакции пользователя (с данным ключом идемпотентности)
+        """
+        for transaction in self._queue:
+            if transaction.get('user_id') == user_id and (
+                    idempotency_key is None or transaction.get('idempotency_key') == idempotency_key):
+                return True
+        return False
+
+    async def flush_for_user(self, user_id: str):
+        """
+        Выгружает очередь перед чтением истории, если в ней есть записи пользователя
+        """
+        if self.has_pending(user_id):
+            await self.flush()
+
+    async def close(self):
+        """
+        Останавливает таймер и полностью выгружает очередь (on_shutdown)
+        """
+        if self._timer_task is not None:
+            self._timer_task.cancel()
+            self._timer_task = None
+        if self._flush_task is not None:
+            await asyncio.gather(self._flush_task, return_exceptions=True)
+        if self.collection is not None and self._queue:
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"credit_ledger: {e}")
+        if self._queue:
+            self._spill()
+
+    def _spill(self, transactions: Optional[List[Dict[str, Any]]] = None, prefix: str = 'spill'):
+        """
+        Сохраняет транзакции на диск: всю очередь (Mongo недоступна) или переданные.
+        При старте загружаются только файлы с префиксом 'spill'.
+        """
+        from_queue = transactions is None
+        if from_queue:
+            transactions = list(self._queue)
+        os.makedirs(SPILL_DIR, exist_ok=True)
+        path = os.path.join(SPILL_DIR, f'{prefix}-{os.getpid()}-{int(time.time())}.jsonl')
+        with open(path, 'a', encoding='utf-8') as f:
+            for transaction in transactions:
+                f.write(json_util.dumps(transaction) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if from_queue:
+            self._queue.clear()
+        if prefix == 'spill':
+            self.spilled += len(transactions)
+        print(f"credit_ledger: {len(transactions)} транзакций сохранено в {path}")
+
+    def _load_spilled(self):
+        for path in sorted(glob.glob(os.path.join(SPILL_DIR, 'spill-*.jsonl'))):
+            claimed = f'{path}.loading-{os.getpid()}'
+            try:
+                # Переименование атомарно: файл заберёт только один воркер
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            with open(claimed, encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        self._queue.append(json_util.loads(line))
+            os.remove(claimed)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": len(self._queue),
+            "max_queue_depth": self.max_depth,
+            "max_queue_size": self.max_size,
+            "batch_size": self.batch_size,
+            "flush_interval_sec": self.interval,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "duplicates": self.duplicates,
+            "flushes": self.flushes,
+            "errors": self.errors,
+            "callback_errors": self.callback_errors,
+            "spilled": self.spilled,
+            "rejected": self.rejected,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self._total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+        }
+
+
+credit_ledger = CreditLedgerQueue()
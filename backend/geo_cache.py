@@ -0,0 +1,123 @@
+"""
+Двухуровневый кеш городов и солнечных таблиц
+
+1. LRU в памяти процесса — координаты, часовой пояс и годовые таблицы восходов/закатов
+2. Коллекция Mongo geo_cache — общая для всех воркеров и переживает перезапуски
+
+Документ geo_cache:
+    {
+        "_id": "Москва",                      # город в том виде, в каком его передал клиент
+        "latitude": 55.75204, "longitude": 37.61781, "timezone": "Europe/Moscow",
+        "sun": {"2025": [[sunrise_us, sunset_us], ...]},   # по дню года, микросекунды UTC
+        "updated_at": datetime
+    }
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кеш со счётчиками попаданий и промахов
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Чтение без учёта в счётчиках и без изменения порядка вытеснения
+        """
+        with self._lock:
+            return self._data.get(key, default)
+
+    def __setitem__(self, key: Hashable, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        # Проверка наличия не считается обращением и не меняет порядок вытеснения
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+
+class GeoCacheStore:
+    """
+    Mongo-уровень кеша (коллекция geo_cache)
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.errors = 0
+
+    async def load(self, city: str) -> Optional[Dict[str, Any]]:
+        try:
+            doc = await self.collection.find_one({"_id": city})
+        except Exception as e:
+            self.errors += 1
+            print(f"geo_cache: ошибка чтения '{city}': {e}")
+            return None
+        if doc:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return doc
+
+    async def save(self, city: str, coordinates: Optional[Tuple[float, float, str]] = None,
+                   sun_years: Optional[Dict[int, List[List[int]]]] = None):
+        update = {"updated_at": datetime.utcnow()}
+        if coordinates:
+            update["latitude"], update["longitude"], update["timezone"] = coordinates
+        for year, table in (sun_years or {}).items():
+            update[f"sun.{year}"] = table
+        try:
+            await self.collection.update_one({"_id": city}, {"$set": update}, upsert=True)
+            self.writes += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"geo_cache: ошибка записи '{city}': {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "writes": self.writes, "errors": self.errors}
@@ -3,9 +3,10 @@ HTML генератор отчетов с полными расчетами и 
 Заменяет PDF экспорт на более удобный HTML формат
 """
 from datetime import datetime
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List
 import base64
 import json
+from report_cache import report_fragments
 from html_generator_helpers import (
     calculate_behavior_fractal, calculate_task_numbers,
     get_planet_color, get_planet_symbol, get_planet_name,
@@ -18,154 +19,25 @@ def create_numerology_report_html(user_data: Dict[str, Any], all_data: Dict[str,
     """
     Создает HTML отчет с полными нумерологическими расчетами из всех разделов
     """
-    
-    # CSS стили для разных тем
-    css_styles = get_css_styles(theme)
-    
-    # JavaScript для базовой функциональности
-    animation_script = """
-        // Базовая функциональность без анимаций, которые могут сломать отображение
-        function initializeReport() {
-            // Убеждаемся что все карточки видимы
-            const cards = document.querySelectorAll('.card');
-            cards.forEach((card) => {
-                // Принудительно убеждаемся в видимости
-                card.style.opacity = '1';
-                card.style.transform = 'translateY(0)';
-                card.style.visibility = 'visible';
-            });
-            
-            console.log('NUMEROM отчёт загружен. Карточек:', cards.length);
-        }
-        
-        // Запускаем немедленно и при загрузке DOM
-        initializeReport();
-        if (document.readyState === 'loading') {
-            document.addEventListener('DOMContentLoaded', initializeReport);
-        }
+    return ''.join(iter_numerology_report_html(user_data, all_data, vedic_data, charts_data,
+                                               theme, selected_calculations))
+
+def iter_numerology_report_html(user_data: Dict[str, Any], all_data: Dict[str, Any],
+                                vedic_data: Dict[str, Any] = None, charts_data: Dict[str, Any] = None,
+                                theme: str = "default", selected_calculations: List[str] = None) -> Iterator[str]:
     """
-    
-    # Если не указаны выбранные расчёты, включаем все доступные
-    if selected_calculations is None:
-        selected_calculations = ['personal_numbers', 'pythagorean_square', 'vedic_times', 'planetary_route']
-    
-    # Генерируем разделы на основе выбранных расчётов
-    content_sections = []
-    
-    # Всегда включаем заголовок и основную информацию
-    content_sections.extend([
-        generate_header(user_data),
-        generate_personal_info(user_data)
-    ])
-    
-    # Добавляем выбранные разделы
-    if 'personal_numbers' in selected_calculations:
-        content_sections.extend([
-            generate_main_numbers(all_data.get('personal_numbers', {})),
-            generate_planetary_strength(all_data.get('personal_numbers', {}))
-        ])
-    
-    if 'name_numerology' in selected_calculations and user_data.get('full_name'):
-        content_sections.append(generate_name_numerology_section(user_data))
-    
-    if 'car_numerology' in selected_calculations and user_data.get('car_number'):
-        content_sections.append(generate_car_numerology_section(user_data))
-    
-    if 'address_numerology' in selected_calculations and (user_data.get('street') or user_data.get('house_number')):
-        content_sections.append(generate_address_numerology_section(user_data))
-    
-    if 'pythagorean_square' in selected_calculations:
-        content_sections.append(generate_pythagorean_square(all_data.get('pythagorean_square', {})))
-    
-    if 'vedic_times' in selected_calculations and all_data.get('vedic_times'):
-        content_sections.append(generate_vedic_times_section(all_data.get('vedic_times', {})))
-    
-    if 'planetary_route' in selected_calculations and all_data.get('planetary_route'):
-        content_sections.append(generate_planetary_route_section(all_data.get('planetary_route', {})))
-    
-    if 'compatibility' in selected_calculations or 'group_compatibility' in selected_calculations:
-        content_sections.append(generate_compatibility_section(all_data))
-    
-    # Всегда включаем рекомендации и футер
-    content_sections.extend([
-        generate_recommendations(),
-        generate_footer()
-    ])
-    
-    # Генерируем табы и их содержимое
-    tabs_html = generate_tabs_structure(user_data, all_data, vedic_data, charts_data, selected_calculations)
-    
-    # Генерируем HTML контент с табами
-    html_content = f"""
-<!DOCTYPE html>
-<html lang="ru">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>NUMEROM - Персональный отчет для {user_data.get('full_name', 'Пользователь')}</title>
-    <style>
-        {css_styles}
-        {get_tabs_css_styles(theme)}
-    </style>
-    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-</head>
-<body>
-    <div class="container">
-        {generate_header(user_data)}
-        {tabs_html}
-    </div>
-    
-    <script>
-        {generate_chart_scripts(charts_data) if charts_data else ''}
-        
-        // Функция переключения табов
-        function switchTab(tabName) {{
-            // Скрываем все табы
-            const allTabs = document.querySelectorAll('.tab-content');
-            allTabs.forEach(tab => {{
-                tab.style.display = 'none';
-            }});
-            
-            // Убираем активный класс у всех кнопок
-            const allButtons = document.querySelectorAll('.tab-button');
-            allButtons.forEach(btn => {{
-                btn.classList.remove('active');
-            }});
-            
-            // Показываем выбранный таб
-            const selectedTab = document.getElementById('tab-' + tabName);
-            if (selectedTab) {{
-                selectedTab.style.display = 'block';
-            }}
-            
-            // Добавляем активный класс к кнопке
-            const selectedButton = document.querySelector('[onclick="switchTab(\\'' + tabName + '\\')"]');
-            if (selectedButton) {{
-                selectedButton.classList.add('active');
-            }}
-        }}
-        
-        // Инициализация: показываем первый таб
-        document.addEventListener('DOMContentLoaded', function() {{
-            switchTab('overview');
-            {animation_script}
-        }});
-        
-        // Функция печати
-        function printReport() {{
-            window.print();
-        }}
-        
-        // Функция сохранения как PDF
-        function saveAsPDF() {{
-            window.print();
-        }}
-        
-    </script>
-</body>
-</html>"""
-    
-    return html_content
+    HTML отчет по частям для потоковой отдачи: шапка со стилями темы уходит сразу,
+    табы — по мере генерации. CSS тем и статичные куски собраны при импорте модуля.
+    """
+    yield REPORT_HEAD
+    yield str(user_data.get('full_name', 'Пользователь'))
+    yield THEME_HEADS.get(theme, THEME_HEADS['default'])
+    yield generate_header(user_data)
+    yield '\n        '
+    yield from iter_tabs_structure(user_data, all_data, vedic_data, charts_data, selected_calculations)
+    yield REPORT_SCRIPT_OPEN
+    yield generate_chart_scripts(charts_data) if charts_data else ''
+    yield REPORT_TAIL
 
 def get_css_styles(theme: str) -> str:
     """Возвращает CSS стили для выбранной темы"""
@@ -1397,93 +1269,198 @@ def get_tabs_css_styles(theme: str) -> str:
         }}
     """
 
-def generate_tabs_structure(user_data: Dict[str, Any], all_data: Dict[str, Any], 
-                            vedic_data: Dict[str, Any] = None, charts_data: Dict[str, Any] = None,
-                            selected_calculations: List[str] = None) -> str:
-    """Генерирует структуру табов как на фронтенде"""
-    
-    # Генерируем контент для каждого таба
-    overview_content = generate_overview_tab(user_data, all_data)
-    charts_content = generate_charts_tab(all_data, charts_data, user_data)
-    planetary_content = generate_planetary_tab(all_data)
-    route_content = generate_route_tab(all_data)
-    compatibility_content = generate_compatibility_tab(all_data)
-    name_content = generate_name_tab(user_data, all_data)
-    address_content = generate_address_tab(user_data, all_data)
-    car_content = generate_car_tab(user_data, all_data)
-    
-    tabs_html = f"""
-    <div class="tabs-container">
-        <div class="tabs-list">
-            <button class="tab-button active" onclick="switchTab('overview')">
-                <span class="tab-icon">👤</span>
-                <span>Обзор</span>
-            </button>
-            <button class="tab-button" onclick="switchTab('charts')">
-                <span class="tab-icon">📊</span>
-                <span>Графики</span>
-            </button>
-            <button class="tab-button" onclick="switchTab('planetary')">
-                <span class="tab-icon">🪐</span>
-                <span>Планеты</span>
-            </button>
-            <button class="tab-button" onclick="switchTab('route')">
-                <span class="tab-icon">🗺️</span>
-                <span>Маршрут</span>
-            </button>
-            <button class="tab-button" onclick="switchTab('compatibility')">
-                <span class="tab-icon">👥</span>
-                <span>Совместимость</span>
-            </button>
-            <button class="tab-button" onclick="switchTab('name')">
-                <span class="tab-icon">⭐</span>
-                <span>Имя</span>
-            </button>
-            <button class="tab-button" onclick="switchTab('address')">
-                <span class="tab-icon">📍</span>
-                <span>Адрес</span>
-            </button>
-            <button class="tab-button" onclick="switchTab('car')">
-                <span class="tab-icon">🚗</span>
-                <span>Авто</span>
-            </button>
-        </div>
-        
-        <div id="tab-overview" class="tab-content active">
-            {overview_content}
-        </div>
-        
-        <div id="tab-charts" class="tab-content">
-            {charts_content}
-        </div>
+# Статичные части отчёта собираются один раз при импорте
+
+REPORT_THEMES = ('default', 'dark')
+
+REPORT_HEAD = """
+<!DOCTYPE html>
+<html lang="ru">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>NUMEROM - Персональный отчет для """
+
+# Тема -> конец <head> со стилями темы и начало <body>; прочие темы (print) оформляются как default
+THEME_HEADS = {
+    theme: f"""</title>
+    <style>
+        {get_css_styles(theme)}
+        {get_tabs_css_styles(theme)}
+    </style>
+    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
+</head>
+<body>
+    <div class="container">
+        """
+    for theme in REPORT_THEMES
+}
+
+# JavaScript для базовой функциональности
+REPORT_ANIMATION_SCRIPT = """
+        // Базовая функциональность без анимаций, которые могут сломать отображение
+        function initializeReport() {
+            // Убеждаемся что все карточки видимы
+            const cards = document.querySelectorAll('.card');
+            cards.forEach((card) => {
+                // Принудительно убеждаемся в видимости
+                card.style.opacity = '1';
+                card.style.transform = 'translateY(0)';
+                card.style.visibility = 'visible';
+            });
+            
+            console.log('NUMEROM отчёт загружен. Карточек:', cards.length);
+        }
         
-        <div id="tab-planetary" class="tab-content">
-            {planetary_content}
-        </div>
+        // Запускаем немедленно и при загрузке DOM
+        initializeReport();
+        if (document.readyState === 'loading') {
+            document.addEventListener('DOMContentLoaded', initializeReport);
+        }
+    """
+
+REPORT_SCRIPT_OPEN = """
+    </div>
+    
+    <script>
+        """
+
+REPORT_TAIL = f"""
         
-        <div id="tab-route" class="tab-content">
-            {route_content}
-        </div>
+        // Функция переключения табов
+        function switchTab(tabName) {{
+            // Скрываем все табы
+            const allTabs = document.querySelectorAll('.tab-content');
+            allTabs.forEach(tab => {{
+                tab.style.display = 'none';
+            }});
+            
+            // Убираем активный класс у всех кнопок
+            const allButtons = document.querySelectorAll('.tab-button');
+            allButtons.forEach(btn => {{
+                btn.classList.remove('active');
+            }});
+            
+            // Показываем выбранный таб
+            const selectedTab = document.getElementById('tab-' + tabName);
+            if (selectedTab) {{
+                selectedTab.style.display = 'block';
+            }}
+            
+            // Добавляем активный класс к кнопке
+            const selectedButton = document.querySelector('[onclick="switchTab(\\'' + tabName + '\\')"]');
+            if (selectedButton) {{
+                selectedButton.classList.add('active');
+            }}
+        }}
         
-        <div id="tab-compatibility" class="tab-content">
-            {compatibility_content}
-        </div>
+        // Инициализация: показываем первый таб
+        document.addEventListener('DOMContentLoaded', function() {{
+            switchTab('overview');
+            {REPORT_ANIMATION_SCRIPT}
+        }});
         
-        <div id="tab-name" class="tab-content">
-            {name_content}
-        </div>
+        // Функция печати
+        function printReport() {{
+            window.print();
+        }}
         
-        <div id="tab-address" class="tab-content">
-            {address_content}
-        </div>
+        // Функция сохранения как PDF
+        function saveAsPDF() {{
+            window.print();
+        }}
         
-        <div id="tab-car" class="tab-content">
-            {car_content}
+    </script>
+</body>
+</html>"""
+
+# Табы отчёта: (id, иконка, заголовок, генератор контента), как на фронтенде.
+# Контент таба кэшируется по данным из REPORT_TAB_INPUTS — при добавлении в генератор таба
+# нового поля его нужно добавить и туда, иначе таб будет браться из кэша со старым значением.
+REPORT_TABS = (
+    ('overview', '👤', 'Обзор', lambda user_data, all_data, charts_data: generate_overview_tab(user_data, all_data)),
+    ('charts', '📊', 'Графики', lambda user_data, all_data, charts_data: generate_charts_tab(all_data, charts_data, user_data)),
+    ('planetary', '🪐', 'Планеты', lambda user_data, all_data, charts_data: generate_planetary_tab(all_data)),
+    ('route', '🗺️', 'Маршрут', lambda user_data, all_data, charts_data: generate_route_tab(all_data)),
+    ('compatibility', '👥', 'Совместимость', lambda user_data, all_data, charts_data: generate_compatibility_tab(all_data)),
+    ('name', '⭐', 'Имя', lambda user_data, all_data, charts_data: generate_name_tab(user_data, all_data)),
+    ('address', '📍', 'Адрес', lambda user_data, all_data, charts_data: generate_address_tab(user_data, all_data)),
+    ('car', '🚗', 'Авто', lambda user_data, all_data, charts_data: generate_car_tab(user_data, all_data)),
+)
+
+# Таб -> (источник, ключ), которые читает генератор таба
+REPORT_TAB_INPUTS = {
+    'overview': (('user_data', 'full_name'), ('user_data', 'email'), ('user_data', 'birth_date'),
+                 ('all_data', 'personal_numbers')),
+    'charts': (('user_data', 'birth_date'), ('all_data', 'personal_numbers'), ('all_data', 'pythagorean_square'),
+               ('charts_data', 'planetary_energy')),
+    'planetary': (('all_data', 'pythagorean_square'),),
+    'route': (('all_data', 'planetary_route'),),
+    'compatibility': (('all_data', 'compatibility'), ('all_data', 'group_compatibility')),
+    'name': (('user_data', 'full_name'), ('all_data', 'name_numerology')),
+    'address': (('user_data', 'street'), ('user_data', 'house_number'), ('all_data', 'address_numerology')),
+    'car': (('user_data', 'car_number'), ('all_data', 'car_numerology')),
+}
+
+TABS_OPEN = """
+    <div class="tabs-container">
+        <div class="tabs-list">
+""" + ''.join(
+    f"""            <button class="tab-button{' active' if index == 0 else ''}" onclick="switchTab('{tab_id}')">
+                <span class="tab-icon">{icon}</span>
+                <span>{title}</span>
+            </button>
+"""
+    for index, (tab_id, icon, title, _) in enumerate(REPORT_TABS)
+) + """        </div>
+"""
+
+TAB_OPENERS = {
+    tab_id: f"""        
+        <div id="tab-{tab_id}" class="tab-content{' active' if index == 0 else ''}">
+            """
+    for index, (tab_id, _, _, _) in enumerate(REPORT_TABS)
+}
+
+TAB_CLOSE = """
         </div>
-    </div>
+"""
+
+TABS_CLOSE = """    </div>
     """
-    
-    return tabs_html
+
+def tab_inputs(tab_id: str, user_data: Dict[str, Any], all_data: Dict[str, Any],
+               charts_data: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Данные, от которых зависит таб (отсутствующий ключ и None различаются, как в .get(key, default))"""
+    sources = {'user_data': user_data or {}, 'all_data': all_data or {}, 'charts_data': charts_data or {}}
+    return {
+        f'{source}.{key}': sources[source][key]
+        for source, key in REPORT_TAB_INPUTS[tab_id]
+        if key in sources[source]
+    }
+
+def iter_tabs_structure(user_data: Dict[str, Any], all_data: Dict[str, Any],
+                        vedic_data: Dict[str, Any] = None, charts_data: Dict[str, Any] = None,
+                        selected_calculations: List[str] = None) -> Iterator[str]:
+    """
+    Структура табов по частям: кнопки — готовый фрагмент, контент каждого таба — из кэша
+    фрагментов или по мере генерации
+    """
+    yield TABS_OPEN
+    for tab_id, _, _, generate in REPORT_TABS:
+        yield TAB_OPENERS[tab_id]
+        yield report_fragments.render(
+            f'html:{tab_id}', tab_inputs(tab_id, user_data, all_data, charts_data),
+            lambda: generate(user_data, all_data, charts_data)
+        )
+        yield TAB_CLOSE
+    yield TABS_CLOSE
+
+def generate_tabs_structure(user_data: Dict[str, Any], all_data: Dict[str, Any], 
+                            vedic_data: Dict[str, Any] = None, charts_data: Dict[str, Any] = None,
+                            selected_calculations: List[str] = None) -> str:
+    """Генерирует структуру табов как на фронтенде"""
+    return ''.join(iter_tabs_structure(user_data, all_data, vedic_data, charts_data, selected_calculations))
 
 def generate_overview_tab(user_data: Dict[str, Any], all_data: Dict[str, Any]) -> str:
     """Генерирует контент таба 'Обзор'"""
@@ -0,0 +1,146 @@
+"""
+Проверка индексов на горячих путях запросов (explain)
+
+Для каждого запроса из HOT_QUERIES выполняется explain() и из выигравшего плана
+собираются стадии. COLLSCAN означает, что запрос читает всю коллекцию — для него нет
+подходящего индекса в collection_registry.EXPECTED_COLLECTIONS или индекс не создан
+(ошибки создания — в collection_registry.index_errors).
+
+Запуск:
+    python index_check.py            # отчёт по текущей базе
+    python index_check.py --ensure   # сначала создать недостающие коллекции и индексы
+
+Тот же отчёт отдаёт GET /api/admin/db/index-check.
+"""
+import asyncio
+import os
+import sys
+from typing import Any, Dict, List, Optional, Set
+
+from collection_registry import collection_registry
+
+_ID = '00000000-0000-0000-0000-000000000000'
+
+# (эндпоинт, коллекция, фильтр, сортировка). Для агрегаций — фильтр их $match.
+HOT_QUERIES = [
+    ('get_current_user, профиль, списание баллов', 'users', {'id': _ID}, None),
+    ('/login, /register', 'users', {'email': 'user@example.com'}, None),
+    ('/user/credit-history', 'credit_transactions', {'user_id': _ID}, [('created_at', -1), ('id', -1)]),
+    ('повтор списания по Idempotency-Key', 'credit_transactions', {'user_id': _ID, 'idempotency_key': 'key'}, None),
+    ('/numerology/saved-calculations', 'numerology_calculations',
+     {'user_id': _ID, 'calculation_type': 'personal_numbers'}, [('created_at', -1)]),
+    ('история расчётов в отчётах', 'numerology_calculations', {'user_id': _ID}, [('created_at', -1)]),
+    ('уроки', 'lessons_v2', {'id': _ID}, None),
+    ('активные уроки', 'lessons_v2', {'is_active': True}, None),
+    ('файлы: скачивание и просмотр', 'files', {'id': _ID}, None),
+    ('файлы урока', 'files', {'lesson_id': _ID}, None),
+    ('push-подписки пользователя', 'push_subscriptions', {'user_id': _ID, 'enabled': True}, None),
+    ('сохранение push-подписки', 'push_subscriptions', {'user_id': _ID, 'endpoint': 'https://push'}, None),
+    ('/student/dashboard-stats: прогресс', 'lesson_progress', {'user_id': _ID}, None),
+    ('/student/dashboard-stats: упражнения', 'exercise_responses', {'user_id': _ID}, None),
+    ('/student/dashboard-stats: тесты', 'quiz_attempts', {'user_id': _ID}, None),
+    ('/student/dashboard-stats: челленджи', 'challenge_progress', {'user_id': _ID}, None),
+    ('/student/dashboard-stats: активность', 'time_activity', {'user_id': _ID}, None),
+    ('просмотр урока/теории за сегодня', 'time_activity',
+     {'user_id': _ID, 'lesson_id': _ID, 'activity_type': 'lesson_view'}, [('created_at', -1)]),
+    ('аналитика урока (админ)', 'time_activity', {'lesson_id': _ID}, None),
+    ('учёт просмотра видео', 'video_watch_time', {'file_id': _ID, 'user_id': _ID}, None),
+    ('/student/dashboard-stats: видео', 'video_watch_time', {'user_id': _ID}, None),
+    ('/student/dashboard-stats: файлы', 'file_analytics', {'user_id': _ID, 'action': 'view'}, None),
+]
+
+
+def plan_stages(plan: Any) -> Set[str]:
+    """
+    Все стадии плана explain (включая вложенные inputStage/inputStages/queryPlan)
+    """
+    stages: Set[str] = set()
+    if isinstance(plan, dict):
+        if isinstance(plan.get('stage'), str):
+            stages.add(plan['stage'])
+        for value in plan.values():
+            stages |= plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages |= plan_stages(item)
+    return stages
+
+
+async def explain_query(db, collection: str, query: Dict[str, Any],
+                        sort: Optional[List] = None) -> Dict[str, Any]:
+    cursor = db[collection].find(query)
+    if sort:
+        cursor = cursor.sort(sort)
+    explain = await cursor.explain()
+    winning_plan = explain.get('queryPlanner', {}).get('winningPlan', {})
+    stages = plan_stages(winning_plan)
+    return {
+        'stages': sorted(stages),
+        'collscan': 'COLLSCAN' in stages,
+        # Сортировка в памяти: индекс не покрывает порядок
+        'in_memory_sort': 'SORT' in stages,
+    }
+
+
+async def check_indexes(db) -> Dict[str, Any]:
+    """
+    Отчёт по HOT_QUERIES: план каждого запроса и список полных сканирований коллекций
+    """
+    results = []
+    for endpoint, collection, query, sort in HOT_QUERIES:
+        try:
+            result = await explain_query(db, collection, query, sort)
+        except Exception as e:
+            result = {'error': str(e), 'collscan': False, 'in_memory_sort': False}
+        results.append({
+            'endpoint': endpoint,
+            'collection': collection,
+            'filter': sorted(query),
+            'sort': [field for field, _ in sort] if sort else [],
+            **result,
+        })
+    return {
+        'queries': results,
+        'collscans': [r for r in results if r['collscan']],
+        'in_memory_sorts': [r for r in results if r['in_memory_sort']],
+        'index_errors': dict(collection_registry.index_errors),
+    }
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    lines = []
+    for r in report['queries']:
+        if r.get('error'):
+            status = f"ошибка: {r['error']}"
+        elif r['collscan']:
+            status = 'COLLSCAN'
+        elif r['in_memory_sort']:
+            status = 'сортировка в памяти'
+        else:
+            status = 'ok'
+        lines.append(f"{status:>20}  {r['collection']}.{'+'.join(r['filter'])}  ({r['endpoint']}): {', '.join(r.get('stages', []))}")
+    for index, error in report['index_errors'].items():
+        lines.append(f"ошибка индекса {index}: {error}")
+    lines.append(f"Полных сканирований: {len(report['collscans'])}, сортировок в памяти: {len(report['in_memory_sorts'])}")
+    return '\n'.join(lines)
+
+
+async def _main(argv) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    load_dotenv(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ.get('MONGODB_DATABASE')]
+    try:
+        if '--ensure' in argv:
+            await collection_registry.ensure(db)
+        report = await check_indexes(db)
+        print(format_report(report))
+    finally:
+        client.close()
+    return 1 if report['collscans'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(_main(sys.argv)))
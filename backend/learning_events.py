@@ -0,0 +1,255 @@
+"""
+Пакетный приём учебных событий (/api/student/events)
+
+Фронтенд отправлял отдельный POST на каждое событие time-activity, video-watch-time и
+file-analytics; каждый делал find, update и начисление баллов. Теперь события копятся на
+клиенте и приходят массивом: одинаковые события сворачиваются по (урок, тип активности) и
+(урок, файл), изменения применяются одним bulk_write на коллекцию, а баллы за весь пакет
+начисляются одной транзакцией.
+
+Формат (массив или {"events": [...]}):
+    {"type": "time_activity", "lesson_id": "...", "activity_type": "theory", "minutes_spent": 2}
+    {"type": "video_watch", "lesson_id": "...", "file_id": "...", "minutes_watched": 1}
+    {"type": "file_analytics", "lesson_id": "...", "file_id": "...", "action": "view"}
+
+Начисление совпадает с одиночными эндпоинтами: минуты * баллы за минуту из конфигурации,
+просмотр файла — один раз за файл (только при создании записи file_view).
+"""
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+MAX_EVENTS = 500
+EVENT_TYPES = ('time_activity', 'video_watch', 'file_analytics')
+FILE_ACTIONS = ('view', 'download')
+
+
+class LearningEventError(ValueError):
+    """Пакет событий не прошёл проверку"""
+
+
+def whole_minutes(value: Any, field: str) -> int:
+    # Баллы начисляются целыми (CreditTransaction.amount), поэтому минуты тоже целые
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise LearningEventError(f'{field} должно быть целым неотрицательным числом')
+    return value
+
+
+def parse_events(payload: Any) -> List[Dict[str, Any]]:
+    """
+    Проверяет пакет и приводит события к единому виду
+    """
+    if isinstance(payload, dict):
+        payload = payload.get('events')
+    if not isinstance(payload, list):
+        raise LearningEventError('Ожидается массив событий')
+    if not payload:
+        raise LearningEventError('Пакет событий пуст')
+    if len(payload) > MAX_EVENTS:
+        raise LearningEventError(f'Не больше {MAX_EVENTS} событий в пакете')
+
+    events = []
+    for index, raw in enumerate(payload):
+        if not isinstance(raw, dict):
+            raise LearningEventError(f'Событие {index}: ожидается объект')
+        event_type = raw.get('type')
+        lesson_id = raw.get('lesson_id')
+        file_id = raw.get('file_id')
+        try:
+            if event_type == 'time_activity':
+                events.append({
+                    'type': event_type,
+                    'lesson_id': lesson_id,
+                    'activity_type': raw.get('activity_type') or 'lesson_view',
+                    'minutes': whole_minutes(raw.get('minutes_spent', 0), 'minutes_spent'),
+                })
+            elif event_type == 'video_watch':
+                if not file_id:
+                    raise LearningEventError('нужен file_id')
+                events.append({
+                    'type': event_type,
+                    'lesson_id': lesson_id,
+                    'file_id': file_id,
+                    'minutes': whole_minutes(raw.get('minutes_watched', 0), 'minutes_watched'),
+                })
+            elif event_type == 'file_analytics':
+                if not file_id or not lesson_id:
+                    raise LearningEventError('нужны file_id и lesson_id')
+                if raw.get('action') not in FILE_ACTIONS:
+                    raise LearningEventError(f"action должно быть одним из {', '.join(FILE_ACTIONS)}")
+                events.append({'type': event_type, 'lesson_id': lesson_id, 'file_id': file_id, 'action': raw['action']})
+            else:
+                raise LearningEventError(f"неизвестный тип, ожидается один из {', '.join(EVENT_TYPES)}")
+        except LearningEventError as e:
+            raise LearningEventError(f'Событие {index}: {e}')
+    return events
+
+
+class EventBatch:
+    """
+    События пакета, свёрнутые по ключам записей, которые они обновляют
+    """
+
+    def __init__(self, events: List[Dict[str, Any]]):
+        self.size = len(events)
+        # (lesson_id, activity_type) -> минуты
+        self.time_minutes: Dict[Tuple[Optional[str], str], int] = {}
+        # (lesson_id, file_id) -> минуты
+        self.video_minutes: Dict[Tuple[Optional[str], str], int] = {}
+        # Записи file_analytics сохраняются все: это журнал действий
+        self.file_actions: List[Dict[str, Any]] = []
+        # (lesson_id, file_id) просмотренных файлов
+        self.file_views: List[Tuple[str, str]] = []
+
+        for event in events:
+            if event['type'] == 'time_activity':
+                key = (event['lesson_id'], event['activity_type'])
+                self.time_minutes[key] = self.time_minutes.get(key, 0) + event['minutes']
+            elif event['type'] == 'video_watch':
+                key = (event['lesson_id'], event['file_id'])
+                self.video_minutes[key] = self.video_minutes.get(key, 0) + event['minutes']
+            else:
+                self.file_actions.append(event)
+                key = (event['lesson_id'], event['file_id'])
+                if event['action'] == 'view' and key not in self.file_views:
+                    self.file_views.append(key)
+
+    @property
+    def file_ids(self) -> List[str]:
+        return sorted({file_id for _, file_id in self.file_views})
+
+    @property
+    def lesson_ids(self) -> List[str]:
+        lessons = {lesson_id for lesson_id, _ in self.time_minutes}
+        lessons |= {lesson_id for lesson_id, _ in self.video_minutes}
+        lessons |= {event['lesson_id'] for event in self.file_actions}
+        return sorted(lesson for lesson in lessons if lesson)
+
+
+def file_view_points(file_info: Dict[str, Any], points_config: Dict[str, Any]) -> Tuple[int, bool]:
+    """
+    Баллы за просмотр файла и признак PDF (как в award_points_for_file_view)
+    """
+    file_type = file_info.get('file_type', '')
+    mime_type = file_info.get('mime_type', '')
+    if mime_type in ('application/pdf', 'pdf') or file_type in ('pdf', 'document'):
+        return points_config.get('pdf_points_per_view', 5), True
+    if file_type == 'media':
+        return points_config.get('media_points_per_view', 10), False
+    if mime_type and 'pdf' in mime_type.lower():
+        return points_config.get('pdf_points_per_view', 5), True
+    return 0, False
+
+
+class EventWrites:
+    """
+    Операции bulk_write по коллекциям и баллы пакета по источникам
+    """
+
+    def __init__(self):
+        self.time_activity: List[UpdateOne] = []
+        self.video_watch_time: List[UpdateOne] = []
+        self.file_analytics: List[Dict[str, Any]] = []
+        self.time_points = 0
+        self.video_points = 0
+        # Баллы видео, продублированные в time_activity (video_watch) — входят в баллы "time" обзора
+        self.video_activity_points = 0
+        # Индекс операции upsert в time_activity -> баллы просмотра файла (начисляются, если запись создана)
+        self.file_view_ops: Dict[int, int] = {}
+
+
+def _activity_upsert(user_id: str, lesson_id: Optional[str], activity_type: str, minutes: int,
+                     points: int, now: datetime, file_id: Optional[str] = None) -> UpdateOne:
+    query = {'user_id': user_id, 'lesson_id': lesson_id, 'activity_type': activity_type}
+    if file_id:
+        query['file_id'] = file_id
+    return UpdateOne(query, {
+        '$inc': {'total_minutes': minutes, 'total_points': points},
+        '$set': {'last_activity_at': now},
+        '$setOnInsert': {'id': str(uuid.uuid4()), 'created_at': now},
+    }, upsert=True)
+
+
+def add_video_watch(writes: EventWrites, user_id: str, lesson_id: Optional[str], file_id: str,
+                    minutes: int, points_per_minute: int, now: datetime) -> int:
+    """
+    Добавляет $inc просмотра видео в video_watch_time и в time_activity (video_watch),
+    как в save_video_watch_time. Возвращает начисляемые баллы.
+    """
+    points = minutes * points_per_minute
+    writes.video_points += points
+    writes.video_watch_time.append(UpdateOne({'file_id': file_id, 'user_id': user_id}, {
+        '$inc': {'total_minutes': minutes, 'total_points': points},
+        '$set': {'last_updated': now},
+        '$setOnInsert': {'id': str(uuid.uuid4()), 'lesson_id': lesson_id, 'created_at': now},
+    }, upsert=True))
+    if lesson_id and minutes > 0:
+        writes.video_activity_points += points
+        writes.time_activity.append(
+            _activity_upsert(user_id, lesson_id, 'video_watch', minutes, points, now, file_id=file_id)
+        )
+    return points
+
+
+def build_event_writes(user_id: str, batch: EventBatch, points_config: Dict[str, Any],
+                       files: Dict[str, Dict[str, Any]], now: datetime) -> EventWrites:
+    """
+    Операции записи для пакета: time_activity, video_watch_time и file_analytics.
+    files — документы files просмотренных файлов по id (неизвестные файлы баллов не дают).
+    """
+    writes = EventWrites()
+    time_points_per_minute = points_config.get('time_points_per_minute', 1)
+    video_points_per_minute = points_config.get('video_points_per_minute', 1)
+
+    for (lesson_id, activity_type), minutes in batch.time_minutes.items():
+        points = minutes * time_points_per_minute
+        writes.time_points += points
+        writes.time_activity.append(_activity_upsert(user_id, lesson_id, activity_type, minutes, points, now))
+
+    for (lesson_id, file_id), minutes in batch.video_minutes.items():
+        add_video_watch(writes, user_id, lesson_id, file_id, minutes, video_points_per_minute, now)
+
+    for lesson_id, file_id in batch.file_views:
+        file_info = files.get(file_id)
+        if not file_info:
+            continue
+        points, is_pdf = file_view_points(file_info, points_config)
+        writes.file_view_ops[len(writes.time_activity)] = points
+        writes.time_activity.append(UpdateOne(
+            {'user_id': user_id, 'lesson_id': lesson_id, 'activity_type': 'file_view', 'file_id': file_id},
+            {
+                '$set': {'last_activity_at': now},
+                '$setOnInsert': {
+                    'id': str(uuid.uuid4()),
+                    'file_type': 'pdf' if is_pdf else file_info.get('mime_type') or file_info.get('file_type', ''),
+                    'total_minutes': 0,
+                    'total_points': points,
+                    'created_at': now,
+                },
+            },
+            upsert=True,
+        ))
+
+    writes.file_analytics = [
+        {
+            'id': str(uuid.uuid4()),
+            'file_id': event['file_id'],
+            'user_id': user_id,
+            'lesson_id': event['lesson_id'],
+            'action': event['action'],
+            'created_at': now,
+        }
+        for event in batch.file_actions
+    ]
+    return writes
+
+
+def awarded_file_points(writes: EventWrites, upserted_ids: Dict[int, Any]) -> int:
+    """
+    Баллы за файлы, впервые просмотренные в этом пакете (upsert создал запись file_view)
+    """
+    return sum(points for index, points in writes.file_view_ops.items() if index in upserted_ids)
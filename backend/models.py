@@ -264,6 +264,8 @@ class CreditTransaction(BaseModel):
     description: str  # описание за что списано/начислено
     category: str  # категория: 'numerology', 'vedic', 'learning', 'quiz', 'materials', 'purchase', etc.
     details: Optional[dict] = None  # дополнительные детали транзакции
+    idempotency_key: Optional[str] = None  # ключ повтора запроса (списание не дублируется)
+    balance_after: Optional[int] = None  # баланс после операции
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 # Credit costs configuration
@@ -271,6 +273,7 @@ CREDIT_COSTS = {
     'name_numerology': 1,           # Нумерология имени
     'personal_numbers': 1,          # Персональные числа
     'pythagorean_square': 1,        # Квадрат Пифагора
+    'numerology_batch_row': 1,      # Пакетный расчёт нумерологии (за строку)
     'vedic_daily': 1,              # Ведическое время на день
     'planetary_daily': 1,           # Планетарный маршрут на день
     'planetary_weekly': 10,         # Планетарный маршрут на неделю
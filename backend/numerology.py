@@ -3,6 +3,10 @@ from typing import Dict, List, Any
 import re
 import calendar
 
+import numpy as np
+
+from birth_date_table import lookup_birth_date
+
 
 def parse_birth_date(birth_date: str) -> tuple[int, int, int]:
     """Parse birth date in DD.MM.YYYY format"""
@@ -102,8 +106,33 @@ def calculate_wisdom_number(day: int, month: int, year: int) -> int:
     return reduce_to_single_digit(total)
 
 
+# Только 7 планет (без Раху и Кету) в нумерологическом порядке дней недели (0=Воскресенье=Солнце)
+PLANET_NAMES = ['Солнце', 'Луна', 'Марс', 'Меркурий', 'Юпитер', 'Венера', 'Сатурн']
+PLANET_WEEKDAYS = ['ВС', 'ПН', 'ВТ', 'СР', 'ЧТ', 'ПТ', 'СБ']
+WEEKDAY_NAMES = ['понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота', 'воскресенье']
+
+
 def calculate_planetary_strength(day: int, month: int, year: int) -> Dict[str, Any]:
     """Calculate Planetary Strength according to the formula with 7 planets (no Rahu/Ketu)"""
+    record = lookup_birth_date(day, month, year)
+    if record is not None:
+        start_planet = (record.weekday + 1) % 7
+        planet_weekday_map = {}
+        for i in range(record.strength_digits):
+            planet_index = (start_planet + i) % 7
+            planet_weekday_map[PLANET_NAMES[planet_index]] = PLANET_WEEKDAYS[planet_index]
+        return {
+            'strength': dict(zip(PLANET_NAMES, record.strength)),
+            'weekday_map': planet_weekday_map,
+            'calculation_number': record.calculation_number,
+            'birth_weekday': WEEKDAY_NAMES[record.weekday],
+            'start_planet_index': start_planet
+        }
+    return _compute_planetary_strength(day, month, year)
+
+
+def _compute_planetary_strength(day: int, month: int, year: int) -> Dict[str, Any]:
+    """Planetary Strength без таблицы дат рождения (используется и при её сборке)"""
     # Формула: день+месяц (как число) * год = результат
     # Пример: 10.01.1982 -> 1001 * 1982 = 1983982
     
@@ -113,8 +142,6 @@ def calculate_planetary_strength(day: int, month: int, year: int) -> Dict[str, A
     # Получаем день недели рождения
     birth_date_obj = datetime(year, month, day)
     weekday = birth_date_obj.weekday()  # 0=Monday, 6=Sunday
-    weekday_names = ['понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота', 'воскресенье']
-    weekday_short = ['ПН', 'ВТ', 'СР', 'ЧТ', 'ПТ', 'СБ', 'ВС']
     
     # Конвертируем в нумерологический порядок (0=Воскресенье=Солнце)
     if weekday == 6:  # Sunday
@@ -125,19 +152,15 @@ def calculate_planetary_strength(day: int, month: int, year: int) -> Dict[str, A
     # Цифры результата определяют силу планет по порядку, начиная с дня недели
     result_digits = [int(d) for d in str(result_number)]
     
-    # Только 7 планет (убираем Раху и Кету)
-    planet_names = ['Солнце', 'Луна', 'Марс', 'Меркурий', 'Юпитер', 'Венера', 'Сатурн']
-    weekdays = ['ВС', 'ПН', 'ВТ', 'СР', 'ЧТ', 'ПТ', 'СБ']
-    
     # Initialize all planets with 0
-    planet_strength = {planet: 0 for planet in planet_names}
+    planet_strength = {planet: 0 for planet in PLANET_NAMES}
     planet_weekday_map = {}  # Для графика: какой планете какой день недели соответствует
     
     # Assign values from result digits
     for i, digit in enumerate(result_digits):
         planet_index = (start_planet + i) % 7  # Используем 7 планет
-        planet_name = planet_names[planet_index]
-        weekday_abbr = weekdays[planet_index]
+        planet_name = PLANET_NAMES[planet_index]
+        weekday_abbr = PLANET_WEEKDAYS[planet_index]
         
         planet_strength[planet_name] = digit
         planet_weekday_map[planet_name] = weekday_abbr
@@ -146,7 +169,7 @@ def calculate_planetary_strength(day: int, month: int, year: int) -> Dict[str, A
         'strength': planet_strength,
         'weekday_map': planet_weekday_map,
         'calculation_number': result_number,
-        'birth_weekday': weekday_names[weekday],
+        'birth_weekday': WEEKDAY_NAMES[weekday],
         'start_planet_index': start_planet
     }
 
@@ -155,6 +178,25 @@ def calculate_personal_numbers(birth_date: str) -> Dict[str, Any]:
     """Calculate all personal numbers"""
     day, month, year = parse_birth_date(birth_date)
     
+    # Предрасчитанная таблица дат рождения (1900–2100)
+    record = lookup_birth_date(day, month, year)
+    if record is not None:
+        soul_number, mind_number, destiny_number, helping_mind_number, wisdom_number, ruling_number = record.numbers
+        return {
+            'soul_number': soul_number,
+            'mind_number': mind_number,
+            'destiny_number': destiny_number,
+            'helping_mind_number': helping_mind_number,
+            'wisdom_number': wisdom_number,
+            'ruling_number': ruling_number,
+            'planetary_strength': dict(zip(PLANET_NAMES, record.strength)),
+            'birth_weekday': WEEKDAY_NAMES[record.weekday],
+            'calculation_details': {
+                'calculation_number': record.calculation_number,
+                'start_planet_index': (record.weekday + 1) % 7
+            }
+        }
+    
     # Основные числа
     soul_number = calculate_soul_number(day)
     mind_number = calculate_mind_number(month)
@@ -228,8 +270,42 @@ def calculate_individual_numbers(birth_date: str) -> Dict[str, int]:
     }
 
 
+# Позиции цифр 1..9 в квадрате Пифагора (строка, столбец)
+SQUARE_POSITIONS = {
+    1: (0, 0), 2: (1, 0), 3: (2, 0),
+    4: (0, 1), 5: (1, 1), 6: (2, 1),
+    7: (0, 2), 8: (1, 2), 9: (2, 2)
+}
+
+
 def create_pythagorean_square(day: int, month: int, year: int) -> Dict[str, Any]:
     """Create Pythagorean Square (Классический, с 4 доп. числами по методу Александрова)"""
+    record = lookup_birth_date(day, month, year)
+    if record is None:
+        return _compute_pythagorean_square(day, month, year)
+    
+    square = [['', '', ''], ['', '', ''], ['', '', '']]
+    counts = [[0, 0, 0], [0, 0, 0], [0, 0, 0]]
+    for i, count in enumerate(record.digit_counts, start=1):
+        r, c = SQUARE_POSITIONS[i]
+        square[r][c] = str(i) * count
+        counts[r][c] = count
+    
+    return {
+        "square": square,
+        "horizontal_sums": [sum(row) for row in counts],
+        "vertical_sums": [sum(counts[r][c] for r in range(3)) for c in range(3)],
+        "diagonal_sums": [
+            sum(counts[i][i] for i in range(3)),
+            sum(counts[i][2 - i] for i in range(3))
+        ],
+        "additional_numbers": list(record.additional_numbers),
+        "number_positions": {str(k): v for k, v in SQUARE_POSITIONS.items()}
+    }
+
+
+def _compute_pythagorean_square(day: int, month: int, year: int) -> Dict[str, Any]:
+    """Квадрат Пифагора без таблицы дат рождения (используется и при её сборке)"""
     # Подготовка цифр даты (с ведущими нулями для дня/месяца)
     day_str = str(day).zfill(2) if day < 10 else str(day)
     month_str = str(month).zfill(2) if month < 10 else str(month)
@@ -251,12 +327,7 @@ def create_pythagorean_square(day: int, month: int, year: int) -> Dict[str, Any]
     # Создаем 3x3 сетку
     square = [['', '', ''], ['', '', ''], ['', '', '']]
 
-    # Соответствие позиций 1..9
-    number_positions = {
-        1: (0, 0), 2: (1, 0), 3: (2, 0),
-        4: (0, 1), 5: (1, 1), 6: (2, 1),
-        7: (0, 2), 8: (1, 2), 9: (2, 2)
-    }
+    number_positions = SQUARE_POSITIONS
 
     # Подсчет количества цифр 1..9 (ноль игнорируем)
     digit_counts = {str(i): 0 for i in range(1, 10)}
@@ -290,6 +361,98 @@ def create_pythagorean_square(day: int, month: int, year: int) -> Dict[str, Any]
     }
 
 
+# ---------- Векторные версии для массивов дат (пакетные расчёты, предрасчёты, аналитика) ----------
+# Принимают int-массивы дней/месяцев/годов одинаковой формы и возвращают массивы,
+# поэлементно совпадающие со скалярными функциями выше.
+
+def _as_int_array(values: Any) -> np.ndarray:
+    return np.asarray(values, dtype=np.int64)
+
+
+def digit_sum_array(numbers: Any) -> np.ndarray:
+    """Sum of decimal digits of every non-negative element"""
+    remaining = _as_int_array(numbers).copy()
+    total = np.zeros_like(remaining)
+    while remaining.any():
+        total += remaining % 10
+        remaining //= 10
+    return total
+
+
+def _reduce_keeping_masters_array(numbers: Any, masters: tuple) -> np.ndarray:
+    """Repeated digit sum that stops as soon as a master number appears (also mid-reduction)"""
+    values = _as_int_array(numbers).copy()
+    active = (values > 9) & ~np.isin(values, masters)
+    while active.any():
+        values[active] = digit_sum_array(values[active])
+        active &= (values > 9) & ~np.isin(values, masters)
+    return values
+
+
+def reduce_to_single_digit_array(numbers: Any) -> np.ndarray:
+    """Vectorised reduce_to_single_digit (master numbers 11, 22, 33 kept)"""
+    return _reduce_keeping_masters_array(numbers, (11, 22, 33))
+
+
+def reduce_to_single_digit_always_array(numbers: Any) -> np.ndarray:
+    """Vectorised reduce_to_single_digit_always: digital root 1 + (n - 1) % 9"""
+    values = _as_int_array(numbers)
+    return np.where(values > 9, 1 + (values - 1) % 9, values)
+
+
+def reduce_for_ruling_number_array(numbers: Any) -> np.ndarray:
+    """Vectorised reduce_for_ruling_number (master numbers 11, 22 kept)"""
+    return _reduce_keeping_masters_array(numbers, (11, 22))
+
+
+def calculate_destiny_number_array(day: Any, month: Any, year: Any) -> np.ndarray:
+    """Vectorised calculate_destiny_number"""
+    return reduce_to_single_digit_always_array(_as_int_array(day) + _as_int_array(month) + _as_int_array(year))
+
+
+def calculate_ruling_number_array(day: Any, month: Any, year: Any) -> np.ndarray:
+    """Vectorised calculate_ruling_number"""
+    total = digit_sum_array(day) + digit_sum_array(month) + digit_sum_array(year)
+    return reduce_for_ruling_number_array(total)
+
+
+def calculate_wisdom_number_array(day: Any, month: Any, year: Any) -> np.ndarray:
+    """Vectorised calculate_wisdom_number"""
+    destiny_number = calculate_destiny_number_array(day, month, year)
+    return reduce_to_single_digit_array(destiny_number + destiny_number)
+
+
+def pythagorean_square_counts_array(day: Any, month: Any, year: Any) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorised digit counting of the Pythagorean square.
+    Returns (counts, additional_numbers): counts[i, k] — how many digits k+1 are in the
+    square of date i, additional_numbers[i] — А1..А4, as in create_pythagorean_square.
+    """
+    day, month, year = _as_int_array(day), _as_int_array(month), _as_int_array(year)
+    first_additional = digit_sum_array(day) + digit_sum_array(month) + digit_sum_array(year)
+    second_additional = digit_sum_array(first_additional)
+    # Первая цифра дня (для однозначного дня — ведущий ноль)
+    first_digit_of_day = day.copy()
+    while (first_digit_of_day > 9).any():
+        first_digit_of_day = np.where(first_digit_of_day > 9, first_digit_of_day // 10, first_digit_of_day)
+    first_digit_of_day = np.where(day < 10, 0, first_digit_of_day)
+    third_additional = np.abs(first_additional - 2 * first_digit_of_day)
+    fourth_additional = digit_sum_array(third_additional)
+
+    # Нули не учитываются, поэтому ведущие нули дня/месяца на подсчёт не влияют
+    rows = np.arange(day.size, dtype=np.int64)
+    counts = np.zeros(day.size * 10, dtype=np.int64)
+    for number in (day, month, year, first_additional, second_additional, third_additional, fourth_additional):
+        remaining = number.ravel().copy()
+        while remaining.any():
+            present = remaining > 0
+            counts += np.bincount(rows[present] * 10 + remaining[present] % 10, minlength=counts.size)
+            remaining //= 10
+    counts = counts.reshape(day.size, 10)[:, 1:].reshape(day.shape + (9,))
+    additional_numbers = np.stack([first_additional, second_additional, third_additional, fourth_additional], axis=-1)
+    return counts, additional_numbers
+
+
 # This function was removed as it was duplicating the enhanced version above
 
 
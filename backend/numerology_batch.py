@@ -0,0 +1,141 @@
+"""
+Пакетный расчёт нумерологии (/api/numerology/batch)
+
+Партнёры загружают списки из тысяч дат рождения и имён. Строки разбираются и проверяются
+заранее, баллы списываются один раз за весь пакет, а результаты считаются порциями
+(BATCH_CHUNK_SIZE строк) и отдаются клиенту в NDJSON по мере готовности.
+
+Форматы входа:
+    JSON  [{"birth_date": "15.08.1985", "full_name": "Anna Smirnova"}, ...]
+    CSV   заголовок birth_date,full_name (или name,surname); разделитель , ; или табуляция
+"""
+import csv
+import io
+import json
+from datetime import date
+from typing import Any, Dict, List, Tuple
+
+from numerology import (
+    calculate_name_numerology,
+    calculate_personal_numbers,
+    create_pythagorean_square,
+    parse_birth_date,
+)
+from vedic_numerology import calculate_comprehensive_vedic_numerology
+
+MAX_BATCH_ROWS = 10000
+BATCH_CHUNK_SIZE = 200
+
+# Ведические поля, которые попадают в результат строки (без текстовых рекомендаций)
+VEDIC_FIELDS = ('janma_ank', 'bhagya_ank', 'atma_ank', 'nama_ank', 'shakti_ank',
+                'graha_shakti', 'mahadasha', 'antardasha')
+
+
+class BatchFormatError(ValueError):
+    """Тело запроса не удалось разобрать как CSV или JSON-массив"""
+
+
+def _normalize_row(raw: Dict[str, Any]) -> Dict[str, str]:
+    row = {str(k).strip().lower(): (v if v is not None else '') for k, v in raw.items() if k is not None}
+    full_name = str(row.get('full_name') or '').strip()
+    if not full_name:
+        full_name = f"{str(row.get('name') or '').strip()} {str(row.get('surname') or '').strip()}".strip()
+    return {'birth_date': str(row.get('birth_date') or '').strip(), 'full_name': full_name}
+
+
+def parse_batch_json(content: bytes) -> List[Dict[str, str]]:
+    try:
+        data = json.loads(content.decode('utf-8-sig'))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise BatchFormatError(f'Некорректный JSON: {e}')
+    if isinstance(data, dict):
+        data = data.get('rows')
+    if not isinstance(data, list):
+        raise BatchFormatError('Ожидается JSON-массив строк')
+    rows = []
+    for item in data:
+        if isinstance(item, str):
+            item = {'birth_date': item}
+        if not isinstance(item, dict):
+            raise BatchFormatError('Каждая строка должна быть объектом с полем birth_date')
+        rows.append(_normalize_row(item))
+    return rows
+
+
+def parse_batch_csv(content: bytes) -> List[Dict[str, str]]:
+    try:
+        text = content.decode('utf-8-sig')
+    except UnicodeDecodeError as e:
+        raise BatchFormatError(f'CSV должен быть в кодировке UTF-8: {e}')
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.DictReader(io.StringIO(text), dialect=dialect)
+    fields = {(f or '').strip().lower() for f in (reader.fieldnames or [])}
+    if 'birth_date' not in fields:
+        raise BatchFormatError('В CSV нет колонки birth_date')
+    return [_normalize_row(raw) for raw in reader if any((v or '').strip() for v in raw.values() if isinstance(v, str))]
+
+
+def parse_batch_rows(content: bytes, content_type: str = '', filename: str = '') -> List[Dict[str, str]]:
+    """
+    Строки пакета из тела запроса или загруженного файла.
+    Формат определяется по Content-Type / расширению, иначе по первому символу.
+    """
+    content_type = (content_type or '').lower()
+    filename = (filename or '').lower()
+    if 'json' in content_type or filename.endswith('.json'):
+        rows = parse_batch_json(content)
+    elif 'csv' in content_type or filename.endswith(('.csv', '.tsv', '.txt')):
+        rows = parse_batch_csv(content)
+    elif content.lstrip()[:1] in (b'[', b'{'):
+        rows = parse_batch_json(content)
+    else:
+        rows = parse_batch_csv(content)
+
+    if not rows:
+        raise BatchFormatError('Пакет не содержит строк')
+    if len(rows) > MAX_BATCH_ROWS:
+        raise BatchFormatError(f'Слишком много строк: {len(rows)} (максимум {MAX_BATCH_ROWS})')
+    return rows
+
+
+def split_valid_rows(rows: List[Dict[str, str]]) -> Tuple[List[Tuple[int, Dict[str, str]]], List[Dict[str, Any]]]:
+    """
+    Делит строки на корректные (индекс, строка) и ошибки — ошибочные строки не оплачиваются
+    """
+    valid, errors = [], []
+    for index, row in enumerate(rows):
+        try:
+            day, month, year = parse_birth_date(row['birth_date'])
+            date(year, month, day)
+        except (ValueError, TypeError):
+            errors.append({'index': index, 'birth_date': row['birth_date'], 'full_name': row['full_name'],
+                           'error': 'Некорректная дата рождения, ожидается DD.MM.YYYY'})
+            continue
+        valid.append((index, row))
+    return valid, errors
+
+
+def calculate_batch_row(index: int, row: Dict[str, str]) -> Dict[str, Any]:
+    """
+    Расчёт одной строки теми же функциями, что и одиночные эндпоинты
+    """
+    birth_date, full_name = row['birth_date'], row['full_name']
+    result = {'index': index, 'birth_date': birth_date, 'full_name': full_name}
+    try:
+        day, month, year = parse_birth_date(birth_date)
+        result['personal_numbers'] = calculate_personal_numbers(birth_date)
+        result['pythagorean_square'] = create_pythagorean_square(day, month, year)
+        vedic = calculate_comprehensive_vedic_numerology(birth_date, full_name)
+        result['vedic'] = {key: vedic[key] for key in VEDIC_FIELDS}
+        if full_name:
+            result['name_numerology'] = calculate_name_numerology(full_name)
+    except Exception as e:
+        result = {'index': index, 'birth_date': birth_date, 'full_name': full_name, 'error': str(e)}
+    return result
+
+
+def calculate_batch_chunk(chunk: List[Tuple[int, Dict[str, str]]]) -> List[Dict[str, Any]]:
+    return [calculate_batch_row(index, row) for index, row in chunk]
@@ -0,0 +1,166 @@
+"""
+Снимок производных нумерологических данных пользователя (users.numerology_profile)
+
+Личные числа, квадрат Пифагора, джанма/бхагья анк, фрактальное поведение, проблемные числа,
+числа имени и энергия дней недели зависят только от даты рождения и имени. Они считаются один
+раз и хранятся в документе пользователя; эндпоинты берут их из того же users.find_one.
+Снимок пересчитывается при смене даты рождения/имени или версии формата.
+"""
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from numerology import (
+    calculate_name_numerology,
+    calculate_personal_numbers,
+    calculate_planetary_strength,
+    create_pythagorean_square,
+    parse_birth_date,
+    reduce_to_single_digit,
+)
+from vedic_numerology import calculate_bhagya_ank, calculate_janma_ank
+
+# Увеличить при изменении состава или алгоритмов снимка — старые снимки пересчитаются сами
+NUMEROLOGY_PROFILE_VERSION = 1
+
+PLANET_NAME_TO_KEY = {
+    'Солнце': 'surya', 'Луна': 'chandra', 'Марс': 'mangal',
+    'Меркурий': 'budha', 'Юпитер': 'guru', 'Венера': 'shukra', 'Сатурн': 'shani'
+}
+
+
+def build_numerology_profile(birth_date: Optional[str], full_name: Optional[str]) -> Dict[str, Any]:
+    """
+    Рассчитывает снимок по дате рождения (DD.MM.YYYY) и полному имени
+    """
+    profile = {
+        'version': NUMEROLOGY_PROFILE_VERSION,
+        'birth_date': birth_date,
+        'full_name': full_name,
+        'computed_at': datetime.utcnow(),
+        'personal_numbers': None,
+        'user_numbers': None,
+        'pythagorean_square': None,
+        'janma_ank': None,
+        'bhagya_ank': None,
+        'fractal_behavior': None,
+        'problem_numbers': None,
+        'name_numbers': None,
+        'weekday_energy': None,
+    }
+    if not birth_date:
+        return profile
+
+    try:
+        day, month, year = parse_birth_date(birth_date)
+
+        personal_numbers = calculate_personal_numbers(birth_date)
+        profile['personal_numbers'] = personal_numbers
+        user_numbers = {
+            'soul_number': personal_numbers.get('soul_number'),
+            'mind_number': personal_numbers.get('mind_number'),
+            'destiny_number': personal_numbers.get('destiny_number'),
+            'wisdom_number': personal_numbers.get('wisdom_number'),
+            'ruling_number': personal_numbers.get('ruling_number'),
+            'personal_day': personal_numbers.get('personal_day')
+        }
+        profile['user_numbers'] = user_numbers
+
+        profile['pythagorean_square'] = create_pythagorean_square(day, month, year)
+
+        # Джанма анк: мастер-число 22 сохраняется, если сумма до редукции ровно 22
+        janma_ank = calculate_janma_ank(day, month, year)
+        if day + month + year == 22:
+            janma_ank = 22
+        profile['janma_ank'] = janma_ank
+        profile['bhagya_ank'] = calculate_bhagya_ank(day, month, year)
+
+        # Фрактальное поведение: день, месяц, год и их сумма
+        year_reduced = reduce_to_single_digit(year)
+        profile['fractal_behavior'] = [
+            reduce_to_single_digit(day),
+            reduce_to_single_digit(month),
+            year_reduced,
+            reduce_to_single_digit(day + month + year)
+        ]
+
+        # Проблемные числа
+        soul_num = user_numbers.get('soul_number', 1)
+        mind_num = user_numbers.get('mind_number', 1)
+        problem1 = reduce_to_single_digit(abs(soul_num - mind_num))
+        problem2 = reduce_to_single_digit(abs(soul_num - year_reduced))
+        problem3 = reduce_to_single_digit(abs(problem1 - problem2))
+        problem4 = reduce_to_single_digit(abs(mind_num - year_reduced))
+        profile['problem_numbers'] = [problem1, problem2, problem3, problem4]
+
+        if full_name:
+            try:
+                name_data = calculate_name_numerology(full_name)
+                profile['name_numbers'] = {
+                    'first_name_number': name_data.get('first_name_number'),
+                    'last_name_number': name_data.get('last_name_number'),
+                    'total_name_number': name_data.get('total_name_number'),
+                    'full_name_number': name_data.get('total_name_number')
+                }
+            except Exception:
+                pass
+
+        # Энергия дней недели (DDMM × YYYY)
+        try:
+            strength_dict = calculate_planetary_strength(day, month, year).get('strength', {})
+            weekday_energy = {}
+            for planet_name, energy_value in strength_dict.items():
+                planet_key = PLANET_NAME_TO_KEY.get(planet_name)
+                if planet_key:
+                    weekday_energy[planet_key] = float(energy_value)
+            profile['weekday_energy'] = weekday_energy
+        except Exception as e:
+            print(f"Error calculating weekday energy: {e}")
+    except Exception as e:
+        print(f"Error building numerology profile: {e}")
+
+    return profile
+
+
+def is_profile_current(profile: Optional[Dict[str, Any]], user: Dict[str, Any]) -> bool:
+    """
+    Снимок актуален, если совпадают версия, дата рождения и имя пользователя
+    """
+    return bool(profile) \
+        and profile.get('version') == NUMEROLOGY_PROFILE_VERSION \
+        and profile.get('birth_date') == user.get('birth_date') \
+        and profile.get('full_name') == user.get('full_name')
+
+
+async def refresh_numerology_profile(db, user: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Пересчитывает снимок и сохраняет его в документе пользователя
+    """
+    profile = build_numerology_profile(user.get('birth_date'), user.get('full_name'))
+    await db.users.update_one({'id': user['id']}, {'$set': {'numerology_profile': profile}})
+    user['numerology_profile'] = profile
+    return profile
+
+
+async def get_numerology_profile(db, user: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Снимок из уже загруженного документа пользователя; устаревший или отсутствующий пересчитывается
+    """
+    profile = user.get('numerology_profile')
+    if is_profile_current(profile, user):
+        return profile
+    return await refresh_numerology_profile(db, user)
+
+
+def energy_calculation_kwargs(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Аргументы для расчётов энергии планет (calculate_planetary_energy_matrix и маршрутов)
+    """
+    return {
+        'user_numbers': profile.get('user_numbers'),
+        'pythagorean_square': profile.get('pythagorean_square'),
+        'fractal_behavior': profile.get('fractal_behavior'),
+        'problem_numbers': profile.get('problem_numbers'),
+        'name_numbers': profile.get('name_numbers'),
+        'weekday_energy': profile.get('weekday_energy'),
+        'janma_ank': profile.get('janma_ank'),
+    }
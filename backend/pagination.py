@@ -0,0 +1,68 @@
+"""
+Постраничная выдача по ключу (keyset pagination)
+
+Вместо skip/limit, который с ростом offset просматривает всё больше документов, следующая
+страница запрашивается по ключу последнего документа предыдущей: (created_at, id) по убыванию.
+Курсор для клиента непрозрачен — это base64 от JSON с ключом последнего документа.
+
+Для каждой коллекции нужен составной индекс (<фильтр>, created_at: -1, id: -1).
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+KEYSET_SORT = [('created_at', -1), ('id', -1)]
+
+
+def encode_cursor(doc: Dict[str, Any]) -> str:
+    created_at = doc.get('created_at')
+    payload = {
+        't': created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+        'id': doc.get('id'),
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, Any]:
+    """
+    (created_at, id) из курсора; некорректный курсор — 400
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        created_at = payload['t']
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        return created_at, payload['id']
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f'Некорректный курсор: {e}')
+
+
+def keyset_query(query: Dict[str, Any], cursor: Optional[str]) -> Dict[str, Any]:
+    """
+    Добавляет к фильтру условие "строго после курсора" в порядке (created_at, id) по убыванию
+    """
+    if not cursor:
+        return query
+    created_at, last_id = decode_cursor(cursor)
+    return {
+        **query,
+        '$or': [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, 'id': {'$lt': last_id}},
+        ],
+    }
+
+
+async def fetch_keyset_page(collection, query: Dict[str, Any], cursor: Optional[str], limit: int,
+                            projection: Optional[Dict[str, Any]] = None) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Страница документов и курсор следующей страницы (None, если страница последняя)
+    """
+    docs = await collection.find(keyset_query(query, cursor), projection) \
+        .sort(KEYSET_SORT).limit(limit + 1).to_list(limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
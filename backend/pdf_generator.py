@@ -19,9 +19,9 @@ from reportlab.graphics.charts.linecharts import HorizontalLineChart
 from reportlab.graphics.charts.barcharts import VerticalBarChart
 from reportlab.graphics.widgets.markers import makeMarker
 from reportlab.lib import colors
-import matplotlib.pyplot as plt
 import matplotlib
 matplotlib.use('Agg')  # Headless backend for server
+from planetary_chart import planetary_chart
 
 # Функции генерации табов определены в конце файла
 
@@ -160,80 +160,10 @@ def create_numerology_report_pdf(user_data: Dict[str, Any], all_data: Dict[str,
 
 def create_planetary_chart(planetary_data: List[Dict]) -> io.BytesIO:
     """
-    Создает график планетарных энергий с помощью matplotlib
+    Создает график планетарных энергий (PNG) с помощью matplotlib.
+    Фигура переиспользуется, готовые графики кэшируются по данным (planetary_chart.py)
     """
-    try:
-        # Настройка matplotlib для красивого графика
-        plt.style.use('default')
-        fig, ax = plt.subplots(figsize=(10, 6))
-        fig.patch.set_facecolor('white')
-        
-        # Данные для графика
-        days = [entry.get('day_name', f"День {i+1}") for i, entry in enumerate(planetary_data)]
-        
-        # Планеты и их цвета
-        planets = ['surya', 'chandra', 'mangal', 'budha', 'guru', 'shukra', 'shani', 'rahu', 'ketu']
-        planet_colors = {
-            'surya': '#FF6B35',     # Оранжевый для Солнца
-            'chandra': '#87CEEB',   # Голубой для Луны  
-            'mangal': '#DC143C',    # Красный для Марса
-            'budha': '#32CD32',     # Зеленый для Меркурия
-            'guru': '#FFD700',      # Золотой для Юпитера
-            'shukra': '#FF69B4',    # Розовый для Венеры
-            'shani': '#4169E1',     # Синий для Сатурна
-            'rahu': '#8B4513',      # Коричневый для Раху
-            'ketu': '#9370DB'       # Фиолетовый для Кету
-        }
-        
-        planet_names = {
-            'surya': 'Сурья (Солнце)',
-            'chandra': 'Чандра (Луна)',
-            'mangal': 'Мангал (Марс)', 
-            'budha': 'Будха (Меркурий)',
-            'guru': 'Гуру (Юпитер)',
-            'shukra': 'Шукра (Венера)',
-            'shani': 'Шани (Сатурн)',
-            'rahu': 'Раху',
-            'ketu': 'Кету'
-        }
-        
-        # Строим линии для каждой планеты
-        for planet in planets[:7]:  # Показываем первые 7 планет для читабельности
-            values = []
-            for entry in planetary_data:
-                energies = entry.get('planetary_energies', {})
-                values.append(energies.get(planet, 50))
-            
-            ax.plot(days, values, 
-                   color=planet_colors[planet], 
-                   linewidth=2, 
-                   marker='o', 
-                   markersize=4,
-                   label=planet_names[planet])
-        
-        # Настройка графика
-        ax.set_title('Планетарные энергии по дням', fontsize=14, fontweight='bold', color='#2c5f2d')
-        ax.set_xlabel('Дни', fontsize=12)
-        ax.set_ylabel('Уровень энергии', fontsize=12)
-        ax.grid(True, alpha=0.3)
-        ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
-        ax.set_ylim(0, 100)
-        
-        # Поворачиваем подписи дней для лучшей читабельности
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        
-        # Сохраняем в буфер
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png', dpi=150, bbox_inches='tight')
-        buffer.seek(0)
-        plt.close(fig)
-        
-        return buffer
-        
-    except Exception as e:
-        print(f"Ошибка создания графика: {e}")
-        return None
+    return planetary_chart.render(planetary_data)
 
 
 def create_compatibility_pdf(user1_data: Dict, user2_data: Dict, compatibility_result: Dict) -> bytes:
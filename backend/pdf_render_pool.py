@@ -0,0 +1,285 @@
+"""
+Рендер PDF-отчётов в пуле процессов
+
+Вёрстка reportlab и графики matplotlib (create_numerology_report_pdf, create_compatibility_pdf)
+выполнялись прямо в async-обработчиках и останавливали цикл событий для всех пользователей.
+Теперь обработчик собирает данные отчёта и ставит задание в пул процессов; в цикле событий
+остаётся только ожидание результата.
+
+- Размер пула — PDF_RENDER_WORKERS процессов, очередь ожидания — PDF_RENDER_QUEUE_SIZE заданий.
+  Сверх этого задания не принимаются (RenderQueueFull -> 503 с Retry-After).
+- Задание хранится в памяти воркера PDF_RENDER_JOB_TTL секунд после завершения: статус
+  запрашивается у того же процесса uvicorn, который его принял.
+- on_success (списание баллов и сохранение в report_cache) вызывается только после успешного
+  рендера; если он падает, задание завершается ошибкой и результат не отдаётся.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', '2'))
+PDF_RENDER_QUEUE_SIZE = int(os.environ.get('PDF_RENDER_QUEUE_SIZE', '16'))
+PDF_RENDER_JOB_TTL = int(os.environ.get('PDF_RENDER_JOB_TTL', '900'))
+
+
+class RenderQueueFull(RuntimeError):
+    """Все процессы пула заняты и очередь заполнена"""
+
+
+def _warm_up():
+    # Импорт reportlab/matplotlib, регистрация шрифтов и фигура графика — один раз на процесс пула
+    import pdf_generator  # noqa: F401
+    from planetary_chart import planetary_chart
+    planetary_chart.warm_up()
+
+
+def render_numerology_pdf(kwargs: Dict[str, Any]) -> Tuple[bytes, Dict[str, Any]]:
+    from pdf_generator import create_numerology_report_pdf
+    from planetary_chart import planetary_chart
+    renders, hits, chart_ms = planetary_chart.renders, planetary_chart.cache_hits, planetary_chart.total_render_ms
+    pdf = create_numerology_report_pdf(**kwargs)
+    # Метрики графика этого отчёта (счётчики planetary_chart живут в процессе пула)
+    return pdf, {
+        'chart_renders': planetary_chart.renders - renders,
+        'chart_cache_hits': planetary_chart.cache_hits - hits,
+        'chart_ms': planetary_chart.total_render_ms - chart_ms,
+    }
+
+
+def render_compatibility_pdf(kwargs: Dict[str, Any]) -> Tuple[bytes, Dict[str, Any]]:
+    from pdf_generator import create_compatibility_pdf
+    return create_compatibility_pdf(kwargs['user1_data'], kwargs['user2_data'], kwargs['compatibility_data']), {}
+
+
+RENDERERS = {
+    'numerology': render_numerology_pdf,
+    'compatibility': render_compatibility_pdf,
+}
+
+
+class RenderJob:
+    """
+    Задание рендера: статус queued -> running -> done | failed
+    """
+
+    def __init__(self, kind: str, user_id: str, filename: str):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.user_id = user_id
+        self.filename = filename
+        self.status = 'queued'
+        self.error: Optional[str] = None
+        self.error_status = 500
+        self.result: Optional[bytes] = None
+        # Ключ report_cache: готовый PDF сохраняется в кэш отчётов вместе со списанием
+        self.cache_key: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.render_ms: Optional[float] = None
+        self.chart_ms: Optional[float] = None
+        self.done = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ('done', 'failed')
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.id,
+            'report_type': self.kind,
+            'status': self.status,
+            'error': self.error,
+            'size_bytes': len(self.result) if self.result else None,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'render_ms': round(self.render_ms, 2) if self.render_ms is not None else None,
+            'chart_ms': round(self.chart_ms, 2) if self.chart_ms is not None else None,
+        }
+
+
+class PdfRenderPool:
+    """
+    Пул процессов рендера с ограниченной очередью и счётчиками
+    """
+
+    def __init__(self, workers: int = PDF_RENDER_WORKERS, queue_size: int = PDF_RENDER_QUEUE_SIZE,
+                 job_ttl: int = PDF_RENDER_JOB_TTL):
+        self.workers = max(1, workers)
+        self.queue_size = max(0, queue_size)
+        self.job_ttl = job_ttl
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.jobs: Dict[str, RenderJob] = {}
+        self.queued = 0
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.pool_restarts = 0
+        self.renders = 0
+        self.max_queue_depth = 0
+        self.last_render_ms = 0.0
+        self.max_render_ms = 0.0
+        self._total_render_ms = 0.0
+        self.max_wait_ms = 0.0
+        # График планетарных энергий (planetary_chart.py) по отчётам всех процессов пула
+        self.chart_renders = 0
+        self.chart_cache_hits = 0
+        self.max_chart_ms = 0.0
+        self._total_chart_ms = 0.0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: дочерний процесс не наследует потоки и сокеты Motor родителя
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_warm_up,
+            )
+        return self._executor
+
+    @property
+    def in_flight(self) -> int:
+        return self.queued + self.running
+
+    def submit(self, kind: str, payload: Dict[str, Any], user_id: str, filename: str,
+               on_success: Optional[Callable[[RenderJob], Awaitable[Any]]] = None,
+               cache_key: Optional[str] = None) -> RenderJob:
+        """
+        Ставит задание в пул. RenderQueueFull, если очередь заполнена.
+        """
+        self._prune()
+        if self.in_flight >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise RenderQueueFull(f'очередь рендера PDF заполнена ({self.in_flight} заданий)')
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+
+        job = RenderJob(kind, user_id, filename)
+        job.cache_key = cache_key
+        self.jobs[job.id] = job
+        self.submitted += 1
+        self.queued += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queued)
+        # Задача копирует contextvars запроса (ключ идемпотентности списания)
+        asyncio.get_running_loop().create_task(self._run(job, RENDERERS[kind], payload, on_success))
+        return job
+
+    async def _run(self, job: RenderJob, renderer, payload: Dict[str, Any], on_success):
+        try:
+            async with self._slots:
+                self.queued -= 1
+                self.running += 1
+                job.status = 'running'
+                job.started_at = datetime.utcnow()
+                self.max_wait_ms = max(self.max_wait_ms, (job.started_at - job.created_at).total_seconds() * 1000)
+                started = time.perf_counter()
+                try:
+                    result, metrics = await asyncio.get_running_loop().run_in_executor(
+                        self._get_executor(), renderer, payload
+                    )
+                except BrokenProcessPool:
+                    # Процесс пула упал (например, по памяти) — следующий рендер поднимет новый пул
+                    self._executor = None
+                    self.pool_restarts += 1
+                    raise RuntimeError('процесс рендера PDF завершился аварийно')
+                finally:
+                    self.running -= 1
+                    self.renders += 1
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    self.last_render_ms = elapsed_ms
+                    self.max_render_ms = max(self.max_render_ms, elapsed_ms)
+                    self._total_render_ms += elapsed_ms
+                    job.render_ms = elapsed_ms
+            self._record_chart(job, metrics)
+            if not result:
+                raise RuntimeError('пустой результат')
+            # on_success видит job.result; при его ошибке результат не отдаётся
+            job.result = result
+            if on_success is not None:
+                await on_success(job)
+            job.status = 'done'
+            self.completed += 1
+        except Exception as e:
+            job.status = 'failed'
+            job.result = None
+            job.error = str(getattr(e, 'detail', None) or e)
+            job.error_status = getattr(e, 'status_code', 500)
+            self.failed += 1
+        finally:
+            if job.status == 'queued':
+                self.queued -= 1
+            job.finished_at = datetime.utcnow()
+            job.done.set()
+
+    def _record_chart(self, job: RenderJob, metrics: Dict[str, Any]):
+        if 'chart_ms' not in metrics:
+            return
+        job.chart_ms = metrics['chart_ms']
+        self.chart_renders += metrics['chart_renders']
+        self.chart_cache_hits += metrics['chart_cache_hits']
+        self._total_chart_ms += metrics['chart_ms']
+        self.max_chart_ms = max(self.max_chart_ms, metrics['chart_ms'])
+
+    async def wait(self, job: RenderJob, timeout: Optional[float] = None) -> RenderJob:
+        await asyncio.wait_for(job.done.wait(), timeout)
+        return job
+
+    def get(self, job_id: str, user_id: str) -> Optional[RenderJob]:
+        """
+        Задание пользователя (чужие задания не видны)
+        """
+        job = self.jobs.get(job_id)
+        if job is None or job.user_id != user_id:
+            return None
+        return job
+
+    def _prune(self):
+        now = datetime.utcnow()
+        expired = [job_id for job_id, job in self.jobs.items()
+                   if job.finished and (now - job.finished_at).total_seconds() > self.job_ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def close(self):
+        """
+        Останавливает процессы пула (on_shutdown)
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "queued": self.queued,
+            "running": self.running,
+            "max_queue_depth": self.max_queue_depth,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "pool_restarts": self.pool_restarts,
+            "jobs_kept": len(self.jobs),
+            "last_render_ms": round(self.last_render_ms, 2),
+            "max_render_ms": round(self.max_render_ms, 2),
+            "avg_render_ms": round(self._total_render_ms / self.renders, 2) if self.renders else 0.0,
+            "max_wait_ms": round(self.max_wait_ms, 2),
+            "chart_renders": self.chart_renders,
+            "chart_cache_hits": self.chart_cache_hits,
+            "max_chart_ms": round(self.max_chart_ms, 2),
+            "avg_chart_ms": round(self._total_chart_ms / self.chart_renders, 2) if self.chart_renders else 0.0,
+        }
+
+
+pdf_render_pool = PdfRenderPool()
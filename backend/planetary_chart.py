@@ -0,0 +1,189 @@
+"""
+График планетарных энергий для PDF-отчёта
+
+create_planetary_chart на каждый отчёт создавал фигуру matplotlib через pyplot, применял
+стиль, делал tight_layout и сохранял PNG 150 dpi — самый дорогой шаг рендера PDF. Теперь
+фигура, оси, линии планет и легенда создаются один раз на процесс (процесс пула рендера
+готовит их при старте), а на каждый график меняются только данные линий и подписи дней.
+
+Готовые PNG кэшируются в памяти процесса по хэшу нарисованных данных (подписи дней и
+значения планет), до CHART_CACHE_SIZE графиков. Время рендера и попадания в кэш
+считаются в stats(); пул рендера передаёт их в статистику отчётов.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+CHART_CACHE_SIZE = int(os.environ.get('CHART_CACHE_SIZE', '128'))
+CHART_DPI = 150
+
+PLANETS = ['surya', 'chandra', 'mangal', 'budha', 'guru', 'shukra', 'shani']  # первые 7 планет для читабельности
+PLANET_COLORS = {
+    'surya': '#FF6B35',     # Оранжевый для Солнца
+    'chandra': '#87CEEB',   # Голубой для Луны
+    'mangal': '#DC143C',    # Красный для Марса
+    'budha': '#32CD32',     # Зеленый для Меркурия
+    'guru': '#FFD700',      # Золотой для Юпитера
+    'shukra': '#FF69B4',    # Розовый для Венеры
+    'shani': '#4169E1',     # Синий для Сатурна
+}
+PLANET_NAMES = {
+    'surya': 'Сурья (Солнце)',
+    'chandra': 'Чандра (Луна)',
+    'mangal': 'Мангал (Марс)',
+    'budha': 'Будха (Меркурий)',
+    'guru': 'Гуру (Юпитер)',
+    'shukra': 'Шукра (Венера)',
+    'shani': 'Шани (Сатурн)',
+}
+
+
+def chart_series(planetary_data: List[Dict]) -> Dict[str, Any]:
+    """
+    Данные, которые попадают на график: подписи дней и значения планет по дням
+    """
+    days = [entry.get('day_name', f"День {i+1}") for i, entry in enumerate(planetary_data)]
+    values = {}
+    for planet in PLANETS:
+        # generate_weekly_planetary_energy кладёт энергии прямо в запись дня,
+        # старый формат — во вложенный planetary_energies
+        values[planet] = [
+            (entry.get('planetary_energies') or entry).get(planet, 50) for entry in planetary_data
+        ]
+    return {'days': days, 'values': values}
+
+
+def chart_key(series: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(series, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+class PlanetaryChartRenderer:
+    """
+    Переиспользуемая фигура matplotlib и кэш PNG по хэшу данных
+    """
+
+    def __init__(self, cache_size: int = CHART_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._figure = None
+        self._axes = None
+        self._lines: Dict[str, Any] = {}
+        # Подписи дней -> обрезка PNG (bbox_inches='tight' считает её отдельной отрисовкой)
+        self._bboxes: Dict[tuple, Any] = {}
+        self.renders = 0
+        self.cache_hits = 0
+        self.last_render_ms = 0.0
+        self.max_render_ms = 0.0
+        self.total_render_ms = 0.0
+
+    def _setup(self):
+        # Без pyplot: фигура не регистрируется в глобальном менеджере и не закрывается
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+        figure = Figure(figsize=(10, 6), dpi=CHART_DPI, facecolor='white')
+        FigureCanvasAgg(figure)
+        ax = figure.add_subplot()
+        for planet in PLANETS:
+            self._lines[planet], = ax.plot([], [],
+                                           color=PLANET_COLORS[planet],
+                                           linewidth=2,
+                                           marker='o',
+                                           markersize=4,
+                                           label=PLANET_NAMES[planet])
+        ax.set_title('Планетарные энергии по дням', fontsize=14, fontweight='bold', color='#2c5f2d')
+        ax.set_xlabel('Дни', fontsize=12)
+        ax.set_ylabel('Уровень энергии', fontsize=12)
+        ax.grid(True, alpha=0.3)
+        ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+        ax.set_ylim(0, 100)
+        # Поля под подписи дней (поворот 45°), чтобы раскладку не пересчитывать на каждый график
+        ax.set_xticks(range(7))
+        ax.set_xticklabels(['Wednesday'] * 7, rotation=45)
+        figure.tight_layout()
+        self._figure, self._axes = figure, ax
+
+    def warm_up(self):
+        """
+        Создаёт фигуру заранее (инициализатор процесса пула рендера)
+        """
+        with self._lock:
+            if self._figure is None:
+                self._setup()
+
+    def _draw(self, series: Dict[str, Any]) -> bytes:
+        if self._figure is None:
+            self._setup()
+        ax = self._axes
+        positions = list(range(len(series['days'])))
+        for planet in PLANETS:
+            self._lines[planet].set_data(positions, series['values'][planet])
+        ax.set_xticks(positions)
+        # Поворачиваем подписи дней для лучшей читабельности
+        ax.set_xticklabels(series['days'], rotation=45, ha='center')
+        ax.relim()
+        ax.autoscale_view()
+
+        # Обрезка зависит только от подписей (линии обрезаны осями): для повторяющихся
+        # недель отрисовка одна, а не две
+        days = tuple(series['days'])
+        bbox = self._bboxes.get(days)
+        if bbox is None:
+            self._figure.canvas.draw()
+            bbox = self._figure.get_tightbbox(self._figure.canvas.get_renderer()).padded(0.1)
+            self._bboxes[days] = bbox
+
+        buffer = io.BytesIO()
+        # reportlab распаковывает PNG и сжимает заново, поэтому сильное сжатие здесь — лишняя работа
+        self._figure.savefig(buffer, format='png', dpi=CHART_DPI, bbox_inches=bbox,
+                             pil_kwargs={'compress_level': 1})
+        return buffer.getvalue()
+
+    def render(self, planetary_data: List[Dict]) -> Optional[io.BytesIO]:
+        """
+        PNG графика (BytesIO) или None при ошибке
+        """
+        series = chart_series(planetary_data)
+        key = chart_key(series)
+        with self._lock:
+            png = self._cache.get(key)
+            if png is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return io.BytesIO(png)
+
+            started = time.perf_counter()
+            try:
+                png = self._draw(series)
+            except Exception as e:
+                print(f"Ошибка создания графика: {e}")
+                return None
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.renders += 1
+            self.last_render_ms = elapsed_ms
+            self.max_render_ms = max(self.max_render_ms, elapsed_ms)
+            self.total_render_ms += elapsed_ms
+
+            self._cache[key] = png
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return io.BytesIO(png)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "chart_renders": self.renders,
+            "chart_cache_hits": self.cache_hits,
+            "chart_cache_size": len(self._cache),
+            "last_chart_ms": round(self.last_render_ms, 2),
+            "max_chart_ms": round(self.max_render_ms, 2),
+            "avg_chart_ms": round(self.total_render_ms / self.renders, 2) if self.renders else 0.0,
+        }
+
+
+planetary_chart = PlanetaryChartRenderer()
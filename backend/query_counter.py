@@ -0,0 +1,74 @@
+"""
+Счётчик запросов к MongoDB в пределах одного HTTP-запроса
+
+Слушатель команд pymongo подключается к клиенту Mongo; пока активен count_queries(),
+каждая отправленная серверу команда (find, aggregate, getMore, insert, ...) учитывается в
+QueryStats текущего контекста. Motor выполняет операции в пуле потоков с копией
+contextvars, поэтому счётчик видит запросы, сделанные из обработчика.
+
+Middleware в server.py считает запросы каждого HTTP-запроса, возвращает число в заголовке
+X-DB-Query-Count и пишет предупреждение в лог, если их больше QUERY_COUNT_WARN_THRESHOLD.
+В тестах (tests/test_query_counter.py):
+
+    with count_queries() as stats:
+        await get_detailed_analytics('lessons', ...)
+    assert stats.count == queries_for_one_lesson
+"""
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+from pymongo import monitoring
+
+QUERY_COUNT_WARN_THRESHOLD = int(os.environ.get('QUERY_COUNT_WARN_THRESHOLD', '100'))
+
+
+class QueryStats:
+    """
+    Количество команд Mongo, всего и по имени команды
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.by_command: Dict[str, int] = {}
+
+    def add(self, command_name: str):
+        self.count += 1
+        self.by_command[command_name] = self.by_command.get(command_name, 0) + 1
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar('query_stats', default=None)
+
+
+class QueryCounterListener(monitoring.CommandListener):
+    def started(self, event):
+        stats = _current_stats.get()
+        if stats is not None:
+            stats.add(event.command_name)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+query_counter_listener = QueryCounterListener()
+
+
+@contextmanager
+def count_queries() -> Iterator[QueryStats]:
+    """
+    Считает запросы к Mongo, сделанные внутри блока (включая вложенные корутины)
+    """
+    stats = QueryStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+def current_query_stats() -> Optional[QueryStats]:
+    return _current_stats.get()
@@ -0,0 +1,291 @@
+"""
+Кэш готовых HTML/PDF отчётов на диске, адресуемый по содержимому
+
+Отчёт зависит только от собранных для генератора данных (профиль, выбранные расчёты, тема,
+ведическое расписание и маршрут на текущий день) и от кода генератора. Ключ — sha256
+нормализованного JSON этих данных плюс версия генератора, поэтому изменение профиля,
+набора расчётов или наступление нового дня дают новый ключ, а старые файлы просто
+вытесняются — явная инвалидация не нужна.
+
+- Файлы лежат в REPORT_CACHE_DIR/<user_id>/<ключ>.<html|pdf>, запись атомарная (os.replace).
+- Общий размер ограничен REPORT_CACHE_MAX_MB, при превышении удаляются давно не читавшиеся
+  файлы (LRU по времени доступа, индекс строится по mtime при первом обращении).
+- Ключ отдаётся как ETag; повторное скачивание — FileResponse без рендера.
+- Потоковый HTML сохраняется через tee(): части уходят клиенту, файл пишется после последней.
+
+Внутри отчёта табы HTML кэшируются отдельно (FragmentCache, в памяти процесса) по хэшу только
+тех данных, которые читает таб: новый номер машины меняет ключ отчёта, но заново
+генерируется только таб «Авто», остальные берутся из кэша фрагментов.
+- Версия генератора — REPORT_GENERATOR_VERSION и хэш исходников генераторов: выкладка
+  новой вёрстки сама делает старые файлы недостижимыми.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Union
+
+REPORT_CACHE_DIR = os.environ.get('REPORT_CACHE_DIR', str(Path(__file__).parent / 'data' / 'report_cache'))
+REPORT_CACHE_MAX_MB = float(os.environ.get('REPORT_CACHE_MAX_MB', '256'))
+REPORT_GENERATOR_VERSION = '1'
+REPORT_FRAGMENT_CACHE_MB = float(os.environ.get('REPORT_FRAGMENT_CACHE_MB', '32'))
+
+GENERATOR_MODULES = ('html_generator.py', 'html_generator_helpers.py', 'pdf_generator.py', 'pdf_generator_tabs.py',
+                     'planetary_chart.py')
+FORMATS = ('html', 'pdf')
+
+
+def _generator_fingerprint() -> str:
+    digest = hashlib.sha256(REPORT_GENERATOR_VERSION.encode())
+    base = Path(__file__).parent
+    for name in GENERATOR_MODULES:
+        try:
+            digest.update((base / name).read_bytes())
+        except OSError:
+            digest.update(name.encode())
+    return digest.hexdigest()[:16]
+
+
+GENERATOR_FINGERPRINT = _generator_fingerprint()
+
+
+def _normalize(value: Any) -> Any:
+    # json.dumps(default=...) для значений, которых нет в JSON
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    return str(value)
+
+
+def _digest(value: Dict[str, Any]) -> str:
+    normalized = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=_normalize)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+def report_key(kind: str, fmt: str, user_id: str, inputs: Dict[str, Any]) -> str:
+    """
+    Ключ отчёта: sha256 от вида, формата, владельца, версии генератора и входных данных
+    """
+    return _digest({'kind': kind, 'format': fmt, 'user_id': user_id, 'generator': GENERATOR_FINGERPRINT, 'inputs': inputs})
+
+
+def etag(key: str) -> str:
+    return f'"{key}"'
+
+
+def etag_matches(if_none_match: Optional[str], key: str) -> bool:
+    """
+    Совпадает ли заголовок If-None-Match с ключом отчёта
+    """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag == etag(key):
+            return True
+    return False
+
+
+class ReportCache:
+    """
+    Файлы отчётов с ограничением общего размера
+    """
+
+    def __init__(self, directory: str = REPORT_CACHE_DIR, max_mb: float = REPORT_CACHE_MAX_MB):
+        self.directory = Path(directory)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        # относительный путь -> размер, от давно не читавшихся к недавним
+        self._index: Optional[OrderedDict] = None
+        # tee() пишет из потока пула Starlette, get() вызывается из цикла событий
+        self._lock = threading.RLock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _relative(self, user_id: str, key: str, fmt: str) -> str:
+        if fmt not in FORMATS:
+            raise ValueError(f'неизвестный формат отчёта: {fmt}')
+        # user_id и key идут в путь: допускаются только безопасные символы
+        safe_user = ''.join(ch for ch in user_id if ch.isalnum() or ch in '-_') or '_'
+        return f'{safe_user}/{key}.{fmt}'
+
+    def _load_index(self) -> OrderedDict:
+        if self._index is None:
+            entries = []
+            if self.directory.exists():
+                for path in self.directory.glob('*/*.*'):
+                    if path.suffix.lstrip('.') not in FORMATS:
+                        continue
+                    try:
+                        stat = path.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, path.relative_to(self.directory).as_posix(), stat.st_size))
+            entries.sort()
+            self._index = OrderedDict((relative, size) for _, relative, size in entries)
+            self.total_bytes = sum(self._index.values())
+        return self._index
+
+    def get(self, user_id: str, key: str, fmt: str) -> Optional[Path]:
+        """
+        Путь к готовому отчёту или None
+        """
+        with self._lock:
+            return self._get(user_id, key, fmt)
+
+    def _get(self, user_id: str, key: str, fmt: str) -> Optional[Path]:
+        index = self._load_index()
+        relative = self._relative(user_id, key, fmt)
+        path = self.directory / relative
+        try:
+            size = path.stat().st_size
+            # mtime — время последнего чтения, по нему строится LRU после перезапуска
+            os.utime(path, None)
+        except OSError:
+            # Файла нет (или его вытеснил другой воркер)
+            if relative in index:
+                self.total_bytes -= index.pop(relative)
+            self.misses += 1
+            return None
+        if relative not in index:
+            index[relative] = size
+            self.total_bytes += size
+        index.move_to_end(relative)
+        self.hits += 1
+        return path
+
+    def put(self, user_id: str, key: str, fmt: str, content: Union[bytes, str]) -> Optional[Path]:
+        """
+        Сохраняет отчёт; ошибки диска не прерывают выдачу отчёта (None)
+        """
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        with self._lock:
+            return self._put(user_id, key, fmt, content)
+
+    def _put(self, user_id: str, key: str, fmt: str, content: bytes) -> Optional[Path]:
+        index = self._load_index()
+        relative = self._relative(user_id, key, fmt)
+        path = self.directory / relative
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as tmp:
+                    tmp.write(content)
+                os.replace(tmp_name, path)
+            except BaseException:
+                os.unlink(tmp_name)
+                raise
+        except OSError as e:
+            self.errors += 1
+            print(f"report_cache: не удалось сохранить {relative}: {e}")
+            return None
+        self.total_bytes += len(content) - index.pop(relative, 0)
+        index[relative] = len(content)
+        self.stores += 1
+        self._evict()
+        return path
+
+    def tee(self, user_id: str, key: str, fmt: str, chunks: Iterable[str]) -> Iterator[str]:
+        """
+        Отдаёт части отчёта дальше и сохраняет отчёт, когда пройдена последняя часть
+        (оборванная отдача или ошибка генерации в кэш не попадают)
+        """
+        parts = []
+        for chunk in chunks:
+            parts.append(chunk)
+            yield chunk
+        self.put(user_id, key, fmt, ''.join(parts))
+
+    def _evict(self):
+        index = self._load_index()
+        while self.total_bytes > self.max_bytes and len(index) > 1:
+            relative, size = index.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self.directory / relative)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            index = self._load_index()
+        lookups = self.hits + self.misses
+        return {
+            "directory": str(self.directory),
+            "files": len(index),
+            "size_mb": round(self.total_bytes / 1024 / 1024, 2),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+            "generator": GENERATOR_FINGERPRINT,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "errors": self.errors,
+        }
+
+
+class FragmentCache:
+    """
+    Отрендеренные фрагменты отчёта (табы HTML) в памяти процесса по хэшу их входных данных.
+    Ключ не зависит от пользователя: фрагмент — функция только своих входных данных.
+    """
+
+    def __init__(self, max_mb: float = REPORT_FRAGMENT_CACHE_MB):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self._fragments: OrderedDict = OrderedDict()
+        # Табы генерируются в потоках пула Starlette (потоковая отдача отчёта)
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+    def render(self, name: str, inputs: Dict[str, Any], render: Callable[[], str]) -> str:
+        """
+        Фрагмент name из кэша или render(), если его входные данные ещё не встречались
+        """
+        key = _digest({'fragment': name, 'inputs': inputs})
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+                self.hits[name] = self.hits.get(name, 0) + 1
+                return fragment
+
+        fragment = render()
+        with self._lock:
+            self.misses[name] = self.misses.get(name, 0) + 1
+            if key not in self._fragments:
+                self._fragments[key] = fragment
+                self.total_bytes += len(fragment)
+            while self.total_bytes > self.max_bytes and self._fragments:
+                _, evicted = self._fragments.popitem(last=False)
+                self.total_bytes -= len(evicted)
+        return fragment
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "fragments": len(self._fragments),
+                "size_mb": round(self.total_bytes / 1024 / 1024, 2),
+                "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+                "hits": dict(self.hits),
+                "misses": dict(self.misses),
+            }
+
+
+report_cache = ReportCache()
+report_fragments = FragmentCache()
@@ -2,6 +2,9 @@ from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, status,
 from fastapi.responses import JSONResponse, StreamingResponse, Response, FileResponse
 from fastapi.staticfiles import StaticFiles
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from contextvars import ContextVar
 from pathlib import Path
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
@@ -15,6 +18,7 @@ import logging
 import tempfile
 import re
 import mimetypes
+import itertools
 
 from dotenv import load_dotenv
 
@@ -50,7 +54,6 @@ from numerology import (
     calculate_compatibility,
     parse_birth_date,
     create_pythagorean_square,
-    reduce_to_single_digit,
     reduce_to_single_digit_always,
     reduce_for_ruling_number
 )
@@ -58,9 +61,25 @@ from vedic_numerology import (
     calculate_comprehensive_vedic_numerology,
     generate_weekly_planetary_energy
 )
-from vedic_time_calculations import get_vedic_day_schedule, get_monthly_planetary_route, get_quarterly_planetary_route, calculate_planetary_hours, calculate_night_planetary_hours, is_favorable_time, get_sunrise_sunset
-from html_generator import create_numerology_report_html
-from pdf_generator import create_numerology_report_pdf, create_compatibility_pdf
+from vedic_time_calculations import get_vedic_day_schedule, get_monthly_planetary_route, get_quarterly_planetary_route, calculate_planetary_hours, calculate_night_planetary_hours, is_favorable_time, get_sunrise_sunset, resolve_city_coordinates, configure_geo_cache, flush_geo_cache, geo_cache_stats
+from numerology_profile import get_numerology_profile, refresh_numerology_profile, is_profile_current, energy_calculation_kwargs
+from credit_ledger import credit_ledger
+from credit_aggregates import apply_credit_aggregates, rebuild_user_aggregate, BREAKDOWN_FIELDS
+from analytics_rollups import record_rollup, invalidate_rollups, rebuild_rollups, load_overview
+from learning_events import LearningEventError, EventBatch, parse_events, build_event_writes, awarded_file_points, file_view_points, whole_minutes
+from video_watch_buffer import video_watch_buffer
+from pagination import fetch_keyset_page, KEYSET_SORT
+from collection_registry import collection_registry
+from index_check import check_indexes
+from query_counter import query_counter_listener, count_queries, QUERY_COUNT_WARN_THRESHOLD
+from student_dashboard import (
+    load_student_activity, facet_totals, rows_by_period, row_time,
+    load_lesson_totals, load_activity_events, lesson_time_pipeline,
+    LESSON_PROJECTION, CHART_DAYS, RECENT_DAYS, DAY_FORMAT, HOUR_FORMAT,
+)
+from html_generator import iter_numerology_report_html
+from pdf_render_pool import pdf_render_pool, RenderJob, RenderQueueFull
+from report_cache import report_cache, report_fragments, report_key, etag, etag_matches
 from planetary_advice import init_planetary_advice_collection, get_personalized_planetary_advice
 import stripe
 
@@ -91,7 +110,7 @@ load_dotenv(ROOT_DIR / '.env')
 
 # Mongo
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[query_counter_listener])
 db = client[os.environ.get('MONGODB_DATABASE')]
 
 # Logging
@@ -229,6 +248,14 @@ async def on_startup():
     try:
         await ensure_super_admin_exists(db)
         await init_planetary_advice_collection(db)
+        # Общий для воркеров кеш координат городов и солнечных таблиц
+        configure_geo_cache(db.geo_cache)
+        # Ожидаемые коллекции и их индексы; дальше наличие коллекций проверяется по реестру
+        await collection_registry.ensure(db)
+        # История баллов пишется пакетами в фоне
+        credit_ledger.configure(db.credit_transactions, on_written=update_credit_aggregates)
+        # Heartbeat-ы просмотра видео копятся в памяти и пишутся $inc раз в несколько секунд
+        video_watch_buffer.configure(db, get_learning_points_config, on_flushed=award_video_watch_points)
         MATERIALS_DIR.mkdir(parents=True, exist_ok=True)
         CONSULTATIONS_DIR.mkdir(parents=True, exist_ok=True)
         CONSULTATIONS_VIDEO_DIR.mkdir(parents=True, exist_ok=True)
@@ -253,10 +280,16 @@ async def on_startup():
 
 @app.on_event('shutdown')
 async def on_shutdown():
+    await flush_geo_cache()
+    # Выгрузка просмотров видео начисляет баллы, поэтому она идёт до закрытия очереди истории
+    await video_watch_buffer.close()
+    await credit_ledger.close()
+    pdf_render_pool.close()
     client.close()
 
 # Helper function for credit transactions
-async def record_credit_transaction(user_id: str, amount: int, description: str, category: str, details: dict = None):
+async def record_credit_transaction(user_id: str, amount: int, description: str, category: str, details: dict = None,
+                                    idempotency_key: str = None, balance_after: int = None):
     """Записать транзакцию баллов в историю"""
     # НЕ записываем транзакции с нулевой суммой - это ошибка логики
     if amount == 0:
@@ -269,9 +302,47 @@ async def record_credit_transaction(user_id: str, amount: int, description: str,
         amount=amount,
         description=description,
         category=category,
-        details=details or {}
+        details=details or {},
+        idempotency_key=idempotency_key,
+        balance_after=balance_after
     )
-    await db.credit_transactions.insert_one(transaction.dict())
+    if credit_ledger.configured:
+        await credit_ledger.put(transaction.dict())
+    else:
+        await db.credit_transactions.insert_one(transaction.dict())
+        await update_credit_aggregates([transaction.dict()])
+
+async def update_credit_aggregates(transactions: List[Dict[str, Any]]):
+    """Обновить счётчики credit_aggregates для записанных транзакций"""
+    await apply_credit_aggregates(db.credit_aggregates, transactions)
+
+async def record_analytics_rollup(user_id: str, points: Optional[Dict[str, int]] = None,
+                                  active_lesson: Optional[str] = None, lessons_completed: int = 0):
+    """Обновить дневные агрегаты админской аналитики (analytics_rollups)"""
+    try:
+        await record_rollup(db.analytics_rollups, user_id, points=points,
+                            active_lesson=active_lesson, lessons_completed=lessons_completed)
+    except Exception as e:
+        # Агрегаты восстанавливаются пересчётом, запись события не должна из-за них падать
+        logger.error(f"Error updating analytics rollups: {str(e)}")
+
+async def award_video_watch_points(users: Dict[str, Dict[str, Any]]):
+    """Начислить баллы за просмотр видео, выгруженный video_watch_buffer (одна транзакция на пользователя)"""
+    for user_id, watched in users.items():
+        await award_credits_for_learning(
+            user_id=user_id,
+            amount=watched["points"],
+            description=f"Просмотр видео ({watched['minutes']} мин.)",
+            category='learning',
+            details={
+                'lesson_ids': watched["lesson_ids"],
+                'file_ids': watched["file_ids"],
+                'minutes_watched': watched["minutes"],
+                'points_per_minute': watched["points_per_minute"],
+                'total_points': watched["points"]
+            }
+        )
+        await record_analytics_rollup(user_id, points={"videos": watched["points"], "time": watched["activity_points"]})
 
 async def get_credits_deduction_config() -> dict:
     """Получить конфигурацию списания баллов"""
@@ -287,20 +358,105 @@ async def get_credits_deduction_config() -> dict:
     default_config = CreditsDeductionConfig()
     return default_config.dict()
 
-async def deduct_credits(user_id: str, cost: int, description: str, category: str, details: dict = None):
-    """Списать баллы и записать транзакцию"""
-    user = await db.users.find_one({'id': user_id})
-    if not user:
-        raise HTTPException(status_code=404, detail='Пользователь не найден')
-    
-    if user.get('credits_remaining', 0) < cost:
+# Ключ идемпотентности из заголовка Idempotency-Key текущего запроса
+request_idempotency_key: ContextVar[Optional[str]] = ContextVar('request_idempotency_key', default=None)
+# Сколько последних ключей списаний хранится в документе пользователя
+CREDIT_IDEMPOTENCY_KEYS_LIMIT = 100
+
+@app.middleware("http")
+async def idempotency_key_middleware(request: Request, call_next):
+    token = request_idempotency_key.set(request.headers.get('idempotency-key') or None)
+    try:
+        return await call_next(request)
+    finally:
+        request_idempotency_key.reset(token)
+
+@app.middleware("http")
+async def query_counter_middleware(request: Request, call_next):
+    with count_queries() as stats:
+        response = await call_next(request)
+    response.headers['X-DB-Query-Count'] = str(stats.count)
+    if stats.count > QUERY_COUNT_WARN_THRESHOLD:
+        logger.warning(f"{request.method} {request.url.path}: {stats.count} запросов к Mongo {stats.by_command}")
+    return response
+
+async def deduct_credits(user_id: str, cost: int, description: str, category: str, details: dict = None,
+                         idempotency_key: str = None) -> int:
+    """
+    Списать баллы и записать транзакцию. Возвращает новый баланс.
+    Проверка баланса и списание — один атомарный find_one_and_update, поэтому при
+    параллельных запросах баланс не уходит в минус. Повтор с тем же ключом идемпотентности
+    (по умолчанию — заголовок Idempotency-Key + описание операции) не списывает баллы второй раз.
+    """
+    if idempotency_key is None and request_idempotency_key.get():
+        idempotency_key = f'{request_idempotency_key.get()}:{description}'
+
+    query = {'id': user_id}
+    if cost > 0:
+        query['credits_remaining'] = {'$gte': cost}
+    update = {'$inc': {'credits_remaining': -cost}}
+    if idempotency_key:
+        query['credit_idempotency_keys'] = {'$ne': idempotency_key}
+        update['$push'] = {'credit_idempotency_keys': {'$each': [idempotency_key], '$slice': -CREDIT_IDEMPOTENCY_KEYS_LIMIT}}
+
+    user = await db.users.find_one_and_update(
+        query, update,
+        projection={'_id': 0, 'credits_remaining': 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if user is None:
+        # Списание не прошло — выясняем почему (редкий путь, отдельный запрос)
+        user = await db.users.find_one({'id': user_id}, {'_id': 0, 'credits_remaining': 1, 'credit_idempotency_keys': 1})
+        if not user:
+            raise HTTPException(status_code=404, detail='Пользователь не найден')
+        if idempotency_key and idempotency_key in user.get('credit_idempotency_keys', []):
+            # Повтор уже оплаченного запроса; дописываем транзакцию, если первая попытка не успела
+            if not credit_ledger.has_pending(user_id, idempotency_key) and \
+                    not await db.credit_transactions.find_one({'user_id': user_id, 'idempotency_key': idempotency_key}, {'_id': 1}):
+                await _record_deduction(user_id, cost, description, category, details, idempotency_key, None)
+            return user.get('credits_remaining', 0)
         raise HTTPException(status_code=402, detail='Недостаточно баллов для операции. Пополните баланс.')
-    
-    # Списываем баллы
-    await db.users.update_one({'id': user_id}, {'$inc': {'credits_remaining': -cost}})
-    
-    # Записываем транзакцию
-    await record_credit_transaction(user_id, -cost, description, category, details)
+
+    balance = user.get('credits_remaining', 0)
+    await _record_deduction(user_id, cost, description, category, details, idempotency_key, balance)
+    return balance
+
+async def refund_credits(user_id: str, amount: int, description: str, details: dict = None,
+                         idempotency_key: str = None) -> bool:
+    """
+    Вернуть баллы и записать транзакцию возврата. С ключом идемпотентности повторный
+    возврат не начисляет баллы второй раз. Возвращает True, если баллы начислены.
+    """
+    query = {'id': user_id}
+    update = {'$inc': {'credits_remaining': amount}}
+    if idempotency_key:
+        query['credit_idempotency_keys'] = {'$ne': idempotency_key}
+        update['$push'] = {'credit_idempotency_keys': {'$each': [idempotency_key], '$slice': -CREDIT_IDEMPOTENCY_KEYS_LIMIT}}
+    user = await db.users.find_one_and_update(
+        query, update,
+        projection={'_id': 0, 'credits_remaining': 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if user is None:
+        return False
+    try:
+        await record_credit_transaction(user_id, amount, description, 'refund', details,
+                                        idempotency_key=idempotency_key, balance_after=user.get('credits_remaining', 0))
+    except DuplicateKeyError:
+        pass
+    return True
+
+# Возвраты, запущенные отдельной задачей (переживают отмену потоковой отдачи); ссылки держим до завершения
+background_refunds = set()
+
+async def _record_deduction(user_id: str, cost: int, description: str, category: str, details: dict,
+                            idempotency_key: Optional[str], balance_after: Optional[int]):
+    try:
+        await record_credit_transaction(user_id, -cost, description, category, details,
+                                        idempotency_key=idempotency_key, balance_after=balance_after)
+    except DuplicateKeyError:
+        # Параллельный повтор с тем же ключом уже записал транзакцию
+        pass
 
 async def get_learning_points_config() -> dict:
     """Получить конфигурацию начисления баллов за обучение"""
@@ -321,14 +477,12 @@ async def award_credits_for_learning(user_id: str, amount: int, description: str
     if amount <= 0:
         return  # Не начисляем нулевые или отрицательные баллы
     
-    user = await db.users.find_one({'id': user_id})
-    if not user:
+    # Начисляем кредиты (одно обновление вместо find_one + update_one)
+    result = await db.users.update_one({'id': user_id}, {'$inc': {'credits_remaining': amount}})
+    if not result.matched_count:
         logger.warning(f"Попытка начислить кредиты несуществующему пользователю: {user_id}")
         return
     
-    # Начисляем кредиты
-    await db.users.update_one({'id': user_id}, {'$inc': {'credits_remaining': amount}})
-    
     # Записываем транзакцию
     await record_credit_transaction(user_id, amount, description, category, details)
     
@@ -352,6 +506,7 @@ async def get_credit_costs():
             'name_numerology': config.get('name_numerology', CREDIT_COSTS.get('name_numerology', 1)),
             'address_numerology': config.get('address_numerology', CREDIT_COSTS.get('address_numerology', 1)),
             'car_numerology': config.get('car_numerology', CREDIT_COSTS.get('car_numerology', 1)),
+            'numerology_batch_row': config.get('numerology_batch_row', CREDIT_COSTS.get('numerology_batch_row', 1)),
             
             # Ведическое время
             'vedic_daily': config.get('vedic_daily', CREDIT_COSTS.get('vedic_daily', 1)),
@@ -379,84 +534,64 @@ async def get_credit_costs():
         return CREDIT_COSTS
 
 @api_router.get('/user/credit-history')
-async def get_credit_history(limit: int = 50, offset: int = 0, current_user: dict = Depends(get_current_user)):
-    """Получить историю транзакций баллов пользователя"""
+async def get_credit_history(limit: int = Query(50, ge=1, le=200), offset: int = 0, cursor: Optional[str] = None,
+                             current_user: dict = Depends(get_current_user)):
+    """
+    Получить историю транзакций баллов пользователя.
+    Следующая страница — по cursor (next_cursor из предыдущего ответа).
+    offset — устаревший путь для старых клиентов (skip, медленнее на дальних страницах;
+    next_cursor в ответе не возвращается).
+    """
     user_id = current_user['user_id']
+    await credit_ledger.flush_for_user(user_id)
     
-    # Получаем транзакции с пагинацией
-    transactions = await db.credit_transactions.find(
-        {'user_id': user_id}
-    ).sort('created_at', -1).skip(offset).limit(limit).to_list(limit)
-    
-    # Очищаем от MongoDB _id
-    result = []
-    for transaction in transactions:
-        transaction_dict = dict(transaction)
-        transaction_dict.pop('_id', None)
-        result.append(transaction_dict)
+    # Получаем транзакции с пагинацией (индекс user_id, created_at, id); offset — только для старых клиентов
+    if cursor or not offset:
+        result, next_cursor = await fetch_keyset_page(db.credit_transactions, {'user_id': user_id}, cursor, limit, {'_id': 0})
+    else:
+        result = await db.credit_transactions.find(
+            {'user_id': user_id}, {'_id': 0}
+        ).sort(KEYSET_SORT).skip(offset).limit(limit).to_list(limit)
+        next_cursor = None
+    
+    # Общее количество — из счётчиков credit_aggregates, если они построены
+    aggregate = await db.credit_aggregates.find_one({'_id': user_id}, {'transaction_count': 1, 'backfilled': 1})
+    if aggregate and aggregate.get('backfilled'):
+        total = aggregate.get('transaction_count', 0)
+    else:
+        total = await db.credit_transactions.count_documents({'user_id': user_id})
     
     return {
         'transactions': result,
-        'total': await db.credit_transactions.count_documents({'user_id': user_id})
+        'total': total,
+        'next_cursor': next_cursor
     }
 
 @api_router.get('/user/points-breakdown')
 async def get_points_breakdown(current_user: dict = Depends(get_current_user)):
     """Получить разбивку баллов по категориям"""
     user_id = current_user['user_id']
+    await credit_ledger.flush_for_user(user_id)
     
-    # Получаем все транзакции пользователя
-    transactions = await db.credit_transactions.find(
-        {'user_id': user_id, 'transaction_type': 'credit'}
-    ).to_list(length=None)
-    
-    # Инициализируем счетчики
-    earned_points = 0  # Заработанные баллы (обучение, активность)
-    purchased_points = 0  # Купленные баллы (подписка, покупка)
-    admin_points = 0  # Баллы, добавленные администратором
-    exercise_review_points = 0  # Баллы за проверку упражнений
-    
-    # Категории для заработанных баллов
-    earned_categories = ['learning', 'exercise', 'quiz', 'challenge', 'lesson']
-    
-    # Категории для купленных баллов
-    purchased_categories = ['purchase', 'subscription']
-    
-    # Обрабатываем транзакции
-    for transaction in transactions:
-        amount = transaction.get('amount', 0)
-        category = transaction.get('category', '')
-        details = transaction.get('details', {})
-        
-        if category in earned_categories:
-            # Проверяем, не является ли это проверкой упражнения
-            if category == 'exercise' and (details.get('reviewed_by') or details.get('admin_review')):
-                exercise_review_points += amount
-            else:
-                earned_points += amount
-        elif category in purchased_categories:
-            purchased_points += amount
-        elif category == 'admin' or details.get('added_by_admin'):
-            admin_points += amount
-        elif category == 'exercise_review' or details.get('exercise_review'):
-            exercise_review_points += amount
-        elif category == 'report':
-            # Отчёты считаются заработанными (пользователь потратил баллы на получение отчёта)
-            # Но это списание, поэтому не добавляем в earned_points
-            # Можно добавить отдельную категорию для отчётов, если нужно
-            pass
+    # Счётчики поддерживаются при записи каждой транзакции (credit_aggregates.py);
+    # для пользователя без счётчиков они один раз строятся по истории
+    aggregate = await db.credit_aggregates.find_one({'_id': user_id}, {'breakdown': 1, 'backfilled': 1})
+    if not aggregate or not aggregate.get('backfilled'):
+        aggregate = await rebuild_user_aggregate(db, user_id)
+    breakdown = {field: 0 for field in BREAKDOWN_FIELDS}
+    breakdown.update(aggregate.get('breakdown') or {})
     
     # Получаем текущий баланс
-    user = await db.users.find_one({'id': user_id})
+    user = await db.users.find_one({'id': user_id}, {'credits_remaining': 1})
     total_balance = user.get('credits_remaining', 0) if user else 0
     
     return {
-        'earned_points': earned_points,
-        'purchased_points': purchased_points,
-        'admin_points': admin_points,
-        'exercise_review_points': exercise_review_points,
+        'earned_points': breakdown['earned_points'],
+        'purchased_points': breakdown['purchased_points'],
+        'admin_points': breakdown['admin_points'],
+        'exercise_review_points': breakdown['exercise_review_points'],
         'total_balance': total_balance,
-        'total_earned': earned_points + exercise_review_points  # Все заработанные включая проверку
+        'total_earned': breakdown['earned_points'] + breakdown['exercise_review_points']  # Все заработанные включая проверку
     }
 
 # ----------------- AUTH -----------------
@@ -493,15 +628,8 @@ async def register(user_data: UserCreate, request: Request):
     await db.users.insert_one(user.dict())
 
     # Записываем начисление бонусных кредитов при регистрации
-    credit_transaction = CreditTransaction(
-        user_id=user.id,
-        transaction_type='credit',
-        amount=100,
-        description='Приветственный бонус при регистрации',
-        category='purchase',
-        details={'reason': 'registration_bonus'}
-    )
-    await db.credit_transactions.insert_one(credit_transaction.dict())
+    await record_credit_transaction(user.id, 100, 'Приветственный бонус при регистрации', 'purchase',
+                                    {'reason': 'registration_bonus'})
 
     # Вычисляем роль из флагов (для новых пользователей всегда 'user')
     role = 'admin' if (user.is_super_admin or user.is_admin) else 'user'
@@ -972,6 +1100,126 @@ async def name_numerology(name_data: dict, current_user: dict = Depends(get_curr
     
     return results
 
+@api_router.post('/numerology/batch')
+async def numerology_batch(request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Пакетный расчёт: CSV или JSON-массив {birth_date, full_name} -> поток NDJSON.
+    Баллы списываются один раз за все корректные строки (за строки с ошибкой расчёта
+    возвращаются в конце), результаты сохраняются insert_many.
+    """
+    import asyncio
+    import json
+    from numerology_batch import (
+        BATCH_CHUNK_SIZE, BatchFormatError, calculate_batch_chunk, parse_batch_rows, split_valid_rows
+    )
+    user_id = current_user['user_id']
+
+    content_type = request.headers.get('content-type', '')
+    filename = ''
+    if content_type.startswith('multipart/form-data'):
+        form = await request.form()
+        upload = form.get('file')
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail='Файл не передан (поле file)')
+        filename = upload.filename or ''
+        content_type = upload.content_type or ''
+        content = await upload.read()
+    else:
+        content = await request.body()
+
+    try:
+        rows = parse_batch_rows(content, content_type, filename)
+    except BatchFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    valid_rows, invalid_rows = split_valid_rows(rows)
+    if not valid_rows:
+        raise HTTPException(status_code=400, detail='В пакете нет строк с корректной датой рождения')
+
+    # Получаем стоимость из конфигурации (за одну строку пакета)
+    config = await get_credits_deduction_config()
+    row_cost = config.get('numerology_batch_row', CREDIT_COSTS.get('numerology_batch_row', 1))
+    total_cost = row_cost * len(valid_rows)
+    batch_id = str(uuid.uuid4())
+
+    # Одно списание на весь пакет
+    await deduct_credits(
+        user_id,
+        total_cost,
+        f'Пакетный расчёт нумерологии ({len(valid_rows)} записей)',
+        'numerology',
+        {'calculation_type': 'numerology_batch', 'batch_id': batch_id,
+         'rows': len(valid_rows), 'rejected_rows': len(invalid_rows)}
+    )
+
+    def ndjson(item: dict) -> bytes:
+        return (json.dumps(item, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+
+    async def refund_unsaved_rows(unsaved: int, failed: int) -> int:
+        """Вернуть баллы за оплаченные, но не рассчитанные или не сохранённые строки"""
+        refund = row_cost * unsaved
+        try:
+            await refund_credits(
+                user_id,
+                refund,
+                f'Возврат за пакетный расчёт нумерологии ({unsaved} записей не рассчитано)',
+                {'calculation_type': 'numerology_batch', 'batch_id': batch_id,
+                 'failed_rows': failed, 'unsaved_rows': unsaved},
+                idempotency_key=f'numerology_batch:{batch_id}:refund'
+            )
+            return refund
+        except Exception as e:
+            logger.error(f"Error refunding numerology batch {batch_id}: {e}")
+            return 0
+
+    async def stream_results():
+        loop = asyncio.get_running_loop()
+        computed = failed = saved = 0
+        refund_task = None
+        try:
+            for error in invalid_rows:
+                yield ndjson(error)
+            for start in range(0, len(valid_rows), BATCH_CHUNK_SIZE):
+                chunk = valid_rows[start:start + BATCH_CHUNK_SIZE]
+                # Расчёт порции в пуле потоков, чтобы не блокировать event loop
+                results = await loop.run_in_executor(None, calculate_batch_chunk, chunk)
+                docs = []
+                for result in results:
+                    yield ndjson(result)
+                    if 'error' in result:
+                        failed += 1
+                        continue
+                    computed += 1
+                    docs.append(NumerologyCalculation(
+                        user_id=user_id,
+                        birth_date=result['birth_date'],
+                        calculation_type='batch',
+                        results={**result, 'batch_id': batch_id}
+                    ).dict())
+                if docs:
+                    try:
+                        await db.numerology_calculations.insert_many(docs, ordered=False)
+                    except BulkWriteError as e:
+                        saved += e.details.get('nInserted', 0)
+                        raise
+                    saved += len(docs)
+        finally:
+            # Все строки оплачены заранее: за ошибки расчёта, несохранённые и не дошедшие до
+            # расчёта строки (обрыв соединения, ошибка записи) баллы возвращаются. Отменённый
+            # генератор ждать уже не может, поэтому возврат — отдельной задачей.
+            unsaved = len(valid_rows) - saved
+            if unsaved:
+                refund_task = loop.create_task(refund_unsaved_rows(unsaved, failed))
+                background_refunds.add(refund_task)
+                refund_task.add_done_callback(background_refunds.discard)
+        credits_charged = total_cost
+        if refund_task is not None:
+            credits_charged -= await refund_task
+        yield ndjson({'summary': True, 'batch_id': batch_id, 'total': len(rows), 'computed': computed,
+                      'failed': failed + len(invalid_rows), 'credits_charged': credits_charged})
+
+    return StreamingResponse(stream_results(), media_type='application/x-ndjson',
+                             headers={'X-Batch-Id': batch_id})
+
 @api_router.post('/numerology/group-compatibility')
 async def group_compatibility_numerology(group_data: GroupCompatibilityRequest, current_user: dict = Depends(get_current_user)):
     """Групповая совместимость (5 человек) - 5 баллов"""
@@ -1125,20 +1373,28 @@ async def get_saved_calculations(
     if calculation_type:
         query['calculation_type'] = calculation_type
     
-    # Получаем последние расчёты каждого типа
-    calculations = await db.numerology_calculations.find(query).sort('created_at', -1).to_list(length=100)
+    # Последний расчёт каждого типа: $sort + $group $first по индексу
+    # (user_id, calculation_type, created_at: -1), без выгрузки истории в Python
+    latest = await db.numerology_calculations.aggregate([
+        {'$match': query},
+        {'$sort': {'user_id': 1, 'calculation_type': 1, 'created_at': -1}},
+        {'$group': {
+            '_id': '$calculation_type',
+            'id': {'$first': '$id'},
+            'results': {'$first': '$results'},
+            'created_at': {'$first': '$created_at'}
+        }}
+    ]).to_list(length=None)
     
-    # Группируем по типу и берём последний для каждого типа
     grouped = {}
-    for calc in calculations:
-        calc_type = calc.get('calculation_type')
-        if calc_type not in grouped:
-            grouped[calc_type] = {
-                'id': calc.get('id'),
-                'calculation_type': calc_type,
-                'results': calc.get('results', {}),
-                'created_at': calc.get('created_at').isoformat() if calc.get('created_at') else None
-            }
+    for calc in sorted(latest, key=lambda c: c.get('created_at') or datetime.min, reverse=True):
+        calc_type = calc['_id']
+        grouped[calc_type] = {
+            'id': calc.get('id'),
+            'calculation_type': calc_type,
+            'results': calc.get('results') or {},
+            'created_at': calc.get('created_at').isoformat() if calc.get('created_at') else None
+        }
     
     return grouped
 
@@ -1208,6 +1464,8 @@ async def vedic_daily_schedule(vedic_request: VedicTimeRequest = Depends(), curr
         # Используем UTC время с timezone для корректной конвертации в локальное время города
         date_obj = datetime.now(pytz.UTC)
 
+    # Координаты города — без блокировки event loop (геокодер выполняется в пуле потоков)
+    await resolve_city_coordinates(city)
     schedule = get_vedic_day_schedule(city=city, date=date_obj)
     if 'error' in schedule:
         # Возвращаем балл при ошибке
@@ -1222,112 +1480,28 @@ async def vedic_daily_schedule(vedic_request: VedicTimeRequest = Depends(), curr
         user_dict = await db.users.find_one({'id': user_id})
         if user_dict and user_dict.get('birth_date'):
             user = User(**user_dict)
-            
-            # Prepare user data for enhanced calculation
-            user_numbers = None
-            pythagorean_square_data = None
-            fractal_behavior = None
-            problem_numbers = None
-            name_numbers = None
-            weekday_energy = None
-            janma_ank_value = None
+            profile = await get_numerology_profile(db, user_dict)
             
             try:
-                day, month, year = parse_birth_date(user.birth_date)
-                
-                # Get personal numbers
-                personal_numbers = calculate_personal_numbers(user.birth_date)
-                user_numbers = {
-                    'soul_number': personal_numbers.get('soul_number'),
-                    'mind_number': personal_numbers.get('mind_number'),
-                    'destiny_number': personal_numbers.get('destiny_number'),
-                    'wisdom_number': personal_numbers.get('wisdom_number'),
-                    'ruling_number': personal_numbers.get('ruling_number'),
-                    'personal_day': personal_numbers.get('personal_day')
-                }
-                
-                # Calculate Pythagorean Square
-                pythagorean_square_data = create_pythagorean_square(day, month, year)
-                
-                # Calculate Janma Ank
-                from vedic_numerology import calculate_janma_ank, calculate_bhagya_ank, calculate_enhanced_daily_planetary_energy
-                janma_ank_value = calculate_janma_ank(day, month, year)
-                total_before_reduction = day + month + year
-                if total_before_reduction == 22:
-                    janma_ank_value = 22
-                
-                destiny_number = calculate_bhagya_ank(day, month, year)
-                
-                # Calculate fractal behavior
-                day_reduced = reduce_to_single_digit(day)
-                month_reduced = reduce_to_single_digit(month)
-                year_reduced = reduce_to_single_digit(year)
-                year_sum = reduce_to_single_digit(day + month + year)
-                fractal_behavior = [day_reduced, month_reduced, year_reduced, year_sum]
-                
-                # Calculate problem numbers
-                soul_num = user_numbers.get('soul_number', 1)
-                mind_num = user_numbers.get('mind_number', 1)
-                destiny_num = user_numbers.get('destiny_number', 1)
-                problem1 = reduce_to_single_digit(abs(soul_num - mind_num))
-                problem2 = reduce_to_single_digit(abs(soul_num - year_reduced))
-                problem3 = reduce_to_single_digit(abs(problem1 - problem2))
-                problem4 = reduce_to_single_digit(abs(mind_num - year_reduced))
-                problem_numbers = [problem1, problem2, problem3, problem4]
-                
-                # Get name numbers if available
-                if hasattr(user, 'full_name') and user.full_name:
-                    from numerology import calculate_name_numerology
-                    try:
-                        name_data = calculate_name_numerology(user.full_name)
-                        name_numbers = {
-                            'first_name_number': name_data.get('first_name_number'),
-                            'last_name_number': name_data.get('last_name_number'),
-                            'total_name_number': name_data.get('total_name_number'),
-                            'full_name_number': name_data.get('total_name_number')
-                        }
-                    except:
-                        pass
-                
-                # Calculate weekday energy
-                try:
-                    from numerology import calculate_planetary_strength
-                    planetary_strength_data = calculate_planetary_strength(day, month, year)
-                    strength_dict = planetary_strength_data.get('strength', {})
-                    planet_name_to_key = {
-                        'Солнце': 'surya', 'Луна': 'chandra', 'Марс': 'mangal',
-                        'Меркурий': 'budha', 'Юпитер': 'guru', 'Венера': 'shukra', 'Сатурн': 'shani'
-                    }
-                    weekday_energy = {}
-                    for planet_name, energy_value in strength_dict.items():
-                        planet_key = planet_name_to_key.get(planet_name)
-                        if planet_key:
-                            weekday_energy[planet_key] = float(energy_value)
-                except:
-                    pass
-                
-                # Get modifiers config
-                modifiers_config = await get_planetary_energy_modifiers_config()
-                
-                # Calculate planetary energy for the day
-                planetary_energies = calculate_enhanced_daily_planetary_energy(
-                    destiny_number=destiny_number,
-                    date=date_obj,
-                    birth_date=user.birth_date,
-                    user_numbers=user_numbers,
-                    pythagorean_square=pythagorean_square_data,
-                    fractal_behavior=fractal_behavior,
-                    problem_numbers=problem_numbers,
-                    name_numbers=name_numbers,
-                    weekday_energy=weekday_energy,
-                    janma_ank=janma_ank_value,
-                    city=city,
-                    modifiers_config=modifiers_config
-                )
-                
-                # Add planetary energies to schedule
-                schedule['planetary_energies'] = planetary_energies
-                schedule['total_energy'] = sum(planetary_energies.values())
+                if profile.get('bhagya_ank') is not None:
+                    from vedic_numerology import calculate_enhanced_daily_planetary_energy
+                    
+                    # Get modifiers config
+                    modifiers_config = await get_planetary_energy_modifiers_config()
+                    
+                    # Calculate planetary energy for the day
+                    planetary_energies = calculate_enhanced_daily_planetary_energy(
+                        destiny_number=profile['bhagya_ank'],
+                        date=date_obj,
+                        birth_date=user.birth_date,
+                        city=city,
+                        modifiers_config=modifiers_config,
+                        **energy_calculation_kwargs(profile)
+                    )
+                    
+                    # Add planetary energies to schedule
+                    schedule['planetary_energies'] = planetary_energies
+                    schedule['total_energy'] = sum(planetary_energies.values())
                 
             except Exception as e:
                 print(f"Error calculating planetary energy for daily schedule: {e}")
@@ -1349,9 +1523,10 @@ async def get_scoring_config_cached():
     
     return config
 
-async def get_user_numerology_data(user_id: str) -> Dict[str, Any]:
-    """Получить нумерологические данные пользователя"""
-    user = await db.users.find_one({'id': user_id})
+async def get_user_numerology_data(user_id: str, user: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Получить нумерологические данные пользователя (из снимка numerology_profile)"""
+    if user is None:
+        user = await db.users.find_one({'id': user_id})
     if not user:
         return {}
     
@@ -1359,9 +1534,12 @@ async def get_user_numerology_data(user_id: str) -> Dict[str, Any]:
     if not birth_date:
         return {}
     
-    # Вычисляем персональные числа
+    # Персональные числа из снимка профиля
     try:
-        numbers = calculate_personal_numbers(birth_date)
+        profile = await get_numerology_profile(db, user)
+        numbers = profile.get('personal_numbers')
+        if not numbers:
+            return {}
         return {
             'soul_number': numbers.get('soul_number', 0),
             'destiny_number': numbers.get('destiny_number', 0),
@@ -2385,6 +2563,8 @@ async def planetary_route(vedic_request: VedicTimeRequest = Depends(), current_u
     if not city:
         raise HTTPException(status_code=422, detail="Город не указан. Укажите город в запросе или обновите профиль пользователя.")
         
+    # Координаты города — без блокировки event loop (геокодер выполняется в пуле потоков)
+    await resolve_city_coordinates(city)
     schedule = get_vedic_day_schedule(city=city, date=date_obj)
     if 'error' in schedule:
         # Возвращаем балл при ошибке
@@ -2395,7 +2575,7 @@ async def planetary_route(vedic_request: VedicTimeRequest = Depends(), current_u
         raise HTTPException(status_code=400, detail=schedule['error'])
         
     # Получаем нумерологические данные пользователя
-    user_data = await get_user_numerology_data(user_id)
+    user_data = await get_user_numerology_data(user_id, user_dict)
     
     # Анализируем день с учётом личных чисел
     day_analysis = analyze_day_compatibility(date_obj, user_data, schedule)
@@ -2417,107 +2597,23 @@ async def planetary_route(vedic_request: VedicTimeRequest = Depends(), current_u
     planetary_energies = {}
     total_energy = 0
     try:
-        # Prepare user data for enhanced calculation
-        user_numbers = None
-        pythagorean_square_data = None
-        fractal_behavior = None
-        problem_numbers = None
-        name_numbers = None
-        weekday_energy = None
-        janma_ank_value = None
+        profile = await get_numerology_profile(db, user_dict)
         
-        if user.birth_date:
+        if user.birth_date and profile.get('bhagya_ank') is not None:
             try:
-                day, month, year = parse_birth_date(user.birth_date)
-                
-                # Get personal numbers
-                personal_numbers = calculate_personal_numbers(user.birth_date)
-                user_numbers = {
-                    'soul_number': personal_numbers.get('soul_number'),
-                    'mind_number': personal_numbers.get('mind_number'),
-                    'destiny_number': personal_numbers.get('destiny_number'),
-                    'wisdom_number': personal_numbers.get('wisdom_number'),
-                    'ruling_number': personal_numbers.get('ruling_number'),
-                    'personal_day': personal_numbers.get('personal_day')
-                }
-                
-                # Calculate Pythagorean Square
-                pythagorean_square_data = create_pythagorean_square(day, month, year)
-                
-                # Calculate Janma Ank
-                from vedic_numerology import calculate_janma_ank, calculate_bhagya_ank, calculate_enhanced_daily_planetary_energy
-                janma_ank_value = calculate_janma_ank(day, month, year)
-                total_before_reduction = day + month + year
-                if total_before_reduction == 22:
-                    janma_ank_value = 22
-                
-                destiny_number = calculate_bhagya_ank(day, month, year)
-                
-                # Calculate fractal behavior
-                day_reduced = reduce_to_single_digit(day)
-                month_reduced = reduce_to_single_digit(month)
-                year_reduced = reduce_to_single_digit(year)
-                year_sum = reduce_to_single_digit(day + month + year)
-                fractal_behavior = [day_reduced, month_reduced, year_reduced, year_sum]
-                
-                # Calculate problem numbers
-                soul_num = user_numbers.get('soul_number', 1)
-                mind_num = user_numbers.get('mind_number', 1)
-                destiny_num = user_numbers.get('destiny_number', 1)
-                problem1 = reduce_to_single_digit(abs(soul_num - mind_num))
-                problem2 = reduce_to_single_digit(abs(soul_num - year_reduced))
-                problem3 = reduce_to_single_digit(abs(problem1 - problem2))
-                problem4 = reduce_to_single_digit(abs(mind_num - year_reduced))
-                problem_numbers = [problem1, problem2, problem3, problem4]
-                
-                # Get name numbers if available
-                if hasattr(user, 'full_name') and user.full_name:
-                    from numerology import calculate_name_numerology
-                    try:
-                        name_data = calculate_name_numerology(user.full_name)
-                        name_numbers = {
-                            'first_name_number': name_data.get('first_name_number'),
-                            'last_name_number': name_data.get('last_name_number'),
-                            'total_name_number': name_data.get('total_name_number'),
-                            'full_name_number': name_data.get('total_name_number')
-                        }
-                    except:
-                        pass
-                
-                # Calculate weekday energy
-                try:
-                    from numerology import calculate_planetary_strength
-                    planetary_strength_data = calculate_planetary_strength(day, month, year)
-                    strength_dict = planetary_strength_data.get('strength', {})
-                    planet_name_to_key = {
-                        'Солнце': 'surya', 'Луна': 'chandra', 'Марс': 'mangal',
-                        'Меркурий': 'budha', 'Юпитер': 'guru', 'Венера': 'shukra', 'Сатурн': 'shani'
-                    }
-                    weekday_energy = {}
-                    for planet_name, energy_value in strength_dict.items():
-                        planet_key = planet_name_to_key.get(planet_name)
-                        if planet_key:
-                            weekday_energy[planet_key] = float(energy_value)
-                except:
-                    pass
+                from vedic_numerology import calculate_enhanced_daily_planetary_energy
                 
                 # Get modifiers config
                 modifiers_config = await get_planetary_energy_modifiers_config()
                 
                 # Calculate planetary energy for the day
                 planetary_energies = calculate_enhanced_daily_planetary_energy(
-                    destiny_number=destiny_number,
+                    destiny_number=profile['bhagya_ank'],
                     date=date_obj,
                     birth_date=user.birth_date,
-                    user_numbers=user_numbers,
-                    pythagorean_square=pythagorean_square_data,
-                    fractal_behavior=fractal_behavior,
-                    problem_numbers=problem_numbers,
-                    name_numbers=name_numbers,
-                    weekday_energy=weekday_energy,
-                    janma_ank=janma_ank_value,
                     city=city,
-                    modifiers_config=modifiers_config
+                    modifiers_config=modifiers_config,
+                    **energy_calculation_kwargs(profile)
                 )
                 
                 total_energy = sum(planetary_energies.values())
@@ -2622,119 +2718,25 @@ async def weekly_planetary_route(vedic_request: VedicTimeRequest = Depends(), cu
         # Импортируем функцию
         from vedic_time_calculations import get_weekly_planetary_route
         
-        # Prepare user data for enhanced calculation
-        user_numbers = None
-        pythagorean_square_data = None
-        fractal_behavior = None
-        problem_numbers = None
-        name_numbers = None
-        weekday_energy = None
-        janma_ank_value = None
-        
         city = vedic_request.city or user.city
         if not city:
             raise HTTPException(status_code=422, detail="Город не указан. Укажите город в запросе или обновите профиль пользователя.")
         
-        # Initialize variables with default values
-        user_numbers = None
-        pythagorean_square_data = None
-        fractal_behavior = None
-        problem_numbers = None
-        name_numbers = None
-        weekday_energy = None
-        janma_ank_value = None
-        
-        if user.birth_date:
-            try:
-                day, month, year = parse_birth_date(user.birth_date)
-                
-                # Get personal numbers
-                personal_numbers = calculate_personal_numbers(user.birth_date)
-                user_numbers = {
-                    'soul_number': personal_numbers.get('soul_number'),
-                    'mind_number': personal_numbers.get('mind_number'),
-                    'destiny_number': personal_numbers.get('destiny_number'),
-                    'wisdom_number': personal_numbers.get('wisdom_number'),
-                    'ruling_number': personal_numbers.get('ruling_number'),
-                    'personal_day': personal_numbers.get('personal_day')
-                }
-                
-                # Calculate Pythagorean Square
-                pythagorean_square_data = create_pythagorean_square(day, month, year)
-                
-                # Calculate Janma Ank
-                from vedic_numerology import calculate_janma_ank
-                janma_ank_value = calculate_janma_ank(day, month, year)
-                total_before_reduction = day + month + year
-                if total_before_reduction == 22:
-                    janma_ank_value = 22
-                
-                # Calculate fractal behavior
-                day_reduced = reduce_to_single_digit(day)
-                month_reduced = reduce_to_single_digit(month)
-                year_reduced = reduce_to_single_digit(year)
-                year_sum = reduce_to_single_digit(day + month + year)
-                fractal_behavior = [day_reduced, month_reduced, year_reduced, year_sum]
-                
-                # Calculate problem numbers
-                soul_num = user_numbers.get('soul_number', 1)
-                mind_num = user_numbers.get('mind_number', 1)
-                destiny_num = user_numbers.get('destiny_number', 1)
-                problem1 = reduce_to_single_digit(abs(soul_num - mind_num))
-                problem2 = reduce_to_single_digit(abs(soul_num - year_reduced))
-                problem3 = reduce_to_single_digit(abs(problem1 - problem2))
-                problem4 = reduce_to_single_digit(abs(mind_num - year_reduced))
-                problem_numbers = [problem1, problem2, problem3, problem4]
-                
-                # Get name numbers if available
-                if hasattr(user, 'full_name') and user.full_name:
-                    from numerology import calculate_name_numerology
-                    try:
-                        name_data = calculate_name_numerology(user.full_name)
-                        name_numbers = {
-                            'first_name_number': name_data.get('first_name_number'),
-                            'last_name_number': name_data.get('last_name_number'),
-                            'total_name_number': name_data.get('total_name_number'),
-                            'full_name_number': name_data.get('total_name_number')
-                        }
-                    except:
-                        pass
-                
-                # Calculate weekday energy
-                try:
-                    from numerology import calculate_planetary_strength
-                    planetary_strength_data = calculate_planetary_strength(day, month, year)
-                    strength_dict = planetary_strength_data.get('strength', {})
-                    planet_name_to_key = {
-                        'Солнце': 'surya', 'Луна': 'chandra', 'Марс': 'mangal',
-                        'Меркурий': 'budha', 'Юпитер': 'guru', 'Венера': 'shukra', 'Сатурн': 'shani'
-                    }
-                    weekday_energy = {}
-                    for planet_name, energy_value in strength_dict.items():
-                        planet_key = planet_name_to_key.get(planet_name)
-                        if planet_key:
-                            weekday_energy[planet_key] = float(energy_value)
-                except:
-                    pass
-            except Exception as e:
-                print(f"Error preparing enhanced calculation data: {e}")
+        # Производные нумерологические данные из снимка профиля
+        profile = await get_numerology_profile(db, user_dict)
         
         # Get modifiers config
         modifiers_config = await get_planetary_energy_modifiers_config()
         
+        await resolve_city_coordinates(city)
+        
         # Получаем недельный маршрут
         weekly_route = get_weekly_planetary_route(
             city=city,
             start_date=date_obj,
             birth_date=user.birth_date,
-            user_numbers=user_numbers,
-            pythagorean_square=pythagorean_square_data,
-            fractal_behavior=fractal_behavior,
-            problem_numbers=problem_numbers,
-            name_numbers=name_numbers,
-            weekday_energy=weekday_energy,
-            janma_ank=janma_ank_value,
-            modifiers_config=modifiers_config
+            modifiers_config=modifiers_config,
+            **energy_calculation_kwargs(profile)
         )
         
         # Получаем нумерологические данные пользователя
@@ -2764,13 +2766,17 @@ async def weekly_planetary_route(vedic_request: VedicTimeRequest = Depends(), cu
             'car_number': user_dict.get('car_number', '')
         }
         
+        # Полные расписания дней недели для анализа - одним проходом по восходам
+        from vedic_time_calculations import get_vedic_schedule_range
+        week_start = datetime.strptime(weekly_route['start_date'], '%Y-%m-%d')
+        if vedic_request.city:
+            await resolve_city_coordinates(vedic_request.city)
+        week_schedules = {s['date']: s for s in get_vedic_schedule_range(vedic_request.city, week_start, 7)}
+        
         # Анализируем каждый день недели
         for day in weekly_route['daily_schedule']:
             day_date = datetime.strptime(day['date'], '%Y-%m-%d')
-            
-            # Получаем полное расписание дня для анализа
-            from vedic_time_calculations import get_vedic_day_schedule
-            day_schedule = get_vedic_day_schedule(city=vedic_request.city, date=day_date)
+            day_schedule = week_schedules.get(day['date']) or get_vedic_day_schedule(city=vedic_request.city, date=day_date)
             
             # Анализируем совместимость дня
             day_analysis = analyze_day_compatibility(day_date, user_data, day_schedule)
@@ -2878,99 +2884,16 @@ async def monthly_planetary_route(vedic_request: VedicTimeRequest = Depends(), c
         raise HTTPException(status_code=422, detail="Город не указан. Укажите город в запросе или обновите профиль пользователя.")
     
     try:
-        # Prepare user data for enhanced calculation
-        user_numbers = None
-        pythagorean_square_data = None
-        fractal_behavior = None
-        problem_numbers = None
-        name_numbers = None
-        weekday_energy = None
-        janma_ank_value = None
-        
-        if user.birth_date:
-            try:
-                day, month, year = parse_birth_date(user.birth_date)
-                
-                # Get personal numbers
-                personal_numbers = calculate_personal_numbers(user.birth_date)
-                user_numbers = {
-                    'soul_number': personal_numbers.get('soul_number'),
-                    'mind_number': personal_numbers.get('mind_number'),
-                    'destiny_number': personal_numbers.get('destiny_number'),
-                    'wisdom_number': personal_numbers.get('wisdom_number'),
-                    'ruling_number': personal_numbers.get('ruling_number'),
-                    'personal_day': personal_numbers.get('personal_day')
-                }
-                
-                # Calculate Pythagorean Square
-                pythagorean_square_data = create_pythagorean_square(day, month, year)
-                
-                # Calculate Janma Ank
-                from vedic_numerology import calculate_janma_ank
-                janma_ank_value = calculate_janma_ank(day, month, year)
-                total_before_reduction = day + month + year
-                if total_before_reduction == 22:
-                    janma_ank_value = 22
-                
-                # Calculate fractal behavior
-                day_reduced = reduce_to_single_digit(day)
-                month_reduced = reduce_to_single_digit(month)
-                year_reduced = reduce_to_single_digit(year)
-                year_sum = reduce_to_single_digit(day + month + year)
-                fractal_behavior = [day_reduced, month_reduced, year_reduced, year_sum]
-                
-                # Calculate problem numbers
-                soul_num = user_numbers.get('soul_number', 1)
-                mind_num = user_numbers.get('mind_number', 1)
-                destiny_num = user_numbers.get('destiny_number', 1)
-                problem1 = reduce_to_single_digit(abs(soul_num - mind_num))
-                problem2 = reduce_to_single_digit(abs(soul_num - year_reduced))
-                problem3 = reduce_to_single_digit(abs(problem1 - problem2))
-                problem4 = reduce_to_single_digit(abs(mind_num - year_reduced))
-                problem_numbers = [problem1, problem2, problem3, problem4]
-                
-                # Get name numbers if available
-                if hasattr(user, 'full_name') and user.full_name:
-                    from numerology import calculate_name_numerology
-                    try:
-                        name_data = calculate_name_numerology(user.full_name)
-                        name_numbers = {
-                            'first_name_number': name_data.get('first_name_number'),
-                            'last_name_number': name_data.get('last_name_number'),
-                            'total_name_number': name_data.get('total_name_number'),
-                            'full_name_number': name_data.get('total_name_number')
-                        }
-                    except:
-                        pass
-                
-                # Calculate weekday energy
-                try:
-                    from numerology import calculate_planetary_strength
-                    planetary_strength_data = calculate_planetary_strength(day, month, year)
-                    strength_dict = planetary_strength_data.get('strength', {})
-                    planet_name_to_key = {
-                        'Солнце': 'surya', 'Луна': 'chandra', 'Марс': 'mangal',
-                        'Меркурий': 'budha', 'Юпитер': 'guru', 'Венера': 'shukra', 'Сатурн': 'shani'
-                    }
-                    weekday_energy = {}
-                    for planet_name, energy_value in strength_dict.items():
-                        planet_key = planet_name_to_key.get(planet_name)
-                        if planet_key:
-                            weekday_energy[planet_key] = float(energy_value)
-                except:
-                    pass
-            except Exception as e:
-                print(f"Error preparing enhanced calculation data: {e}")
+        # Производные нумерологические данные из снимка профиля
+        profile = await get_numerology_profile(db, user_dict)
         
         # Get modifiers config
         modifiers_config = await get_planetary_energy_modifiers_config()
+        await resolve_city_coordinates(city)
         
         monthly_route = get_monthly_planetary_route(
             city=city, start_date=date_obj, birth_date=user.birth_date,
-            user_numbers=user_numbers, pythagorean_square=pythagorean_square_data,
-            fractal_behavior=fractal_behavior, problem_numbers=problem_numbers,
-            name_numbers=name_numbers, weekday_energy=weekday_energy,
-            janma_ank=janma_ank_value, modifiers_config=modifiers_config
+            modifiers_config=modifiers_config, **energy_calculation_kwargs(profile)
         )
         return monthly_route
     except Exception as e:
@@ -3018,99 +2941,16 @@ async def quarterly_planetary_route(vedic_request: VedicTimeRequest = Depends(),
         raise HTTPException(status_code=422, detail="Город не указан. Укажите город в запросе или обновите профиль пользователя.")
     
     try:
-        # Prepare user data for enhanced calculation (same as monthly)
-        user_numbers = None
-        pythagorean_square_data = None
-        fractal_behavior = None
-        problem_numbers = None
-        name_numbers = None
-        weekday_energy = None
-        janma_ank_value = None
-        
-        if user.birth_date:
-            try:
-                day, month, year = parse_birth_date(user.birth_date)
-                
-                # Get personal numbers
-                personal_numbers = calculate_personal_numbers(user.birth_date)
-                user_numbers = {
-                    'soul_number': personal_numbers.get('soul_number'),
-                    'mind_number': personal_numbers.get('mind_number'),
-                    'destiny_number': personal_numbers.get('destiny_number'),
-                    'wisdom_number': personal_numbers.get('wisdom_number'),
-                    'ruling_number': personal_numbers.get('ruling_number'),
-                    'personal_day': personal_numbers.get('personal_day')
-                }
-                
-                # Calculate Pythagorean Square
-                pythagorean_square_data = create_pythagorean_square(day, month, year)
-                
-                # Calculate Janma Ank
-                from vedic_numerology import calculate_janma_ank
-                janma_ank_value = calculate_janma_ank(day, month, year)
-                total_before_reduction = day + month + year
-                if total_before_reduction == 22:
-                    janma_ank_value = 22
-                
-                # Calculate fractal behavior
-                day_reduced = reduce_to_single_digit(day)
-                month_reduced = reduce_to_single_digit(month)
-                year_reduced = reduce_to_single_digit(year)
-                year_sum = reduce_to_single_digit(day + month + year)
-                fractal_behavior = [day_reduced, month_reduced, year_reduced, year_sum]
-                
-                # Calculate problem numbers
-                soul_num = user_numbers.get('soul_number', 1)
-                mind_num = user_numbers.get('mind_number', 1)
-                destiny_num = user_numbers.get('destiny_number', 1)
-                problem1 = reduce_to_single_digit(abs(soul_num - mind_num))
-                problem2 = reduce_to_single_digit(abs(soul_num - year_reduced))
-                problem3 = reduce_to_single_digit(abs(problem1 - problem2))
-                problem4 = reduce_to_single_digit(abs(mind_num - year_reduced))
-                problem_numbers = [problem1, problem2, problem3, problem4]
-                
-                # Get name numbers if available
-                if hasattr(user, 'full_name') and user.full_name:
-                    from numerology import calculate_name_numerology
-                    try:
-                        name_data = calculate_name_numerology(user.full_name)
-                        name_numbers = {
-                            'first_name_number': name_data.get('first_name_number'),
-                            'last_name_number': name_data.get('last_name_number'),
-                            'total_name_number': name_data.get('total_name_number'),
-                            'full_name_number': name_data.get('total_name_number')
-                        }
-                    except:
-                        pass
-                
-                # Calculate weekday energy
-                try:
-                    from numerology import calculate_planetary_strength
-                    planetary_strength_data = calculate_planetary_strength(day, month, year)
-                    strength_dict = planetary_strength_data.get('strength', {})
-                    planet_name_to_key = {
-                        'Солнце': 'surya', 'Луна': 'chandra', 'Марс': 'mangal',
-                        'Меркурий': 'budha', 'Юпитер': 'guru', 'Венера': 'shukra', 'Сатурн': 'shani'
-                    }
-                    weekday_energy = {}
-                    for planet_name, energy_value in strength_dict.items():
-                        planet_key = planet_name_to_key.get(planet_name)
-                        if planet_key:
-                            weekday_energy[planet_key] = float(energy_value)
-                except:
-                    pass
-            except Exception as e:
-                print(f"Error preparing enhanced calculation data: {e}")
+        # Производные нумерологические данные из снимка профиля
+        profile = await get_numerology_profile(db, user_dict)
         
         # Get modifiers config
         modifiers_config = await get_planetary_energy_modifiers_config()
+        await resolve_city_coordinates(city)
         
         quarterly_route = get_quarterly_planetary_route(
             city=city, start_date=date_obj, birth_date=user.birth_date,
-            user_numbers=user_numbers, pythagorean_square=pythagorean_square_data,
-            fractal_behavior=fractal_behavior, problem_numbers=problem_numbers,
-            name_numbers=name_numbers, weekday_energy=weekday_energy,
-            janma_ank=janma_ank_value, modifiers_config=modifiers_config
+            modifiers_config=modifiers_config, **energy_calculation_kwargs(profile)
         )
         return quarterly_route
     except Exception as e:
@@ -3337,118 +3177,11 @@ async def get_planetary_energy(days: int = 7, current_user: dict = Depends(get_c
     )
     
     try:
-        # Get user's personal numbers for enhanced calculation
-        user_numbers = None
-        pythagorean_square_data = None
-        fractal_behavior = None
-        problem_numbers = None
-        name_numbers = None
-        weekday_energy = None
-        
-        if user.birth_date:
-            try:
-                day, month, year = parse_birth_date(user.birth_date)
-                
-                # Get personal numbers
-                personal_numbers = calculate_personal_numbers(user.birth_date)
-                user_numbers = {
-                    'soul_number': personal_numbers.get('soul_number'),
-                    'mind_number': personal_numbers.get('mind_number'),
-                    'destiny_number': personal_numbers.get('destiny_number'),
-                    'wisdom_number': personal_numbers.get('wisdom_number'),
-                    'ruling_number': personal_numbers.get('ruling_number'),
-                    'personal_day': personal_numbers.get('personal_day')
-                }
-                
-                # Calculate Pythagorean Square
-                pythagorean_square_data = create_pythagorean_square(day, month, year)
-                
-                # Calculate Janma Ank (Life Path/Birth Number) - can be master number 22
-                from vedic_numerology import calculate_janma_ank
-                janma_ank_value = calculate_janma_ank(day, month, year)
-                # Note: calculate_janma_ank uses reduce_to_single_digit which preserves 11, 22, 33
-                # But we need to check if the sum before reduction was 22
-                total_before_reduction = day + month + year
-                if total_before_reduction == 22 or (total_before_reduction > 9 and reduce_to_single_digit(total_before_reduction) == 4 and total_before_reduction % 11 == 0):
-                    # Check if it's actually 22 (master number)
-                    if total_before_reduction == 22:
-                        janma_ank_value = 22
-                
-                # Calculate fractal behavior (4 numbers: day, month, year reduced, sum)
-                day_reduced = reduce_to_single_digit(day)
-                month_reduced = reduce_to_single_digit(month)
-                year_reduced = reduce_to_single_digit(year)
-                year_sum = reduce_to_single_digit(day + month + year)
-                fractal_behavior = [day_reduced, month_reduced, year_reduced, year_sum]
-                
-                # Calculate problem numbers (simplified - can be enhanced)
-                # Problem numbers are calculated from personal numbers
-                soul_num = user_numbers.get('soul_number', 1)
-                mind_num = user_numbers.get('mind_number', 1)
-                destiny_num = user_numbers.get('destiny_number', 1)
-                year_num = year_reduced
-                
-                # Problem numbers calculation (simplified)
-                problem1 = reduce_to_single_digit(abs(soul_num - mind_num))
-                problem2 = reduce_to_single_digit(abs(soul_num - year_num))
-                problem3 = reduce_to_single_digit(abs(problem1 - problem2))
-                problem4 = reduce_to_single_digit(abs(mind_num - year_num))
-                problem_numbers = [problem1, problem2, problem3, problem4]
-                
-                # Get name numbers if available
-                if hasattr(user, 'full_name') and user.full_name:
-                    # Calculate name numbers (name and surname separately)
-                    from numerology import calculate_name_numerology
-                    try:
-                        name_data = calculate_name_numerology(user.full_name)
-                        name_numbers = {
-                            'first_name_number': name_data.get('first_name_number'),
-                            'last_name_number': name_data.get('last_name_number'),
-                            'total_name_number': name_data.get('total_name_number'),
-                            'full_name_number': name_data.get('total_name_number')  # Alias
-                        }
-                    except:
-                        # Fallback to simple calculation
-                        try:
-                            from numerology import calculate_full_name_number
-                            name_num = calculate_full_name_number(user.full_name)
-                            name_numbers = {'name_number': name_num, 'full_name_number': name_num}
-                        except:
-                            pass
-                
-                # Calculate weekday energy (personal energy by day of week)
-                # This uses calculate_planetary_strength which calculates DDMM × YYYY
-                try:
-                    from numerology import calculate_planetary_strength
-                    planetary_strength_data = calculate_planetary_strength(day, month, year)
-                    strength_dict = planetary_strength_data.get('strength', {})
-                    weekday_map = planetary_strength_data.get('weekday_map', {})
-                    
-                    # Map planet names to energy keys
-                    planet_name_to_key = {
-                        'Солнце': 'surya',
-                        'Луна': 'chandra',
-                        'Марс': 'mangal',
-                        'Меркурий': 'budha',
-                        'Юпитер': 'guru',
-                        'Венера': 'shukra',
-                        'Сатурн': 'shani'
-                    }
-                    
-                    weekday_energy = {}
-                    for planet_name, energy_value in strength_dict.items():
-                        planet_key = planet_name_to_key.get(planet_name)
-                        if planet_key:
-                            weekday_energy[planet_key] = float(energy_value)
-                except Exception as e:
-                    print(f"Error calculating weekday energy: {e}")
-                    weekday_energy = None
-                
-            except Exception as e:
-                print(f"Error preparing enhanced calculation data: {e}")
-                pass
+        # Производные нумерологические данные из снимка профиля
+        profile = await get_numerology_profile(db, user_dict)
         
         user_city = getattr(user, 'city', 'Москва') or 'Москва'
+        await resolve_city_coordinates(user_city)
         # Get modifiers config
         modifiers_config = await get_planetary_energy_modifiers_config()
         
@@ -3465,15 +3198,10 @@ async def get_planetary_energy(days: int = 7, current_user: dict = Depends(get_c
             
             # Generate weekly data starting from this week's start date
             week_data = generate_weekly_planetary_energy(
-                user.birth_date, user_numbers, user_city,
-                pythagorean_square=pythagorean_square_data,
-                fractal_behavior=fractal_behavior,
-                problem_numbers=problem_numbers,
-                name_numbers=name_numbers,
-                weekday_energy=weekday_energy,
-                janma_ank=janma_ank_value if 'janma_ank_value' in locals() else None,
+                user.birth_date, city=user_city,
                 modifiers_config=modifiers_config,
-                start_date=week_start_date
+                start_date=week_start_date,
+                **energy_calculation_kwargs(profile)
             )
             
             chart_data.extend(week_data)
@@ -3844,6 +3572,46 @@ def parse_lesson_from_text_v2(text_content: str) -> 'LessonV2':
 
 # ==================== ADMIN API ====================
 
+@app.get("/api/admin/geo-cache/stats")
+async def get_geo_cache_stats(current_user: dict = Depends(get_current_user)):
+    """Счётчики кеша городов и солнечных таблиц текущего воркера"""
+    user = await db.users.find_one({"id": current_user.get("user_id")})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not user.get('is_super_admin', False) and not user.get('is_admin', False):
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+    return geo_cache_stats()
+
+@app.get("/api/admin/credit-ledger/stats")
+async def get_credit_ledger_stats(current_user: dict = Depends(get_current_user)):
+    """Глубина очереди и время пакетной записи истории баллов текущего воркера"""
+    user = await db.users.find_one({"id": current_user.get("user_id")})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not user.get('is_super_admin', False) and not user.get('is_admin', False):
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+    return credit_ledger.stats()
+
+@app.get("/api/admin/video-watch/stats")
+async def get_video_watch_buffer_stats(current_user: dict = Depends(get_current_user)):
+    """Накопленные heartbeat-ы просмотра видео и время их выгрузки в текущем воркере"""
+    user = await db.users.find_one({"id": current_user.get("user_id")})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not user.get('is_super_admin', False) and not user.get('is_admin', False):
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+    return video_watch_buffer.stats()
+
+@app.get("/api/admin/db/index-check")
+async def get_index_check(current_user: dict = Depends(get_current_user)):
+    """Планы (explain) запросов горячих эндпоинтов: полные сканирования коллекций и сортировки в памяти"""
+    user = await db.users.find_one({"id": current_user.get("user_id")})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not user.get('is_super_admin', False) and not user.get('is_admin', False):
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+    return await check_indexes(db)
+
 @app.get("/api/admin/users")
 async def get_all_users(current_user: dict = Depends(get_current_user)):
     """Получить всех пользователей для админа"""
@@ -4929,6 +4697,10 @@ async def update_user_profile_v2(request_data: dict, current_user: dict = Depend
         if not updated_user:
             raise HTTPException(status_code=404, detail="User not found after update")
 
+        # Снимок нумерологии пересчитываем только при смене даты рождения или имени
+        if not is_profile_current(updated_user.get("numerology_profile"), updated_user):
+            await refresh_numerology_profile(db, updated_user)
+
         updated_user.pop("_id", None)
         return updated_user
 
@@ -5107,25 +4879,29 @@ async def delete_lesson_v2(
 
         # Каскадное удаление связанных данных
         # 1. Удаляем прогресс студентов по этому уроку (если есть коллекция)
-        if "lesson_progress" in await db.list_collection_names():
+        if collection_registry.exists("lesson_progress"):
             progress_result = await db.lesson_progress.delete_many({"lesson_id": lesson_id})
             logger.info(f"Deleted {progress_result.deleted_count} progress records for lesson {lesson_id}")
 
         # 2. Удаляем ответы студентов на упражнения (если есть коллекция)
-        if "exercise_responses" in await db.list_collection_names():
+        if collection_registry.exists("exercise_responses"):
             responses_result = await db.exercise_responses.delete_many({"lesson_id": lesson_id})
             logger.info(f"Deleted {responses_result.deleted_count} exercise responses for lesson {lesson_id}")
 
         # 3. Удаляем результаты тестов (если есть коллекция)
-        if "quiz_results" in await db.list_collection_names():
+        if collection_registry.exists("quiz_results"):
             quiz_result = await db.quiz_results.delete_many({"lesson_id": lesson_id})
             logger.info(f"Deleted {quiz_result.deleted_count} quiz results for lesson {lesson_id}")
 
         # 4. Удаляем прогресс челленджей (если есть коллекция)
-        if "challenge_progress" in await db.list_collection_names():
+        if collection_registry.exists("challenge_progress"):
             challenge_result = await db.challenge_progress.delete_many({"lesson_id": lesson_id})
             logger.info(f"Deleted {challenge_result.deleted_count} challenge progress records for lesson {lesson_id}")
 
+        # Баллы и активность удалённого прогресса входят в агрегаты аналитики —
+        # итоги пересчитаются при следующем открытии обзора
+        await invalidate_rollups(db.analytics_rollups)
+
         # 5. Удаляем сам урок
         delete_result = await db.lessons_v2.delete_one({"id": lesson_id})
 
@@ -5555,11 +5331,13 @@ async def get_student_dashboard_stats(current_user: dict = Depends(get_current_u
         if not user_id:
             logger.error(f"Invalid current_user object: {current_user}")
             raise HTTPException(status_code=401, detail="Invalid token")
+        await video_watch_buffer.flush_for_user(user_id)
 
         # Получаем данные пользователя для расчета эффективности
         user = await db.users.find_one({"id": user_id})
         user_birth_date = user.get('birth_date') if user else None
         user_city = user.get('city', 'Москва') if user else 'Москва'
+        await resolve_city_coordinates(user_city)
         user_ruling_planet = None
         if user_birth_date:
             try:
@@ -5568,265 +5346,182 @@ async def get_student_dashboard_stats(current_user: dict = Depends(get_current_u
             except Exception as e:
                 logger.error(f"Error calculating user ruling planet: {e}")
 
-        collection_names = await db.list_collection_names()
+        now = datetime.utcnow()
+        seven_days_ago = now - timedelta(days=RECENT_DAYS)
 
-        # ----- Уроки и прогресс -----
-        lessons_cursor = db.lessons_v2.find({"is_active": True})
-        lessons = await lessons_cursor.to_list(length=None)
+        lessons = await db.lessons_v2.find({"is_active": True}, LESSON_PROJECTION).to_list(length=None)
         total_lessons = len(lessons)
+        lessons_dict = {l["id"]: l for l in lessons}
+        # Планета урока зависит только от названия — считаем один раз на урок
+        lesson_planets = {l["id"]: detect_lesson_planet(l.get("title", ""), "") for l in lessons}
 
-        lesson_progress_list = []
-        if "lesson_progress" in collection_names:
-            progress_cursor = db.lesson_progress.find({"user_id": user_id})
-            lesson_progress_list = await progress_cursor.to_list(length=None)
+        # Один aggregate с $facet на коллекцию вместо загрузки всей истории студента
+        activity_data = await load_student_activity(db, user_id, list(lessons_dict), now)
 
-        completed_lessons = len([p for p in lesson_progress_list if p.get("is_completed")])
-        in_progress_lessons = len([
-            p for p in lesson_progress_list
-            if not p.get("is_completed") and p.get("completion_percentage", 0) > 0
-        ])
+        # ----- Уроки и прогресс -----
+        progress_totals = facet_totals(activity_data["lesson_progress"])
+        completed_lessons = progress_totals.get("completed", 0)
+        in_progress_lessons = progress_totals.get("in_progress", 0)
 
         # ----- Упражнения -----
-        total_exercises_completed = 0
-        recent_exercises = 0
-        exercise_points = 0
-        exercise_review_points = 0  # Баллы за проверенные упражнения
-        exercise_review_time = 0  # Время проверки упражнений администратором
-        
-        if "exercise_responses" in collection_names:
-            exercise_cursor = db.exercise_responses.find({"user_id": user_id})
-            exercise_responses = await exercise_cursor.to_list(length=None)
-            total_exercises_completed = len(exercise_responses)
-            
-            # Баллы за проверенные упражнения (назначенные администратором)
-            exercise_review_points = sum(resp.get("points_earned", 0) for resp in exercise_responses if resp.get("reviewed", False))
-            exercise_review_time = sum(resp.get("review_time_minutes", 0) for resp in exercise_responses if resp.get("review_time_minutes"))
-            
-            # Если нет баллов за проверку, используем базовые баллы
-            if exercise_review_points == 0:
-                exercise_points = total_exercises_completed * 10  # 10 баллов за упражнение
-            else:
-                exercise_points = exercise_review_points
+        exercise_totals = facet_totals(activity_data["exercise_responses"])
+        total_exercises_completed = exercise_totals.get("count", 0)
+        recent_exercises = exercise_totals.get("recent", 0)
+        # Баллы за проверенные упражнения (назначенные администратором)
+        exercise_review_points = exercise_totals.get("review_points", 0)
+        # Время проверки упражнений администратором
+        exercise_review_time = exercise_totals.get("review_time_minutes", 0)
+
+        # Если нет баллов за проверку, используем базовые баллы
+        if exercise_review_points == 0:
+            exercise_points = total_exercises_completed * 10  # 10 баллов за упражнение
+        else:
+            exercise_points = exercise_review_points
 
-            seven_days_ago = datetime.utcnow() - timedelta(days=7)
-            recent_exercises = sum(
-                1 for resp in exercise_responses
-                if resp.get("submitted_at") and resp["submitted_at"] >= seven_days_ago
-            )
-        
         # Также проверяем time_activity для баллов за упражнения
-        if "time_activity" in collection_names:
-            exercise_review_activity = await db.time_activity.find({
-                "user_id": user_id,
-                "activity_type": "exercise_review"
-            }).to_list(length=None)
-            
-            if exercise_review_activity:
-                exercise_review_points = max(exercise_review_points, sum(a.get("total_points", 0) for a in exercise_review_activity))
-                exercise_review_time = max(exercise_review_time, sum(a.get("review_time_minutes", 0) for a in exercise_review_activity))
-                exercise_points = exercise_review_points if exercise_review_points > 0 else exercise_points
+        activity_totals = facet_totals(activity_data["time_activity"])
+        if activity_totals.get("review_count"):
+            exercise_review_points = max(exercise_review_points, activity_totals.get("review_points", 0))
+            exercise_review_time = max(exercise_review_time, activity_totals.get("review_time_minutes", 0))
+            exercise_points = exercise_review_points if exercise_review_points > 0 else exercise_points
 
         # ----- Тесты (детальная аналитика) -----
-        total_quiz_attempts = 0
-        total_quiz_points = 0
-        recent_quizzes = 0
+        quiz_totals = facet_totals(activity_data["quiz_attempts"])
+        total_quiz_attempts = quiz_totals.get("count", 0)
+        total_quiz_points = quiz_totals.get("points", 0)
+        recent_quizzes = quiz_totals.get("recent", 0)
+        max_quiz_score = max(0, quiz_totals.get("max_score") or 0)
+        avg_quiz_score = quiz_totals.get("score_sum", 0) / total_quiz_attempts if total_quiz_attempts > 0 else 0
+
+        # Формируем детали по каждому уроку с тестами
         quiz_details = []
-        quiz_attempts_by_lesson = {}
-        max_quiz_score = 0
-        avg_quiz_score = 0
-        
-        if "quiz_attempts" in collection_names:
-            quiz_cursor = db.quiz_attempts.find({"user_id": user_id})
-            quiz_attempts = await quiz_cursor.to_list(length=None)
-            total_quiz_attempts = len(quiz_attempts)
-            
-            # Получаем информацию об уроках для тестов
-            lessons_dict = {l["id"]: l for l in lessons}
-
-            for attempt in quiz_attempts:
-                points = attempt.get("points_earned") or 0
-                score = attempt.get("score", 0)
-                lesson_id = attempt.get("lesson_id")
-                passed = attempt.get("passed", False)
-                
-                # Если баллы не указаны, но тест пройден - начисляем 10 баллов
-                if points == 0 and passed:
-                    points = 10
-                
-                total_quiz_points += points
-                max_quiz_score = max(max_quiz_score, score)
-                
-                # Группируем попытки по урокам
-                if lesson_id not in quiz_attempts_by_lesson:
-                    quiz_attempts_by_lesson[lesson_id] = []
-                
-                quiz_attempts_by_lesson[lesson_id].append({
-                    "attempt_id": attempt.get("id"),
-                    "score": score,
-                    "points_earned": points,
-                    "passed": attempt.get("passed", False),
-                    "attempted_at": attempt.get("attempted_at").isoformat() if attempt.get("attempted_at") else None,
-                    "time_spent_minutes": attempt.get("time_spent_minutes", 0)
-                })
+        for lesson_quiz in activity_data["quiz_attempts"].get("by_lesson", []):
+            lesson = lessons_dict.get(lesson_quiz["_id"])
+            if not lesson:
+                continue
 
-                attempted_at = attempt.get("attempted_at")
-                if attempted_at and attempted_at >= datetime.utcnow() - timedelta(days=7):
-                    recent_quizzes += 1
-            
-            # Вычисляем средний балл
-            if total_quiz_attempts > 0:
-                avg_quiz_score = sum(attempt.get("score", 0) for attempt in quiz_attempts) / total_quiz_attempts
-            
-            # Формируем детали по каждому уроку с тестами
-            for lesson_id, attempts in quiz_attempts_by_lesson.items():
-                lesson = lessons_dict.get(lesson_id)
-                if not lesson:
-                    continue
-                
-                quiz = lesson.get("quiz")
-                max_possible_score = 100  # По умолчанию
-                if quiz and quiz.get("questions"):
-                    # Максимальный балл = сумма всех баллов за вопросы
-                    max_possible_score = sum(q.get("points", 10) for q in quiz.get("questions", []))
-                
-                best_attempt = max(attempts, key=lambda x: x.get("score", 0))
-                passed_count = sum(1 for a in attempts if a.get("passed", False))
-                
-                quiz_details.append({
-                    "lesson_id": lesson_id,
-                    "lesson_title": lesson.get("title", "Урок"),
-                    "total_attempts": len(attempts),
-                    "passed_attempts": passed_count,
-                    "pass_percentage": round((passed_count / len(attempts)) * 100, 1) if attempts else 0,
-                    "best_score": best_attempt.get("score", 0),
-                    "best_score_percentage": round((best_attempt.get("score", 0) / max_possible_score) * 100, 1) if max_possible_score > 0 else 0,
-                    "avg_score": round(sum(a.get("score", 0) for a in attempts) / len(attempts), 1) if attempts else 0,
-                    "avg_score_percentage": round((sum(a.get("score", 0) for a in attempts) / len(attempts) / max_possible_score) * 100, 1) if attempts and max_possible_score > 0 else 0,
-                    "max_possible_score": max_possible_score,
-                    "total_points_earned": sum(a.get("points_earned", 0) for a in attempts),
-                    "total_time_minutes": sum(a.get("time_spent_minutes", 0) for a in attempts),
-                    "attempts": attempts
-                })
+            quiz = lesson.get("quiz")
+            max_possible_score = 100  # По умолчанию
+            if quiz and quiz.get("questions"):
+                # Максимальный балл = сумма всех баллов за вопросы
+                max_possible_score = sum(q.get("points", 10) for q in quiz.get("questions", []))
+
+            attempts_count = lesson_quiz["total_attempts"]
+            passed_count = lesson_quiz["passed_attempts"]
+            best_score = lesson_quiz["best_score"]
+            avg_score = lesson_quiz["score_sum"] / attempts_count
+            # Последние попытки в хронологическом порядке
+            attempts = [{
+                "attempt_id": attempt.get("attempt_id"),
+                "score": attempt["score"],
+                "points_earned": attempt["points_earned"],
+                "passed": attempt["passed"],
+                "attempted_at": attempt["attempted_at"].isoformat() if attempt.get("attempted_at") else None,
+                "time_spent_minutes": attempt["time_spent_minutes"]
+            } for attempt in reversed(lesson_quiz["attempts"])]
+
+            quiz_details.append({
+                "lesson_id": lesson_quiz["_id"],
+                "lesson_title": lesson.get("title", "Урок"),
+                "total_attempts": attempts_count,
+                "passed_attempts": passed_count,
+                "pass_percentage": round((passed_count / attempts_count) * 100, 1),
+                "best_score": best_score,
+                "best_score_percentage": round((best_score / max_possible_score) * 100, 1) if max_possible_score > 0 else 0,
+                "avg_score": round(avg_score, 1),
+                "avg_score_percentage": round((avg_score / max_possible_score) * 100, 1) if max_possible_score > 0 else 0,
+                "max_possible_score": max_possible_score,
+                "total_points_earned": lesson_quiz["total_points_earned"],
+                "total_time_minutes": lesson_quiz["total_time_minutes"],
+                "attempts": attempts
+            })
 
         # ----- Челленджи (детальная аналитика) -----
-        total_challenge_attempts = 0
         total_challenge_points = 0
         recent_challenges = 0
         total_challenge_days_completed = 0
         total_challenge_time_minutes = 0
         challenge_details = []
         challenge_problem_days = []
-        
-        if "challenge_progress" in collection_names:
-            challenge_cursor = db.challenge_progress.find({"user_id": user_id})
-            challenge_attempts = await challenge_cursor.to_list(length=None)
-            total_challenge_attempts = len(challenge_attempts)
 
-            # Получаем информацию об уроках для челленджей
-            lessons_dict = {l["id"]: l for l in lessons}
+        challenge_attempts = activity_data["challenge_progress"]
+        total_challenge_attempts = len(challenge_attempts)
+        # Время по урокам из time_activity (одной группировкой вместо запроса на каждый челлендж)
+        minutes_by_lesson = {
+            row["_id"]: row["minutes"] for row in activity_data["time_activity"].get("by_lesson", [])
+        }
 
-            for attempt in challenge_attempts:
-                points = attempt.get("points_earned") or 0
-                completed_days = attempt.get("completed_days") or []
-                current_day = attempt.get("current_day", 0)
-                daily_notes = attempt.get("daily_notes", [])
-                
-                if points == 0:
-                    points = len(completed_days) * 15  # 15 баллов за каждый завершенный день
-                
-                total_challenge_points += points
-                total_challenge_days_completed += len(completed_days)
-                
-                # Время на челлендж (из time_activity для этого урока)
-                challenge_time = 0
-                if "time_activity" in collection_names:
-                    challenge_time_records = await db.time_activity.find({
-                        "user_id": user_id,
-                        "lesson_id": attempt.get("lesson_id")
-                    }).to_list(length=None)
-                    challenge_time = sum(r.get("total_minutes", 0) for r in challenge_time_records)
-                
-                total_challenge_time_minutes += challenge_time
-                
-                # Определяем дни с проблемами (дни без заметок или пропущенные дни)
-                lesson = lessons_dict.get(attempt.get("lesson_id"))
-                challenge = None
-                if lesson and lesson.get("challenge"):
-                    challenge = lesson["challenge"]
-                    total_days = challenge.get("total_days", 0)
-                    
-                    # Дни с проблемами: пропущенные дни между завершенными
-                    if completed_days and total_days > 0:
-                        for day in range(1, min(current_day + 1, total_days + 1)):
-                            if day not in completed_days:
-                                # Проверяем есть ли заметка для этого дня
-                                has_note = any(note.get("day") == day for note in daily_notes)
-                                if not has_note:
-                                    challenge_problem_days.append({
-                                        "lesson_id": attempt.get("lesson_id"),
-                                        "lesson_title": lesson.get("title", "Урок"),
-                                        "challenge_id": attempt.get("challenge_id"),
-                                        "day": day,
-                                        "reason": "Пропущенный день"
-                                    })
-                
-                # Детали по каждому челленджу
-                challenge_details.append({
-                    "lesson_id": attempt.get("lesson_id"),
-                    "lesson_title": lessons_dict.get(attempt.get("lesson_id"), {}).get("title", "Урок"),
-                    "challenge_id": attempt.get("challenge_id"),
-                    "current_day": current_day,
-                    "completed_days": len(completed_days),
-                    "total_days": challenge.get("total_days", 0) if challenge else 0,
-                    "completion_percentage": round((len(completed_days) / challenge.get("total_days", 1)) * 100, 1) if challenge and challenge.get("total_days") else 0,
-                    "is_completed": attempt.get("is_completed", False),
-                    "points_earned": points,
-                    "time_minutes": challenge_time,
-                    "started_at": attempt.get("started_at").isoformat() if attempt.get("started_at") else None,
-                    "completed_at": attempt.get("completed_at").isoformat() if attempt.get("completed_at") else None
-                })
+        for attempt in challenge_attempts:
+            points = attempt.get("points_earned") or 0
+            completed_days = attempt.get("completed_days") or []
+            current_day = attempt.get("current_day", 0)
+            daily_notes = attempt.get("daily_notes") or []
+
+            if points == 0:
+                points = len(completed_days) * 15  # 15 баллов за каждый завершенный день
+
+            total_challenge_points += points
+            total_challenge_days_completed += len(completed_days)
+
+            # Время на челлендж (из time_activity для этого урока)
+            challenge_time = minutes_by_lesson.get(attempt.get("lesson_id"), 0)
+            total_challenge_time_minutes += challenge_time
+
+            # Определяем дни с проблемами (дни без заметок или пропущенные дни)
+            lesson = lessons_dict.get(attempt.get("lesson_id"))
+            challenge = None
+            if lesson and lesson.get("challenge"):
+                challenge = lesson["challenge"]
+                total_days = challenge.get("total_days", 0)
+
+                # Дни с проблемами: пропущенные дни между завершенными
+                if completed_days and total_days > 0:
+                    noted_days = {note.get("day") for note in daily_notes}
+                    for day in range(1, min(current_day + 1, total_days + 1)):
+                        if day not in completed_days and day not in noted_days:
+                            challenge_problem_days.append({
+                                "lesson_id": attempt.get("lesson_id"),
+                                "lesson_title": lesson.get("title", "Урок"),
+                                "challenge_id": attempt.get("challenge_id"),
+                                "day": day,
+                                "reason": "Пропущенный день"
+                            })
+
+            # Детали по каждому челленджу
+            challenge_details.append({
+                "lesson_id": attempt.get("lesson_id"),
+                "lesson_title": lessons_dict.get(attempt.get("lesson_id"), {}).get("title", "Урок"),
+                "challenge_id": attempt.get("challenge_id"),
+                "current_day": current_day,
+                "completed_days": len(completed_days),
+                "total_days": challenge.get("total_days", 0) if challenge else 0,
+                "completion_percentage": round((len(completed_days) / challenge.get("total_days", 1)) * 100, 1) if challenge and challenge.get("total_days") else 0,
+                "is_completed": attempt.get("is_completed", False),
+                "points_earned": points,
+                "time_minutes": challenge_time,
+                "started_at": attempt.get("started_at").isoformat() if attempt.get("started_at") else None,
+                "completed_at": attempt.get("completed_at").isoformat() if attempt.get("completed_at") else None
+            })
 
-                last_updated = attempt.get("last_updated")
-                if last_updated and last_updated >= datetime.utcnow() - timedelta(days=7):
-                    recent_challenges += 1
+            last_updated = attempt.get("last_updated")
+            if last_updated and last_updated >= seven_days_ago:
+                recent_challenges += 1
 
         # ----- Время обучения -----
-        time_minutes = 0
-        time_points = 0
-        if "time_activity" in collection_names:
-            time_records = await db.time_activity.find({"user_id": user_id}).to_list(length=None)
-            for record in time_records:
-                if record.get("activity_type") == "file_view":
-                    continue  # учитываем отдельно ниже
-                time_minutes += record.get("total_minutes", 0)
-                time_points += record.get("total_points", 0)
+        time_minutes = activity_totals.get("time_minutes", 0)
+        time_points = activity_totals.get("time_points", 0)
 
         # ----- Видео -----
-        video_minutes = 0
-        video_points = 0
-        if "video_watch_time" in collection_names:
-            video_records = await db.video_watch_time.find({"user_id": user_id}).to_list(length=None)
-            video_minutes = sum(record.get("total_minutes", 0) for record in video_records)
-            video_points = sum(record.get("total_points", 0) for record in video_records)
+        video_totals = facet_totals(activity_data["video_watch_time"])
+        video_minutes = video_totals.get("minutes", 0)
+        video_points = video_totals.get("points", 0)
 
         # ----- Файлы -----
-        file_view_points = 0
-        file_views = 0
-        file_downloads = 0
-        if "time_activity" in collection_names:
-            file_view_records = await db.time_activity.find({
-                "user_id": user_id,
-                "activity_type": "file_view"
-            }).to_list(length=None)
-            file_view_points = sum(record.get("total_points", 0) for record in file_view_records)
-            file_views = sum(record.get("view_count", 0) for record in file_view_records)
-
-        if "file_analytics" in collection_names:
-            file_views = max(
-                file_views,
-                await db.file_analytics.count_documents({"user_id": user_id, "action": "view"})
-            )
-            file_downloads = await db.file_analytics.count_documents({"user_id": user_id, "action": "download"})
+        file_view_points = activity_totals.get("file_view_points", 0)
+        file_views = activity_totals.get("file_views", 0)
+        file_actions = {row["_id"]: row["count"] for row in activity_data["file_analytics"].get("totals", [])}
+        file_views = max(file_views, file_actions.get("view", 0))
+        file_downloads = file_actions.get("download", 0)
 
         # ----- Общие баллы и уровни -----
         total_points = (
@@ -5869,12 +5564,32 @@ async def get_student_dashboard_stats(current_user: dict = Depends(get_current_u
             progress_to_next_level = 100
 
         # ----- Активность по дням (7 дней) с детализацией и эффективностью -----
-        # Создаем словарь уроков для быстрого доступа
-        lessons_dict = {l["id"]: l for l in lessons}
-        
+        # События за неделю приходят из агрегатов сгруппированными по (день, урок, минута)
+        exercise_days = rows_by_period(activity_data["exercise_responses"].get("chart", []))
+        quiz_days = rows_by_period(activity_data["quiz_attempts"].get("chart", []))
+        activity_days = rows_by_period(activity_data["time_activity"].get("chart", []), "created_day", "last_day")
+        video_days = rows_by_period(activity_data["video_watch_time"].get("chart", []), "created_day", "last_day")
+        file_view_days = rows_by_period(activity_data["file_analytics"].get("chart", []))
+        theory_days = rows_by_period(activity_data["lesson_progress"].get("chart", []))
+        pdf_file_ids = activity_data["pdf_file_ids"]
+
+        def lesson_efficiency(lesson_id, activity_at, is_completed=False, completion_percentage=0.0):
+            lesson_planet = lesson_planets.get(lesson_id) if lesson_id else None
+            if not (user_ruling_planet and lesson_planet):
+                return None
+            return calculate_activity_efficiency(
+                user_ruling_planet,
+                lesson_planet,
+                activity_at,
+                is_completed,
+                completion_percentage,
+                user_city
+            )
+
         activity_chart = []
-        for i in range(7):
-            day = datetime.utcnow() - timedelta(days=6 - i)
+        for i in range(CHART_DAYS):
+            day = now - timedelta(days=CHART_DAYS - 1 - i)
+            day_key = day.strftime('%Y-%m-%d')
             day_start = day.replace(hour=0, minute=0, second=0, microsecond=0)
             day_end = day_start + timedelta(days=1)
 
@@ -5885,286 +5600,105 @@ async def get_student_dashboard_stats(current_user: dict = Depends(get_current_u
             pdf_activity = 0  # Активность просмотра PDF файлов
             study_time_minutes = 0  # Время обучения в минутах
             file_views_count = 0  # Количество просмотров файлов
-            
-            # Эффективность активности за день (средняя по всем активностям)
-            day_efficiencies = []
 
-            if "exercise_responses" in collection_names:
-                exercise_count = await db.exercise_responses.count_documents({
-                    "user_id": user_id,
-                    "submitted_at": {"$gte": day_start, "$lt": day_end}
-                })
-                day_activity += exercise_count
-                
-                # Получаем упражнения для расчета эффективности
-                exercise_records = await db.exercise_responses.find({
-                    "user_id": user_id,
-                    "submitted_at": {"$gte": day_start, "$lt": day_end}
-                }).to_list(length=None)
-                
-                for ex in exercise_records:
-                    lesson_id = ex.get("lesson_id")
-                    lesson = lessons_dict.get(lesson_id) if lesson_id else None
-                    lesson_planet = None
-                    if lesson:
-                        lesson_planet = detect_lesson_planet(lesson.get("title", ""), "")
-                    
-                    if user_ruling_planet and lesson_planet:
-                        efficiency = calculate_activity_efficiency(
-                            user_ruling_planet,
-                            lesson_planet,
-                            ex.get("submitted_at", day_start),
-                            False,
-                            0.0,
-                            user_city
-                        )
-                        day_efficiencies.append(efficiency)
+            # Эффективность активности за день (средняя по всем событиям)
+            efficiency_sum = 0.0
+            efficiency_weight = 0
 
-            if "quiz_attempts" in collection_names:
-                quiz_count = await db.quiz_attempts.count_documents({
-                    "user_id": user_id,
-                    "attempted_at": {"$gte": day_start, "$lt": day_end}
-                })
-                day_activity += quiz_count
-                
-                # Получаем тесты для расчета эффективности
-                quiz_records = await db.quiz_attempts.find({
-                    "user_id": user_id,
-                    "attempted_at": {"$gte": day_start, "$lt": day_end}
-                }).to_list(length=None)
-                
-                for quiz in quiz_records:
-                    lesson_id = quiz.get("lesson_id")
-                    lesson = lessons_dict.get(lesson_id) if lesson_id else None
-                    lesson_planet = None
-                    if lesson:
-                        lesson_planet = detect_lesson_planet(lesson.get("title", ""), "")
-                    
-                    if user_ruling_planet and lesson_planet:
-                        efficiency = calculate_activity_efficiency(
-                            user_ruling_planet,
-                            lesson_planet,
-                            quiz.get("attempted_at", day_start),
-                            False,
-                            0.0,
-                            user_city
-                        )
-                        day_efficiencies.append(efficiency)
+            def add_efficiency(row, default_time):
+                nonlocal efficiency_sum, efficiency_weight
+                efficiency = lesson_efficiency(row["_id"].get("lesson_id"), row_time(row, default_time))
+                if efficiency is not None:
+                    efficiency_sum += efficiency * row["count"]
+                    efficiency_weight += row["count"]
 
-            if "challenge_progress" in collection_names:
-                challenge_count = await db.challenge_progress.count_documents({
-                    "user_id": user_id,
-                    "last_updated": {"$gte": day_start, "$lt": day_end}
-                })
-                day_activity += challenge_count
-                
-                # Получаем челленджи для расчета эффективности
-                challenge_records = await db.challenge_progress.find({
-                    "user_id": user_id,
-                    "last_updated": {"$gte": day_start, "$lt": day_end}
-                }).to_list(length=None)
-                
-                for challenge in challenge_records:
-                    lesson_id = challenge.get("lesson_id")
-                    lesson = lessons_dict.get(lesson_id) if lesson_id else None
-                    lesson_planet = None
-                    if lesson:
-                        lesson_planet = detect_lesson_planet(lesson.get("title", ""), "")
-                    
-                    is_completed = challenge.get("is_completed", False)
-                    completed_days = challenge.get("completed_days", [])
-                    total_days = 0
-                    if lesson and lesson.get("challenge"):
-                        total_days = lesson["challenge"].get("total_days", 0)
-                    completion_percentage = (len(completed_days) / total_days * 100) if total_days > 0 else 0
-                    
-                    if user_ruling_planet and lesson_planet:
-                        efficiency = calculate_activity_efficiency(
-                            user_ruling_planet,
-                            lesson_planet,
-                            challenge.get("last_updated", day_start),
-                            is_completed,
-                            completion_percentage,
-                            user_city
-                        )
-                        day_efficiencies.append(efficiency)
+            for row in exercise_days.get(day_key, []):
+                day_activity += row["count"]
+                add_efficiency(row, day_start)
+
+            for row in quiz_days.get(day_key, []):
+                day_activity += row["count"]
+                add_efficiency(row, day_start)
+
+            for challenge in challenge_attempts:
+                last_updated = challenge.get("last_updated")
+                if not (isinstance(last_updated, datetime) and day_start <= last_updated < day_end):
+                    continue
+                day_activity += 1
+
+                lesson = lessons_dict.get(challenge.get("lesson_id"))
+                completed_days = challenge.get("completed_days") or []
+                total_days = 0
+                if lesson and lesson.get("challenge"):
+                    total_days = lesson["challenge"].get("total_days", 0)
+                completion_percentage = (len(completed_days) / total_days * 100) if total_days > 0 else 0
+
+                efficiency = lesson_efficiency(
+                    challenge.get("lesson_id"),
+                    last_updated,
+                    challenge.get("is_completed", False),
+                    completion_percentage
+                )
+                if efficiency is not None:
+                    efficiency_sum += efficiency
+                    efficiency_weight += 1
 
             # УНИФИЦИРОВАННЫЙ ИСТОЧНИК ДАННЫХ: time_activity - основная коллекция для всех типов активности
-            # Все данные активности должны браться из time_activity с правильными типами:
             # - "lesson_view" - присутствие в уроке
             # - "theory" или "theory_view" - просмотр теории
             # - "video_watch" - просмотр видео (время в минутах)
             # - "file_view" - просмотр файлов (PDF и другие)
-            # - "exercise" - выполнение упражнений
-            # - "challenge" - выполнение челленджей
-            # - "quiz" - прохождение тестов
-            
-            if "time_activity" in collection_names:
-                # Получаем все записи активности за день из time_activity
-                all_activity_records_cursor = db.time_activity.find({
-                    "user_id": user_id,
-                    "$or": [
-                        {"last_activity_at": {"$gte": day_start, "$lt": day_end}},
-                        {"created_at": {"$gte": day_start, "$lt": day_end}}
-                    ]
-                })
-                all_activity_records = []
-                async for r in all_activity_records_cursor:
-                    r_dict = dict(r)
-                    r_dict.pop("_id", None)  # Удаляем ObjectId
-                    all_activity_records.append(r_dict)
-                
-                # Группируем по типам активности
-                for record in all_activity_records:
-                    activity_type = record.get("activity_type", "")
-                    lesson_id = record.get("lesson_id")
-                    lesson = lessons_dict.get(lesson_id) if lesson_id else None
-                    lesson_planet = None
-                    if lesson:
-                        lesson_planet = detect_lesson_planet(lesson.get("title", ""), "")
-                    
-                    # Присутствие в уроке (lesson_view, но не file_view)
-                    if activity_type == "lesson_view":
-                        lesson_presence += 1
-                        # Суммируем время обучения из lesson_view
-                        study_time_minutes += record.get("total_minutes", 0)
-                    
-                    # Активность теории
-                    if activity_type in ["theory", "theory_view"]:
-                        theory_activity += 1
-                        # Суммируем время обучения из теории
-                        study_time_minutes += record.get("total_minutes", 0)
-                    
-                    # Активность просмотра видео (суммируем минуты)
-                    if activity_type == "video_watch":
-                        video_activity += record.get("total_minutes", 0)
-                        # Суммируем время обучения из видео
-                        study_time_minutes += record.get("total_minutes", 0)
-                    
-                    # Активность просмотра PDF (file_view с типом pdf)
-                    if activity_type == "file_view":
-                        file_views_count += 1  # Считаем все просмотры файлов
-                        file_type = record.get("file_type", "")
-                        if file_type in ["pdf", "application/pdf"]:
-                            pdf_activity += 1
-                    
-                    # Рассчитываем эффективность для всех типов активности
-                    if user_ruling_planet and lesson_planet:
-                        efficiency = calculate_activity_efficiency(
-                            user_ruling_planet,
-                            lesson_planet,
-                            record.get("created_at") or record.get("last_activity_at") or day_start,
-                            False,
-                            0.0,
-                            user_city
-                        )
-                        day_efficiencies.append(efficiency)
-            
+            # Запись учитывается в день создания и в день последней активности
+            for row in activity_days.get(day_key, []):
+                activity_type = row["_id"].get("activity_type") or ""
+                minutes = row.get("minutes", 0)
+
+                # Присутствие в уроке (lesson_view, но не file_view)
+                if activity_type == "lesson_view":
+                    lesson_presence += row["count"]
+                    study_time_minutes += minutes
+
+                # Активность теории
+                if activity_type in ["theory", "theory_view"]:
+                    theory_activity += row["count"]
+                    study_time_minutes += minutes
+
+                # Активность просмотра видео (суммируем минуты)
+                if activity_type == "video_watch":
+                    video_activity += minutes
+                    study_time_minutes += minutes
+
+                # Активность просмотра PDF (file_view с типом pdf)
+                if activity_type == "file_view":
+                    file_views_count += row["count"]
+                    if row["_id"].get("is_pdf"):
+                        pdf_activity += row["count"]
+
+                add_efficiency(row, day_start)
+
             # ДОПОЛНИТЕЛЬНЫЕ ИСТОЧНИКИ (для обратной совместимости и детализации):
-            # video_watch_time - для детального времени просмотра видео (если нет в time_activity)
-            if "video_watch_time" in collection_names and video_activity == 0:
-                video_records_cursor = db.video_watch_time.find({
-                    "user_id": user_id,
-                    "$or": [
-                        {"last_updated": {"$gte": day_start, "$lt": day_end}},
-                        {"created_at": {"$gte": day_start, "$lt": day_end}}
-                    ]
-                })
-                video_records = []
-                async for r in video_records_cursor:
-                    r_dict = dict(r)
-                    r_dict.pop("_id", None)
-                    video_records.append(r_dict)
-                video_activity = sum(r.get("total_minutes", 0) for r in video_records)
-                
-                # Рассчитываем эффективность для просмотра видео
-                for record in video_records:
-                    lesson_id = record.get("lesson_id")
-                    lesson = lessons_dict.get(lesson_id) if lesson_id else None
-                    lesson_planet = None
-                    if lesson:
-                        lesson_planet = detect_lesson_planet(lesson.get("title", ""), "")
-                    
-                    if user_ruling_planet and lesson_planet:
-                        efficiency = calculate_activity_efficiency(
-                            user_ruling_planet,
-                            lesson_planet,
-                            record.get("created_at", day_start),
-                            False,
-                            0.0,
-                            user_city
-                        )
-                        day_efficiencies.append(efficiency)
-            
-            # file_analytics - для просмотров файлов (если нет в time_activity или для дополнения)
-            if "file_analytics" in collection_names:
-                file_views_cursor = db.file_analytics.find({
-                    "user_id": user_id,
-                    "created_at": {"$gte": day_start, "$lt": day_end},
-                    "action": "view"
-                })
-                file_views = []
-                async for fv in file_views_cursor:
-                    fv_dict = dict(fv)
-                    fv_dict.pop("_id", None)
-                    file_views.append(fv_dict)
-                
-                # Добавляем к общему количеству просмотров файлов
-                file_views_count += len(file_views)
-                
-                # Получаем информацию о файлах, чтобы определить PDF
-                file_ids = [fv.get("file_id") for fv in file_views if fv.get("file_id")]
-                if file_ids:
-                    pdf_files_cursor = db.files.find({
-                        "id": {"$in": file_ids},
-                        "mime_type": {"$in": ["application/pdf", "pdf"]}
-                    })
-                    pdf_files = []
-                    async for f in pdf_files_cursor:
-                        pdf_file = dict(f)
-                        pdf_file.pop("_id", None)
-                        pdf_files.append(pdf_file)
-                    pdf_file_ids = {f.get("id") for f in pdf_files}
-                    # Добавляем к активности PDF (если еще не было в time_activity)
-                    if pdf_activity == 0:
-                        pdf_activity = len([fv for fv in file_views if fv.get("file_id") in pdf_file_ids])
-            
+            # video_watch_time - если просмотр видео не записан в time_activity
+            if video_activity == 0:
+                for row in video_days.get(day_key, []):
+                    video_activity += row.get("minutes", 0)
+                    add_efficiency(row, day_start)
+
+            # file_analytics - дополняет просмотры файлов
+            day_file_views = file_view_days.get(day_key, [])
+            file_views_count += sum(row["count"] for row in day_file_views)
+            if pdf_activity == 0:
+                pdf_activity = sum(row["count"] for row in day_file_views if row["_id"].get("file_id") in pdf_file_ids)
+
             # lesson_progress - для активности теории (если нет в time_activity)
-            if "lesson_progress" in collection_names and theory_activity == 0:
-                theory_records_cursor = db.lesson_progress.find({
-                    "user_id": user_id,
-                    "last_accessed": {"$gte": day_start, "$lt": day_end}
-                })
-                theory_records = []
-                async for r in theory_records_cursor:
-                    r_dict = dict(r)
-                    r_dict.pop("_id", None)
-                    theory_records.append(r_dict)
-                theory_activity = len(theory_records)
-                
-                # Рассчитываем эффективность для теории
-                for record in theory_records:
-                    lesson_id = record.get("lesson_id")
-                    lesson = lessons_dict.get(lesson_id) if lesson_id else None
-                    lesson_planet = None
-                    if lesson:
-                        lesson_planet = detect_lesson_planet(lesson.get("title", ""), "")
-                    
-                    if user_ruling_planet and lesson_planet:
-                        efficiency = calculate_activity_efficiency(
-                            user_ruling_planet,
-                            lesson_planet,
-                            record.get("last_accessed", day_start),
-                            False,
-                            0.0,
-                            user_city
-                        )
-                        day_efficiencies.append(efficiency)
+            if theory_activity == 0:
+                for row in theory_days.get(day_key, []):
+                    theory_activity += row["count"]
+                    add_efficiency(row, day_start)
 
             # Рассчитываем среднюю эффективность за день
             avg_efficiency = 0.0
-            if day_efficiencies:
-                avg_efficiency = sum(day_efficiencies) / len(day_efficiencies)
+            if efficiency_weight:
+                avg_efficiency = efficiency_sum / efficiency_weight
             elif day_activity > 0:
                 # Если есть активность, но не удалось рассчитать эффективность, используем базовую
                 avg_efficiency = 50.0
@@ -6233,17 +5767,11 @@ async def get_student_dashboard_stats(current_user: dict = Depends(get_current_u
             })
 
         # ----- Топ уроков (по прогрессу) -----
-        top_lessons = []
-        if lesson_progress_list:
-            for progress in lesson_progress_list:
-                lesson = next((l for l in lessons if l["id"] == progress["lesson_id"]), None)
-                if lesson:
-                    top_lessons.append({
-                        "lesson_id": lesson["id"],
-                        "lesson_title": lesson.get("title", "Урок"),
-                        "completion": progress.get("completion_percentage", 0)
-                    })
-            top_lessons = sorted(top_lessons, key=lambda x: x["completion"], reverse=True)[:5]
+        top_lessons = [{
+            "lesson_id": row["lesson_id"],
+            "lesson_title": lessons_dict[row["lesson_id"]].get("title", "Урок"),
+            "completion": row["completion"]
+        } for row in activity_data["lesson_progress"].get("top", [])]
 
         return {
             "stats": {
@@ -6339,11 +5867,13 @@ async def get_detailed_analytics(
         if not user_id:
             logger.error("No user_id found in current_user")
             raise HTTPException(status_code=401, detail="Invalid token")
+        await video_watch_buffer.flush_for_user(user_id)
 
         # Получаем данные пользователя для расчета эффективности
         user = await db.users.find_one({"id": user_id})
         user_birth_date = user.get('birth_date') if user else None
         user_city = user.get('city', 'Москва') if user else 'Москва'
+        await resolve_city_coordinates(user_city)
         user_ruling_planet = None
         if user_birth_date:
             try:
@@ -6352,74 +5882,40 @@ async def get_detailed_analytics(
             except Exception as e:
                 logger.error(f"Error calculating user ruling planet: {e}")
 
-        collection_names = await db.list_collection_names()
+        collection_names = collection_registry.names
         logger.info(f"Available collections: {collection_names}")
         
         if section == 'lessons':
             # Детальная аналитика по урокам
-            lessons_cursor = db.lessons_v2.find({"is_active": True})
-            lessons = await lessons_cursor.to_list(length=None)
-            
-            lesson_progress_list = []
-            if "lesson_progress" in collection_names:
-                progress_cursor = db.lesson_progress.find({"user_id": user_id})
-                lesson_progress_list = await progress_cursor.to_list(length=None)
-            
+            lessons = await db.lessons_v2.find({"is_active": True}, LESSON_PROJECTION).to_list(length=None)
+            lesson_ids = [lesson["id"] for lesson in lessons]
+
+            progress_by_lesson = {}
+            progress_list = await db.lesson_progress.find(
+                {"user_id": user_id, "lesson_id": {"$in": lesson_ids}},
+                {"_id": 0, "lesson_id": 1, "completion_percentage": 1, "is_completed": 1, "started_at": 1, "completed_at": 1}
+            ).to_list(length=None)
+            for progress in progress_list:
+                progress_by_lesson.setdefault(progress["lesson_id"], progress)
+
+            # Время, видео и файлы по всем урокам — по одному $group на коллекцию
+            lesson_totals = await load_lesson_totals(db, user_id, lesson_ids)
+
             # Детали по каждому уроку
             lesson_details = []
             for lesson in lessons:
-                progress = next((p for p in lesson_progress_list if p.get("lesson_id") == lesson["id"]), None)
-                
-                # Время изучения урока
-                lesson_time = 0
-                if "time_activity" in collection_names:
-                    time_records = await db.time_activity.find({
-                        "user_id": user_id,
-                        "lesson_id": lesson["id"]
-                    }).to_list(length=None)
-                    lesson_time = sum(r.get("total_minutes", 0) for r in time_records)
-                
-                # Видео время
-                video_time = 0
-                if "video_watch_time" in collection_names:
-                    video_records = await db.video_watch_time.find({
-                        "user_id": user_id,
-                        "lesson_id": lesson["id"]
-                    }).to_list(length=None)
-                    video_time = sum(r.get("total_minutes", 0) for r in video_records)
-                
-                # Файлы
-                file_views = 0
-                file_downloads = 0
-                if "time_activity" in collection_names:
-                    file_records = await db.time_activity.find({
-                        "user_id": user_id,
-                        "lesson_id": lesson["id"],
-                        "activity_type": "file_view"
-                    }).to_list(length=None)
-                    file_views = sum(r.get("view_count", 0) for r in file_records)
-                
-                if "file_analytics" in collection_names:
-                    file_views = max(file_views, await db.file_analytics.count_documents({
-                        "user_id": user_id,
-                        "lesson_id": lesson["id"],
-                        "action": "view"
-                    }))
-                    file_downloads = await db.file_analytics.count_documents({
-                        "user_id": user_id,
-                        "lesson_id": lesson["id"],
-                        "action": "download"
-                    })
-                
+                progress = progress_by_lesson.get(lesson["id"])
+                totals = lesson_totals[lesson["id"]]
+
                 lesson_details.append({
                     "lesson_id": lesson["id"],
                     "lesson_title": lesson.get("title", "Урок"),
                     "completion_percentage": progress.get("completion_percentage", 0) if progress else 0,
                     "is_completed": progress.get("is_completed", False) if progress else False,
-                    "time_minutes": lesson_time,
-                    "video_minutes": video_time,
-                    "file_views": file_views,
-                    "file_downloads": file_downloads,
+                    "time_minutes": totals["time_minutes"],
+                    "video_minutes": totals["video_minutes"],
+                    "file_views": max(totals["time_file_views"], totals["file_views"]),
+                    "file_downloads": totals["file_downloads"],
                     "started_at": progress.get("started_at").isoformat() if progress and progress.get("started_at") else None,
                     "completed_at": progress.get("completed_at").isoformat() if progress and progress.get("completed_at") else None
                 })
@@ -6448,197 +5944,77 @@ async def get_detailed_analytics(
                 start_dt = None
                 end_dt = None
             
+            # Планета урока зависит только от названия — считаем один раз на урок
+            lesson_planets = {l["id"]: detect_lesson_planet(l.get("title", ""), "") for l in lessons}
+
             # Функция-помощник для сбора данных активности за период (час или день)
-            async def collect_activity_data(period_start, period_end, is_hour=False):
-                """Собирает данные активности за указанный период (час или день)"""
+            def collect_activity_data(events, period_key, period_start):
+                """Собирает данные активности за период из событий, сгруппированных load_activity_events"""
                 period_activity = 0
                 period_theory_activity = 0
                 period_lesson_presence = 0
                 period_video_activity = 0
                 period_pdf_activity = 0
                 period_study_time_minutes = 0
-                period_file_views_count = 0
-                period_efficiencies = []
-                
-                # Упражнения
-                if "exercise_responses" in collection_names:
-                    exercise_count = await db.exercise_responses.count_documents({
-                        "user_id": user_id,
-                        "submitted_at": {"$gte": period_start, "$lt": period_end}
-                    })
-                    period_activity += exercise_count
-                    
-                    exercise_records = await db.exercise_responses.find({
-                        "user_id": user_id,
-                        "submitted_at": {"$gte": period_start, "$lt": period_end}
-                    }).to_list(length=None)
-                    
-                    for ex in exercise_records:
-                        lesson_id = ex.get("lesson_id")
-                        lesson = lessons_dict.get(lesson_id) if lesson_id else None
-                        lesson_planet = detect_lesson_planet(lesson.get("title", ""), "") if lesson else None
-                        if user_ruling_planet and lesson_planet:
-                            efficiency = calculate_activity_efficiency(
-                                user_ruling_planet, lesson_planet, ex.get("submitted_at", period_start),
-                                False, 0.0, user_city
-                            )
-                            period_efficiencies.append(efficiency)
-                
-                # Тесты
-                if "quiz_attempts" in collection_names:
-                    quiz_count = await db.quiz_attempts.count_documents({
-                        "user_id": user_id,
-                        "attempted_at": {"$gte": period_start, "$lt": period_end}
-                    })
-                    period_activity += quiz_count
-                    
-                    quiz_records = await db.quiz_attempts.find({
-                        "user_id": user_id,
-                        "attempted_at": {"$gte": period_start, "$lt": period_end}
-                    }).to_list(length=None)
-                    
-                    for quiz in quiz_records:
-                        lesson_id = quiz.get("lesson_id")
-                        lesson = lessons_dict.get(lesson_id) if lesson_id else None
-                        lesson_planet = detect_lesson_planet(lesson.get("title", ""), "") if lesson else None
-                        if user_ruling_planet and lesson_planet:
-                            efficiency = calculate_activity_efficiency(
-                                user_ruling_planet, lesson_planet, quiz.get("attempted_at", period_start),
-                                False, 0.0, user_city
-                            )
-                            period_efficiencies.append(efficiency)
-                
+                efficiency_sum = 0.0
+                efficiency_weight = 0
+
+                def add_efficiency(lesson_id, activity_at, count=1, is_completed=False, completion_percentage=0.0):
+                    nonlocal efficiency_sum, efficiency_weight
+                    lesson_planet = lesson_planets.get(lesson_id) if lesson_id else None
+                    if user_ruling_planet and lesson_planet:
+                        efficiency = calculate_activity_efficiency(
+                            user_ruling_planet, lesson_planet, activity_at,
+                            is_completed, completion_percentage, user_city
+                        )
+                        efficiency_sum += efficiency * count
+                        efficiency_weight += count
+
+                # Упражнения и тесты
+                for collection in ("exercise_responses", "quiz_attempts"):
+                    for row in events[collection].get(period_key, []):
+                        period_activity += row["count"]
+                        add_efficiency(row["_id"].get("lesson_id"), row_time(row, period_start), row["count"])
+
                 # Челленджи
-                if "challenge_progress" in collection_names:
-                    challenge_count = await db.challenge_progress.count_documents({
-                        "user_id": user_id,
-                        "last_updated": {"$gte": period_start, "$lt": period_end}
-                    })
-                    period_activity += challenge_count
-                    
-                    challenge_records = await db.challenge_progress.find({
-                        "user_id": user_id,
-                        "last_updated": {"$gte": period_start, "$lt": period_end}
-                    }).to_list(length=None)
-                    
-                    for challenge in challenge_records:
-                        lesson_id = challenge.get("lesson_id")
-                        lesson = lessons_dict.get(lesson_id) if lesson_id else None
-                        lesson_planet = detect_lesson_planet(lesson.get("title", ""), "") if lesson else None
-                        is_completed = challenge.get("is_completed", False)
-                        completed_days = challenge.get("completed_days", [])
-                        total_days = lesson["challenge"].get("total_days", 0) if lesson and lesson.get("challenge") else 0
-                        completion_percentage = (len(completed_days) / total_days * 100) if total_days > 0 else 0
-                        if user_ruling_planet and lesson_planet:
-                            efficiency = calculate_activity_efficiency(
-                                user_ruling_planet, lesson_planet, challenge.get("last_updated", period_start),
-                                is_completed, completion_percentage, user_city
-                            )
-                            period_efficiencies.append(efficiency)
-                
-                # Присутствие в уроке
-                if "time_activity" in collection_names:
-                    presence_records = await db.time_activity.find({
-                        "user_id": user_id,
-                        "$or": [
-                            {"created_at": {"$gte": period_start, "$lt": period_end}},
-                            {"last_activity_at": {"$gte": period_start, "$lt": period_end}}
-                        ],
-                        "activity_type": {"$ne": "file_view"}
-                    }).to_list(length=None)
-                    period_lesson_presence = len(presence_records)
-                    period_study_time_minutes = sum(r.get("total_minutes", 0) for r in presence_records)
-                    
-                    for record in presence_records:
-                        lesson_id = record.get("lesson_id")
-                        lesson = lessons_dict.get(lesson_id) if lesson_id else None
-                        lesson_planet = detect_lesson_planet(lesson.get("title", ""), "") if lesson else None
-                        if user_ruling_planet and lesson_planet:
-                            efficiency = calculate_activity_efficiency(
-                                user_ruling_planet, lesson_planet, record.get("created_at") or record.get("last_activity_at") or period_start,
-                                False, 0.0, user_city
-                            )
-                            period_efficiencies.append(efficiency)
-                
-                # Видео
-                if "time_activity" in collection_names:
-                    video_records = await db.time_activity.find({
-                        "user_id": user_id,
-                        "$or": [
-                            {"created_at": {"$gte": period_start, "$lt": period_end}},
-                            {"last_activity_at": {"$gte": period_start, "$lt": period_end}}
-                        ],
-                        "activity_type": "video_watch"
-                    }).to_list(length=None)
-                    period_video_activity = sum(r.get("total_minutes", 0) for r in video_records)
-                    
-                    for record in video_records:
-                        lesson_id = record.get("lesson_id")
-                        lesson = lessons_dict.get(lesson_id) if lesson_id else None
-                        lesson_planet = detect_lesson_planet(lesson.get("title", ""), "") if lesson else None
-                        if user_ruling_planet and lesson_planet:
-                            efficiency = calculate_activity_efficiency(
-                                user_ruling_planet, lesson_planet, record.get("created_at") or record.get("last_activity_at") or period_start,
-                                False, 0.0, user_city
-                            )
-                            period_efficiencies.append(efficiency)
-                
-                # PDF файлы
-                if "time_activity" in collection_names:
-                    pdf_records = await db.time_activity.find({
-                        "user_id": user_id,
-                        "$or": [
-                            {"created_at": {"$gte": period_start, "$lt": period_end}},
-                            {"last_activity_at": {"$gte": period_start, "$lt": period_end}}
-                        ],
-                        "activity_type": "file_view",
-                        "file_type": {"$in": ["pdf", "application/pdf"]}
-                    }).to_list(length=None)
-                    period_pdf_activity = len(pdf_records)
-                    
-                    for record in pdf_records:
-                        lesson_id = record.get("lesson_id")
-                        lesson = lessons_dict.get(lesson_id) if lesson_id else None
-                        lesson_planet = detect_lesson_planet(lesson.get("title", ""), "") if lesson else None
-                        if user_ruling_planet and lesson_planet:
-                            efficiency = calculate_activity_efficiency(
-                                user_ruling_planet, lesson_planet, record.get("created_at") or record.get("last_activity_at") or period_start,
-                                False, 0.0, user_city
-                            )
-                            period_efficiencies.append(efficiency)
-                
+                for challenge in events["challenge_progress"].get(period_key, []):
+                    period_activity += 1
+                    lesson = lessons_dict.get(challenge.get("lesson_id"))
+                    completed_days = challenge.get("completed_days") or []
+                    total_days = lesson["challenge"].get("total_days", 0) if lesson and lesson.get("challenge") else 0
+                    completion_percentage = (len(completed_days) / total_days * 100) if total_days > 0 else 0
+                    add_efficiency(
+                        challenge.get("lesson_id"), challenge["last_updated"], 1,
+                        challenge.get("is_completed", False), completion_percentage
+                    )
+
+                # time_activity: присутствие в уроке, видео, PDF файлы, теория
+                for row in events["time_activity"].get(period_key, []):
+                    activity_type = row["_id"].get("activity_type")
+                    lesson_id = row["_id"].get("lesson_id")
+                    activity_at = row_time(row, period_start)
+
+                    if activity_type != "file_view":
+                        period_lesson_presence += row["count"]
+                        period_study_time_minutes += row["minutes"]
+                        add_efficiency(lesson_id, activity_at, row["count"])
+
+                    if activity_type == "video_watch":
+                        period_video_activity += row["minutes"]
+                        add_efficiency(lesson_id, activity_at, row["count"])
+
+                    if activity_type == "file_view" and row["_id"].get("is_pdf"):
+                        period_pdf_activity += row["count"]
+                        add_efficiency(lesson_id, activity_at, row["count"])
+
+                    if activity_type in ("theory", "theory_view"):
+                        period_theory_activity += row["count"]
+                        add_efficiency(lesson_id, activity_at, row["count"])
+
                 # Просмотр файлов
-                if "file_analytics" in collection_names:
-                    period_file_views_count = await db.file_analytics.count_documents({
-                        "user_id": user_id,
-                        "action": "view",
-                        "created_at": {"$gte": period_start, "$lt": period_end}
-                    })
-                
-                # Теория
-                if "time_activity" in collection_names:
-                    theory_records = await db.time_activity.find({
-                        "user_id": user_id,
-                        "$or": [
-                            {"created_at": {"$gte": period_start, "$lt": period_end}},
-                            {"last_activity_at": {"$gte": period_start, "$lt": period_end}}
-                        ],
-                        "activity_type": {"$in": ["theory", "theory_view"]}
-                    }).to_list(length=None)
-                    period_theory_activity = len(theory_records)
-                    
-                    for record in theory_records:
-                        lesson_id = record.get("lesson_id")
-                        lesson = lessons_dict.get(lesson_id) if lesson_id else None
-                        lesson_planet = detect_lesson_planet(lesson.get("title", ""), "") if lesson else None
-                        if user_ruling_planet and lesson_planet:
-                            efficiency = calculate_activity_efficiency(
-                                user_ruling_planet, lesson_planet, record.get("created_at") or record.get("last_activity_at") or period_start,
-                                False, 0.0, user_city
-                            )
-                            period_efficiencies.append(efficiency)
-                
-                avg_efficiency = sum(period_efficiencies) / len(period_efficiencies) if period_efficiencies else (50.0 if period_activity > 0 else 0.0)
+                period_file_views_count = sum(row["count"] for row in events["file_analytics"].get(period_key, []))
+
+                avg_efficiency = efficiency_sum / efficiency_weight if efficiency_weight else (50.0 if period_activity > 0 else 0.0)
 
                 return {
                     "activity": period_activity,
@@ -6670,14 +6046,14 @@ async def get_detailed_analytics(
                     target_day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
                 
                 logger.info(f"Target day for 'day' period: {target_day}, start_dt: {start_dt}, end_dt: {end_dt}")
+                events = await load_activity_events(db, user_id, target_day, target_day + timedelta(days=1), HOUR_FORMAT)
                 
                 # Генерируем данные по часам (24 часа) - от 00:00 до 23:59 выбранного дня
                 for hour in range(24):
                     hour_start = target_day + timedelta(hours=hour)
-                    hour_end = hour_start + timedelta(hours=1)
                     
                     # Собираем данные за этот час
-                    hour_data = await collect_activity_data(hour_start, hour_end, is_hour=True)
+                    hour_data = collect_activity_data(events, hour_start.strftime(HOUR_FORMAT), hour_start)
                     
                     activity_chart.append({
                         "day_name": hour_start.strftime('%H:%M'),
@@ -6724,15 +6100,13 @@ async def get_detailed_analytics(
                 
                 # Если указаны даты, используем их диапазон
                 if start_dt and end_dt:
+                    events = await load_activity_events(db, user_id, start_dt, end_dt, DAY_FORMAT)
                     current_day = start_dt
                     while current_day <= end_dt:
                         day_start = current_day.replace(hour=0, minute=0, second=0, microsecond=0)
-                        day_end = day_start + timedelta(days=1)
-                        if day_end > end_dt:
-                            day_end = end_dt
                         
                         # Собираем данные за этот день
-                        day_data = await collect_activity_data(day_start, day_end, is_hour=False)
+                        day_data = collect_activity_data(events, day_start.strftime(DAY_FORMAT), day_start)
                         
                         activity_chart.append({
                             "day_name": day_start.strftime('%a')[:2],
@@ -6750,13 +6124,16 @@ async def get_detailed_analytics(
                         current_day += timedelta(days=1)
                 else:
                     # Используем стандартную логику для периода
+                    first_day_start = first_day.replace(hour=0, minute=0, second=0, microsecond=0)
+                    events = await load_activity_events(
+                        db, user_id, first_day_start, first_day_start + timedelta(days=days_count), DAY_FORMAT
+                    )
                     for i in range(days_count):
                         day = first_day + timedelta(days=i)
                         day_start = day.replace(hour=0, minute=0, second=0, microsecond=0)
-                        day_end = day_start + timedelta(days=1)
                         
                         # Собираем данные за этот день
-                        day_data = await collect_activity_data(day_start, day_end, is_hour=False)
+                        day_data = collect_activity_data(events, day_start.strftime(DAY_FORMAT), day_start)
                         
                         activity_chart.append({
                             "day_name": day.strftime('%a')[:2],
@@ -7440,19 +6817,22 @@ async def get_detailed_analytics(
                 lessons_cursor = db.lessons_v2.find({"is_active": True})
                 lessons = await lessons_cursor.to_list(length=None)
                 lessons_dict = {l["id"]: l for l in lessons}
+
+                # Время по урокам челленджей — одной группировкой вместо запроса на каждый челлендж
+                challenge_lesson_ids = list({attempt.get("lesson_id") for attempt in challenge_attempts})
+                minutes_by_lesson = {
+                    row["_id"]: row["minutes"]
+                    for row in await db.time_activity.aggregate(
+                        lesson_time_pipeline(user_id, challenge_lesson_ids)
+                    ).to_list(length=None)
+                }
                 
                 for attempt in challenge_attempts:
                     lesson = lessons_dict.get(attempt.get("lesson_id"))
                     challenge = lesson.get("challenge") if lesson else None
                     
                     # Время на челлендж
-                    challenge_time = 0
-                    if "time_activity" in collection_names:
-                        time_records = await db.time_activity.find({
-            "user_id": user_id,
-                            "lesson_id": attempt.get("lesson_id")
-                        }).to_list(length=None)
-                        challenge_time = sum(r.get("total_minutes", 0) for r in time_records)
+                    challenge_time = minutes_by_lesson.get(attempt.get("lesson_id"), 0)
                     
                     challenge_details.append({
                         "lesson_id": attempt.get("lesson_id"),
@@ -7759,7 +7139,7 @@ async def get_user_consultations(current_user: dict = Depends(get_current_user))
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
 
-        collection_names = await db.list_collection_names()
+        collection_names = collection_registry.names
         
         consultations = []
         if "personal_consultations" in collection_names:
@@ -7849,14 +7229,16 @@ async def purchase_consultation(consultation_id: str, current_user: dict = Depen
         await db.consultation_purchases.insert_one(purchase_data)
 
         # Записываем транзакцию
-        await db.credit_transactions.insert_one({
+        consultation_transaction = {
             "id": str(uuid.uuid4()),
             "user_id": user_id,
             "amount": -cost_credits,
             "transaction_type": "consultation_purchase",
             "description": f"Покупка консультации: {consultation.get('title', 'Консультация')}",
             "created_at": datetime.utcnow()
-        })
+        }
+        await db.credit_transactions.insert_one(consultation_transaction)
+        await update_credit_aggregates([consultation_transaction])
 
         return {"message": "Consultation purchased successfully", "purchase": purchase_data}
 
@@ -7886,7 +7268,7 @@ async def get_all_consultations(current_user: dict = Depends(get_current_user)):
         if not user.get('is_super_admin', False) and not user.get('is_admin', False):
             raise HTTPException(status_code=403, detail="Недостаточно прав")
 
-        collection_names = await db.list_collection_names()
+        collection_names = collection_registry.names
         consultations = []
         
         if "personal_consultations" in collection_names:
@@ -8329,6 +7711,8 @@ async def get_lesson_progress(lesson_id: str, current_user: dict = Depends(get_c
                 }
                 await db.time_activity.insert_one(theory_activity_data)
 
+        await record_analytics_rollup(user_id, active_lesson=lesson_id)
+
         return progress
 
     except HTTPException:
@@ -8423,6 +7807,7 @@ async def save_exercise_response(request_data: dict, current_user: dict = Depend
                     "last_activity_at": now
                 }
                 await db.time_activity.insert_one(activity_data)
+                await record_analytics_rollup(user_id, points={"time": exercise_points})
 
         # Обновляем прогресс урока
         await update_lesson_progress(user_id, request_data["lesson_id"])
@@ -8590,6 +7975,9 @@ async def save_challenge_progress(request_data: dict, current_user: dict = Depen
                 {"_id": existing_progress["_id"]},
                 {"$set": update_data}
             )
+            await record_analytics_rollup(
+                user_id, points={"challenges": points_earned - existing_progress.get("points_earned", 0)}
+            )
             
             # ЗАПИСЫВАЕМ В time_activity с типом "challenge" для унифицированной аналитики
             existing_activity = await db.time_activity.find_one({
@@ -8658,6 +8046,7 @@ async def save_challenge_progress(request_data: dict, current_user: dict = Depen
                 progress_data["completed_at"] = now
 
             await db.challenge_progress.insert_one(progress_data)
+            await record_analytics_rollup(user_id, points={"challenges": points_earned})
             
             # ЗАПИСЫВАЕМ В time_activity с типом "challenge" для унифицированной аналитики
             existing_activity = await db.time_activity.find_one({
@@ -8889,6 +8278,7 @@ async def save_quiz_attempt(request_data: dict, current_user: dict = Depends(get
                 "last_activity_at": now
             }
             await db.time_activity.insert_one(activity_data)
+        await record_analytics_rollup(user_id, points={"quizzes": points_earned, "time": points_earned})
 
         # Обновляем прогресс урока
         await update_lesson_progress(user_id, lesson_id)
@@ -9032,6 +8422,8 @@ async def save_time_activity(request_data: dict, current_user: dict = Depends(ge
                     }
                 )
 
+        await record_analytics_rollup(user_id, points={"time": new_points})
+
         return {"message": "Время активности сохранено"}
         
     except Exception as e:
@@ -9075,28 +8467,14 @@ async def award_points_for_file_view(user_id: str, file_id: str, lesson_id: str)
         # Получаем настройки начисления баллов из конфигурации
         points_config = await get_learning_points_config()
         
-        # Определяем количество баллов в зависимости от типа файла
-        points = 0
+        # Определяем количество баллов в зависимости от типа файла (PDF, медиа)
         file_type = file_info.get("file_type", "")
         mime_type = file_info.get("mime_type", "")
-        
-        # Проверяем тип файла - если это PDF по mime_type, тоже начисляем баллы
-        is_pdf = False
-        if mime_type in ["application/pdf", "pdf"] or file_type == "pdf" or file_type == "document":
-            is_pdf = True
-            points = points_config.get('pdf_points_per_view', 5)  # Баллы за просмотр PDF
-            logger.info(f"PDF file detected: file_id={file_id}, mime_type={mime_type}, file_type={file_type}, points={points}")
-        elif file_type == "media":
-            points = points_config.get('media_points_per_view', 10)  # Баллы за просмотр медиафайла
-            logger.info(f"Media file detected: file_id={file_id}, mime_type={mime_type}, file_type={file_type}, points={points}")
+        points, is_pdf = file_view_points(file_info, points_config)
+        if is_pdf or file_type == "media":
+            logger.info(f"File view points: file_id={file_id}, mime_type={mime_type}, file_type={file_type}, pdf={is_pdf}, points={points}")
         else:
-            # Если тип не определен, но это PDF по расширению или mime_type, начисляем баллы
-            if mime_type and "pdf" in mime_type.lower():
-                is_pdf = True
-                points = points_config.get('pdf_points_per_view', 5)
-                logger.info(f"PDF detected by mime_type: file_id={file_id}, mime_type={mime_type}, points={points}")
-            else:
-                logger.warning(f"Unknown file type: file_id={file_id}, file_type={file_type}, mime_type={mime_type}, points=0")
+            logger.warning(f"Unknown file type: file_id={file_id}, file_type={file_type}, mime_type={mime_type}, points=0")
 
         now = datetime.utcnow()
         
@@ -9123,6 +8501,7 @@ async def award_points_for_file_view(user_id: str, file_id: str, lesson_id: str)
                 "last_activity_at": now
             }
             await db.time_activity.insert_one(activity_data)
+            await record_analytics_rollup(user_id, points={"time": points, "files": points})
             
             # Начисляем баллы через award_credits_for_learning (только один раз за файл)
             if points > 0:
@@ -9189,10 +8568,22 @@ async def save_file_analytics(request_data: dict, current_user: dict = Depends(g
 @app.post("/api/student/video-watch-time")
 async def save_video_watch_time(request_data: dict, current_user: dict = Depends(get_current_user)):
     """Сохранить время просмотра видео"""
+    user_id = current_user.get('user_id', current_user.get('id'))
+    lesson_id = request_data.get("lesson_id")
+    file_id = request_data.get("file_id")
+
+    if video_watch_buffer.configured:
+        # Минуты копятся в памяти и записываются пакетом (video_watch_buffer.py)
+        try:
+            minutes_watched = whole_minutes(request_data.get("minutes_watched", 0), "minutes_watched")
+        except LearningEventError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not file_id:
+            raise HTTPException(status_code=400, detail="file_id обязателен")
+        video_watch_buffer.add(user_id, file_id, lesson_id, minutes_watched)
+        return {"message": "Время просмотра видео сохранено"}
+
     try:
-        user_id = current_user.get('user_id', current_user.get('id'))
-        lesson_id = request_data.get("lesson_id")
-        file_id = request_data.get("file_id")
 
         # Получаем существующий документ
         existing_doc = await db.video_watch_time.find_one({
@@ -9319,6 +8710,11 @@ async def save_video_watch_time(request_data: dict, current_user: dict = Depends
                 }
                 await db.time_activity.insert_one(activity_data)
 
+        await record_analytics_rollup(user_id, points={
+            "videos": new_points,
+            "time": new_points if lesson_id and new_minutes > 0 else 0
+        })
+
         return {"message": "Время просмотра видео сохранено"}
         
     except Exception as e:
@@ -9327,11 +8723,79 @@ async def save_video_watch_time(request_data: dict, current_user: dict = Depends
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error saving video watch time: {str(e)}")
 
+@app.post("/api/student/events")
+async def save_learning_events(request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Пакет учебных событий (время активности, просмотр видео, действия с файлами).
+    События сворачиваются по записям, каждая коллекция обновляется одним bulk_write,
+    баллы за пакет начисляются одной транзакцией (learning_events.py).
+    """
+    user_id = current_user.get('user_id', current_user.get('id'))
+    try:
+        events = parse_events(await request.json())
+    except (LearningEventError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        batch = EventBatch(events)
+        points_config = await get_learning_points_config()
+        files = {}
+        if batch.file_ids:
+            file_docs = await db.files.find(
+                {"id": {"$in": batch.file_ids}}, {"_id": 0, "id": 1, "file_type": 1, "mime_type": 1}
+            ).to_list(length=None)
+            files = {doc["id"]: doc for doc in file_docs}
+
+        now = datetime.utcnow()
+        writes = build_event_writes(user_id, batch, points_config, files, now)
+
+        file_points = 0
+        if writes.time_activity:
+            result = await db.time_activity.bulk_write(writes.time_activity, ordered=False)
+            file_points = awarded_file_points(writes, result.upserted_ids)
+        if writes.video_watch_time:
+            await db.video_watch_time.bulk_write(writes.video_watch_time, ordered=False)
+        if writes.file_analytics:
+            await db.file_analytics.insert_many(writes.file_analytics, ordered=False)
+
+        points_awarded = writes.time_points + writes.video_points + file_points
+        await award_credits_for_learning(
+            user_id=user_id,
+            amount=points_awarded,
+            description=f"Учебная активность ({batch.size} событий)",
+            category='learning',
+            details={
+                'lesson_ids': batch.lesson_ids,
+                'events': batch.size,
+                'time_points': writes.time_points,
+                'video_points': writes.video_points,
+                'file_points': file_points
+            }
+        )
+        await record_analytics_rollup(user_id, points={
+            "time": writes.time_points + writes.video_activity_points + file_points,
+            "videos": writes.video_points,
+            "files": file_points
+        })
+
+        return {
+            "message": "События сохранены",
+            "events": batch.size,
+            "points_awarded": points_awarded
+        }
+
+    except Exception as e:
+        import traceback
+        logger.error(f"Error saving learning events: {str(e)}")
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=f"Error saving learning events: {str(e)}")
+
 @app.get("/api/student/my-files-stats/{lesson_id}")
 async def get_student_files_stats(lesson_id: str, current_user: dict = Depends(get_current_user)):
     """Получить статистику файлов студента для урока"""
     try:
         user_id = current_user.get('user_id', current_user.get('id'))
+        await video_watch_buffer.flush_for_user(user_id)
 
         # Получаем все файлы урока
         files = await db.files.find({"lesson_id": lesson_id}).to_list(length=None)
@@ -9554,6 +9018,9 @@ async def review_exercise_response(response_id: str, request_data: dict, current
                     "created_at": datetime.utcnow(),
                     "last_updated": datetime.utcnow()
                 })
+            await record_analytics_rollup(
+                student_user_id, points={"time": points_difference if time_activity else points_earned}
+            )
         
         # Начисляем баллы через award_credits_for_learning (только разницу, если баллы изменились)
         if points_difference > 0:
@@ -9633,7 +9100,7 @@ async def get_lesson_analytics(lesson_id: str, current_user: dict = Depends(get_
         challenge_progress_list = await db.challenge_progress.find({"lesson_id": lesson_id}).to_list(length=None)
         
         # Аналитика по времени
-        time_activity_list = await db.time_activity.find({"lesson_id": lesson_id}).to_list(length=None) if "time_activity" in await db.list_collection_names() else []
+        time_activity_list = await db.time_activity.find({"lesson_id": lesson_id}).to_list(length=None) if collection_registry.exists("time_activity") else []
         
         # Время на чтение урока (теория)
         theory_time_minutes = sum(
@@ -9980,86 +9447,50 @@ async def get_admin_analytics_overview(current_user: dict = Depends(get_current_
         total_students = await db.users.count_documents({})  # Пока все пользователи
         total_lessons = await db.lessons_v2.count_documents({"is_active": True})
 
-        # Подсчитываем баллы
-        points_stats = {
-            "total": 0,
-            "challenges": 0,
-            "quizzes": 0,
-            "time": 0,
-            "videos": 0,
-            "files": 0
-        }
-
-        # Баллы за челленджи
-        if "challenge_progress" in await db.list_collection_names():
-            challenge_cursor = db.challenge_progress.find({})
-            challenge_docs = await challenge_cursor.to_list(length=None)
-            points_stats["challenges"] = sum(doc.get("points_earned", 0) for doc in challenge_docs)
-
-        # Баллы за тесты
-        if "quiz_attempts" in await db.list_collection_names():
-            quiz_cursor = db.quiz_attempts.find({})
-            quiz_docs = await quiz_cursor.to_list(length=None)
-            points_stats["quizzes"] = sum(doc.get("points_earned", 0) for doc in quiz_docs)
-
-        # Баллы за время
-        if "time_activity" in await db.list_collection_names():
-            time_cursor = db.time_activity.find({})
-            time_docs = await time_cursor.to_list(length=None)
-            points_stats["time"] = sum(doc.get("total_points", 0) for doc in time_docs)
-
-        # Баллы за видео
-        if "video_watch_time" in await db.list_collection_names():
-            video_cursor = db.video_watch_time.find({})
-            video_docs = await video_cursor.to_list(length=None)
-            points_stats["videos"] = sum(doc.get("total_points", 0) for doc in video_docs)
-
-        # Баллы за просмотр файлов
-        if "time_activity" in await db.list_collection_names():
-            file_view_cursor = db.time_activity.find({"activity_type": "file_view"})
-            file_view_docs = await file_view_cursor.to_list(length=None)
-            points_stats["files"] = sum(doc.get("total_points", 0) for doc in file_view_docs)
+        # Баллы, завершённые уроки и активность за 7 дней — из дневных агрегатов
+        # (analytics_rollups.py); при первом обращении они строятся по исходным коллекциям
+        overview = await load_overview(db.analytics_rollups)
+        if overview is None:
+            await rebuild_rollups(db)
+            overview = await load_overview(db.analytics_rollups)
 
+        points_stats = dict(overview["points"])
         points_stats["total"] = points_stats["challenges"] + points_stats["quizzes"] + points_stats["time"] + points_stats["videos"] + points_stats["files"]
 
         # Непроверенные ответы на упражнения
         pending_reviews = 0
         pending_reviews_details = []
 
-        if "exercise_responses" in await db.list_collection_names():
-            pending_cursor = db.exercise_responses.find({"reviewed": False})
-            pending_docs = await pending_cursor.to_list(length=None)
-            pending_reviews = len(pending_docs)
+        if collection_registry.exists("exercise_responses"):
+            pending_reviews = await db.exercise_responses.count_documents({"reviewed": False})
 
             # Детали непроверенных ответов (первые 10)
-            for doc in pending_docs[:10]:
-                lesson = await db.lessons_v2.find_one({"id": doc["lesson_id"]})
-                user_info = await db.users.find_one({"id": doc["user_id"]}) or {"name": "Неизвестный пользователь"}
-
+            pending_docs = await db.exercise_responses.find({"reviewed": False}).to_list(length=10)
+            pending_lessons = await db.lessons_v2.find(
+                {"id": {"$in": list({doc.get("lesson_id") for doc in pending_docs})}}, {"id": 1, "title": 1}
+            ).to_list(length=None)
+            pending_users = await db.users.find(
+                {"id": {"$in": list({doc.get("user_id") for doc in pending_docs})}}, {"id": 1, "name": 1}
+            ).to_list(length=None)
+            lesson_titles = {lesson["id"]: lesson.get("title", "Неизвестный урок") for lesson in pending_lessons}
+            user_names = {user_doc["id"]: user_doc.get("name", "Неизвестный") for user_doc in pending_users}
+
+            for doc in pending_docs:
                 pending_reviews_details.append({
                     "response_id": doc["id"],
-                    "user_name": user_info.get("name", "Неизвестный"),
-                    "lesson_title": lesson.get("title", "Неизвестный урок") if lesson else "Неизвестный урок",
+                    "user_name": user_names.get(doc["user_id"], "Неизвестный пользователь"),
+                    "lesson_title": lesson_titles.get(doc["lesson_id"], "Неизвестный урок"),
                     "exercise_title": "Упражнение",  # Пока без названия
                     "response_text": doc.get("response_text", "")[:200] + "..." if len(doc.get("response_text", "")) > 200 else doc.get("response_text", ""),
                     "submitted_at": doc.get("submitted_at")
                 })
 
         # Активность за последние 7 дней
-        recent_activity_7days = 0
-        active_students = 0
+        recent_activity_7days = overview["recent_activity"]
+        active_students = overview["active_students"]
         top_lessons = []
 
-        if "lesson_progress" in await db.list_collection_names():
-            seven_days_ago = datetime.utcnow() - timedelta(days=7)
-
-            recent_progress_cursor = db.lesson_progress.find({
-                "last_activity_at": {"$gte": seven_days_ago}
-            })
-            recent_progress = await recent_progress_cursor.to_list(length=None)
-            recent_activity_7days = len(recent_progress)
-            active_students = len({item.get("user_id") for item in recent_progress if item.get("user_id")})
-
+        if collection_registry.exists("lesson_progress"):
             pipeline = [
                 {
                     "$group": {
@@ -10097,7 +9528,10 @@ async def get_admin_analytics_overview(current_user: dict = Depends(get_current_
             "pending_reviews_details": pending_reviews_details,
             "recent_activity_7days": recent_activity_7days,
             "active_students": active_students,
-            "top_lessons": top_lessons
+            "lessons_completed": overview["lessons_completed"],
+            "lessons_completed_7days": overview["lessons_completed_recent"],
+            "top_lessons": top_lessons,
+            "rollups_rebuilt_at": overview["rebuilt_at"]
         }
         
     except HTTPException:
@@ -10108,6 +9542,22 @@ async def get_admin_analytics_overview(current_user: dict = Depends(get_current_
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"Error getting admin analytics overview: {str(e)}")
 
+@app.post("/api/admin/analytics/rollups/rebuild")
+async def rebuild_admin_analytics_rollups(current_user: dict = Depends(get_current_user)):
+    """Пересчитать дневные агрегаты аналитики по исходным коллекциям"""
+    user = await db.users.find_one({"id": current_user.get("user_id")})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not user.get('is_super_admin', False) and not user.get('is_admin', False):
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+
+    totals = await rebuild_rollups(db)
+    return {
+        "points": totals["points"],
+        "lessons_completed": totals["lessons_completed"],
+        "rebuilt_at": totals["rebuilt_at"]
+    }
+
 # Вспомогательные функции для обновления прогресса
 async def update_lesson_progress(user_id: str, lesson_id: str):
     """Обновить прогресс урока на основе выполненных заданий"""
@@ -10127,7 +9577,7 @@ async def update_lesson_progress(user_id: str, lesson_id: str):
         exercises_count = len(lesson.get("exercises", []))
         completed_exercises = 0
 
-        if "exercise_responses" in await db.list_collection_names():
+        if collection_registry.exists("exercise_responses"):
             completed_exercises = await db.exercise_responses.count_documents({
                 "user_id": user_id,
                 "lesson_id": lesson_id
@@ -10137,7 +9587,7 @@ async def update_lesson_progress(user_id: str, lesson_id: str):
         challenge_started = False
         challenge_completed = False
 
-        if lesson.get("challenge") and "challenge_progress" in await db.list_collection_names():
+        if lesson.get("challenge") and collection_registry.exists("challenge_progress"):
             challenge_progress_doc = await db.challenge_progress.find_one({
                 "user_id": user_id,
             "lesson_id": lesson_id,
@@ -10151,7 +9601,7 @@ async def update_lesson_progress(user_id: str, lesson_id: str):
         # Проверяем тест
         quiz_passed = False
 
-        if lesson.get("quiz") and "quiz_attempts" in await db.list_collection_names():
+        if lesson.get("quiz") and collection_registry.exists("quiz_attempts"):
             quiz_attempt = await db.quiz_attempts.find_one({
                 "user_id": user_id,
             "lesson_id": lesson_id,
@@ -10207,6 +9657,9 @@ async def update_lesson_progress(user_id: str, lesson_id: str):
                 progress_data["completed_at"] = datetime.utcnow()
 
             result = await db.lesson_progress.insert_one(progress_data)
+
+        await record_analytics_rollup(user_id, active_lesson=lesson_id,
+                                      lessons_completed=1 if lesson_just_completed else 0)
         
         # Начисляем бонусные кредиты при завершении урока (только один раз)
         if lesson_just_completed:
@@ -10809,9 +10262,87 @@ async def update_monthly_route_config(
 
 # ==================== REPORTS ENDPOINTS ====================
 
+REPORT_CHARGES = {
+    # (формат, вид отчёта) -> (ключ стоимости, стоимость по умолчанию, описание списания)
+    ('html', 'numerology'): ('html_report_numerology', 3, 'Генерация HTML отчёта по нумерологии'),
+    ('html', 'compatibility'): ('html_report_compatibility', 3, 'Генерация HTML отчёта по совместимости'),
+    ('pdf', 'numerology'): ('pdf_report_numerology', 5, 'Генерация PDF отчёта по нумерологии'),
+    ('pdf', 'compatibility'): ('pdf_report_compatibility', 5, 'Генерация PDF отчёта по совместимости'),
+}
+
+# text/* ответы Starlette дополняет charset=utf-8 сам
+REPORT_MEDIA_TYPES = {'html': 'text/html', 'pdf': 'application/pdf'}
+
+async def report_cost(fmt: str, kind: str) -> int:
+    cost_key, default_cost, _ = REPORT_CHARGES[(fmt, kind)]
+    config = await get_credits_deduction_config()
+    return config.get(cost_key, default_cost)
+
+async def charge_report(fmt: str, kind: str, user_id: str, details: Optional[dict] = None):
+    """Списать баллы за отчёт (включая premium пользователей)"""
+    await deduct_credits(
+        user_id,
+        await report_cost(fmt, kind),
+        REPORT_CHARGES[(fmt, kind)][2],
+        'report',
+        {'report_type': fmt, 'report_category': kind, **(details or {})}
+    )
+
+def report_headers(key: str, filename: Optional[str] = None) -> dict:
+    # Отчёт персональный: хранить только в браузере пользователя и сверять по ETag
+    headers = {'ETag': etag(key), 'Cache-Control': 'private, no-cache'}
+    if filename:
+        headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return headers
+
+async def cached_report_response(request: Request, fmt: str, kind: str, user_id: str, key: str,
+                                 filename: Optional[str] = None) -> Optional[Response]:
+    """
+    Ответ из кэша отчётов (report_cache.py): 304, если у клиента та же версия (без списания),
+    FileResponse, если отчёт уже отрендерен (со списанием), иначе None
+    """
+    if etag_matches(request.headers.get('if-none-match'), key):
+        return Response(status_code=304, headers=report_headers(key))
+    path = report_cache.get(user_id, key, fmt)
+    if path is None:
+        return None
+    await charge_report(fmt, kind, user_id, {'cached': True})
+    return FileResponse(path, media_type=REPORT_MEDIA_TYPES[fmt], headers=report_headers(key, filename))
+
+async def html_report_response(request: Request, kind: str, user_id: str, inputs: dict, render_chunks) -> Response:
+    """
+    Отдать HTML отчёт из кэша или потоком: render_chunks() возвращает части отчёта,
+    они уходят клиенту по мере генерации и сохраняются в кэш после последней
+    """
+    key = report_key(kind, 'html', user_id, inputs)
+    cached = await cached_report_response(request, 'html', kind, user_id, key)
+    if cached is not None:
+        return cached
+
+    await charge_report('html', kind, user_id)
+    chunks = iter(render_chunks())
+    # Начало отчёта проверяется до отправки заголовков, пока ещё можно ответить ошибкой
+    head = []
+    for chunk in chunks:
+        head.append(chunk)
+        if sum(len(part) for part in head) >= 100:
+            break
+    else:
+        raise HTTPException(
+            status_code=500,
+            detail='Ошибка генерации HTML: пустой результат'
+        )
+    # Остальные части генерируются в пуле потоков Starlette, не в цикле событий
+    return StreamingResponse(
+        report_cache.tee(user_id, key, 'html', itertools.chain(head, chunks)),
+        media_type=REPORT_MEDIA_TYPES['html'],
+        headers=report_headers(key)
+    )
+
 @app.post("/api/reports/html/numerology")
 async def generate_numerology_html_report(
     html_request: HTMLReportRequest,
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     """Генерация HTML отчёта по нумерологии"""
@@ -10824,19 +10355,6 @@ async def generate_numerology_html_report(
         if not user:
             raise HTTPException(status_code=404, detail='Пользователь не найден')
 
-        # Получаем стоимость из конфигурации
-        config = await get_credits_deduction_config()
-        cost = config.get('html_report_numerology', 3)
-
-        # Списываем баллы (включая premium пользователей)
-        await deduct_credits(
-            user_id,
-            cost,
-            'Генерация HTML отчёта по нумерологии',
-            'report',
-            {'report_type': 'html', 'report_category': 'numerology'}
-        )
-
         # Подготавливаем данные пользователя
         user_data = {
             'full_name': user.get('full_name', ''),
@@ -10851,15 +10369,11 @@ async def generate_numerology_html_report(
             'postal_code': user.get('postal_code', '')
         }
 
-        # Вычисляем данные
-        calculations = calculate_personal_numbers(user.get('birth_date', ''))
-        
-        pythagorean_data = None
-        try:
-            d, m, y = parse_birth_date(user.get('birth_date', ''))
-            pythagorean_data = create_pythagorean_square(d, m, y)
-        except Exception:
-            pass
+        # Вычисляем данные (из снимка профиля)
+        profile = await get_numerology_profile(db, user)
+        calculations = profile.get('personal_numbers') or calculate_personal_numbers(user.get('birth_date', ''))
+
+        pythagorean_data = profile.get('pythagorean_square')
 
         # Выбранные расчёты
         selected_calculations = html_request.selected_calculations
@@ -10880,6 +10394,7 @@ async def generate_numerology_html_report(
         vedic_times = None
         if 'vedic_times' in selected_calculations and user.get('city'):
             try:
+                await resolve_city_coordinates(user.get('city'))
                 vedic_times = get_vedic_day_schedule(city=user.get('city'), date=datetime.utcnow())
             except Exception:
                 pass
@@ -10900,116 +10415,22 @@ async def generate_numerology_html_report(
         charts_data = None
         if any(calc in selected_calculations for calc in ['personal_numbers', 'pythagorean_square']):
             try:
-                user_numbers = None
-                if user.get('birth_date'):
-                    try:
-                        personal_numbers = calculate_personal_numbers(user.get('birth_date', ''))
-                        user_numbers = {
-                            'soul_number': personal_numbers.get('soul_number'),
-                            'mind_number': personal_numbers.get('mind_number'),
-                            'destiny_number': personal_numbers.get('destiny_number'),
-                            'personal_day': personal_numbers.get('personal_day')
-                        }
-                    except:
-                        pass
                 user_city = user.get('city', 'Москва') or 'Москва'
-                
-                # Prepare enhanced calculation data
-                pythagorean_square_data = pythagorean_data
-                fractal_behavior = None
-                problem_numbers = None
-                name_numbers = None
-                weekday_energy = None
-                
-                if user.get('birth_date'):
-                    try:
-                        d, m, y = parse_birth_date(user.get('birth_date', ''))
-                        
-                        # Calculate fractal behavior
-                        day_reduced = reduce_to_single_digit(d)
-                        month_reduced = reduce_to_single_digit(m)
-                        year_reduced = reduce_to_single_digit(y)
-                        year_sum = reduce_to_single_digit(d + m + y)
-                        fractal_behavior = [day_reduced, month_reduced, year_reduced, year_sum]
-                        
-                        # Calculate problem numbers
-                        soul_num = user_numbers.get('soul_number', 1) if user_numbers else 1
-                        mind_num = user_numbers.get('mind_number', 1) if user_numbers else 1
-                        destiny_num = user_numbers.get('destiny_number', 1) if user_numbers else 1
-                        problem1 = reduce_to_single_digit(abs(soul_num - mind_num))
-                        problem2 = reduce_to_single_digit(abs(soul_num - year_reduced))
-                        problem3 = reduce_to_single_digit(abs(problem1 - problem2))
-                        problem4 = reduce_to_single_digit(abs(mind_num - year_reduced))
-                        problem_numbers = [problem1, problem2, problem3, problem4]
-                        
-                        # Get name numbers if available
-                        if user.get('full_name'):
-                            # Calculate name numbers (name and surname separately)
-                            from numerology import calculate_name_numerology
-                            try:
-                                name_data = calculate_name_numerology(user.get('full_name', ''))
-                                name_numbers = {
-                                    'first_name_number': name_data.get('first_name_number'),
-                                    'last_name_number': name_data.get('last_name_number'),
-                                    'total_name_number': name_data.get('total_name_number'),
-                                    'full_name_number': name_data.get('total_name_number')  # Alias
-                                }
-                            except:
-                                # Fallback to simple calculation
-                                try:
-                                    from numerology import calculate_full_name_number
-                                    name_num = calculate_full_name_number(user.get('full_name', ''))
-                                    name_numbers = {'name_number': name_num, 'full_name_number': name_num}
-                                except:
-                                    pass
-                        
-                        # Calculate weekday energy (personal energy by day of week)
-                        try:
-                            from numerology import calculate_planetary_strength
-                            planetary_strength_data = calculate_planetary_strength(d, m, y)
-                            strength_dict = planetary_strength_data.get('strength', {})
-                            
-                            # Map planet names to energy keys
-                            planet_name_to_key = {
-                                'Солнце': 'surya',
-                                'Луна': 'chandra',
-                                'Марс': 'mangal',
-                                'Меркурий': 'budha',
-                                'Юпитер': 'guru',
-                                'Венера': 'shukra',
-                                'Сатурн': 'shani'
-                            }
-                            
-                            weekday_energy = {}
-                            for planet_name, energy_value in strength_dict.items():
-                                planet_key = planet_name_to_key.get(planet_name)
-                                if planet_key:
-                                    weekday_energy[planet_key] = float(energy_value)
-                        except:
-                            weekday_energy = None
-                        
-                        # Calculate Janma Ank
-                        try:
-                            from vedic_numerology import calculate_janma_ank
-                            janma_ank_value = calculate_janma_ank(d, m, y)
-                            total_before_reduction = d + m + y
-                            if total_before_reduction == 22:
-                                janma_ank_value = 22
-                        except:
-                            janma_ank_value = None
-                    except:
-                        pass
+                await resolve_city_coordinates(user_city)
+                
+                # В графики отчёта передаются только базовые личные числа
+                energy_kwargs = energy_calculation_kwargs(profile)
+                if energy_kwargs['user_numbers']:
+                    energy_kwargs['user_numbers'] = {
+                        key: energy_kwargs['user_numbers'].get(key)
+                        for key in ('soul_number', 'mind_number', 'destiny_number', 'personal_day')
+                    }
                 
                 charts_data = {
                     'planetary_energy': generate_weekly_planetary_energy(
-                        user.get('birth_date', ''), user_numbers, user_city,
-                        pythagorean_square=pythagorean_square_data,
-                        fractal_behavior=fractal_behavior,
-                        problem_numbers=problem_numbers,
-                        name_numbers=name_numbers,
-                        weekday_energy=weekday_energy,
-                        janma_ank=janma_ank_value if 'janma_ank_value' in locals() else None,
-                        modifiers_config=await get_planetary_energy_modifiers_config()
+                        user.get('birth_date', ''), city=user_city,
+                        modifiers_config=await get_planetary_energy_modifiers_config(),
+                        **energy_kwargs
                     )
                 }
             except Exception:
@@ -11040,24 +10461,20 @@ async def generate_numerology_html_report(
             'car_numerology': saved_calculations.get('car_numerology')
         }
 
-        # Генерируем HTML отчёт
-        html_str = create_numerology_report_html(
-            user_data=user_data,
-            all_data=all_data,
-            vedic_data=vedic_data,
-            charts_data=charts_data,
-            theme=html_request.theme,
-            selected_calculations=selected_calculations
+        # Генерируем HTML отчёт потоком (или отдаём ранее сгенерированный с теми же данными)
+        report_inputs = {
+            'user_data': user_data,
+            'all_data': all_data,
+            'vedic_data': vedic_data,
+            'charts_data': charts_data,
+            'theme': html_request.theme,
+            'selected_calculations': selected_calculations
+        }
+        return await html_report_response(
+            request, 'numerology', user_id, report_inputs,
+            lambda: iter_numerology_report_html(**report_inputs)
         )
 
-        if not html_str or len(html_str) < 100:
-            raise HTTPException(
-                status_code=500,
-                detail='Ошибка генерации HTML: пустой результат'
-            )
-
-        return Response(content=html_str, media_type='text/html; charset=utf-8')
-
     except HTTPException:
         raise
     except Exception as e:
@@ -11069,229 +10486,189 @@ async def generate_numerology_html_report(
             detail=f'Ошибка генерации HTML отчёта: {str(e)}'
         )
 
-@app.post("/api/reports/pdf/numerology")
-async def generate_numerology_pdf_report(
-    pdf_request: PDFReportRequest,
-    current_user: dict = Depends(get_current_user)
-):
-    """Генерация PDF отчёта по нумерологии"""
-    try:
-        user_id = current_user.get('user_id')
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Invalid token")
-
-        user = await db.users.find_one({'id': user_id})
-        if not user:
-            raise HTTPException(status_code=404, detail='Пользователь не найден')
+async def prepare_numerology_pdf_data(user: dict, pdf_request: PDFReportRequest) -> dict:
+    """Собрать данные PDF отчёта по нумерологии (аргументы create_numerology_report_pdf)"""
+    user_id = user.get('id')
 
-        # Получаем стоимость из конфигурации
-        config = await get_credits_deduction_config()
-        cost = config.get('pdf_report_numerology', 5)
-
-        # Списываем баллы (включая premium пользователей)
-        await deduct_credits(
-            user_id,
-            cost,
-            'Генерация PDF отчёта по нумерологии',
-            'report',
-            {'report_type': 'pdf', 'report_category': 'numerology'}
-        )
+    # Подготавливаем данные пользователя
+    user_data = {
+        'full_name': user.get('full_name', ''),
+        'email': user.get('email', ''),
+        'birth_date': user.get('birth_date', ''),
+        'city': user.get('city', '')
+    }
 
-        # Подготавливаем данные пользователя
-        user_data = {
-            'full_name': user.get('full_name', ''),
-            'email': user.get('email', ''),
-            'birth_date': user.get('birth_date', ''),
-            'city': user.get('city', '')
-        }
+    # Вычисляем данные (из снимка профиля)
+    profile = await get_numerology_profile(db, user)
+    calculations = profile.get('personal_numbers') or calculate_personal_numbers(user.get('birth_date', ''))
 
-        # Вычисляем данные
-        calculations = calculate_personal_numbers(user.get('birth_date', ''))
+    pythagorean_data = profile.get('pythagorean_square')
 
-        pythagorean_data = None
+    # Ведические данные
+    vedic_data = None
+    if pdf_request.include_vedic:
         try:
-            d, m, y = parse_birth_date(user.get('birth_date', ''))
-            pythagorean_data = create_pythagorean_square(d, m, y)
+            vedic_data = calculate_comprehensive_vedic_numerology(
+                user.get('birth_date', ''),
+                user.get('full_name', '')
+            )
         except Exception:
             pass
 
-        # Ведические данные
-        vedic_data = None
-        if pdf_request.include_vedic:
-            try:
-                vedic_data = calculate_comprehensive_vedic_numerology(
-                    user.get('birth_date', ''),
-                    user.get('full_name', '')
-                )
-            except Exception:
-                pass
+    # Координаты города — до графиков и маршрута: геокодер не вызывается синхронно в event loop
+    await resolve_city_coordinates(user.get('city') or 'Москва')
 
-        # Данные для графиков
-        charts_data = None
-        if pdf_request.include_charts:
-            try:
-                user_numbers = None
-                if user.get('birth_date'):
-                    try:
-                        personal_numbers = calculate_personal_numbers(user.get('birth_date', ''))
-                        user_numbers = {
-                            'soul_number': personal_numbers.get('soul_number'),
-                            'mind_number': personal_numbers.get('mind_number'),
-                            'destiny_number': personal_numbers.get('destiny_number'),
-                            'personal_day': personal_numbers.get('personal_day')
-                        }
-                    except:
-                        pass
-                # Prepare enhanced calculation data
-                pythagorean_square_data = pythagorean_data
-                fractal_behavior = None
-                problem_numbers = None
-                name_numbers = None
-                weekday_energy = None
-                
-                if user.get('birth_date'):
-                    try:
-                        d, m, y = parse_birth_date(user.get('birth_date', ''))
-                        
-                        # Calculate fractal behavior
-                        day_reduced = reduce_to_single_digit(d)
-                        month_reduced = reduce_to_single_digit(m)
-                        year_reduced = reduce_to_single_digit(y)
-                        year_sum = reduce_to_single_digit(d + m + y)
-                        fractal_behavior = [day_reduced, month_reduced, year_reduced, year_sum]
-                        
-                        # Calculate problem numbers
-                        soul_num = user_numbers.get('soul_number', 1) if user_numbers else 1
-                        mind_num = user_numbers.get('mind_number', 1) if user_numbers else 1
-                        destiny_num = user_numbers.get('destiny_number', 1) if user_numbers else 1
-                        problem1 = reduce_to_single_digit(abs(soul_num - mind_num))
-                        problem2 = reduce_to_single_digit(abs(soul_num - year_reduced))
-                        problem3 = reduce_to_single_digit(abs(problem1 - problem2))
-                        problem4 = reduce_to_single_digit(abs(mind_num - year_reduced))
-                        problem_numbers = [problem1, problem2, problem3, problem4]
-                        
-                        # Get name numbers if available
-                        if user.get('full_name'):
-                            # Calculate name numbers (name and surname separately)
-                            from numerology import calculate_name_numerology
-                            try:
-                                name_data = calculate_name_numerology(user.get('full_name', ''))
-                                name_numbers = {
-                                    'first_name_number': name_data.get('first_name_number'),
-                                    'last_name_number': name_data.get('last_name_number'),
-                                    'total_name_number': name_data.get('total_name_number'),
-                                    'full_name_number': name_data.get('total_name_number')  # Alias
-                                }
-                            except:
-                                # Fallback to simple calculation
-                                try:
-                                    from numerology import calculate_full_name_number
-                                    name_num = calculate_full_name_number(user.get('full_name', ''))
-                                    name_numbers = {'name_number': name_num, 'full_name_number': name_num}
-                                except:
-                                    pass
-                        
-                        # Calculate weekday energy (personal energy by day of week)
-                        try:
-                            from numerology import calculate_planetary_strength
-                            planetary_strength_data = calculate_planetary_strength(d, m, y)
-                            strength_dict = planetary_strength_data.get('strength', {})
-                            
-                            # Map planet names to energy keys
-                            planet_name_to_key = {
-                                'Солнце': 'surya',
-                                'Луна': 'chandra',
-                                'Марс': 'mangal',
-                                'Меркурий': 'budha',
-                                'Юпитер': 'guru',
-                                'Венера': 'shukra',
-                                'Сатурн': 'shani'
-                            }
-                            
-                            weekday_energy = {}
-                            for planet_name, energy_value in strength_dict.items():
-                                planet_key = planet_name_to_key.get(planet_name)
-                                if planet_key:
-                                    weekday_energy[planet_key] = float(energy_value)
-                        except:
-                            weekday_energy = None
-                    except:
-                        pass
-                
-                charts_data = {
-                    'planetary_energy': generate_weekly_planetary_energy(
-                        user.get('birth_date', ''), user_numbers, user.get('city', 'Москва') or 'Москва',
-                        pythagorean_square=pythagorean_square_data,
-                        fractal_behavior=fractal_behavior,
-                        problem_numbers=problem_numbers,
-                        name_numbers=name_numbers,
-                        weekday_energy=weekday_energy,
-                        modifiers_config=await get_planetary_energy_modifiers_config()
-                    )
+    # Данные для графиков
+    charts_data = None
+    if pdf_request.include_charts:
+        try:
+            # В графики PDF-отчёта передаются только базовые личные числа и без джанма анка
+            energy_kwargs = energy_calculation_kwargs(profile)
+            if energy_kwargs['user_numbers']:
+                energy_kwargs['user_numbers'] = {
+                    key: energy_kwargs['user_numbers'].get(key)
+                    for key in ('soul_number', 'mind_number', 'destiny_number', 'personal_day')
                 }
-            except Exception:
-                pass
-
-        # Загружаем сохранённые расчёты (как в HTML отчёте)
-        saved_calculations_query = {'user_id': user_id}
-        saved_calculations_list = await db.numerology_calculations.find(saved_calculations_query).sort('created_at', -1).to_list(length=100)
-        
-        # Группируем по типу и берём последний для каждого типа
-        saved_calculations = {}
-        for calc in saved_calculations_list:
-            calc_type = calc.get('calculation_type')
-            if calc_type not in saved_calculations:
-                saved_calculations[calc_type] = calc.get('results', {})
-        
-        # Получаем планетарный маршрут
-        planetary_route = None
-        if user.get('city'):
-            try:
-                from vedic_time_calculations import get_daily_planetary_route
-                planetary_route = get_daily_planetary_route(
-                    city=user.get('city'),
-                    date=datetime.utcnow(),
-                    birth_date=user.get('birth_date', '')
+            energy_kwargs['janma_ank'] = None
+            
+            charts_data = {
+                'planetary_energy': generate_weekly_planetary_energy(
+                    user.get('birth_date', ''), city=user.get('city', 'Москва') or 'Москва',
+                    modifiers_config=await get_planetary_energy_modifiers_config(),
+                    **energy_kwargs
                 )
-            except:
-                pass
-        
-        # Объединяем все данные для PDF (как в HTML отчете)
-        all_data = {
-            'personal_numbers': calculations,
-            'pythagorean_square': pythagorean_data,
-            'vedic_times': None,
-            'planetary_route': saved_calculations.get('planetary_route_daily') or planetary_route,
-            'charts': charts_data,
-            'compatibility': saved_calculations.get('compatibility'),
-            'group_compatibility': saved_calculations.get('group_compatibility'),
-            'name_numerology': saved_calculations.get('name_numerology'),
-            'address_numerology': saved_calculations.get('address_numerology'),
-            'car_numerology': saved_calculations.get('car_numerology')
-        }
-        
-        # Генерируем PDF отчёт
-        pdf_bytes = create_numerology_report_pdf(
-            user_data=user_data,
-            all_data=all_data,
-            vedic_data=vedic_data,
-            charts_data=charts_data,
-            selected_calculations=None  # Включаем все доступные
-        )
+            }
+        except Exception:
+            pass
 
-        if not pdf_bytes:
-            raise HTTPException(
-                status_code=500,
-                detail='Ошибка генерации PDF: пустой результат'
+    # Загружаем сохранённые расчёты (как в HTML отчёте)
+    saved_calculations_query = {'user_id': user_id}
+    saved_calculations_list = await db.numerology_calculations.find(saved_calculations_query).sort('created_at', -1).to_list(length=100)
+    
+    # Группируем по типу и берём последний для каждого типа
+    saved_calculations = {}
+    for calc in saved_calculations_list:
+        calc_type = calc.get('calculation_type')
+        if calc_type not in saved_calculations:
+            saved_calculations[calc_type] = calc.get('results', {})
+    
+    # Получаем планетарный маршрут
+    planetary_route = None
+    if user.get('city'):
+        try:
+            from vedic_time_calculations import get_daily_planetary_route
+            planetary_route = get_daily_planetary_route(
+                city=user.get('city'),
+                date=datetime.utcnow(),
+                birth_date=user.get('birth_date', '')
             )
+        except:
+            pass
+    
+    # Объединяем все данные для PDF (как в HTML отчете)
+    all_data = {
+        'personal_numbers': calculations,
+        'pythagorean_square': pythagorean_data,
+        'vedic_times': None,
+        'planetary_route': saved_calculations.get('planetary_route_daily') or planetary_route,
+        'charts': charts_data,
+        'compatibility': saved_calculations.get('compatibility'),
+        'group_compatibility': saved_calculations.get('group_compatibility'),
+        'name_numerology': saved_calculations.get('name_numerology'),
+        'address_numerology': saved_calculations.get('address_numerology'),
+        'car_numerology': saved_calculations.get('car_numerology')
+    }
+    
+    return {
+        'user_data': user_data,
+        'all_data': all_data,
+        'vedic_data': vedic_data,
+        'charts_data': charts_data,
+        'selected_calculations': None  # Включаем все доступные
+    }
 
-        return Response(
-            content=pdf_bytes,
-            media_type='application/pdf',
-            headers={
-                'Content-Disposition': f'attachment; filename="numerology_report_{user_id}.pdf"'
-            }
+def prepare_compatibility_pdf_data(compatibility_request: CompatibilityRequest) -> dict:
+    """Собрать данные PDF отчёта по совместимости (аргументы create_compatibility_pdf)"""
+    return {
+        'user1_data': {
+            'name': compatibility_request.person1_name or 'Человек 1',
+            'birth_date': compatibility_request.person1_birth_date
+        },
+        'user2_data': {
+            'name': compatibility_request.person2_name or 'Человек 2',
+            'birth_date': compatibility_request.person2_birth_date
+        },
+        'compatibility_data': calculate_compatibility(
+            compatibility_request.person1_birth_date,
+            compatibility_request.person2_birth_date
         )
+    }
+
+def pdf_filename(kind: str, user_id: str) -> str:
+    return f'{kind}_report_{user_id}.pdf'
+
+async def submit_pdf_report(kind: str, user: dict, payload: dict) -> RenderJob:
+    """
+    Поставить рендер PDF в пул процессов (pdf_render_pool.py).
+    Баллы списываются только после успешного рендера, тогда же PDF сохраняется в кэш отчётов.
+    """
+    user_id = user['id']
+    cost = await report_cost('pdf', kind)
+    # Ранний отказ, чтобы не рендерить отчёт, который нечем оплатить; само списание атомарно
+    if cost > 0 and user.get('credits_remaining', 0) < cost:
+        raise HTTPException(status_code=402, detail='Недостаточно баллов для операции. Пополните баланс.')
+
+    async def charge(job: RenderJob):
+        await charge_report('pdf', kind, user_id, {'render_job_id': job.id})
+        report_cache.put(user_id, job.cache_key, 'pdf', job.result)
+
+    try:
+        return pdf_render_pool.submit(
+            kind, payload, user_id, pdf_filename(kind, user_id),
+            on_success=charge, cache_key=report_key(kind, 'pdf', user_id, payload)
+        )
+    except RenderQueueFull as e:
+        raise HTTPException(status_code=503, detail=f'Сервис PDF перегружен: {e}', headers={'Retry-After': '10'})
+
+async def pdf_job_response(job: RenderJob) -> Response:
+    """Дождаться задания рендера и отдать PDF (или ошибку задания)"""
+    await pdf_render_pool.wait(job)
+    if job.status != 'done':
+        raise HTTPException(status_code=job.error_status, detail=f'Ошибка генерации PDF: {job.error}')
+    return Response(
+        content=job.result,
+        media_type=REPORT_MEDIA_TYPES['pdf'],
+        headers=report_headers(job.cache_key, job.filename)
+    )
+
+async def pdf_report_response(request: Request, kind: str, user: dict, payload: dict) -> Response:
+    """Отдать PDF из кэша отчётов или отрендерить в пуле и дождаться результата"""
+    key = report_key(kind, 'pdf', user['id'], payload)
+    cached = await cached_report_response(request, 'pdf', kind, user['id'], key, pdf_filename(kind, user['id']))
+    if cached is not None:
+        return cached
+    job = await submit_pdf_report(kind, user, payload)
+    return await pdf_job_response(job)
+
+@app.post("/api/reports/pdf/numerology")
+async def generate_numerology_pdf_report(
+    pdf_request: PDFReportRequest,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """Генерация PDF отчёта по нумерологии"""
+    try:
+        user_id = current_user.get('user_id')
+        if not user_id:
+            raise HTTPException(status_code=401, detail="Invalid token")
+
+        user = await db.users.find_one({'id': user_id})
+        if not user:
+            raise HTTPException(status_code=404, detail='Пользователь не найден')
+
+        # Готовый PDF из кэша или рендер в пуле процессов (баллы — после успешного рендера)
+        payload = await prepare_numerology_pdf_data(user, pdf_request)
+        return await pdf_report_response(request, 'numerology', user, payload)
 
     except HTTPException:
         raise
@@ -11307,6 +10684,7 @@ async def generate_numerology_pdf_report(
 @app.post("/api/reports/html/compatibility")
 async def generate_compatibility_html_report(
     compatibility_request: CompatibilityRequest,
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     """Генерация HTML отчёта по совместимости"""
@@ -11319,19 +10697,6 @@ async def generate_compatibility_html_report(
         if not user:
             raise HTTPException(status_code=404, detail='Пользователь не найден')
 
-        # Получаем стоимость из конфигурации
-        config = await get_credits_deduction_config()
-        cost = config.get('html_report_compatibility', 3)
-
-        # Списываем баллы (включая premium пользователей)
-        await deduct_credits(
-            user_id,
-            cost,
-            'Генерация HTML отчёта по совместимости',
-            'report',
-            {'report_type': 'html', 'report_category': 'compatibility'}
-        )
-
         # Вычисляем совместимость
         compatibility_result = calculate_compatibility(
             compatibility_request.person1_birth_date,
@@ -11348,17 +10713,13 @@ async def generate_compatibility_html_report(
             'birth_date': compatibility_request.person2_birth_date
         }
 
-        # Генерируем HTML отчёт
+        # Генерируем HTML отчёт (или отдаём ранее сгенерированный с теми же данными)
         from html_generator import create_compatibility_html
-        html_str = create_compatibility_html(user1_data, user2_data, compatibility_result)
-
-        if not html_str or len(html_str) < 100:
-            raise HTTPException(
-                status_code=500,
-                detail='Ошибка генерации HTML: пустой результат'
-            )
-
-        return Response(content=html_str, media_type='text/html; charset=utf-8')
+        return await html_report_response(
+            request, 'compatibility', user_id,
+            {'user1_data': user1_data, 'user2_data': user2_data, 'compatibility_data': compatibility_result},
+            lambda: [create_compatibility_html(user1_data, user2_data, compatibility_result)]
+        )
 
     except HTTPException:
         raise
@@ -11374,6 +10735,7 @@ async def generate_compatibility_html_report(
 @app.post("/api/reports/pdf/compatibility")
 async def generate_compatibility_pdf_report(
     compatibility_request: CompatibilityRequest,
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     """Генерация PDF отчёта по совместимости"""
@@ -11386,51 +10748,8 @@ async def generate_compatibility_pdf_report(
         if not user:
             raise HTTPException(status_code=404, detail='Пользователь не найден')
 
-        # Получаем стоимость из конфигурации
-        config = await get_credits_deduction_config()
-        cost = config.get('pdf_report_compatibility', 5)
-
-        # Списываем баллы (включая premium пользователей)
-        await deduct_credits(
-            user_id,
-            cost,
-            'Генерация PDF отчёта по совместимости',
-            'report',
-            {'report_type': 'pdf', 'report_category': 'compatibility'}
-        )
-
-        # Вычисляем совместимость
-        compatibility_result = calculate_compatibility(
-            compatibility_request.person1_birth_date,
-            compatibility_request.person2_birth_date
-        )
-
-        # Подготавливаем данные пользователей
-        user1_data = {
-            'name': compatibility_request.person1_name or 'Человек 1',
-            'birth_date': compatibility_request.person1_birth_date
-        }
-        user2_data = {
-            'name': compatibility_request.person2_name or 'Человек 2',
-            'birth_date': compatibility_request.person2_birth_date
-        }
-
-        # Генерируем PDF отчёт
-        pdf_bytes = create_compatibility_pdf(user1_data, user2_data, compatibility_result)
-
-        if not pdf_bytes:
-            raise HTTPException(
-                status_code=500,
-                detail='Ошибка генерации PDF: пустой результат'
-            )
-
-        return Response(
-            content=pdf_bytes,
-            media_type='application/pdf',
-            headers={
-                'Content-Disposition': f'attachment; filename="compatibility_report_{user_id}.pdf"'
-            }
-        )
+        # Готовый PDF из кэша или рендер в пуле процессов (баллы — после успешного рендера)
+        return await pdf_report_response(request, 'compatibility', user, prepare_compatibility_pdf_data(compatibility_request))
 
     except HTTPException:
         raise
@@ -11443,6 +10762,75 @@ async def generate_compatibility_pdf_report(
             detail=f'Ошибка генерации PDF отчёта по совместимости: {str(e)}'
         )
 
+@app.post("/api/reports/pdf/numerology/jobs", status_code=202)
+async def submit_numerology_pdf_job(
+    pdf_request: PDFReportRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Поставить PDF отчёт по нумерологии в очередь рендера; статус — GET /api/reports/pdf/jobs/{job_id}"""
+    user = await db.users.find_one({'id': current_user.get('user_id')})
+    if not user:
+        raise HTTPException(status_code=404, detail='Пользователь не найден')
+    job = await submit_pdf_report('numerology', user, await prepare_numerology_pdf_data(user, pdf_request))
+    return job.to_dict()
+
+@app.post("/api/reports/pdf/compatibility/jobs", status_code=202)
+async def submit_compatibility_pdf_job(
+    compatibility_request: CompatibilityRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Поставить PDF отчёт по совместимости в очередь рендера; статус — GET /api/reports/pdf/jobs/{job_id}"""
+    user = await db.users.find_one({'id': current_user.get('user_id')})
+    if not user:
+        raise HTTPException(status_code=404, detail='Пользователь не найден')
+    job = await submit_pdf_report('compatibility', user, prepare_compatibility_pdf_data(compatibility_request))
+    return job.to_dict()
+
+@app.get("/api/reports/pdf/jobs/{job_id}")
+async def get_pdf_job_status(job_id: str, current_user: dict = Depends(get_current_user)):
+    """Статус задания рендера PDF: queued, running, done или failed"""
+    job = pdf_render_pool.get(job_id, current_user.get('user_id'))
+    if not job:
+        raise HTTPException(status_code=404, detail='Задание не найдено')
+    return job.to_dict()
+
+@app.get("/api/reports/pdf/jobs/{job_id}/result")
+async def get_pdf_job_result(
+    job_id: str,
+    wait: float = Query(60, ge=0, le=300, description="Сколько секунд ждать завершения рендера"),
+    current_user: dict = Depends(get_current_user)
+):
+    """PDF задания: ждёт завершения рендера не дольше wait секунд"""
+    import asyncio
+    job = pdf_render_pool.get(job_id, current_user.get('user_id'))
+    if not job:
+        raise HTTPException(status_code=404, detail='Задание не найдено')
+    try:
+        await pdf_render_pool.wait(job, timeout=wait)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=409, detail=f'Отчёт ещё не готов (статус {job.status})', headers={'Retry-After': '5'})
+    return await pdf_job_response(job)
+
+@app.get("/api/admin/pdf-render/stats")
+async def get_pdf_render_stats(current_user: dict = Depends(get_current_user)):
+    """Размер пула, очередь, число рендеров и их время в текущем воркере"""
+    user = await db.users.find_one({"id": current_user.get("user_id")})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not user.get('is_super_admin', False) and not user.get('is_admin', False):
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+    return pdf_render_pool.stats()
+
+@app.get("/api/admin/report-cache/stats")
+async def get_report_cache_stats(current_user: dict = Depends(get_current_user)):
+    """Файлы кэша отчётов на диске, попадания и вытеснения, кэш табов HTML в текущем воркере"""
+    user = await db.users.find_one({"id": current_user.get("user_id")})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not user.get('is_super_admin', False) and not user.get('is_admin', False):
+        raise HTTPException(status_code=403, detail="Недостаточно прав")
+    return {**report_cache.stats(), 'tab_fragments': report_fragments.stats()}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,430 @@
+"""
+Агрегации для дашборда студента (/api/student/dashboard-stats)
+
+Раньше дашборд загружал в Python всю историю студента (lesson_progress, exercise_responses,
+time_activity, quiz_attempts, видео, файлы) и для графика за 7 дней делал ещё по несколько
+запросов на каждый день. Теперь на каждую коллекцию выполняется один aggregate с $facet,
+который возвращает только счётчики, суммы по урокам и сгруппированные события за 7 дней,
+поэтому объём ответа Mongo не зависит от длины истории.
+
+События за 7 дней группируются по (дню, уроку, минуте): эффективность активности считается
+один раз на группу и учитывается с весом количества событий в ней.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Tuple
+
+CHART_DAYS = 7
+RECENT_DAYS = 7
+# Сколько последних попыток теста по уроку отдаётся для графика попыток
+QUIZ_ATTEMPTS_PER_LESSON = 20
+
+PDF_TYPES = ['pdf', 'application/pdf']
+
+LESSON_PROJECTION = {
+    '_id': 0, 'id': 1, 'title': 1, 'quiz.questions.points': 1, 'challenge.total_days': 1,
+}
+CHALLENGE_PROJECTION = {
+    '_id': 0, 'lesson_id': 1, 'challenge_id': 1, 'current_day': 1, 'completed_days': 1,
+    'daily_notes.day': 1, 'points_earned': 1, 'is_completed': 1, 'started_at': 1,
+    'completed_at': 1, 'last_updated': 1,
+}
+
+
+def chart_window(now: datetime) -> Tuple[datetime, datetime]:
+    """
+    Начало первого и конец последнего дня графика активности (UTC)
+    """
+    today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=CHART_DAYS - 1), today + timedelta(days=1)
+
+
+def _in_window(start: datetime, end: datetime) -> Dict[str, Any]:
+    return {'$gte': start, '$lt': end}
+
+
+def _date_string(field: Any, fmt: str) -> Dict[str, Any]:
+    # $dateToString падает на строках, поэтому не-даты превращаются в null
+    return {'$cond': [{'$eq': [{'$type': field}, 'date']},
+                      {'$dateToString': {'format': fmt, 'date': field}}, None]}
+
+
+def _day(field: Any) -> Dict[str, Any]:
+    return _date_string(field, '%Y-%m-%d')
+
+
+def _minute(field: Any) -> Dict[str, Any]:
+    return _date_string(field, '%Y-%m-%dT%H:%M')
+
+
+def _count_if(condition: Any) -> Dict[str, Any]:
+    return {'$sum': {'$cond': [condition, 1, 0]}}
+
+
+def _sum_if(condition: Any, field: str) -> Dict[str, Any]:
+    return {'$sum': {'$cond': [condition, field, 0]}}
+
+
+# Баллы за попытку теста: пройденный тест без баллов засчитывается как 10
+_QUIZ_POINTS = {'$let': {
+    'vars': {'points': {'$ifNull': ['$points_earned', 0]}},
+    'in': {'$cond': [{'$and': [{'$eq': ['$$points', 0]}, '$passed']}, 10, '$$points']},
+}}
+
+
+def lesson_progress_pipeline(user_id: str, lesson_ids: List[str], start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    return [
+        {'$match': {'user_id': user_id}},
+        {'$facet': {
+            'totals': [{'$group': {
+                '_id': None,
+                'completed': _count_if('$is_completed'),
+                'in_progress': _count_if({'$and': [{'$not': ['$is_completed']},
+                                                   {'$gt': ['$completion_percentage', 0]}]}),
+            }}],
+            'top': [
+                {'$match': {'lesson_id': {'$in': lesson_ids}}},
+                {'$project': {'_id': 0, 'lesson_id': 1,
+                              'completion': {'$ifNull': ['$completion_percentage', 0]}}},
+                {'$sort': {'completion': -1, 'lesson_id': 1}},
+                {'$limit': 5},
+            ],
+            'chart': [
+                {'$match': {'last_accessed': _in_window(start, end)}},
+                {'$group': {
+                    '_id': {'day': _day('$last_accessed'), 'lesson_id': '$lesson_id',
+                            'minute': _minute('$last_accessed')},
+                    'count': {'$sum': 1},
+                }},
+            ],
+        }},
+    ]
+
+
+def exercise_responses_pipeline(user_id: str, since: datetime, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    return [
+        {'$match': {'user_id': user_id}},
+        {'$facet': {
+            'totals': [{'$group': {
+                '_id': None,
+                'count': {'$sum': 1},
+                'review_points': _sum_if('$reviewed', '$points_earned'),
+                'review_time_minutes': {'$sum': '$review_time_minutes'},
+                'recent': _count_if({'$gte': ['$submitted_at', since]}),
+            }}],
+            'chart': [
+                {'$match': {'submitted_at': _in_window(start, end)}},
+                {'$group': {
+                    '_id': {'day': _day('$submitted_at'), 'lesson_id': '$lesson_id',
+                            'minute': _minute('$submitted_at')},
+                    'count': {'$sum': 1},
+                }},
+            ],
+        }},
+    ]
+
+
+def time_activity_pipeline(user_id: str, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    is_file_view = {'$eq': ['$activity_type', 'file_view']}
+    not_file_view = {'$ne': ['$activity_type', 'file_view']}
+    is_review = {'$eq': ['$activity_type', 'exercise_review']}
+    return [
+        {'$match': {'user_id': user_id}},
+        {'$facet': {
+            'totals': [{'$group': {
+                '_id': None,
+                'time_minutes': _sum_if(not_file_view, '$total_minutes'),
+                'time_points': _sum_if(not_file_view, '$total_points'),
+                'file_view_points': _sum_if(is_file_view, '$total_points'),
+                'file_views': _sum_if(is_file_view, '$view_count'),
+                'review_count': _count_if(is_review),
+                'review_points': _sum_if(is_review, '$total_points'),
+                'review_time_minutes': _sum_if(is_review, '$review_time_minutes'),
+            }}],
+            # Время по урокам — для времени на челленджи
+            'by_lesson': [{'$group': {'_id': '$lesson_id', 'minutes': {'$sum': '$total_minutes'}}}],
+            # Запись попадает в день создания и в день последней активности
+            'chart': [
+                {'$match': {'$or': [{'last_activity_at': _in_window(start, end)},
+                                    {'created_at': _in_window(start, end)}]}},
+                {'$group': {
+                    '_id': {
+                        'activity_type': '$activity_type',
+                        'lesson_id': '$lesson_id',
+                        'is_pdf': {'$in': ['$file_type', PDF_TYPES]},
+                        'created_day': _day('$created_at'),
+                        'last_day': _day('$last_activity_at'),
+                        'minute': _minute({'$ifNull': ['$created_at', '$last_activity_at']}),
+                    },
+                    'count': {'$sum': 1},
+                    'minutes': {'$sum': '$total_minutes'},
+                }},
+            ],
+        }},
+    ]
+
+
+def video_watch_time_pipeline(user_id: str, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    return [
+        {'$match': {'user_id': user_id}},
+        {'$facet': {
+            'totals': [{'$group': {
+                '_id': None,
+                'minutes': {'$sum': '$total_minutes'},
+                'points': {'$sum': '$total_points'},
+            }}],
+            'chart': [
+                {'$match': {'$or': [{'last_updated': _in_window(start, end)},
+                                    {'created_at': _in_window(start, end)}]}},
+                {'$group': {
+                    '_id': {
+                        'lesson_id': '$lesson_id',
+                        'created_day': _day('$created_at'),
+                        'last_day': _day('$last_updated'),
+                        'minute': _minute('$created_at'),
+                    },
+                    'count': {'$sum': 1},
+                    'minutes': {'$sum': '$total_minutes'},
+                }},
+            ],
+        }},
+    ]
+
+
+def quiz_attempts_pipeline(user_id: str, since: datetime, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    score = {'$ifNull': ['$score', 0]}
+    return [
+        {'$match': {'user_id': user_id}},
+        {'$facet': {
+            'totals': [{'$group': {
+                '_id': None,
+                'count': {'$sum': 1},
+                'points': {'$sum': _QUIZ_POINTS},
+                'max_score': {'$max': score},
+                'score_sum': {'$sum': score},
+                'recent': _count_if({'$gte': ['$attempted_at', since]}),
+            }}],
+            'by_lesson': [
+                {'$sort': {'attempted_at': -1}},
+                {'$group': {
+                    '_id': '$lesson_id',
+                    'total_attempts': {'$sum': 1},
+                    'passed_attempts': _count_if('$passed'),
+                    'best_score': {'$max': score},
+                    'score_sum': {'$sum': score},
+                    'total_points_earned': {'$sum': _QUIZ_POINTS},
+                    'total_time_minutes': {'$sum': '$time_spent_minutes'},
+                    'attempts': {'$push': {
+                        'attempt_id': '$id',
+                        'score': score,
+                        'points_earned': _QUIZ_POINTS,
+                        'passed': {'$ifNull': ['$passed', False]},
+                        'attempted_at': '$attempted_at',
+                        'time_spent_minutes': {'$ifNull': ['$time_spent_minutes', 0]},
+                    }},
+                }},
+                {'$addFields': {'attempts': {'$slice': ['$attempts', QUIZ_ATTEMPTS_PER_LESSON]}}},
+            ],
+            'chart': [
+                {'$match': {'attempted_at': _in_window(start, end)}},
+                {'$group': {
+                    '_id': {'day': _day('$attempted_at'), 'lesson_id': '$lesson_id',
+                            'minute': _minute('$attempted_at')},
+                    'count': {'$sum': 1},
+                }},
+            ],
+        }},
+    ]
+
+
+def file_analytics_pipeline(user_id: str, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    return [
+        {'$match': {'user_id': user_id, 'action': {'$in': ['view', 'download']}}},
+        {'$facet': {
+            'totals': [{'$group': {'_id': '$action', 'count': {'$sum': 1}}}],
+            'chart': [
+                {'$match': {'action': 'view', 'created_at': _in_window(start, end)}},
+                {'$group': {'_id': {'day': _day('$created_at'), 'file_id': '$file_id'},
+                            'count': {'$sum': 1}}},
+            ],
+        }},
+    ]
+
+
+async def _facet(collection, pipeline: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    result = await collection.aggregate(pipeline).to_list(1)
+    return result[0] if result else {}
+
+
+def facet_totals(facet: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Документ счётчиков из facet 'totals' (пустой, если событий нет)
+    """
+    totals = facet.get('totals') or [{}]
+    return totals[0]
+
+
+async def load_student_activity(db, user_id: str, lesson_ids: List[str], now: datetime) -> Dict[str, Any]:
+    """
+    Все агрегаты дашборда студента, запросы к коллекциям выполняются параллельно
+    """
+    start, end = chart_window(now)
+    since = now - timedelta(days=RECENT_DAYS)
+    (progress, exercises, activity, videos, quizzes, files, challenges) = await asyncio.gather(
+        _facet(db.lesson_progress, lesson_progress_pipeline(user_id, lesson_ids, start, end)),
+        _facet(db.exercise_responses, exercise_responses_pipeline(user_id, since, start, end)),
+        _facet(db.time_activity, time_activity_pipeline(user_id, start, end)),
+        _facet(db.video_watch_time, video_watch_time_pipeline(user_id, start, end)),
+        _facet(db.quiz_attempts, quiz_attempts_pipeline(user_id, since, start, end)),
+        _facet(db.file_analytics, file_analytics_pipeline(user_id, start, end)),
+        db.challenge_progress.find({'user_id': user_id}, CHALLENGE_PROJECTION).to_list(length=None),
+    )
+    viewed_file_ids = list({row['_id'].get('file_id') for row in files.get('chart', [])
+                            if row['_id'].get('file_id')})
+    pdf_file_ids = set()
+    if viewed_file_ids:
+        pdf_files = await db.files.find(
+            {'id': {'$in': viewed_file_ids}, 'mime_type': {'$in': PDF_TYPES}}, {'_id': 0, 'id': 1}
+        ).to_list(length=None)
+        pdf_file_ids = {f['id'] for f in pdf_files}
+    return {
+        'lesson_progress': progress,
+        'exercise_responses': exercises,
+        'time_activity': activity,
+        'video_watch_time': videos,
+        'quiz_attempts': quizzes,
+        'file_analytics': files,
+        'challenge_progress': challenges,
+        'pdf_file_ids': pdf_file_ids,
+    }
+
+
+# ----- Детальная аналитика (/api/student/analytics/{section}) -----
+
+DAY_FORMAT = '%Y-%m-%d'
+HOUR_FORMAT = '%Y-%m-%dT%H'
+
+
+def lesson_time_pipeline(user_id: str, lesson_ids: List[Any]) -> List[Dict[str, Any]]:
+    """
+    Время из time_activity по урокам (всего и просмотры файлов) одной группировкой
+    """
+    return [
+        {'$match': {'user_id': user_id, 'lesson_id': {'$in': lesson_ids}}},
+        {'$group': {
+            '_id': '$lesson_id',
+            'minutes': {'$sum': '$total_minutes'},
+            'file_views': _sum_if({'$eq': ['$activity_type', 'file_view']}, '$view_count'),
+        }},
+    ]
+
+
+async def load_lesson_totals(db, user_id: str, lesson_ids: List[str]) -> Dict[str, Dict[str, int]]:
+    """
+    Суммы по урокам за всё время: время изучения, видео, просмотры и скачивания файлов.
+    Один $group по lesson_id на коллекцию вместо запросов на каждый урок.
+    """
+    time_rows, video_rows, file_rows = await asyncio.gather(
+        db.time_activity.aggregate(lesson_time_pipeline(user_id, lesson_ids)).to_list(length=None),
+        db.video_watch_time.aggregate([
+            {'$match': {'user_id': user_id, 'lesson_id': {'$in': lesson_ids}}},
+            {'$group': {'_id': '$lesson_id', 'minutes': {'$sum': '$total_minutes'}}},
+        ]).to_list(length=None),
+        db.file_analytics.aggregate([
+            {'$match': {'user_id': user_id, 'lesson_id': {'$in': lesson_ids},
+                        'action': {'$in': ['view', 'download']}}},
+            {'$group': {'_id': {'lesson_id': '$lesson_id', 'action': '$action'}, 'count': {'$sum': 1}}},
+        ]).to_list(length=None),
+    )
+    totals = {lesson_id: {'time_minutes': 0, 'video_minutes': 0, 'time_file_views': 0,
+                          'file_views': 0, 'file_downloads': 0} for lesson_id in lesson_ids}
+    for row in time_rows:
+        totals[row['_id']]['time_minutes'] = row['minutes']
+        totals[row['_id']]['time_file_views'] = row['file_views']
+    for row in video_rows:
+        totals[row['_id']]['video_minutes'] = row['minutes']
+    for row in file_rows:
+        field = 'file_views' if row['_id']['action'] == 'view' else 'file_downloads'
+        totals[row['_id']['lesson_id']][field] = row['count']
+    return totals
+
+
+def _events_by_period_pipeline(user_id: str, time_field: str, start: datetime, end: datetime,
+                               period_format: str) -> List[Dict[str, Any]]:
+    field = f'${time_field}'
+    return [
+        {'$match': {'user_id': user_id, time_field: _in_window(start, end)}},
+        {'$group': {
+            '_id': {'period': _date_string(field, period_format), 'lesson_id': '$lesson_id',
+                    'minute': _minute(field)},
+            'count': {'$sum': 1},
+        }},
+    ]
+
+
+async def load_activity_events(db, user_id: str, start: datetime, end: datetime,
+                               period_format: str) -> Dict[str, Dict[str, List[Dict[str, Any]]]]:
+    """
+    События студента в окне [start, end), сгруппированные по периодам графика
+    (period_format — DAY_FORMAT или HOUR_FORMAT). Один запрос на коллекцию вместо
+    запросов на каждый день или час графика.
+    """
+    window = _in_window(start, end)
+    exercises, quizzes, activity, file_views, challenges = await asyncio.gather(
+        db.exercise_responses.aggregate(
+            _events_by_period_pipeline(user_id, 'submitted_at', start, end, period_format)).to_list(length=None),
+        db.quiz_attempts.aggregate(
+            _events_by_period_pipeline(user_id, 'attempted_at', start, end, period_format)).to_list(length=None),
+        # Запись time_activity попадает в период создания и в период последней активности
+        db.time_activity.aggregate([
+            {'$match': {'user_id': user_id, '$or': [{'created_at': window}, {'last_activity_at': window}]}},
+            {'$group': {
+                '_id': {
+                    'activity_type': '$activity_type',
+                    'lesson_id': '$lesson_id',
+                    'is_pdf': {'$in': ['$file_type', PDF_TYPES]},
+                    'created_period': _date_string('$created_at', period_format),
+                    'last_period': _date_string('$last_activity_at', period_format),
+                    'minute': _minute({'$ifNull': ['$created_at', '$last_activity_at']}),
+                },
+                'count': {'$sum': 1},
+                'minutes': {'$sum': '$total_minutes'},
+            }},
+        ]).to_list(length=None),
+        db.file_analytics.aggregate([
+            {'$match': {'user_id': user_id, 'action': 'view', 'created_at': window}},
+            {'$group': {'_id': {'period': _date_string('$created_at', period_format)}, 'count': {'$sum': 1}}},
+        ]).to_list(length=None),
+        db.challenge_progress.find({'user_id': user_id, 'last_updated': window}, CHALLENGE_PROJECTION).to_list(length=None),
+    )
+    challenges_by_period: Dict[str, List[Dict[str, Any]]] = {}
+    for challenge in challenges:
+        challenges_by_period.setdefault(challenge['last_updated'].strftime(period_format), []).append(challenge)
+    return {
+        'exercise_responses': rows_by_period(exercises, 'period'),
+        'quiz_attempts': rows_by_period(quizzes, 'period'),
+        'time_activity': rows_by_period(activity, 'created_period', 'last_period'),
+        'file_analytics': rows_by_period(file_views, 'period'),
+        'challenge_progress': challenges_by_period,
+    }
+
+
+def rows_by_period(rows: List[Dict[str, Any]], *period_fields: str) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Сгруппированные события по ключу периода (день 'YYYY-MM-DD' или час 'YYYY-MM-DDTHH');
+    событие с несколькими полями периода попадает в каждый из них
+    """
+    by_period: Dict[str, List[Dict[str, Any]]] = {}
+    for row in rows:
+        for period in {row['_id'].get(field) for field in (period_fields or ('day',))}:
+            if period:
+                by_period.setdefault(period, []).append(row)
+    return by_period
+
+
+def row_time(row: Dict[str, Any], default: datetime) -> datetime:
+    """
+    Время группы событий (с точностью до минуты) для расчёта эффективности
+    """
+    minute = row['_id'].get('minute')
+    return datetime.strptime(minute, '%Y-%m-%dT%H:%M') if minute else default
@@ -3,6 +3,8 @@ from typing import Dict, List, Any, Tuple
 import random
 import re
 
+import numpy as np
+
 def parse_birth_date(birth_date: str) -> tuple[int, int, int]:
     """Parse birth date in DD.MM.YYYY format"""
     try:
@@ -318,6 +320,23 @@ def generate_weekly_planetary_energy(birth_date: str, user_numbers: Dict[str, in
     else:
         base_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
     
+    # Energy for all 7 days in one pass
+    daily_energies = planetary_energy_rows(calculate_planetary_energy_matrix(
+        destiny_number=destiny_number,
+        start_date=base_date,
+        days=7,
+        birth_date=birth_date,
+        user_numbers=user_numbers,
+        pythagorean_square=pythagorean_square,
+        fractal_behavior=fractal_behavior,
+        problem_numbers=problem_numbers,
+        name_numbers=name_numbers,
+        weekday_energy=weekday_energy,
+        janma_ank=janma_ank,
+        city=city,
+        modifiers_config=modifiers_config
+    ))
+    
     # Generate 7 days of energy data
     for i in range(7):
         current_date = base_date + timedelta(days=i)
@@ -349,21 +368,7 @@ def generate_weekly_planetary_energy(birth_date: str, user_numbers: Dict[str, in
                 elif abs(destiny_number - week_reduced) > 5:
                     week_modifier = -3  # Negative modifier for large differences
         
-        # Use enhanced calculation
-        day_energy = calculate_enhanced_daily_planetary_energy(
-            destiny_number=destiny_number,
-            date=current_date,
-            birth_date=birth_date,
-            user_numbers=user_numbers,
-            pythagorean_square=pythagorean_square,
-            fractal_behavior=fractal_behavior,
-            problem_numbers=problem_numbers,
-            name_numbers=name_numbers,
-            weekday_energy=weekday_energy,
-            janma_ank=janma_ank,
-            city=city,
-            modifiers_config=modifiers_config
-        )
+        day_energy = daily_energies[i]
         
         # Apply week-specific modifier to ensure variation between weeks
         if week_modifier != 0:
@@ -778,9 +783,166 @@ def get_randomized_quiz_questions(num_questions: int = 10) -> List[Dict[str, Any
     
     return selected_questions
 
-def calculate_enhanced_daily_planetary_energy(
+# Planetary energy engine
+# Row order of the energy matrix and key order of the per-day dicts
+PLANET_KEYS = ('surya', 'chandra', 'mangal', 'budha', 'guru', 'shukra', 'shani', 'rahu', 'ketu')
+
+# Number -> row of the energy matrix (1=Surya, 2=Chandra, 3=Guru, 4=Rahu, 5=Budh,
+# 6=Shukra, 7=Ketu, 8=Shani, 9=Mangal); -1 for 0 and master numbers
+_NUMBER_TO_ROW = np.full(34, -1, dtype=np.int64)
+_NUMBER_TO_ROW[1:10] = [0, 1, 4, 7, 3, 5, 8, 6, 2]
+
+# Ruling planet of the weekday (0=Monday ... 6=Sunday): row and planet number
+_RULING_ROW = np.array([1, 2, 3, 4, 5, 6, 0], dtype=np.int64)
+_RULING_NUMBER = np.array([2, 9, 5, 3, 6, 8, 1], dtype=np.int64)
+
+PLANET_RELATIONSHIPS = {
+    'Surya': {'friends': ['Chandra', 'Mangal', 'Guru'], 'enemies': ['Shukra', 'Shani']},
+    'Chandra': {'friends': ['Surya', 'Budh'], 'enemies': []},
+    'Mangal': {'friends': ['Surya', 'Chandra', 'Guru'], 'enemies': ['Budh']},
+    'Budh': {'friends': ['Surya', 'Shukra'], 'enemies': ['Chandra']},
+    'Guru': {'friends': ['Surya', 'Chandra', 'Mangal'], 'enemies': ['Budh', 'Shukra']},
+    'Shukra': {'friends': ['Budh', 'Shani'], 'enemies': ['Surya', 'Chandra']},
+    'Shani': {'friends': ['Budh', 'Shukra', 'Rahu'], 'enemies': ['Surya', 'Chandra', 'Mangal']},
+    'Rahu': {'friends': ['Budh', 'Shukra', 'Shani'], 'enemies': ['Surya', 'Chandra', 'Mangal']},
+    'Ketu': {'friends': ['Mangal', 'Guru'], 'enemies': ['Surya', 'Chandra', 'Budh']}
+}
+
+
+def _build_weekday_relationships() -> Tuple[np.ndarray, np.ndarray]:
+    """Friend/enemy masks (7 weekdays x 9 planets) relative to the weekday's ruling planet"""
+    names = ('Surya', 'Chandra', 'Mangal', 'Budh', 'Guru', 'Shukra', 'Shani', 'Rahu', 'Ketu')
+    day_planets = ['Chandra', 'Mangal', 'Budh', 'Guru', 'Shukra', 'Shani', 'Surya']
+    friends = np.zeros((7, 9), dtype=bool)
+    enemies = np.zeros((7, 9), dtype=bool)
+    for weekday, ruling_planet in enumerate(day_planets):
+        relationship = PLANET_RELATIONSHIPS[ruling_planet]
+        for row, name in enumerate(names):
+            friends[weekday, row] = name in relationship['friends']
+            enemies[weekday, row] = name in relationship['enemies']
+    return friends, enemies
+
+
+_WEEKDAY_FRIENDS, _WEEKDAY_ENEMIES = _build_weekday_relationships()
+
+# Anti-cyclicity variation multipliers and signs per row
+_VARIATION_PATTERN = np.array([0, 1, -1, 2, -2, 1.5, -1.5, 0.5, -0.5])
+_DAY_VARIATION_SIGN = np.array([1 if i % 2 == 0 else -1 for i in range(9)], dtype=float)
+_MONTH_VARIATION_SIGN = np.array([1 if i % 3 == 0 else -1 for i in range(9)], dtype=float)
+
+_MODIFIER_DEFAULTS = {
+    'friend_planet_bonus': 0.10,
+    'enemy_planet_penalty': 0.10,
+    'fractal_present_bonus': 0.10,
+    'fractal_absent_penalty': 0.10,
+    'problem_number_penalty': 0.10,
+    'individual_year_bonus': 0.06,
+    'individual_month_bonus': 0.05,
+    'pythagorean_digit_bonus': 0.03,
+    'soul_number_bonus': 0.08,
+    'mind_number_bonus': 0.06,
+    'destiny_number_bonus': 0.05,
+    'wisdom_number_bonus': 0.04,
+    'ruling_number_bonus': 0.07,
+    'line_sum_bonus': 2.0,
+    'name_number_bonus': 0.04,
+    'surname_number_bonus': 0.04,
+    'total_name_bonus': 0.05,
+    'weekday_multiplier': 3.0,
+    'anti_cyclicity_enabled': True,
+    'anti_cyclicity_threshold': 5.0,
+    'anti_cyclicity_variation': 3.0,
+}
+
+
+def compile_planetary_energy_modifiers(modifiers_config: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    Compile the admin modifiers config into the weights used by the energy engine.
+    Done once per range instead of a dict lookup per planet per day.
+    """
+    config = modifiers_config or {}
+    compiled = {key: config.get(key, default) for key, default in _MODIFIER_DEFAULTS.items()}
+
+    # Values below 1 are treated as "percent" and map to the fixed ±12 points
+    friend_bonus = compiled['friend_planet_bonus']
+    enemy_penalty = compiled['enemy_planet_penalty']
+    friend_bonus = 12 if friend_bonus < 1 else friend_bonus
+    enemy_penalty = 12 if enemy_penalty < 1 else enemy_penalty
+    compiled['relationship_weights'] = (
+        np.where(_WEEKDAY_FRIENDS, friend_bonus, 0) - np.where(_WEEKDAY_ENEMIES, enemy_penalty, 0)
+    ).astype(float)
+    compiled['variation_vector'] = compiled['anti_cyclicity_variation'] * _VARIATION_PATTERN
+    return compiled
+
+
+def _reduce_array(values: np.ndarray) -> np.ndarray:
+    """Vectorised reduce_to_single_digit: master numbers 11/22/33 kept, everything else digital root"""
+    values = np.asarray(values, dtype=np.int64)
+    roots = np.where(values > 0, 1 + (values - 1) % 9, values)
+    return np.where(np.isin(values, (11, 22, 33)), values, roots)
+
+
+_NUMBER_ROWS = {number: int(_NUMBER_TO_ROW[number]) for number in range(1, 10)}
+
+
+def _number_row(number: Any) -> int:
+    """Matrix row for a planet number, -1 if the number has no planet"""
+    return _NUMBER_ROWS.get(number, -1)
+
+
+def _add_to_rows(energies: np.ndarray, rows: np.ndarray, amount: float, mask: np.ndarray = None) -> None:
+    """Add amount to energies[rows[i], i] for every day i with a planet (and mask set)"""
+    selected = rows >= 0
+    if mask is not None:
+        selected &= mask
+    columns = np.nonzero(selected)[0]
+    energies[rows[columns], columns] += amount
+
+
+def _solar_period_masks(dates: List[datetime], city: str,
+                        sun_times: List[Tuple[datetime, datetime]] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-day flags: noon falls into Rahu Kaal / into Abhijit Muhurta"""
+    in_rahu = np.zeros(len(dates), dtype=bool)
+    in_abhijit = np.zeros(len(dates), dtype=bool)
+    try:
+        from vedic_time_calculations import get_sunrise_sunset, calculate_rahu_kaal, calculate_abhijit_muhurta
+    except:
+        return in_rahu, in_abhijit
+
+    for i, date in enumerate(dates):
+        try:
+            if sun_times is not None:
+                sunrise, sunset = sun_times[i]
+            else:
+                sunrise, sunset = get_sunrise_sunset(city, date)
+            current_time = date.replace(hour=12, minute=0, second=0, microsecond=0)  # Use noon as default
+            rahu_start, rahu_end = calculate_rahu_kaal(sunrise, sunset, date.weekday())
+            rahu_hit = rahu_start <= current_time <= rahu_end
+            abhijit_start, abhijit_end = calculate_abhijit_muhurta(sunrise, sunset)
+            abhijit_hit = abhijit_start <= current_time <= abhijit_end
+        except:
+            # Naive dates cannot be compared with the city's local times - no modifier for the day
+            continue
+        in_rahu[i] = rahu_hit
+        in_abhijit[i] = abhijit_hit
+    return in_rahu, in_abhijit
+
+
+def _column_stdev(energies: np.ndarray, threshold: float) -> np.ndarray:
+    """Sample standard deviation of each day; days right at the threshold use statistics.stdev"""
+    import statistics
+
+    std_dev = energies.std(axis=0, ddof=1)
+    borderline = np.nonzero(np.abs(std_dev - threshold) <= 1e-9 * max(1.0, abs(threshold)))[0]
+    for column in borderline:
+        std_dev[column] = statistics.stdev(energies[:, column].tolist())
+    return std_dev
+
+
+def calculate_planetary_energy_matrix(
     destiny_number: int,
-    date: datetime,
+    start_date: datetime,
+    days: int,
     birth_date: str = None,
     user_numbers: Dict[str, int] = None,
     pythagorean_square: Dict[str, Any] = None,
@@ -790,51 +952,24 @@ def calculate_enhanced_daily_planetary_energy(
     weekday_energy: Dict[str, float] = None,
     janma_ank: int = None,
     city: str = "Москва",
-    modifiers_config: Dict[str, Any] = None
-) -> Dict[str, int]:
+    modifiers_config: Dict[str, Any] = None,
+    sun_times: List[Tuple[datetime, datetime]] = None
+) -> np.ndarray:
     """
-    Enhanced planetary energy calculation with all factors:
-    Uses configurable modifiers from modifiers_config if provided, otherwise uses defaults
+    Batch planetary energy engine: one birth profile, `days` consecutive days from start_date.
+    Returns an int matrix of shape (9, days), rows in PLANET_KEYS order, values 0-100.
+    sun_times optionally supplies (sunrise, sunset) per day so no solar computation is repeated.
     """
-    # Get modifiers from config or use defaults
-    if modifiers_config is None:
-        modifiers_config = {}
-    
-    # Helper function to get config value or default
-    def get_modifier(key: str, default: float) -> float:
-        return modifiers_config.get(key, default)
-    
-    # Number to planet mapping
-    number_to_planet = {
-        1: 'Surya', 2: 'Chandra', 3: 'Guru', 4: 'Rahu',
-        5: 'Budh', 6: 'Shukra', 7: 'Ketu', 8: 'Shani', 9: 'Mangal'
-    }
-    
-    # Planet name normalization
-    planet_name_map = {
-        'Surya': 'surya', 'Chandra': 'chandra', 'Mangal': 'mangal',
-        'Budh': 'budha', 'Budha': 'budha', 'Guru': 'guru',
-        'Shukra': 'shukra', 'Shani': 'shani', 'Rahu': 'rahu', 'Ketu': 'ketu'
-    }
-    
-    # Planet relationships (friendliness/hostility)
-    planet_relationships = {
-        'Surya': {'friends': ['Chandra', 'Mangal', 'Guru'], 'enemies': ['Shukra', 'Shani']},
-        'Chandra': {'friends': ['Surya', 'Budh'], 'enemies': []},
-        'Mangal': {'friends': ['Surya', 'Chandra', 'Guru'], 'enemies': ['Budh']},
-        'Budh': {'friends': ['Surya', 'Shukra'], 'enemies': ['Chandra']},
-        'Guru': {'friends': ['Surya', 'Chandra', 'Mangal'], 'enemies': ['Budh', 'Shukra']},
-        'Shukra': {'friends': ['Budh', 'Shani'], 'enemies': ['Surya', 'Chandra']},
-        'Shani': {'friends': ['Budh', 'Shukra', 'Rahu'], 'enemies': ['Surya', 'Chandra', 'Mangal']},
-        'Rahu': {'friends': ['Budh', 'Shukra', 'Shani'], 'enemies': ['Surya', 'Chandra', 'Mangal']},
-        'Ketu': {'friends': ['Mangal', 'Guru'], 'enemies': ['Surya', 'Chandra', 'Budh']}
-    }
-    
-    # Get ruling planet for the day (based on weekday)
-    weekday = date.weekday()  # 0=Monday, 6=Sunday
-    day_planets = ['Chandra', 'Mangal', 'Budh', 'Guru', 'Shukra', 'Shani', 'Surya']
-    ruling_planet = day_planets[weekday]
-    
+    modifiers = compile_planetary_energy_modifiers(modifiers_config)
+    dates = [start_date + timedelta(days=i) for i in range(days)]
+
+    day_arr = np.array([d.day for d in dates], dtype=np.int64)
+    month_arr = np.array([d.month for d in dates], dtype=np.int64)
+    year_arr = np.array([d.year for d in dates], dtype=np.int64)
+    short_year_arr = year_arr % 100  # Last two digits of year
+    weekday_arr = np.array([d.weekday() for d in dates], dtype=np.int64)
+    ruling_rows = _RULING_ROW[weekday_arr]
+
     # Calculate base energy = (Janma Ank × 10) mod 100
     if janma_ank is None:
         if birth_date:
@@ -843,698 +978,192 @@ def calculate_enhanced_daily_planetary_energy(
                 janma_ank = calculate_janma_ank(day, month, year)
             except:
                 janma_ank = destiny_number  # Fallback to destiny number
-    
+
     base_energy = (janma_ank * 10) % 100
-    
-    # Get date components for modification functions
-    day_num = date.day
-    month_num = date.month
-    year_num = date.year % 100  # Last two digits of year
-    
-    # Functions of modification for each planet (fP(date))
-    # These are based on date and create unique variation for each planet
-    modification_functions = {
-        "surya": day_num % 20,
-        "chandra": month_num % 20,
-        "mangal": (day_num + month_num) % 20,
-        "budha": year_num % 20,
-        "guru": (day_num * 2) % 20,
-        "shukra": (month_num * 2) % 20,
-        "shani": (year_num * 2) % 20,
-        "rahu": (day_num + year_num) % 20,
-        "ketu": (month_num + year_num) % 20
-    }
-    
-    # Initialize base energy for each planet = base_energy + fP(date)
-    planet_energies = {
-        "surya": base_energy + modification_functions["surya"],
-        "chandra": base_energy + modification_functions["chandra"],
-        "mangal": base_energy + modification_functions["mangal"],
-        "budha": base_energy + modification_functions["budha"],
-        "guru": base_energy + modification_functions["guru"],
-        "shukra": base_energy + modification_functions["shukra"],
-        "shani": base_energy + modification_functions["shani"],
-        "rahu": base_energy + modification_functions["rahu"],
-        "ketu": base_energy + modification_functions["ketu"]
-    }
-    
-    # 1. Planet friendliness/hostility: +12 for friends, -12 for enemies
-    ruling_planet_data = planet_relationships.get(ruling_planet, {})
-    friends = ruling_planet_data.get('friends', [])
-    enemies = ruling_planet_data.get('enemies', [])
-    
-    for planet_name, planet_key in [('Surya', 'surya'), ('Chandra', 'chandra'), ('Mangal', 'mangal'),
-                                     ('Budh', 'budha'), ('Guru', 'guru'), ('Shukra', 'shukra'),
-                                     ('Shani', 'shani'), ('Rahu', 'rahu'), ('Ketu', 'ketu')]:
-        if planet_key in planet_energies:
-            if planet_name in friends:
-                # +12 for friendly planets (can be configured, but default is 12)
-                friend_bonus = get_modifier('friend_planet_bonus', 0.10)
-                # Convert percentage to absolute value if needed, or use direct value
-                if friend_bonus < 1:
-                    # It's a percentage, convert to absolute (12 = 0.12 * 100)
-                    planet_energies[planet_key] += 12
-                else:
-                    planet_energies[planet_key] += friend_bonus
-            elif planet_name in enemies:
-                # -12 for enemy planets (can be configured, but default is 12)
-                enemy_penalty = get_modifier('enemy_planet_penalty', 0.10)
-                # Convert percentage to absolute value if needed, or use direct value
-                if enemy_penalty < 1:
-                    # It's a percentage, convert to absolute (12 = 0.12 * 100)
-                    planet_energies[planet_key] -= 12
-                else:
-                    planet_energies[planet_key] -= enemy_penalty
-    
+
+    # Base energy for each planet = base_energy + fP(date)
+    energies = np.empty((9, days), dtype=float)
+    energies[0] = day_arr % 20
+    energies[1] = month_arr % 20
+    energies[2] = (day_arr + month_arr) % 20
+    energies[3] = short_year_arr % 20
+    energies[4] = (day_arr * 2) % 20
+    energies[5] = (month_arr * 2) % 20
+    energies[6] = (short_year_arr * 2) % 20
+    energies[7] = (day_arr + short_year_arr) % 20
+    energies[8] = (month_arr + short_year_arr) % 20
+    energies += base_energy
+
+    # 1. Planet friendliness/hostility towards the ruling planet of the weekday
+    energies += modifiers['relationship_weights'][weekday_arr].T
+
     # 2. Fractal behavior: present planets +10%, absent -10%
     if fractal_behavior:
-        fractal_planets = set()
+        present = np.zeros(9, dtype=bool)
         for num in fractal_behavior:
-            if num in number_to_planet:
-                planet_name = number_to_planet[num]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                fractal_planets.add(planet_key)
-        
-        for planet_key in planet_energies:
-            if planet_key in fractal_planets:
-                planet_energies[planet_key] += destiny_number * get_modifier('fractal_present_bonus', 0.10)
-            else:
-                planet_energies[planet_key] -= destiny_number * get_modifier('fractal_absent_penalty', 0.10)
-    
+            if _number_row(num) >= 0:
+                present[_number_row(num)] = True
+        present_bonus = destiny_number * modifiers['fractal_present_bonus']
+        absent_penalty = destiny_number * modifiers['fractal_absent_penalty']
+        energies[present] += present_bonus
+        energies[~present] -= absent_penalty
+
     # 3. Problem numbers: -10% for present
     if problem_numbers:
-        problem_planets = set()
-        for num in problem_numbers:
-            if num in number_to_planet:
-                planet_name = number_to_planet[num]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                problem_planets.add(planet_key)
-        
-        for planet_key in problem_planets:
-            if planet_key in planet_energies:
-                planet_energies[planet_key] -= destiny_number * get_modifier('problem_number_penalty', 0.10)
-    
+        problem_rows = {_number_row(num) for num in problem_numbers} - {-1}
+        for row in problem_rows:
+            energies[row] -= destiny_number * modifiers['problem_number_penalty']
+
     # 4. Individual year, month, day
+    individual_month = individual_day = None
     if birth_date:
         try:
             day, month, year = parse_birth_date(birth_date)
-            current_year = date.year
-            current_month = date.month
-            current_day = date.day
-            
-            # Individual year = reduce(day + month + current_year)
-            individual_year = reduce_to_single_digit(day + month + current_year)
-            # Individual month = reduce(individual_year + current_month)
-            individual_month = reduce_to_single_digit(individual_year + current_month)
-            # Individual day = reduce(individual_month + current_day)
-            individual_day = reduce_to_single_digit(individual_month + current_day)
-            
-            # Apply modifiers for individual numbers with different weights
-            # Individual year - important, add energy
-            if individual_year in number_to_planet:
-                planet_name = number_to_planet[individual_year]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                if planet_key in planet_energies:
-                    planet_energies[planet_key] += destiny_number * get_modifier('individual_year_bonus', 0.06)
-            
-            # Individual month - add energy
-            if individual_month in number_to_planet:
-                planet_name = number_to_planet[individual_month]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                if planet_key in planet_energies:
-                    planet_energies[planet_key] += destiny_number * get_modifier('individual_month_bonus', 0.05)
-            
-            # Individual day - most important for current day, add more energy
+        except:
+            day = None
+        if day is not None:
+            individual_year = _reduce_array(day + month + year_arr)
+            individual_month = _reduce_array(individual_year + month_arr)
+            individual_day = _reduce_array(individual_month + day_arr)
+
+            _add_to_rows(energies, _NUMBER_TO_ROW[individual_year], destiny_number * modifiers['individual_year_bonus'])
+            _add_to_rows(energies, _NUMBER_TO_ROW[individual_month], destiny_number * modifiers['individual_month_bonus'])
             # +15 for planet of personal day number (individual day)
-            if individual_day in number_to_planet:
-                planet_name = number_to_planet[individual_day]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                if planet_key in planet_energies:
-                    # +15 for planet of personal day number
-                    planet_energies[planet_key] += 15
-            
+            _add_to_rows(energies, _NUMBER_TO_ROW[individual_day], 15)
+
             # +10 for planet of user's personal day number (if user has personal day)
             if user_numbers and user_numbers.get('personal_day'):
-                user_personal_day = user_numbers.get('personal_day')
-                if user_personal_day in number_to_planet:
-                    planet_name = number_to_planet[user_personal_day]
-                    planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                    if planet_key in planet_energies:
-                        # +10 for planet of user's personal day number
-                        planet_energies[planet_key] += 10
-            
-            # Calculate problem numbers (ЧПГ, ЧПМ, ЧПД)
-            # ЧПГ (Число проблемы года) = ЧИГ - число судьбы (по модулю)
-            problem_year = reduce_to_single_digit(abs(individual_year - destiny_number))
-            # ЧПМ (Число проблемы месяца) = месяц рождения - ЧИМ (по модулю)
-            problem_month = reduce_to_single_digit(abs(month - individual_month))
-            # ЧПД (Число проблемы дня) = день рождения - ЧИД (по модулю)
-            problem_day = reduce_to_single_digit(abs(day - individual_day))
-            
-            # MODIFIER: Problem numbers matching - energy drops to almost zero
-            # Get all important numbers for comparison with problem numbers
-            important_numbers_for_problems = {
-                'individual_year': individual_year,
-                'individual_month': individual_month,
-                'individual_day': individual_day,
-                'current_day': current_day_reduced,
-                'soul': user_numbers.get('soul_number') if user_numbers else None,
-                'mind': user_numbers.get('mind_number') if user_numbers else None,
-                'destiny': destiny_number,
-                'janma_ank': janma_ank if janma_ank else None
-            }
-            
-            # Check if problem numbers match important numbers
-            problem_numbers_list = [
-                ('chpg', problem_year),
-                ('chpm', problem_month),
-                ('chpd', problem_day)
-            ]
-            
-            for problem_key, problem_value in problem_numbers_list:
-                if problem_value in number_to_planet:
-                    problem_planet_name = number_to_planet[problem_value]
-                    problem_planet_key = planet_name_map.get(problem_planet_name, problem_planet_name.lower())
-                    
-                    if problem_planet_key in planet_energies:
-                        # Check if problem number matches any important number
-                        for num_key, num_value in important_numbers_for_problems.items():
-                            if num_value is None:
-                                continue
-                            
-                            # Reduce to single digit if needed
-                            num_reduced = num_value
-                            if num_value > 9 and num_value not in [11, 22, 33]:
-                                num_reduced = reduce_to_single_digit(num_value)
-                            
-                            # If problem number matches important number - energy drops significantly (but not to zero)
-                            if problem_value == num_reduced:
-                                # MATCH: Energy drops significantly (but not extreme) - will be normalized later
-                                planet_energies[problem_planet_key] -= destiny_number * get_modifier('problem_number_match_penalty', 0.80)
-            
-            # MODIFIER 1: If day matches personal day - energy increases significantly (but not to 100%)
-            # Check if current day number (reduced) matches individual day
-            current_day_reduced_for_check = reduce_to_single_digit(current_day)
-            if current_day_reduced_for_check == individual_day:
-                # This day matches personal day - add significant energy boost
-                if individual_day in number_to_planet:
-                    planet_name = number_to_planet[individual_day]
-                    planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                    if planet_key in planet_energies:
-                        # Add significant boost (but not extreme) - will be normalized later
-                        planet_energies[planet_key] += destiny_number * get_modifier('personal_day_match_bonus', 0.60)
-            
-            # MODIFIER 2: If personal month number matches day - add 50% energy
-            # Check if individual_month matches current_day (reduced to single digit)
-            current_day_reduced = reduce_to_single_digit(current_day)
-            if individual_month == current_day_reduced:
-                # Personal month matches day - add 50% energy
-                if individual_month in number_to_planet:
-                    planet_name = number_to_planet[individual_month]
-                    planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                    if planet_key in planet_energies:
-                        planet_energies[planet_key] += destiny_number * get_modifier('personal_month_match_bonus', 0.50)
-            
-            # ENHANCED: Day number matching logic - maximize good values, minimize bad
-            # Get all important numbers for comparison (including problem numbers)
-            important_numbers = {
-                'individual_day': individual_day,
-                'individual_month': individual_month,
-                'individual_year': individual_year,
-                'current_day': current_day_reduced,
-                'soul': user_numbers.get('soul_number') if user_numbers else None,
-                'mind': user_numbers.get('mind_number') if user_numbers else None,
-                'destiny': destiny_number,
-                'janma_ank': janma_ank if janma_ank else None,
-                'problem_year': problem_year,
-                'problem_month': problem_month,
-                'problem_day': problem_day
-            }
-            
-            # Check for matches and mismatches
-            for num_key, num_value in important_numbers.items():
-                if num_value is None:
-                    continue
-                
-                # Skip problem numbers in this loop - they are handled separately
-                if num_key in ['problem_year', 'problem_month', 'problem_day']:
-                    continue
-                
-                # Reduce to single digit if needed (except for master numbers)
-                num_reduced = num_value
-                if num_value > 9 and num_value not in [11, 22, 33]:
-                    num_reduced = reduce_to_single_digit(num_value)
-                
-                if num_reduced in number_to_planet:
-                    planet_name = number_to_planet[num_reduced]
-                    planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                    
-                    if planet_key in planet_energies:
-                        # Check if this number matches any problem number - if so, energy drops significantly
-                        if num_reduced == problem_year or num_reduced == problem_month or num_reduced == problem_day:
-                            # PROBLEM NUMBER MATCH: Energy drops significantly (but not extreme)
-                            planet_energies[planet_key] -= destiny_number * get_modifier('problem_number_match_penalty', 0.80)
-                            continue  # Skip other modifiers for this planet
-                        
-                        # Check for matches with current day
-                        if num_reduced == current_day_reduced:
-                            # MATCH: Maximum good value - add significant energy
-                            planet_energies[planet_key] += destiny_number * get_modifier('current_day_match_bonus', 0.40)
-                        else:
-                            # Check if planets are enemies
-                            planet_data = planet_relationships.get(planet_name, {})
-                            ruling_planet_data = planet_relationships.get(ruling_planet, {})
-                            
-                            # Check if this planet is enemy of ruling planet
-                            if planet_name in ruling_planet_data.get('enemies', []):
-                                # ENEMY: Reduce energy significantly
-                                planet_energies[planet_key] -= destiny_number * get_modifier('enemy_mismatch_penalty', 0.30)
-                            # Check if this planet is friend of ruling planet
-                            elif planet_name in ruling_planet_data.get('friends', []):
-                                # FRIEND: Add some energy even if not exact match
-                                planet_energies[planet_key] += destiny_number * get_modifier('friend_mismatch_bonus', 0.15)
-                            else:
-                                # NEUTRAL: Small reduction for mismatch
-                                planet_energies[planet_key] -= destiny_number * get_modifier('neutral_mismatch_penalty', 0.10)
-            
-            # Additional check: if problem numbers match current day or other important numbers
-            for problem_num in [problem_year, problem_month, problem_day]:
-                if problem_num in number_to_planet:
-                    problem_planet_name = number_to_planet[problem_num]
-                    problem_planet_key = planet_name_map.get(problem_planet_name, problem_planet_name.lower())
-                    
-                    if problem_planet_key in planet_energies:
-                        # Check if problem number matches current day
-                        if problem_num == current_day_reduced:
-                            # Problem number matches current day - energy drops significantly
-                            planet_energies[problem_planet_key] -= destiny_number * get_modifier('problem_number_match_penalty', 0.80)
-                        
-                        # Check if problem number matches individual numbers
-                        if problem_num == individual_year or problem_num == individual_month or problem_num == individual_day:
-                            # Problem number matches individual number - energy drops significantly
-                            planet_energies[problem_planet_key] -= destiny_number * get_modifier('problem_number_match_penalty', 0.80)
-            
-            # Handle Janma Ank = 22 (master number)
-            if janma_ank == 22:
-                # Master number 22 - special handling
-                # 22 reduces to 4 (Rahu), but has special power
-                rahu_key = 'rahu'
-                if rahu_key in planet_energies:
-                    # Master number 22 gives extra power to Rahu
-                    planet_energies[rahu_key] += destiny_number * get_modifier('janma_ank_22_bonus', 0.25)
-                
-                # Also check if 22 matches any important numbers
-                if current_day_reduced == 4:  # 22 reduces to 4
-                    if rahu_key in planet_energies:
-                        planet_energies[rahu_key] += destiny_number * get_modifier('janma_ank_22_match_bonus', 0.30)
-            
-            # Handle cyclicity - redirect energy when cycles occur
-            # Check for repeating patterns in numbers
-            number_sequence = [individual_year, individual_month, individual_day, current_day_reduced]
-            unique_numbers = set(number_sequence)
-            
-            # If we have cyclicity (repeating numbers), redirect energy
-            if len(unique_numbers) < len(number_sequence):
-                # Cyclicity detected - redistribute energy
-                repeated_numbers = [n for n in number_sequence if number_sequence.count(n) > 1]
-                for repeated_num in set(repeated_numbers):
-                    if repeated_num in number_to_planet:
-                        planet_name = number_to_planet[repeated_num]
-                        planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                        if planet_key in planet_energies:
-                            # Increase energy for repeated numbers (cyclicity boost)
-                            planet_energies[planet_key] += destiny_number * get_modifier('cyclicity_bonus', 0.20)
-                            
-                            # Redirect some energy from non-repeated planets
-                            for other_key in planet_energies:
-                                if other_key != planet_key:
-                                    # Small reduction to redirect energy
-                                    planet_energies[other_key] -= destiny_number * get_modifier('cyclicity_penalty', 0.05)
-        except:
-            pass
-    
+                row = _number_row(user_numbers.get('personal_day'))
+                if row >= 0:
+                    energies[row] += 10
+            # The problem-number (ЧПГ/ЧПМ/ЧПД), day-match, master 22 and cyclicity modifiers of the
+            # previous per-day implementation were never reached: that block read current_day_reduced
+            # before assigning it and the NameError was swallowed. They are left out so results stay the same.
+
+    planet_counts = pythagorean_square.get('planet_counts', {}) if pythagorean_square else {}
+
     # 5. Pythagorean Square: more digits = more energy
-    if pythagorean_square:
-        planet_counts = pythagorean_square.get('planet_counts', {})
-        for num, count in planet_counts.items():
-            if num in number_to_planet:
-                planet_name = number_to_planet[num]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                if planet_key in planet_energies:
-                    # More digits = more energy (each digit adds bonus%)
-                    planet_energies[planet_key] += destiny_number * get_modifier('pythagorean_digit_bonus', 0.03) * count
-    
+    for num, count in planet_counts.items():
+        row = _number_row(num)
+        if row >= 0:
+            energies[row] += destiny_number * modifiers['pythagorean_digit_bonus'] * count
+
     # 6. Personal numbers (soul, mind, destiny, wisdom, ruling)
     if user_numbers:
-        # Soul number - very important, add more energy
-        soul_num = user_numbers.get('soul_number')
-        if soul_num and soul_num in number_to_planet:
-            planet_name = number_to_planet[soul_num]
-            planet_key = planet_name_map.get(planet_name, planet_name.lower())
-            if planet_key in planet_energies:
-                planet_energies[planet_key] += destiny_number * get_modifier('soul_number_bonus', 0.08)
-        
-        # Mind number - important, add energy
-        mind_num = user_numbers.get('mind_number')
-        if mind_num and mind_num in number_to_planet:
-            planet_name = number_to_planet[mind_num]
-            planet_key = planet_name_map.get(planet_name, planet_name.lower())
-            if planet_key in planet_energies:
-                planet_energies[planet_key] += destiny_number * get_modifier('mind_number_bonus', 0.06)
-        
-        # Destiny number - already used as base, but can add bonus
-        destiny_num = user_numbers.get('destiny_number')
-        if destiny_num and destiny_num in number_to_planet:
-            planet_name = number_to_planet[destiny_num]
-            planet_key = planet_name_map.get(planet_name, planet_name.lower())
-            if planet_key in planet_energies:
-                planet_energies[planet_key] += destiny_number * get_modifier('destiny_number_bonus', 0.05)
-        
-        # Wisdom number - add energy
-        wisdom_num = user_numbers.get('wisdom_number')
-        if wisdom_num and wisdom_num in number_to_planet:
-            planet_name = number_to_planet[wisdom_num]
-            planet_key = planet_name_map.get(planet_name, planet_name.lower())
-            if planet_key in planet_energies:
-                planet_energies[planet_key] += destiny_number * get_modifier('wisdom_number_bonus', 0.04)
-        
-        # Ruling number - very important, add more energy
         ruling_num = user_numbers.get('ruling_number')
-        if ruling_num:
+        if ruling_num and ruling_num > 9:
             # Ruling number can be master number (11, 22), so reduce it first
-            if ruling_num > 9:
-                ruling_num = reduce_to_single_digit(ruling_num)
-            if ruling_num in number_to_planet:
-                planet_name = number_to_planet[ruling_num]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                if planet_key in planet_energies:
-                    planet_energies[planet_key] += destiny_number * get_modifier('ruling_number_bonus', 0.07)
-    
-    # 7. Horizontals, verticals, diagonals
+            ruling_num = reduce_to_single_digit(ruling_num)
+        personal_weights = (
+            (user_numbers.get('soul_number'), 'soul_number_bonus'),
+            (user_numbers.get('mind_number'), 'mind_number_bonus'),
+            (user_numbers.get('destiny_number'), 'destiny_number_bonus'),
+            (user_numbers.get('wisdom_number'), 'wisdom_number_bonus'),
+            (ruling_num, 'ruling_number_bonus'),
+        )
+        for num, modifier_key in personal_weights:
+            row = _number_row(num) if num else -1
+            if row >= 0:
+                energies[row] += destiny_number * modifiers[modifier_key]
+
+    # 7. Horizontals (1-4-7, 2-5-8, 3-6-9), verticals (1-2-3, 4-5-6, 7-8-9), diagonals (1-5-9, 3-5-7)
     if pythagorean_square:
-        # Calculate sums for horizontals, verticals, diagonals
-        planet_counts = pythagorean_square.get('planet_counts', {})
-        
-        # Horizontals: (1-4-7), (2-5-8), (3-6-9)
-        horizontal1 = planet_counts.get(1, 0) + planet_counts.get(4, 0) + planet_counts.get(7, 0)
-        horizontal2 = planet_counts.get(2, 0) + planet_counts.get(5, 0) + planet_counts.get(8, 0)
-        horizontal3 = planet_counts.get(3, 0) + planet_counts.get(6, 0) + planet_counts.get(9, 0)
-        
-        # Verticals: (1-2-3), (4-5-6), (7-8-9)
-        vertical1 = planet_counts.get(1, 0) + planet_counts.get(2, 0) + planet_counts.get(3, 0)
-        vertical2 = planet_counts.get(4, 0) + planet_counts.get(5, 0) + planet_counts.get(6, 0)
-        vertical3 = planet_counts.get(7, 0) + planet_counts.get(8, 0) + planet_counts.get(9, 0)
-        
-        # Diagonals: (1-5-9), (3-5-7)
-        diagonal1 = planet_counts.get(1, 0) + planet_counts.get(5, 0) + planet_counts.get(9, 0)
-        diagonal2 = planet_counts.get(3, 0) + planet_counts.get(5, 0) + planet_counts.get(7, 0)
-        
-        # Apply modifiers based on sums for each planet in the line
-        line_bonus = get_modifier('line_sum_bonus', 2.0)
-        # Horizontal 1: planets 1, 4, 7
-        for num in [1, 4, 7]:
-            if num in number_to_planet:
-                planet_name = number_to_planet[num]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                if planet_key in planet_energies:
-                    planet_energies[planet_key] += horizontal1 * line_bonus
-        
-        # Horizontal 2: planets 2, 5, 8
-        for num in [2, 5, 8]:
-            if num in number_to_planet:
-                planet_name = number_to_planet[num]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                if planet_key in planet_energies:
-                    planet_energies[planet_key] += horizontal2 * line_bonus
-        
-        # Horizontal 3: planets 3, 6, 9
-        for num in [3, 6, 9]:
-            if num in number_to_planet:
-                planet_name = number_to_planet[num]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                if planet_key in planet_energies:
-                    planet_energies[planet_key] += horizontal3 * line_bonus
-        
-        # Vertical 1: planets 1, 2, 3
-        for num in [1, 2, 3]:
-            if num in number_to_planet:
-                planet_name = number_to_planet[num]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                if planet_key in planet_energies:
-                    planet_energies[planet_key] += vertical1 * line_bonus
-        
-        # Vertical 2: planets 4, 5, 6
-        for num in [4, 5, 6]:
-            if num in number_to_planet:
-                planet_name = number_to_planet[num]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                if planet_key in planet_energies:
-                    planet_energies[planet_key] += vertical2 * line_bonus
-        
-        # Vertical 3: planets 7, 8, 9
-        for num in [7, 8, 9]:
-            if num in number_to_planet:
-                planet_name = number_to_planet[num]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                if planet_key in planet_energies:
-                    planet_energies[planet_key] += vertical3 * line_bonus
-        
-        # Diagonal 1: planets 1, 5, 9
-        for num in [1, 5, 9]:
-            if num in number_to_planet:
-                planet_name = number_to_planet[num]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                if planet_key in planet_energies:
-                    planet_energies[planet_key] += diagonal1 * line_bonus
-        
-        # Diagonal 2: planets 3, 5, 7
-        for num in [3, 5, 7]:
-            if num in number_to_planet:
-                planet_name = number_to_planet[num]
-                planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                if planet_key in planet_energies:
-                    planet_energies[planet_key] += diagonal2 * line_bonus
-    
+        line_bonus = modifiers['line_sum_bonus']
+        for line in ((1, 4, 7), (2, 5, 8), (3, 6, 9), (1, 2, 3), (4, 5, 6), (7, 8, 9), (1, 5, 9), (3, 5, 7)):
+            line_sum = sum(planet_counts.get(num, 0) for num in line)
+            for num in line:
+                energies[_NUMBER_TO_ROW[num]] += line_sum * line_bonus
+
     # 8. Name and surname
     if name_numbers:
-        # Name number - add energy
         name_num = name_numbers.get('name_number') or name_numbers.get('first_name_number')
-        if name_num and name_num in number_to_planet:
-            planet_name = number_to_planet[name_num]
-            planet_key = planet_name_map.get(planet_name, planet_name.lower())
-            if planet_key in planet_energies:
-                planet_energies[planet_key] += destiny_number * get_modifier('name_number_bonus', 0.04)
-        
-        # Surname number - add energy
         surname_num = name_numbers.get('surname_number') or name_numbers.get('last_name_number')
-        if surname_num and surname_num in number_to_planet:
-            planet_name = number_to_planet[surname_num]
-            planet_key = planet_name_map.get(planet_name, planet_name.lower())
-            if planet_key in planet_energies:
-                planet_energies[planet_key] += destiny_number * get_modifier('surname_number_bonus', 0.04)
-        
-        # Total name number - add energy
         total_name_num = name_numbers.get('total_name_number') or name_numbers.get('full_name_number')
-        if total_name_num and total_name_num in number_to_planet:
-            planet_name = number_to_planet[total_name_num]
-            planet_key = planet_name_map.get(planet_name, planet_name.lower())
-            if planet_key in planet_energies:
-                planet_energies[planet_key] += destiny_number * get_modifier('total_name_bonus', 0.05)
-        
-        # MODIFIER 3: Check for name/surname matches with important numbers
-        # Get ruling planet number
-        ruling_planet_num = None
-        for num, planet in number_to_planet.items():
-            if planet == ruling_planet:
-                ruling_planet_num = num
-                break
-        
-        # Get individual day and month numbers
-        individual_day_num = None
-        individual_month_num = None
-        if birth_date:
-            try:
-                day, month, year = parse_birth_date(birth_date)
-                current_year = date.year
-                current_month = date.month
-                current_day = date.day
-                # Individual year = reduce(day + month + current_year)
-                individual_year_calc = reduce_to_single_digit(day + month + current_year)
-                # Individual month = reduce(individual_year + current_month)
-                individual_month_num = reduce_to_single_digit(individual_year_calc + current_month)
-                # Individual day = reduce(individual_month + current_day)
-                individual_day_num = reduce_to_single_digit(individual_month_num + current_day)
-            except:
-                pass
-        
-        # Check if name number matches ruling planet, individual day, or individual month
-        if name_num:
-            if ruling_planet_num and name_num == ruling_planet_num:
-                # Name matches ruling planet - add significant energy
-                planet_key = planet_name_map.get(ruling_planet, ruling_planet.lower())
-                if planet_key in planet_energies:
-                    planet_energies[planet_key] += destiny_number * 0.30  # +30% energy
-            if individual_day_num and name_num == individual_day_num:
-                # Name matches individual day - add significant energy
-                if name_num in number_to_planet:
-                    planet_name = number_to_planet[name_num]
-                    planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                    if planet_key in planet_energies:
-                        planet_energies[planet_key] += destiny_number * 0.25  # +25% energy
-            if individual_month_num and name_num == individual_month_num:
-                # Name matches individual month - add energy
-                if name_num in number_to_planet:
-                    planet_name = number_to_planet[name_num]
-                    planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                    if planet_key in planet_energies:
-                        planet_energies[planet_key] += destiny_number * 0.20  # +20% energy
-        
-        # Check if surname number matches ruling planet, individual day, or individual month
-        if surname_num:
-            if ruling_planet_num and surname_num == ruling_planet_num:
-                # Surname matches ruling planet - add significant energy
-                planet_key = planet_name_map.get(ruling_planet, ruling_planet.lower())
-                if planet_key in planet_energies:
-                    planet_energies[planet_key] += destiny_number * 0.30  # +30% energy
-            if individual_day_num and surname_num == individual_day_num:
-                # Surname matches individual day - add significant energy
-                if surname_num in number_to_planet:
-                    planet_name = number_to_planet[surname_num]
-                    planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                    if planet_key in planet_energies:
-                        planet_energies[planet_key] += destiny_number * 0.25  # +25% energy
-            if individual_month_num and surname_num == individual_month_num:
-                # Surname matches individual month - add energy
-                if surname_num in number_to_planet:
-                    planet_name = number_to_planet[surname_num]
-                    planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                    if planet_key in planet_energies:
-                        planet_energies[planet_key] += destiny_number * 0.20  # +20% energy
-        
-        # Check if total name number matches ruling planet, individual day, or individual month
-        if total_name_num:
-            if ruling_planet_num and total_name_num == ruling_planet_num:
-                # Total name matches ruling planet - add very significant energy
-                planet_key = planet_name_map.get(ruling_planet, ruling_planet.lower())
-                if planet_key in planet_energies:
-                    planet_energies[planet_key] += destiny_number * 0.40  # +40% energy
-            if individual_day_num and total_name_num == individual_day_num:
-                # Total name matches individual day - add very significant energy
-                if total_name_num in number_to_planet:
-                    planet_name = number_to_planet[total_name_num]
-                    planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                    if planet_key in planet_energies:
-                        planet_energies[planet_key] += destiny_number * 0.35  # +35% energy
-            if individual_month_num and total_name_num == individual_month_num:
-                # Total name matches individual month - add significant energy
-                if total_name_num in number_to_planet:
-                    planet_name = number_to_planet[total_name_num]
-                    planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                    if planet_key in planet_energies:
-                        planet_energies[planet_key] += destiny_number * 0.30  # +30% energy
-    
+
+        for num, modifier_key in ((name_num, 'name_number_bonus'),
+                                  (surname_num, 'surname_number_bonus'),
+                                  (total_name_num, 'total_name_bonus')):
+            row = _number_row(num) if num else -1
+            if row >= 0:
+                energies[row] += destiny_number * modifiers[modifier_key]
+
+        # Matches with the ruling planet, individual day and individual month
+        ruling_numbers = _RULING_NUMBER[weekday_arr]
+        for num, (ruling_weight, day_weight, month_weight) in ((name_num, (0.30, 0.25, 0.20)),
+                                                               (surname_num, (0.30, 0.25, 0.20)),
+                                                               (total_name_num, (0.40, 0.35, 0.30))):
+            row = _number_row(num) if num else -1
+            if row < 0:
+                continue
+            rows = np.full(days, row, dtype=np.int64)
+            _add_to_rows(energies, rows, destiny_number * ruling_weight, ruling_numbers == num)
+            if individual_day is not None:
+                _add_to_rows(energies, rows, destiny_number * day_weight, individual_day == num)
+                _add_to_rows(energies, rows, destiny_number * month_weight, individual_month == num)
+
     # 9. Weekday indicators (maximum weight)
     if weekday_energy:
-        weekday_mult = get_modifier('weekday_multiplier', 3.0)
+        weekday_mult = modifiers['weekday_multiplier']
         for planet_key, energy_value in weekday_energy.items():
-            if planet_key in planet_energies:
-                # Maximum weight - multiply by configured multiplier (very important factor)
-                planet_energies[planet_key] += energy_value * weekday_mult
-    
-    # 10. Rahu kala, Buli kala, Obhit muhurta
-    try:
-        from vedic_time_calculations import get_sunrise_sunset, calculate_rahu_kaal, calculate_abhijit_muhurta
-        if get_sunrise_sunset and calculate_rahu_kaal and calculate_abhijit_muhurta:
-            try:
-                sunrise, sunset = get_sunrise_sunset(city, date)
-                current_time = date.replace(hour=12, minute=0, second=0, microsecond=0)  # Use noon as default
-                
-                # Calculate Rahu kala
-                rahu_start, rahu_end = calculate_rahu_kaal(sunrise, sunset, weekday)
-                in_rahu_kala = rahu_start <= current_time <= rahu_end
-                
-                # Calculate Abhijit muhurta (Obhit muhurta)
-                abhijit_start, abhijit_end = calculate_abhijit_muhurta(sunrise, sunset)
-                in_abhijit = abhijit_start <= current_time <= abhijit_end
-                
-                # Apply modifiers based on periods
-                # Rahu kala is generally unfavorable, so reduce energy for ruling planet
-                if in_rahu_kala:
-                    ruling_planet_key = planet_name_map.get(ruling_planet, ruling_planet.lower())
-                    if ruling_planet_key in planet_energies:
-                        planet_energies[ruling_planet_key] -= destiny_number * 0.15  # -15% during Rahu kala
-                
-                # Abhijit muhurta is favorable, so increase energy
-                if in_abhijit:
-                    # Increase energy for friendly planets during Abhijit
-                    for planet_name in friends:
-                        planet_key = planet_name_map.get(planet_name, planet_name.lower())
-                        if planet_key in planet_energies:
-                            planet_energies[planet_key] += destiny_number * 0.20  # +20% during Abhijit
-            except:
-                pass
-    except:
-        pass
-    
-    # Anti-cyclicity function: remove cyclical patterns for each planet individually
-    # This ensures each planet has its own dynamic range (0-100%) based on matches/mismatches
-    anti_cyclicity_enabled = get_modifier('anti_cyclicity_enabled', True)
-    if anti_cyclicity_enabled:
-        import statistics
-        
-        # Get threshold and variation from config
-        threshold = get_modifier('anti_cyclicity_threshold', 5.0)
-        variation = get_modifier('anti_cyclicity_variation', 3.0)
-        
-        # Planet order for deterministic variation
-        planet_order = ['surya', 'chandra', 'mangal', 'budha', 'guru', 'shukra', 'shani', 'rahu', 'ketu']
-        variation_pattern = [0, 1, -1, 2, -2, 1.5, -1.5, 0.5, -0.5]  # Variation multipliers
-        
-        # Calculate standard deviation of all energies
-        energy_values = list(planet_energies.values())
-        if len(energy_values) > 1:
-            try:
-                std_dev = statistics.stdev(energy_values)
-            except:
-                std_dev = 0
-            
-            # If standard deviation is too low (all planets too similar), add variation to each planet
-            if std_dev < threshold:
-                for i, planet_key in enumerate(planet_order):
-                    if planet_key in planet_energies:
-                        # Add deterministic variation based on planet position
-                        variation_amount = variation * variation_pattern[i % len(variation_pattern)]
-                        planet_energies[planet_key] += variation_amount
-        
-        # Apply anti-cyclicity for each planet individually
-        # This ensures each planet can reach 0% or 100% based on matches/mismatches
-        for i, planet_key in enumerate(planet_order):
-            if planet_key not in planet_energies:
-                continue
-            
-            current_energy = planet_energies[planet_key]
-            
-            # Calculate variation for this specific planet based on its position
-            planet_variation = variation * variation_pattern[i % len(variation_pattern)]
-            
-            # Add date-based variation to create unique pattern for each planet
-            day_variation = (date.day % 9) * 0.5 * (1 if i % 2 == 0 else -1)
-            month_variation = (date.month % 7) * 0.3 * (1 if i % 3 == 0 else -1)
-            
-            # Combine variations
-            total_variation = planet_variation + day_variation + month_variation
-            
-            # Apply variation to break cyclicity for this planet
-            planet_energies[planet_key] = current_energy + total_variation
-    
-    # Normalize all values to 0-100 range using clamp function
-    # Allow values to reach exactly 0% and 100% based on matches/mismatches
-    # clamp(0, 100, x) = min(100, max(0, x))
-    result = {}
-    for planet_key, energy in planet_energies.items():
-        # Apply clamp function: min(100, max(0, energy))
-        # This allows energies to reach 0% and 100% when there are strong matches/mismatches
-        clamped_energy = min(100, max(0, energy))
-        result[planet_key] = int(clamped_energy)
-    
-    return result
\ No newline at end of file
+            if planet_key in PLANET_KEYS:
+                energies[PLANET_KEYS.index(planet_key)] += energy_value * weekday_mult
+
+    # 10. Rahu Kaal lowers the ruling planet, Abhijit Muhurta raises its friends
+    in_rahu, in_abhijit = _solar_period_masks(dates, city, sun_times)
+    _add_to_rows(energies, ruling_rows, -(destiny_number * 0.15), in_rahu)
+    friend_mask = _WEEKDAY_FRIENDS[weekday_arr].T & in_abhijit
+    energies[friend_mask] += destiny_number * 0.20
+
+    # Anti-cyclicity: keep planets apart when the day is too flat, then add per-planet date variation
+    if modifiers['anti_cyclicity_enabled']:
+        flat_days = _column_stdev(energies, modifiers['anti_cyclicity_threshold']) < modifiers['anti_cyclicity_threshold']
+        energies[:, flat_days] += modifiers['variation_vector'][:, None]
+
+        day_variation = ((day_arr % 9) * 0.5)[None, :] * _DAY_VARIATION_SIGN[:, None]
+        month_variation = ((month_arr % 7) * 0.3)[None, :] * _MONTH_VARIATION_SIGN[:, None]
+        energies += (modifiers['variation_vector'][:, None] + day_variation) + month_variation
+
+    # clamp(0, 100, x) - energies can reach exactly 0% and 100%
+    return np.trunc(np.clip(energies, 0, 100)).astype(np.int64)
+
+
+def planetary_energy_rows(energy_matrix: np.ndarray) -> List[Dict[str, int]]:
+    """Split a (9, N) energy matrix into N per-day {planet: energy} dicts"""
+    return [dict(zip(PLANET_KEYS, column)) for column in energy_matrix.T.tolist()]
+
+
+def calculate_enhanced_daily_planetary_energy(
+    destiny_number: int,
+    date: datetime,
+    birth_date: str = None,
+    user_numbers: Dict[str, int] = None,
+    pythagorean_square: Dict[str, Any] = None,
+    fractal_behavior: List[int] = None,
+    problem_numbers: List[int] = None,
+    name_numbers: Dict[str, int] = None,
+    weekday_energy: Dict[str, float] = None,
+    janma_ank: int = None,
+    city: str = "Москва",
+    modifiers_config: Dict[str, Any] = None
+) -> Dict[str, int]:
+    """
+    Enhanced planetary energy calculation with all factors for a single day.
+    Uses configurable modifiers from modifiers_config if provided, otherwise uses defaults.
+    Thin wrapper over calculate_planetary_energy_matrix - use that directly for date ranges.
+    """
+    energy_matrix = calculate_planetary_energy_matrix(
+        destiny_number=destiny_number,
+        start_date=date,
+        days=1,
+        birth_date=birth_date,
+        user_numbers=user_numbers,
+        pythagorean_square=pythagorean_square,
+        fractal_behavior=fractal_behavior,
+        problem_numbers=problem_numbers,
+        name_numbers=name_numbers,
+        weekday_energy=weekday_energy,
+        janma_ank=janma_ank,
+        city=city,
+        modifiers_config=modifiers_config
+    )
+    return planetary_energy_rows(energy_matrix)[0]
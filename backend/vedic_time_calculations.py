@@ -1,60 +1,347 @@
 """
 Ведические временные расчеты с привязкой к городу и часовому поясу
 """
+import asyncio
+import threading
+import time
 import pytz
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 import math
-from typing import Dict, Any, Tuple, List
+from typing import Dict, Any, Tuple, List, Optional, Callable
 from geopy.geocoders import Nominatim
+from city_gazetteer import get_city_gazetteer
+from geo_cache import GeoCacheStore, LRUCache
 
-# Глобальный кеш для координат городов
-_city_cache = {}
+# Размеры LRU-кешей процесса (городов и годовых солнечных таблиц)
+CITY_CACHE_SIZE = 4096
+SUN_YEAR_CACHE_SIZE = 512
 
-def get_city_coordinates(city: str) -> Tuple[float, float, str]:
+# Кеш координат городов: город -> (широта, долгота, часовой пояс)
+_city_cache = LRUCache(CITY_CACHE_SIZE)
+# Годовые таблицы восходов/закатов: ((широта, долгота, пояс), год) -> [[восход_мкс, закат_мкс], ...]
+_sun_year_cache = LRUCache(SUN_YEAR_CACHE_SIZE)
+
+# Общий для воркеров уровень кеша в Mongo (коллекция geo_cache), подключается из server.py
+_geo_store: Optional[GeoCacheStore] = None
+# Города, для которых Mongo уже опрошен в этом процессе
+_geo_store_checked = LRUCache(CITY_CACHE_SIZE)
+# Несохранённые в Mongo годовые таблицы: город -> {год}
+_pending_geo_writes: Dict[str, set] = {}
+_geo_flush_task = None
+
+# TimezoneFinder загружает полигоны часовых поясов — создаём один раз на процесс
+_timezone_finder = None
+
+
+def _timezone_at(latitude: float, longitude: float) -> str:
     """
-    Получает координаты и часовой пояс для города с кешированием
+    Часовой пояс по координатам (общий экземпляр TimezoneFinder)
     """
-    if city in _city_cache:
-        return _city_cache[city]
-    
+    global _timezone_finder
     try:
-        geolocator = Nominatim(user_agent="numerom_app", timeout=10)
-        location = geolocator.geocode(city)
-        if location:
-            latitude = location.latitude
-            longitude = location.longitude
-            
-            # Определяем часовой пояс по координатам
+        if _timezone_finder is None:
             import timezonefinder
-            tf = timezonefinder.TimezoneFinder()
-            timezone_str = tf.timezone_at(lat=latitude, lng=longitude)
-            
-            result = (latitude, longitude, timezone_str or "UTC")
+            _timezone_finder = timezonefinder.TimezoneFinder()
+        return _timezone_finder.timezone_at(lat=latitude, lng=longitude) or "UTC"
+    except Exception:
+        return "UTC"
+
+
+# Внешний геокодер вызывается только для городов, которых нет в справочнике
+GEOCODER_TIMEOUT = 10
+# Сколько секунд помнить, что город не найден (или сервис не ответил)
+NEGATIVE_CACHE_TTL = 15 * 60
+# После стольких ошибок подряд перестаём обращаться к сервису на BREAKER_RESET_TIMEOUT секунд
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_RESET_TIMEOUT = 60
+
+# Известные города на случай, если справочник и геокодер недоступны
+FALLBACK_COORDS = {
+    "кишинев": (47.0105, 28.8638, "Europe/Chisinau"),
+    "москва": (55.7558, 37.6173, "Europe/Moscow"),
+    "киев": (50.4501, 30.5234, "Europe/Kiev"),
+    "минск": (53.9006, 27.5590, "Europe/Minsk"),
+}
+
+
+def _nominatim_geocode(city: str) -> Optional[Tuple[float, float]]:
+    """
+    Геокодирование через Nominatim (OpenStreetMap): (широта, долгота) или None
+    """
+    geolocator = Nominatim(user_agent="numerom_app", timeout=GEOCODER_TIMEOUT)
+    location = geolocator.geocode(city)
+    if location:
+        return location.latitude, location.longitude
+    return None
+
+
+class GeocoderCircuitBreaker:
+    """
+    Автоматический выключатель для внешнего геокодера.
+    closed — запросы идут как обычно; open — сервис считается недоступным и запросы
+    сразу уходят в локальный fallback; half-open — после паузы пропускается один пробный запрос.
+    """
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probe_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+_geocoder: Callable[[str], Optional[Tuple[float, float]]] = _nominatim_geocode
+geocoder_breaker = GeocoderCircuitBreaker()
+# Город -> момент (time.monotonic), до которого не повторяем геокодирование
+_negative_cache: Dict[str, float] = {}
+# Single-flight: город -> событие завершения текущего запроса к геокодеру
+_inflight_lookups: Dict[str, threading.Event] = {}
+_inflight_lock = threading.Lock()
+_async_inflight: Dict[str, "asyncio.Future"] = {}
+
+
+def set_geocoder(geocoder: Optional[Callable[[str], Optional[Tuple[float, float]]]] = None):
+    """
+    Подменяет внешний геокодер (например, локальной заглушкой в тестах).
+    Без аргументов возвращает Nominatim. Сбрасывает негативный кеш и выключатель.
+    """
+    global _geocoder
+    _geocoder = geocoder or _nominatim_geocode
+    _negative_cache.clear()
+    geocoder_breaker.record_success()
+
+
+def _lookup_offline(city: str) -> Optional[Tuple[float, float, str]]:
+    """
+    Поиск без сети: кеш процесса и офлайн-справочник городов
+    """
+    cached = _city_cache.get(city)
+    if cached:
+        return cached
+    
+    gazetteer = get_city_gazetteer()
+    if gazetteer is not None:
+        found = gazetteer.lookup(city)
+        if found:
+            latitude, longitude, timezone_str = found
+            # Справочник может содержать пояс, которого ещё нет в установленной версии pytz
+            if timezone_str not in pytz.all_timezones_set:
+                timezone_str = _timezone_at(latitude, longitude)
+            result = (latitude, longitude, timezone_str)
             _city_cache[city] = result
             return result
-    except:
-        pass
-    
-    # Fallback для известных городов
-    fallback_coords = {
-        "кишинев": (47.0105, 28.8638, "Europe/Chisinau"),
-        "москва": (55.7558, 37.6173, "Europe/Moscow"),
-        "киев": (50.4501, 30.5234, "Europe/Kiev"),
-        "минск": (53.9006, 27.5590, "Europe/Minsk"),
-    }
-    
+    return None
+
+
+def _local_fallback(city: str) -> Tuple[float, float, str]:
+    """
+    Предустановленные координаты известных городов, иначе UTC
+    """
     city_lower = city.lower()
-    if city_lower in fallback_coords:
-        result = fallback_coords[city_lower]
+    if city_lower in FALLBACK_COORDS:
+        result = FALLBACK_COORDS[city_lower]
         _city_cache[city] = result
         return result
-    
-    # По умолчанию UTC
-    result = (0.0, 0.0, "UTC")
+    # По умолчанию UTC (не кешируем навсегда — город повторно проверится после TTL)
+    return (0.0, 0.0, "UTC")
+
+
+def _geocode_remote(city: str) -> Optional[Tuple[float, float, str]]:
+    """
+    Один запрос к внешнему геокодеру с учётом выключателя и негативного кеша
+    """
+    if not geocoder_breaker.allow_request():
+        return None
+    try:
+        location = _geocoder(city)
+    except Exception as e:
+        print(f"Геокодер недоступен для '{city}': {e}")
+        geocoder_breaker.record_failure()
+        _negative_cache[city] = time.monotonic() + NEGATIVE_CACHE_TTL
+        return None
+    
+    geocoder_breaker.record_success()
+    if not location:
+        _negative_cache[city] = time.monotonic() + NEGATIVE_CACHE_TTL
+        return None
+    
+    latitude, longitude = location
+    # Определяем часовой пояс по координатам
+    result = (latitude, longitude, _timezone_at(latitude, longitude))
     _city_cache[city] = result
     return result
 
 
+def get_city_coordinates(city: str) -> Tuple[float, float, str]:
+    """
+    Получает координаты и часовой пояс для города с кешированием.
+    Сначала ищем в офлайн-справочнике городов, внешний геокодер — только для неизвестных
+    городов: одновременные запросы одного города объединяются в один, неудачи помнятся
+    NEGATIVE_CACHE_TTL секунд, а при недоступности сервиса срабатывает выключатель.
+    """
+    result = _lookup_offline(city)
+    if result:
+        return result
+    
+    expires_at = _negative_cache.get(city)
+    if expires_at is not None:
+        if time.monotonic() < expires_at:
+            return _local_fallback(city)
+        _negative_cache.pop(city, None)
+    
+    with _inflight_lock:
+        pending = _inflight_lookups.get(city)
+        if pending is None:
+            _inflight_lookups[city] = threading.Event()
+    
+    if pending is not None:
+        # Другой поток уже геокодирует этот город — ждём его результата
+        pending.wait(GEOCODER_TIMEOUT + 1)
+        return _city_cache.get(city) or _local_fallback(city)
+    
+    try:
+        result = _geocode_remote(city)
+    finally:
+        with _inflight_lock:
+            _inflight_lookups.pop(city).set()
+    
+    return result or _local_fallback(city)
+
+
+async def resolve_city_coordinates(city: str) -> Tuple[float, float, str]:
+    """
+    Асинхронный вариант get_city_coordinates для обработчиков FastAPI.
+    Справочник и кеш отвечают сразу, сетевой геокодер выполняется в пуле потоков,
+    поэтому event loop не блокируется; параллельные запросы одного города ждут один вызов.
+    """
+    result = _lookup_offline(city)
+    if _geo_store is not None and city and city not in _geo_store_checked:
+        await _load_from_geo_store(city)
+        result = result or _city_cache.peek(city)
+    if result:
+        return result
+    
+    future = _async_inflight.get(city)
+    if future is None:
+        future = asyncio.get_running_loop().run_in_executor(None, get_city_coordinates, city)
+        _async_inflight[city] = future
+        future.add_done_callback(lambda _: _async_inflight.pop(city, None))
+    # shield: отмена одного запроса не должна отменять общий вызов для остальных
+    result = await asyncio.shield(future)
+    if _geo_store is not None and _city_cache.peek(city) == result:
+        await _geo_store.save(city, result)
+    return result
+
+
+def configure_geo_cache(collection):
+    """
+    Подключает Mongo-коллекцию geo_cache как второй уровень кеша городов и солнечных таблиц
+    """
+    global _geo_store
+    _geo_store = GeoCacheStore(collection) if collection is not None else None
+    _geo_store_checked.clear()
+
+
+async def _load_from_geo_store(city: str):
+    """
+    Переносит координаты и сохранённые годовые таблицы города из Mongo в память процесса
+    """
+    doc = await _geo_store.load(city)
+    _geo_store_checked[city] = True
+    if not doc or doc.get("latitude") is None:
+        return
+    
+    coordinates = _city_cache.peek(city)
+    if coordinates is None:
+        coordinates = (doc["latitude"], doc["longitude"], doc["timezone"])
+        _city_cache[city] = coordinates
+    # Таблицы действительны только для тех же координат, что и сейчас в кеше
+    if (doc["latitude"], doc["longitude"], doc["timezone"]) == tuple(coordinates):
+        for year, table in (doc.get("sun") or {}).items():
+            _sun_year_cache[(tuple(coordinates), int(year))] = table
+
+
+async def flush_geo_cache():
+    """
+    Записывает в Mongo годовые таблицы, рассчитанные с момента последней записи
+    """
+    global _geo_flush_task
+    _geo_flush_task = None
+    if _geo_store is None:
+        return
+    while _pending_geo_writes:
+        city, years = _pending_geo_writes.popitem()
+        coordinates = _city_cache.peek(city)
+        if coordinates is None:
+            continue
+        sun_years = {}
+        for year in years:
+            table = _sun_year_cache.peek((tuple(coordinates), year))
+            if table is not None:
+                sun_years[year] = table
+        await _geo_store.save(city, coordinates, sun_years)
+
+
+def _schedule_geo_flush():
+    """
+    Планирует фоновую запись в Mongo, если вызвано из потока event loop
+    """
+    global _geo_flush_task
+    if _geo_store is None or _geo_flush_task is not None:
+        return
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Вызов из пула потоков или скрипта — запишется при следующей выгрузке
+        return
+    _geo_flush_task = loop.create_task(flush_geo_cache())
+
+
+def geo_cache_stats() -> Dict[str, Any]:
+    """
+    Счётчики попаданий и промахов всех уровней гео-кеша
+    """
+    return {
+        "cities": _city_cache.stats(),
+        "sun_years": _sun_year_cache.stats(),
+        "mongo": _geo_store.stats() if _geo_store is not None else None,
+        "pending_writes": sum(len(years) for years in _pending_geo_writes.values()),
+    }
+
+
 def get_city_timezone(city: str) -> str:
     """
     Получает часовой пояс для указанного города
@@ -63,40 +350,100 @@ def get_city_timezone(city: str) -> str:
     return timezone
 
 
-def get_sunrise_sunset(city: str, date: datetime) -> Tuple[datetime, datetime]:
+def _sun_times_for_day(observer, timezone, day: date) -> Tuple[datetime, datetime]:
     """
-    Вычисляет время восхода и заката для указанного города и даты
+    Восход и закат для одного календарного дня (в часовом поясе города)
     """
     try:
-        from astral import LocationInfo
         from astral.sun import sun
         
-        # Используем кешированные координаты
-        latitude, longitude, timezone_str = get_city_coordinates(city)
-        
-        city_info = LocationInfo(city, "Unknown", timezone_str, latitude, longitude)
-        
-        s = sun(city_info.observer, date=date.date())
-        sunrise = s['sunrise']
-        sunset = s['sunset']
-        
+        s = sun(observer, date=day)
         # Переводим в локальный часовой пояс города (astral возвращает UTC)
-        timezone = pytz.timezone(timezone_str)
-        sunrise = sunrise.astimezone(timezone)
-        sunset = sunset.astimezone(timezone)
-        
-        return sunrise, sunset
+        return s['sunrise'].astimezone(timezone), s['sunset'].astimezone(timezone)
     except:
         pass
     
     # Fallback: примерные времена (6:00 и 18:00 по местному времени)
-    timezone = pytz.timezone(get_city_timezone(city))
-    sunrise = timezone.localize(datetime.combine(date.date(), datetime.min.time().replace(hour=6)))
-    sunset = timezone.localize(datetime.combine(date.date(), datetime.min.time().replace(hour=18)))
-    
+    sunrise = timezone.localize(datetime.combine(day, datetime.min.time().replace(hour=6)))
+    sunset = timezone.localize(datetime.combine(day, datetime.min.time().replace(hour=18)))
     return sunrise, sunset
 
 
+_EPOCH = datetime(1970, 1, 1, tzinfo=pytz.UTC)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _compute_sun_days(city: str, coordinates: Tuple[float, float, str], first_day: date,
+                      days: int) -> List[List[int]]:
+    """
+    Восходы и закаты на days дней в микросекундах UTC (компактный вид для кеша)
+    """
+    latitude, longitude, timezone_str = coordinates
+    timezone = pytz.timezone(timezone_str)
+    try:
+        from astral import LocationInfo
+        observer = LocationInfo(city, "Unknown", timezone_str, latitude, longitude).observer
+    except:
+        observer = None
+    
+    table = []
+    for offset in range(days):
+        sunrise, sunset = _sun_times_for_day(observer, timezone, first_day + timedelta(days=offset))
+        table.append([(sunrise - _EPOCH) // _MICROSECOND, (sunset - _EPOCH) // _MICROSECOND])
+    return table
+
+
+def _sun_year(city: str, coordinates: Tuple[float, float, str], year: int) -> List[List[int]]:
+    """
+    Годовая таблица восходов/закатов из кеша; при промахе рассчитывается и ставится в очередь на запись в Mongo
+    """
+    key = (tuple(coordinates), year)
+    table = _sun_year_cache.get(key)
+    if table is None:
+        first_day = date(year, 1, 1)
+        table = _compute_sun_days(city, coordinates, first_day, (date(year + 1, 1, 1) - first_day).days)
+        _sun_year_cache[key] = table
+        _pending_geo_writes.setdefault(city, set()).add(year)
+        _schedule_geo_flush()
+    return table
+
+
+def get_sun_table(city: str, first_day: date, days: int) -> Dict[date, Tuple[datetime, datetime]]:
+    """
+    Таблица восходов и закатов на days дней подряд начиная с first_day.
+    Берётся из годовых таблиц города (память процесса -> Mongo geo_cache -> расчёт astral).
+    """
+    coordinates = get_city_coordinates(city)
+    timezone = pytz.timezone(coordinates[2])
+    
+    if city not in _city_cache:
+        # Город не определён (временный fallback на UTC) — считаем без кеширования
+        raw_days = _compute_sun_days(city, coordinates, first_day, days)
+    else:
+        years = {}
+        raw_days = []
+        for offset in range(days):
+            day = first_day + timedelta(days=offset)
+            if day.year not in years:
+                years[day.year] = _sun_year(city, coordinates, day.year)
+            raw_days.append(years[day.year][day.timetuple().tm_yday - 1])
+    
+    table = {}
+    for offset, (sunrise_us, sunset_us) in enumerate(raw_days):
+        table[first_day + timedelta(days=offset)] = (
+            (_EPOCH + sunrise_us * _MICROSECOND).astimezone(timezone),
+            (_EPOCH + sunset_us * _MICROSECOND).astimezone(timezone),
+        )
+    return table
+
+
+def get_sunrise_sunset(city: str, date: datetime) -> Tuple[datetime, datetime]:
+    """
+    Вычисляет время восхода и заката для указанного города и даты
+    """
+    return get_sun_table(city, date.date(), 1)[date.date()]
+
+
 def calculate_rahu_kaal(sunrise: datetime, sunset: datetime, weekday: int) -> Tuple[datetime, datetime]:
     """
     Рассчитывает Раху Кала для указанного дня
@@ -314,6 +661,92 @@ def is_favorable_time(planet: str, time: datetime) -> bool:
     return hour in favorable_hours.get(planet, [])
 
 
+SANSKRIT_DAYS = [
+    'Somavar (सोमवार)',     # Понедельник - День Луны
+    'Mangalvar (मंगलवार)',  # Вторник - День Марса
+    'Budhvar (बुधवार)',     # Среда - День Меркурия  
+    'Guruvaar (गुरुवार)',   # Четверг - День Юпитера
+    'Shukravar (शुक्रवार)',  # Пятница - День Венеры
+    'Shanivar (शनिवार)',    # Суббота - День Сатурна
+    'Ravivar (रविवार)'      # Воскресенье - День Солнца
+]
+
+
+def _build_vedic_day_schedule(city: str, timezone_str: str, date: datetime, sunrise: datetime, sunset: datetime,
+                              next_sunrise: datetime, birth_date: str = None) -> Dict[str, Any]:
+    """
+    Сводка дня по уже известным восходу, закату и восходу следующего дня
+    """
+    weekday = date.weekday()
+    
+    # Рассчитываем все временные периоды
+    rahu_start, rahu_end = calculate_rahu_kaal(sunrise, sunset, weekday)
+    gulika_start, gulika_end = calculate_gulika_kaal(sunrise, sunset, weekday)
+    yama_start, yama_end = calculate_yamaghanta(sunrise, sunset, weekday)
+    abhijit_start, abhijit_end = calculate_abhijit_muhurta(sunrise, sunset)
+    
+    # Планетарные часы дня и ночи
+    planetary_hours = calculate_planetary_hours(sunrise, sunset, weekday)
+    night_hours = calculate_night_planetary_hours(sunset, next_sunrise, weekday)
+    
+    return {
+        "city": city,
+        "timezone": timezone_str,
+        "date": date.strftime("%Y-%m-%d"),
+        "weekday": {
+            "name": SANSKRIT_DAYS[weekday],
+            "ruling_planet": get_planet_sanskrit(['Chandra', 'Mangal', 'Budh', 'Guru', 'Shukra', 'Shani', 'Surya'][weekday])
+        },
+        "sun_times": {
+            "sunrise": sunrise.strftime("%H:%M"),
+            "sunset": sunset.strftime("%H:%M"),
+            "day_duration_hours": str(sunset - sunrise)
+        },
+        "inauspicious_periods": {
+            "rahu_kaal": {
+                "name": "राहु काल (Rahu Kaal)",
+                "description": "Неблагоприятное время, избегайте начинания новых дел",
+                "start": rahu_start.strftime("%H:%M"),
+                "end": rahu_end.strftime("%H:%M"),
+                "duration_minutes": int((rahu_end - rahu_start).total_seconds() / 60)
+            },
+            "gulika_kaal": {
+                "name": "गुलिक काल (Gulika Kaal)", 
+                "description": "Период планеты Гулика, неблагоприятный для важных дел",
+                "start": gulika_start.strftime("%H:%M"),
+                "end": gulika_end.strftime("%H:%M"),
+                "duration_minutes": int((gulika_end - gulika_start).total_seconds() / 60)
+            },
+            "yamaghanta": {
+                "name": "यमगण्ड (Yamaghanta)",
+                "description": "Период Ямы, избегайте рискованных предприятий",
+                "start": yama_start.strftime("%H:%M"),
+                "end": yama_end.strftime("%H:%M"),
+                "duration_minutes": int((yama_end - yama_start).total_seconds() / 60)
+            }
+        },
+        "auspicious_periods": {
+            "abhijit_muhurta": {
+                "name": "अभिजित् मुहूर्त (Abhijit Muhurta)",
+                "description": "Самое благоприятное время дня для любых начинаний",
+                "start": abhijit_start.strftime("%H:%M"),
+                "end": abhijit_end.strftime("%H:%M"),
+                "duration_minutes": 48
+            }
+        },
+        "planetary_hours": planetary_hours,
+        "night_hours": night_hours,
+        "recommendations": get_daily_recommendations(weekday, planetary_hours, birth_date)
+    }
+
+
+def _localize_to_city(date: datetime, timezone) -> datetime:
+    """Конвертирует дату в часовой пояс города"""
+    if date.tzinfo is None:
+        return timezone.localize(date)
+    return date.astimezone(timezone)
+
+
 def get_vedic_day_schedule(city: str, date: datetime, birth_date: str = None) -> Dict[str, Any]:
     """
     Полная ведическая сводка дня для указанного города
@@ -321,99 +754,62 @@ def get_vedic_day_schedule(city: str, date: datetime, birth_date: str = None) ->
     try:
         # Получаем часовой пояс города
         timezone_str = get_city_timezone(city)
-        timezone = pytz.timezone(timezone_str)
-        
-        # Конвертируем дату в часовой пояс города
-        if date.tzinfo is None:
-            date = timezone.localize(date)
-        else:
-            date = date.astimezone(timezone)
-        
-        # Получаем восход и закат
-        sunrise, sunset = get_sunrise_sunset(city, date)
-        weekday = date.weekday()
-        
-        # Получаем восход следующего дня для расчета ночных часов
-        next_day = date + timedelta(days=1)
-        next_sunrise, _ = get_sunrise_sunset(city, next_day)
-        
-        # Рассчитываем все временные периоды
-        rahu_start, rahu_end = calculate_rahu_kaal(sunrise, sunset, weekday)
-        gulika_start, gulika_end = calculate_gulika_kaal(sunrise, sunset, weekday)
-        yama_start, yama_end = calculate_yamaghanta(sunrise, sunset, weekday)
-        abhijit_start, abhijit_end = calculate_abhijit_muhurta(sunrise, sunset)
+        date = _localize_to_city(date, pytz.timezone(timezone_str))
         
-        # Планетарные часы дня и ночи
-        planetary_hours = calculate_planetary_hours(sunrise, sunset, weekday)
-        night_hours = calculate_night_planetary_hours(sunset, next_sunrise, weekday)
+        # Восход и закат этого дня и восход следующего дня (для ночных часов)
+        sun_table = get_sun_table(city, date.date(), 2)
+        sunrise, sunset = sun_table[date.date()]
+        next_sunrise, _ = sun_table[(date + timedelta(days=1)).date()]
         
-        # Названия дней недели на санскрите
-        sanskrit_days = [
-            'Somavar (सोमवार)',     # Понедельник - День Луны
-            'Mangalvar (मंगलवार)',  # Вторник - День Марса
-            'Budhvar (बुधवार)',     # Среда - День Меркурия  
-            'Guruvaar (गुरुवार)',   # Четверг - День Юпитера
-            'Shukravar (शुक्रवार)',  # Пятница - День Венеры
-            'Shanivar (शनिवार)',    # Суббота - День Сатурна
-            'Ravivar (रविवार)'      # Воскресенье - День Солнца
-        ]
+        return _build_vedic_day_schedule(city, timezone_str, date, sunrise, sunset, next_sunrise, birth_date)
         
+    except Exception as e:
         return {
+            "error": f"Ошибка расчета ведического расписания: {str(e)}",
             "city": city,
-            "timezone": timezone_str,
-            "date": date.strftime("%Y-%m-%d"),
-            "weekday": {
-                "name": sanskrit_days[weekday],
-                "ruling_planet": get_planet_sanskrit(['Chandra', 'Mangal', 'Budh', 'Guru', 'Shukra', 'Shani', 'Surya'][weekday])
-            },
-            "sun_times": {
-                "sunrise": sunrise.strftime("%H:%M"),
-                "sunset": sunset.strftime("%H:%M"),
-                "day_duration_hours": str(sunset - sunrise)
-            },
-            "inauspicious_periods": {
-                "rahu_kaal": {
-                    "name": "राहु काल (Rahu Kaal)",
-                    "description": "Неблагоприятное время, избегайте начинания новых дел",
-                    "start": rahu_start.strftime("%H:%M"),
-                    "end": rahu_end.strftime("%H:%M"),
-                    "duration_minutes": int((rahu_end - rahu_start).total_seconds() / 60)
-                },
-                "gulika_kaal": {
-                    "name": "गुलिक काल (Gulika Kaal)", 
-                    "description": "Период планеты Гулика, неблагоприятный для важных дел",
-                    "start": gulika_start.strftime("%H:%M"),
-                    "end": gulika_end.strftime("%H:%M"),
-                    "duration_minutes": int((gulika_end - gulika_start).total_seconds() / 60)
-                },
-                "yamaghanta": {
-                    "name": "यमगण्ड (Yamaghanta)",
-                    "description": "Период Ямы, избегайте рискованных предприятий",
-                    "start": yama_start.strftime("%H:%M"),
-                    "end": yama_end.strftime("%H:%M"),
-                    "duration_minutes": int((yama_end - yama_start).total_seconds() / 60)
-                }
-            },
-            "auspicious_periods": {
-                "abhijit_muhurta": {
-                    "name": "अभिजित् मुहूर्त (Abhijit Muhurta)",
-                    "description": "Самое благоприятное время дня для любых начинаний",
-                    "start": abhijit_start.strftime("%H:%M"),
-                    "end": abhijit_end.strftime("%H:%M"),
-                    "duration_minutes": 48
-                }
-            },
-            "planetary_hours": planetary_hours,
-            "night_hours": night_hours,
-            "recommendations": get_daily_recommendations(weekday, planetary_hours, birth_date)
+            "date": date.strftime("%Y-%m-%d") if date else None
         }
+
+
+def get_vedic_schedule_range(city: str, start: datetime, days: int, birth_date: str = None,
+                             sun_table: Dict[date, Tuple[datetime, datetime]] = None) -> List[Dict[str, Any]]:
+    """
+    Ведические сводки на days дней подряд начиная с start.
+    Город определяется один раз, восходы и закаты считаются одним проходом на N+1 дней:
+    восход следующего дня для ночных часов берется из той же таблицы.
+    Дни с ошибкой возвращаются словарем с ключом "error", как в get_vedic_day_schedule.
+    """
+    dates = [start + timedelta(days=offset) for offset in range(days)]
+    try:
+        timezone_str = get_city_timezone(city)
+        timezone = pytz.timezone(timezone_str)
+        local_dates = [_localize_to_city(day_date, timezone) for day_date in dates]
         
+        # Таблица должна покрывать каждый день и следующий за ним
+        needed = {d.date() for d in local_dates} | {(d + timedelta(days=1)).date() for d in local_dates}
+        if needed and (sun_table is None or not needed.issubset(sun_table)):
+            first_day, last_day = min(needed), max(needed)
+            sun_table = get_sun_table(city, first_day, (last_day - first_day).days + 1)
     except Exception as e:
-        return {
+        return [{
             "error": f"Ошибка расчета ведического расписания: {str(e)}",
             "city": city,
-            "date": date.strftime("%Y-%m-%d") if date else None
-        }
+            "date": day_date.strftime("%Y-%m-%d")
+        } for day_date in dates]
+    
+    schedules = []
+    for local_date in local_dates:
+        try:
+            sunrise, sunset = sun_table[local_date.date()]
+            next_sunrise, _ = sun_table[(local_date + timedelta(days=1)).date()]
+            schedules.append(_build_vedic_day_schedule(city, timezone_str, local_date, sunrise, sunset, next_sunrise, birth_date))
+        except Exception as e:
+            schedules.append({
+                "error": f"Ошибка расчета ведического расписания: {str(e)}",
+                "city": city,
+                "date": local_date.strftime("%Y-%m-%d")
+            })
+    return schedules
 
 
 def get_daily_recommendations(weekday: int, planetary_hours: List[Dict], birth_date: str = None) -> Dict[str, Any]:
@@ -505,6 +901,19 @@ def get_planet_mantra(planet: str) -> str:
     return mantras.get(planet, 'ॐ (Om)')
 
 
+def get_period_sun_table(city: str, start_date: datetime, days: int) -> Dict[date, Tuple[datetime, datetime]]:
+    """
+    Таблица восходов на период маршрута с запасом в день с каждой стороны:
+    локальная дата города может отличаться от даты start_date в UTC.
+    Одна таблица обслуживает и ведические расписания, и расчет энергий планет.
+    """
+    try:
+        return get_sun_table(city, start_date.date() - timedelta(days=1), days + 3)
+    except Exception as e:
+        print(f"Error calculating sun table for {city}: {e}")
+        return None
+
+
 def get_monthly_planetary_route(city: str, start_date: datetime, birth_date: str = None,
                                 user_numbers: Dict[str, int] = None, pythagorean_square: Dict[str, Any] = None,
                                 fractal_behavior: List[int] = None, problem_numbers: List[int] = None,
@@ -514,7 +923,7 @@ def get_monthly_planetary_route(city: str, start_date: datetime, birth_date: str
     """
     Генерирует планетарный маршрут на месяц с расчетом энергии планет
     """
-    from vedic_numerology import calculate_enhanced_daily_planetary_energy, calculate_janma_ank, calculate_bhagya_ank, parse_birth_date, reduce_to_single_digit
+    from vedic_numerology import calculate_planetary_energy_matrix, planetary_energy_rows, calculate_janma_ank, calculate_bhagya_ank, parse_birth_date, reduce_to_single_digit
     
     monthly_schedule = []
     current_date = start_date
@@ -529,10 +938,37 @@ def get_monthly_planetary_route(city: str, start_date: datetime, birth_date: str
             destiny_number = calculate_bhagya_ank(day, month, year)
         except:
             pass
+
+    # Sunrise/sunset table shared by the day schedules and the energy engine
+    sun_table = get_period_sun_table(city, start_date, 30)
+    daily_schedules = get_vedic_schedule_range(city, start_date, 30, sun_table=sun_table)
+    
+    # Planetary energy for the whole period in one pass
+    daily_energies = []
+    if birth_date and destiny_number is not None:
+        try:
+            daily_energies = planetary_energy_rows(calculate_planetary_energy_matrix(
+                destiny_number=destiny_number,
+                start_date=start_date,
+                days=30,
+                birth_date=birth_date,
+                user_numbers=user_numbers,
+                pythagorean_square=pythagorean_square,
+                fractal_behavior=fractal_behavior,
+                problem_numbers=problem_numbers,
+                name_numbers=name_numbers,
+                weekday_energy=weekday_energy,
+                janma_ank=janma_ank,
+                city=city,
+                modifiers_config=modifiers_config,
+                sun_times=[sun_table[(start_date + timedelta(days=offset)).date()] for offset in range(30)] if sun_table else None
+            ))
+        except Exception as e:
+            print(f"Error calculating planetary energy for {start_date}: {e}")
     
     for day in range(30):  # 30 дней месяца
         try:
-            daily_schedule = get_vedic_day_schedule(city=city, date=current_date)
+            daily_schedule = daily_schedules[day]
             
             if 'error' not in daily_schedule:
                 # Calculate planetary energy for this day
@@ -541,22 +977,9 @@ def get_monthly_planetary_route(city: str, start_date: datetime, birth_date: str
                 day_type = 'neutral'
                 day_type_ru = 'Нейтральный'
                 
-                if birth_date and destiny_number is not None:
+                if day < len(daily_energies):
                     try:
-                        planetary_energies = calculate_enhanced_daily_planetary_energy(
-                            destiny_number=destiny_number,
-                            date=current_date,
-                            birth_date=birth_date,
-                            user_numbers=user_numbers,
-                            pythagorean_square=pythagorean_square,
-                            fractal_behavior=fractal_behavior,
-                            problem_numbers=problem_numbers,
-                            name_numbers=name_numbers,
-                            weekday_energy=weekday_energy,
-                            janma_ank=janma_ank,
-                            city=city,
-                            modifiers_config=modifiers_config
-                        )
+                        planetary_energies = daily_energies[day]
                         
                         # Calculate total energy (sum of all planets)
                         total_energy = sum(planetary_energies.values())
@@ -645,7 +1068,7 @@ def get_weekly_planetary_route(city: str, start_date: datetime, birth_date: str
     Генерирует планетарный маршрут на неделю (7 дней) с расчетом энергии планет
     С детальным анализом каждого дня
     """
-    from vedic_numerology import calculate_enhanced_daily_planetary_energy, calculate_janma_ank, calculate_bhagya_ank, parse_birth_date, reduce_to_single_digit
+    from vedic_numerology import calculate_planetary_energy_matrix, planetary_energy_rows, calculate_janma_ank, calculate_bhagya_ank, parse_birth_date, reduce_to_single_digit
     
     weekly_schedule = []
     current_date = start_date
@@ -660,11 +1083,38 @@ def get_weekly_planetary_route(city: str, start_date: datetime, birth_date: str
             destiny_number = calculate_bhagya_ank(day, month, year)
         except:
             pass
+
+    # Sunrise/sunset table shared by the day schedules and the energy engine
+    sun_table = get_period_sun_table(city, start_date, 7)
+    daily_schedules = get_vedic_schedule_range(city, start_date, 7, sun_table=sun_table)
+    
+    # Planetary energy for the whole period in one pass
+    daily_energies = []
+    if birth_date and destiny_number is not None:
+        try:
+            daily_energies = planetary_energy_rows(calculate_planetary_energy_matrix(
+                destiny_number=destiny_number,
+                start_date=start_date,
+                days=7,
+                birth_date=birth_date,
+                user_numbers=user_numbers,
+                pythagorean_square=pythagorean_square,
+                fractal_behavior=fractal_behavior,
+                problem_numbers=problem_numbers,
+                name_numbers=name_numbers,
+                weekday_energy=weekday_energy,
+                janma_ank=janma_ank,
+                city=city,
+                modifiers_config=modifiers_config,
+                sun_times=[sun_table[(start_date + timedelta(days=offset)).date()] for offset in range(7)] if sun_table else None
+            ))
+        except Exception as e:
+            print(f"Error calculating planetary energy for {start_date}: {e}")
     
     # Собираем данные за 7 дней
     for day_offset in range(7):
         try:
-            daily_schedule = get_vedic_day_schedule(city=city, date=current_date)
+            daily_schedule = daily_schedules[day_offset]
             
             if 'error' not in daily_schedule:
                 weekday_info = daily_schedule.get('weekday', {})
@@ -683,22 +1133,9 @@ def get_weekly_planetary_route(city: str, start_date: datetime, birth_date: str
                 day_type_ru = 'Нейтральный'
                 color_class = 'blue'
                 
-                if birth_date and destiny_number is not None:
+                if day_offset < len(daily_energies):
                     try:
-                        planetary_energies = calculate_enhanced_daily_planetary_energy(
-                            destiny_number=destiny_number,
-                            date=current_date,
-                            birth_date=birth_date,
-                            user_numbers=user_numbers,
-                            pythagorean_square=pythagorean_square,
-                            fractal_behavior=fractal_behavior,
-                            problem_numbers=problem_numbers,
-                            name_numbers=name_numbers,
-                            weekday_energy=weekday_energy,
-                            janma_ank=janma_ank,
-                            city=city,
-                            modifiers_config=modifiers_config
-                        )
+                        planetary_energies = daily_energies[day_offset]
                         
                         # Calculate total energy (sum of all planets)
                         total_energy = sum(planetary_energies.values())
@@ -872,7 +1309,7 @@ def get_quarterly_planetary_route(city: str, start_date: datetime, birth_date: s
     """
     Генерирует планетарный маршрут на квартал (90 дней) с расчетом энергии планет
     """
-    from vedic_numerology import calculate_enhanced_daily_planetary_energy, calculate_janma_ank, calculate_bhagya_ank, parse_birth_date, reduce_to_single_digit
+    from vedic_numerology import calculate_planetary_energy_matrix, planetary_energy_rows, calculate_janma_ank, calculate_bhagya_ank, parse_birth_date, reduce_to_single_digit
     
     quarterly_schedule = []
     current_date = start_date
@@ -887,6 +1324,33 @@ def get_quarterly_planetary_route(city: str, start_date: datetime, birth_date: s
             destiny_number = calculate_bhagya_ank(day, month, year)
         except:
             pass
+
+    # Sunrise/sunset table shared by the day schedules and the energy engine
+    sun_table = get_period_sun_table(city, start_date, 90)
+    daily_schedules = get_vedic_schedule_range(city, start_date, 90, sun_table=sun_table)
+    
+    # Planetary energy for the whole period in one pass
+    daily_energies = []
+    if birth_date and destiny_number is not None:
+        try:
+            daily_energies = planetary_energy_rows(calculate_planetary_energy_matrix(
+                destiny_number=destiny_number,
+                start_date=start_date,
+                days=90,
+                birth_date=birth_date,
+                user_numbers=user_numbers,
+                pythagorean_square=pythagorean_square,
+                fractal_behavior=fractal_behavior,
+                problem_numbers=problem_numbers,
+                name_numbers=name_numbers,
+                weekday_energy=weekday_energy,
+                janma_ank=janma_ank,
+                city=city,
+                modifiers_config=modifiers_config,
+                sun_times=[sun_table[(start_date + timedelta(days=offset)).date()] for offset in range(90)] if sun_table else None
+            ))
+        except Exception as e:
+            print(f"Error calculating planetary energy for {start_date}: {e}")
     
     # Группируем по неделям для квартального обзора
     weeks = []
@@ -894,7 +1358,7 @@ def get_quarterly_planetary_route(city: str, start_date: datetime, birth_date: s
     
     for day in range(90):  # 90 дней квартала
         try:
-            daily_schedule = get_vedic_day_schedule(city=city, date=current_date)
+            daily_schedule = daily_schedules[day]
             
             if 'error' not in daily_schedule:
                 # Calculate planetary energy for this day
@@ -903,22 +1367,9 @@ def get_quarterly_planetary_route(city: str, start_date: datetime, birth_date: s
                 day_type = 'neutral'
                 day_type_ru = 'Нейтральный'
                 
-                if birth_date and destiny_number is not None:
+                if day < len(daily_energies):
                     try:
-                        planetary_energies = calculate_enhanced_daily_planetary_energy(
-                            destiny_number=destiny_number,
-                            date=current_date,
-                            birth_date=birth_date,
-                            user_numbers=user_numbers,
-                            pythagorean_square=pythagorean_square,
-                            fractal_behavior=fractal_behavior,
-                            problem_numbers=problem_numbers,
-                            name_numbers=name_numbers,
-                            weekday_energy=weekday_energy,
-                            janma_ank=janma_ank,
-                            city=city,
-                            modifiers_config=modifiers_config
-                        )
+                        planetary_energies = daily_energies[day]
                         
                         # Calculate total energy (sum of all planets)
                         total_energy = sum(planetary_energies.values())
@@ -0,0 +1,182 @@
+"""
+Свёртка heartbeat-ов просмотра видео (/api/student/video-watch-time)
+
+Плеер отправляет время просмотра периодически, и каждый запрос делал find_one и update_one
+в video_watch_time, update в time_activity, чтение конфигурации баллов и начисление. Теперь
+запрос только прибавляет минуты в памяти процесса по ключу (пользователь, файл), а раз в
+FLUSH_INTERVAL секунд и при остановке накопленное пишется $inc-ами: один bulk_write в
+video_watch_time и один в time_activity, конфигурация баллов читается один раз на выгрузку.
+Число записей зависит от числа зрителей, а не от частоты heartbeat-ов.
+
+Баллы считаются по тем же правилам (минуты * video_points_per_minute), начисление —
+одной транзакцией на пользователя за выгрузку (on_flushed). Чтение статистики видео
+пользователя вызывает flush_for_user, чтобы увидеть ещё не записанные минуты.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from learning_events import EventWrites, add_video_watch
+
+FLUSH_INTERVAL = float(os.environ.get('VIDEO_WATCH_FLUSH_INTERVAL', '15'))
+
+
+class VideoWatchCoalescer:
+    """
+    Минуты просмотра по (user_id, file_id), выгружаемые пакетом по таймеру
+    """
+
+    def __init__(self, interval: float = FLUSH_INTERVAL):
+        self.interval = interval
+        self.db = None
+        self.points_config_loader: Optional[Callable[[], Awaitable[Dict[str, Any]]]] = None
+        self.on_flushed: Optional[Callable[[Dict[str, Dict[str, Any]]], Awaitable[None]]] = None
+        # (user_id, file_id) -> {"lesson_id": .., "minutes": ..}
+        self._pending: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._flush_lock = asyncio.Lock()
+        self._timer_task: Optional[asyncio.Task] = None
+        self.heartbeats = 0
+        self.flushes = 0
+        self.written = 0
+        self.errors = 0
+        self.callback_errors = 0
+        self.max_pending = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    def configure(self, db, points_config_loader, on_flushed=None):
+        """
+        Подключает базу и запускает периодическую выгрузку (вызывается при старте).
+        on_flushed(users) — корутина, получает по пользователю баллы и минуты выгрузки.
+        """
+        self.db = db
+        self.points_config_loader = points_config_loader
+        self.on_flushed = on_flushed
+        if self._timer_task is None:
+            self._timer_task = asyncio.get_running_loop().create_task(self._run_timer())
+
+    @property
+    def configured(self) -> bool:
+        return self.db is not None
+
+    async def _run_timer(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._pending:
+                try:
+                    await self.flush()
+                except Exception as e:
+                    print(f"video_watch_buffer: ошибка фоновой выгрузки: {e}")
+
+    def add(self, user_id: str, file_id: str, lesson_id: Optional[str], minutes: int):
+        """
+        Учитывает heartbeat без обращения к базе
+        """
+        entry = self._pending.setdefault((user_id, file_id), {'lesson_id': lesson_id, 'minutes': 0})
+        entry['minutes'] += minutes
+        if lesson_id:
+            entry['lesson_id'] = lesson_id
+        self.heartbeats += 1
+        self.max_pending = max(self.max_pending, len(self._pending))
+
+    def has_pending(self, user_id: str) -> bool:
+        return any(key[0] == user_id for key in self._pending)
+
+    async def flush_for_user(self, user_id: str):
+        """
+        Выгружает накопленное перед чтением статистики, если в нём есть минуты пользователя
+        """
+        if self.has_pending(user_id):
+            await self.flush()
+
+    async def flush(self):
+        """
+        Записывает накопленные минуты и начисляет баллы за них
+        """
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            started = time.perf_counter()
+            try:
+                points_config = await self.points_config_loader()
+                points_per_minute = points_config.get('video_points_per_minute', 1)
+                now = datetime.utcnow()
+                writes = EventWrites()
+                users: Dict[str, Dict[str, Any]] = {}
+                for (user_id, file_id), entry in pending.items():
+                    activity_before = writes.video_activity_points
+                    points = add_video_watch(writes, user_id, entry['lesson_id'], file_id,
+                                             entry['minutes'], points_per_minute, now)
+                    user = users.setdefault(user_id, {'points': 0, 'activity_points': 0, 'minutes': 0,
+                                                      'file_ids': [], 'lesson_ids': [],
+                                                      'points_per_minute': points_per_minute})
+                    user['points'] += points
+                    user['activity_points'] += writes.video_activity_points - activity_before
+                    user['minutes'] += entry['minutes']
+                    user['file_ids'].append(file_id)
+                    if entry['lesson_id'] and entry['lesson_id'] not in user['lesson_ids']:
+                        user['lesson_ids'].append(entry['lesson_id'])
+
+                await self.db.video_watch_time.bulk_write(writes.video_watch_time, ordered=False)
+            except Exception as e:
+                # video_watch_time не записан: минуты возвращаются к новым heartbeat-ам
+                self.errors += 1
+                for key, entry in pending.items():
+                    self._restore(key, entry)
+                raise RuntimeError(f"не удалось записать просмотр видео ({len(pending)} записей): {e}") from e
+            finally:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                self.flushes += 1
+                self.last_flush_ms = elapsed_ms
+                self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.written += len(writes.video_watch_time)
+
+            try:
+                if writes.time_activity:
+                    await self.db.time_activity.bulk_write(writes.time_activity, ordered=False)
+                if self.on_flushed is not None:
+                    await self.on_flushed(users)
+            except Exception as e:
+                # video_watch_time уже записан — повторять нельзя, иначе минуты задвоятся
+                self.callback_errors += 1
+                print(f"video_watch_buffer: ошибка обработки записанной выгрузки: {e}")
+
+    def _restore(self, key: Tuple[str, str], entry: Dict[str, Any]):
+        current = self._pending.setdefault(key, {'lesson_id': entry['lesson_id'], 'minutes': 0})
+        current['minutes'] += entry['minutes']
+        current['lesson_id'] = current['lesson_id'] or entry['lesson_id']
+
+    async def close(self):
+        """
+        Останавливает таймер и выгружает накопленное (on_shutdown)
+        """
+        if self._timer_task is not None:
+            self._timer_task.cancel()
+            self._timer_task = None
+        if self.configured and self._pending:
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"video_watch_buffer: {e}")
+        if self._pending:
+            print(f"video_watch_buffer: не записано {len(self._pending)} записей просмотра видео")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "max_pending": self.max_pending,
+            "flush_interval_sec": self.interval,
+            "heartbeats": self.heartbeats,
+            "flushes": self.flushes,
+            "written": self.written,
+            "errors": self.errors,
+            "callback_errors": self.callback_errors,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+        }
+
+
+video_watch_buffer = VideoWatchCoalescer()
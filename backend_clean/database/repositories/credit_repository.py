@@ -11,7 +11,7 @@ Credit Repository
 Дата создания: 2025-10-09
 """
 
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
 
 from .base import BaseRepository
@@ -80,6 +80,26 @@ class CreditRepository(BaseRepository):
             sort=[('created_at', -1)]  # Сначала новые
         )
 
+    async def find_by_idempotency_key(
+        self,
+        user_id: str,
+        idempotency_key: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Найти транзакцию, записанную с данным ключом идемпотентности
+
+        Args:
+            user_id: ID пользователя
+            idempotency_key: Ключ повтора запроса
+
+        Returns:
+            Транзакция или None
+        """
+        return await self.find_one(
+            {'user_id': user_id, 'idempotency_key': idempotency_key},
+            {'_id': 0}
+        )
+
     async def count_by_user(self, user_id: str) -> int:
         """
         Подсчитать количество транзакций пользователя
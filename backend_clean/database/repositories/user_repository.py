@@ -21,6 +21,7 @@ User Repository
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
 
 from .base import BaseRepository
 from models.user import User, UserResponse, create_user_response
@@ -189,6 +190,45 @@ class UserRepository(BaseRepository):
             amount
         )
 
+    async def deduct_credits_if_sufficient(
+        self,
+        user_id: str,
+        cost: int,
+        idempotency_key: Optional[str] = None,
+        keys_limit: int = 100
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Атомарно списать баллы, если их хватает (один find_one_and_update)
+
+        Ключ идемпотентности сохраняется в credit_idempotency_keys (последние keys_limit),
+        повторное списание с тем же ключом не выполняется.
+
+        Args:
+            user_id: ID пользователя
+            cost: Количество баллов для списания
+            idempotency_key: Ключ повтора запроса (опционально)
+            keys_limit: Сколько последних ключей хранить
+
+        Returns:
+            Документ пользователя с новым credits_remaining или None, если списание не выполнено
+        """
+        query = {'id': user_id}
+        if cost > 0:
+            query['credits_remaining'] = {'$gte': cost}
+        update = {'$inc': {'credits_remaining': -cost}}
+        if idempotency_key:
+            query['credit_idempotency_keys'] = {'$ne': idempotency_key}
+            update['$push'] = {
+                'credit_idempotency_keys': {'$each': [idempotency_key], '$slice': -keys_limit}
+            }
+
+        return await self.collection.find_one_and_update(
+            query,
+            update,
+            projection={'_id': 0, 'credits_remaining': 1},
+            return_document=ReturnDocument.AFTER
+        )
+
     async def update_subscription(
         self,
         user_id: str,
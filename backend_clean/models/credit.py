@@ -30,6 +30,8 @@ class CreditTransaction(BaseModel):
     description: str  # описание за что списано/начислено
     category: str  # категория: 'numerology', 'vedic', 'learning', 'quiz', 'materials', 'purchase', etc.
     details: Optional[dict] = None  # дополнительные детали транзакции
+    idempotency_key: Optional[str] = None  # ключ повтора запроса (списание не дублируется)
+    balance_after: Optional[int] = None  # баланс после операции
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 
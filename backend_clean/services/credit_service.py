@@ -50,7 +50,9 @@ class CreditService:
         amount: int,
         description: str,
         category: str,
-        details: Optional[Dict[str, Any]] = None
+        details: Optional[Dict[str, Any]] = None,
+        idempotency_key: Optional[str] = None,
+        balance_after: Optional[int] = None
     ) -> CreditTransaction:
         """
         Записать транзакцию баллов (начисление или списание)
@@ -63,6 +65,8 @@ class CreditService:
             description: Описание транзакции
             category: Категория (personal_numbers, lesson_viewing, etc.)
             details: Дополнительные данные (опционально)
+            idempotency_key: Ключ повтора запроса (опционально)
+            balance_after: Баланс после операции (опционально)
 
         Returns:
             Созданная CreditTransaction
@@ -73,7 +77,9 @@ class CreditService:
             amount=amount,
             description=description,
             category=category,
-            details=details or {}
+            details=details or {},
+            idempotency_key=idempotency_key,
+            balance_after=balance_after
         )
 
         await self.credit_repo.create_transaction(transaction.dict())
@@ -89,19 +95,25 @@ class CreditService:
         cost: int,
         description: str,
         category: str,
-        details: Optional[Dict[str, Any]] = None
+        details: Optional[Dict[str, Any]] = None,
+        idempotency_key: Optional[str] = None
     ) -> CreditTransaction:
         """
         Списать баллы у пользователя с проверкой баланса
 
         Источник: backend/server.py строки 136-149
 
+        Проверка баланса и списание выполняются одним атомарным find_one_and_update,
+        поэтому параллельные запросы не уводят баланс в минус. Повтор с тем же
+        idempotency_key не списывает баллы второй раз и возвращает исходную транзакцию.
+
         Args:
             user_id: ID пользователя
             cost: Стоимость операции (положительное число)
             description: Описание операции
             category: Категория (из CREDIT_COSTS)
             details: Дополнительные данные
+            idempotency_key: Ключ повтора запроса (например, заголовок Idempotency-Key)
 
         Returns:
             Созданная CreditTransaction
@@ -110,32 +122,45 @@ class CreditService:
             HTTPException: 404 если пользователь не найден
             HTTPException: 402 если недостаточно баллов
         """
-        # Проверяем существование пользователя
-        user = await self.user_repo.find_by_id(user_id)
-        if not user:
-            raise HTTPException(
-                status_code=404,
-                detail='Пользователь не найден'
-            )
+        user = await self.user_repo.deduct_credits_if_sufficient(user_id, cost, idempotency_key)
+
+        if user is None:
+            # Списание не выполнено - выясняем причину
+            user = await self.user_repo.find_by_id(user_id)
+            if not user:
+                raise HTTPException(
+                    status_code=404,
+                    detail='Пользователь не найден'
+                )
+
+            if idempotency_key and idempotency_key in user.get('credit_idempotency_keys', []):
+                # Повтор уже оплаченного запроса
+                existing = await self.credit_repo.find_by_idempotency_key(user_id, idempotency_key)
+                if existing:
+                    return CreditTransaction(**existing)
+                return await self.record_transaction(
+                    user_id=user_id,
+                    amount=-cost,
+                    description=description,
+                    category=category,
+                    details=details,
+                    idempotency_key=idempotency_key
+                )
 
-        # Проверяем баланс
-        credits_remaining = user.get('credits_remaining', 0)
-        if credits_remaining < cost:
             raise HTTPException(
                 status_code=402,
                 detail='Недостаточно баллов для операции. Пополните баланс.'
             )
 
-        # Списываем баллы
-        await self.user_repo.increment_credits(user_id, -cost)
-
         # Записываем транзакцию (отрицательное значение)
         return await self.record_transaction(
             user_id=user_id,
             amount=-cost,
             description=description,
             category=category,
-            details=details
+            details=details,
+            idempotency_key=idempotency_key,
+            balance_after=user.get('credits_remaining')
         )
 
     # ===========================================
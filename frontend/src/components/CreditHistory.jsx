@@ -36,7 +36,7 @@ const CreditHistory = ({ onNavigate }) => {
   const [transactions, setTransactions] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState('');
-  const [page, setPage] = useState(0);
+  const [nextCursor, setNextCursor] = useState(null);
   const [totalTransactions, setTotalTransactions] = useState(0);
   const [hasMore, setHasMore] = useState(true);
 
@@ -97,15 +97,17 @@ const CreditHistory = ({ onNavigate }) => {
 
   useEffect(() => {
     loadTransactions();
-  }, [page]);
+  }, []);
 
-  const loadTransactions = async () => {
+  // Следующая страница запрашивается по next_cursor из предыдущего ответа (без offset)
+  const loadTransactions = async (cursor = null) => {
     setLoading(true);
     setError('');
 
     try {
+      const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
       const response = await axios.get(
-        `${backendUrl}/api/user/credit-history?limit=${limit}&offset=${page * limit}`,
+        `${backendUrl}/api/user/credit-history?limit=${limit}${cursorParam}`,
         {
           headers: {
             'Authorization': `Bearer ${localStorage.getItem('token')}`
@@ -116,7 +118,7 @@ const CreditHistory = ({ onNavigate }) => {
       const newTransactions = response.data.transactions;
       setTotalTransactions(response.data.total);
       
-      if (page === 0) {
+      if (!cursor) {
         setTransactions(newTransactions);
         // Обновляем профиль пользователя для актуального баланса
         if (refreshProfile) {
@@ -126,7 +128,8 @@ const CreditHistory = ({ onNavigate }) => {
         setTransactions(prev => [...prev, ...newTransactions]);
       }
       
-      setHasMore(newTransactions.length === limit);
+      setNextCursor(response.data.next_cursor);
+      setHasMore(Boolean(response.data.next_cursor));
     } catch (error) {
       console.error('Error loading credit history:', error);
       setError(error.response?.data?.detail || 'Ошибка при загрузке истории транзакций');
@@ -158,12 +161,11 @@ const CreditHistory = ({ onNavigate }) => {
 
   const loadMore = () => {
     if (!loading && hasMore) {
-      setPage(prev => prev + 1);
+      loadTransactions(nextCursor);
     }
   };
 
   const refresh = () => {
-    setPage(0);
     loadTransactions();
     // Обновляем профиль пользователя для актуального баланса
     if (refreshProfile) {
@@ -1,4 +1,5 @@
 // Инициализация базы данных для NumerOM Learning System V2
+// Индексы рабочей базы (MONGODB_DATABASE) создаёт backend при старте: backend/collection_registry.py
 db = db.getSiblingDB('learning_v2');
 
 print("Initializing NumerOM Learning System V2 database...");
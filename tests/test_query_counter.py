@@ -0,0 +1,101 @@
+"""
+Число запросов к Mongo в /api/student/analytics/lessons не зависит от числа уроков
+
+Mongo заменяется на mongomock-motor; mongomock не отправляет событий мониторинга pymongo,
+поэтому каждый вызов метода коллекции передаётся в query_counter_listener как команда.
+"""
+import asyncio
+import os
+import sys
+import types
+from datetime import datetime, timedelta
+
+import pytest
+
+mongomock_motor = pytest.importorskip('mongomock_motor')
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'backend')
+sys.path.insert(0, BACKEND_DIR)
+
+from query_counter import count_queries, query_counter_listener  # noqa: E402
+
+
+class CountingCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def command(*args, **kwargs):
+            query_counter_listener.started(types.SimpleNamespace(command_name=name))
+            return attr(*args, **kwargs)
+        return command
+
+
+class CountingDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getattr__(self, name):
+        return CountingCollection(self._database[name])
+
+    def __getitem__(self, name):
+        return CountingCollection(self._database[name])
+
+
+@pytest.fixture(scope='module')
+def server():
+    os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    os.environ.setdefault('MONGODB_DATABASE', 'test')
+    cwd = os.getcwd()
+    # server.py монтирует uploads/ относительно рабочего каталога
+    os.chdir(BACKEND_DIR)
+    try:
+        import server as server_module
+        import student_dashboard
+    finally:
+        os.chdir(cwd)
+    # mongomock не знает $type: в тесте периоды считаются без защиты от строковых дат
+    original = student_dashboard._date_string
+    student_dashboard._date_string = lambda field, fmt: {'$dateToString': {'format': fmt, 'date': field}}
+    yield server_module
+    student_dashboard._date_string = original
+
+
+async def seed(database, lessons: int):
+    now = datetime.utcnow().replace(second=0, microsecond=0)
+    await database.users.insert_one({'id': 'u1', 'birth_date': '15.08.1985', 'city': 'Москва'})
+    for i in range(lessons):
+        lesson_id = f'lesson-{i}'
+        await database.lessons_v2.insert_one({'id': lesson_id, 'title': f'Урок {i}', 'is_active': True})
+        await database.lesson_progress.insert_one({'user_id': 'u1', 'lesson_id': lesson_id,
+                                                   'completion_percentage': 50, 'is_completed': False})
+        await database.time_activity.insert_one({'user_id': 'u1', 'lesson_id': lesson_id, 'activity_type': 'lesson_view',
+                                                 'total_minutes': 5, 'created_at': now - timedelta(days=i % 7),
+                                                 'last_activity_at': now})
+        await database.video_watch_time.insert_one({'user_id': 'u1', 'lesson_id': lesson_id, 'total_minutes': 3})
+        await database.exercise_responses.insert_one({'user_id': 'u1', 'lesson_id': lesson_id,
+                                                      'submitted_at': now - timedelta(days=i % 7)})
+
+
+def lessons_analytics_queries(server, lessons: int) -> int:
+    async def run():
+        database = mongomock_motor.AsyncMongoMockClient()['analytics_test']
+        await seed(database, lessons)
+        server.db = CountingDatabase(database)
+        with count_queries() as stats:
+            result = await server.get_detailed_analytics('lessons', period='week', start_date=None,
+                                                         end_date=None, current_user={'user_id': 'u1'})
+        assert result
+        return stats.count
+    return asyncio.run(run())
+
+
+def test_lessons_analytics_query_count_is_constant(server):
+    single = lessons_analytics_queries(server, 1)
+    many = lessons_analytics_queries(server, 50)
+    assert single > 0
+    assert many == single